@@ -33,13 +33,15 @@ export async function POST(request: Request) {
 // Function to run a Python script and return the result
 async function runPythonModel(scriptPath: string, modelType: string, features: any): Promise<any> {
   return new Promise((resolve, reject) => {
-    // Prepare arguments
-    const args = [scriptPath, modelType, JSON.stringify(features)]
+    // Features go through stdin ("-") so long keystroke timings never hit the argument length limit
+    const args = [scriptPath, modelType, "-"]
 
     console.log(`Running Python script: python ${args.join(" ")}`)
 
     // Spawn a Python process
     const pythonProcess = spawn("python", args)
+    pythonProcess.stdin.write(JSON.stringify(features))
+    pythonProcess.stdin.end()
 
     let result = ""
     let error = ""
@@ -76,6 +76,7 @@ export async function POST(request: Request) {
 
     // Prepare features for anomaly detection
     const features = {
+      user_id: userId,
       from_account_id: fromAccountId,
       to_account_id: toAccountId,
       transaction_amount: amount,
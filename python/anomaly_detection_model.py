@@ -2,18 +2,47 @@
 # Anomaly detection model for IOB Banking
 
 import sys
+import copy
 import json
 import pickle
 import os
 import numpy as np
 from datetime import datetime
 import logging
-from typing import Dict, Any, Tuple
+import time
+import threading
+from typing import Dict, Any, Tuple, List, Optional
 import joblib
 from sklearn.ensemble import RandomForestClassifier, IsolationForest
 from sklearn.preprocessing import StandardScaler
 import xgboost as xgb
 from river import anomaly, preprocessing, ensemble, tree, metrics, drift
+from keystroke_features import KEYSTROKE_STATS, KeystrokeProfileStore, keystroke_statistics_batch
+from build_models import model_status, start_background_build, training_in_progress
+from memory_report import (
+    build_memory_report, current_rss_bytes, memory_policy, plan_within_budget, resolve_memory_budget
+)
+from columnar_io import (
+    KEYSTROKE_OFFSETS, KEYSTROKE_VALUES, build_feature_matrix, id_values, ragged_rows, read_columns,
+    timestamp_seconds, write_columns
+)
+from transfer_graph import TRANSFER_GRAPH_FEATURES, TransferGraphIndex, event_time
+from user_baseline import BASELINE_SIGNALS, LoginBaselineIndex
+from rule_engine import get_rules
+from hot_path import HotPathScorer, hot_path_enabled
+from ensemble_members import MemberRunner, deadline_after
+from score_audit import ScoreAuditStore, audit_directory
+from isolation_backend import BACKENDS, default_backend, load_member
+from request_profiler import profiled
+from session_cache import get_session_cache
+from native_artifacts import export_native, load_native, native_directory, native_is_current
+from synthetic_data import generate_matrix
+from online_backends import load_or_build_online_model
+from state_persistence import StateSaver, UpdateLog, update_log_path
+from feature_attribution import AttributionExplainer
+from feature_drift import (
+    FeatureDriftMonitor, bin_counts, bin_edges, drift_interval_seconds, load_reference, save_reference
+)
 
 # Configure logging
 logging.basicConfig(
@@ -34,276 +63,705 @@ LOGIN_SCALER_PATH = os.path.join(MODEL_DIR, "login_scaler.pkl")
 TRANSACTION_RF_MODEL_PATH = os.path.join(MODEL_DIR, "transaction_rf_model.pkl")
 TRANSACTION_XGB_MODEL_PATH = os.path.join(MODEL_DIR, "transaction_xgb_model.pkl")
 TRANSACTION_SCALER_PATH = os.path.join(MODEL_DIR, "transaction_scaler.pkl")
+LOGIN_IFOREST_MODEL_PATH = os.path.join(MODEL_DIR, "login_iforest_model.pkl")
+TRANSACTION_IFOREST_MODEL_PATH = os.path.join(MODEL_DIR, "transaction_iforest_model.pkl")
 ONLINE_LOGIN_MODEL_PATH = os.path.join(MODEL_DIR, "online_login_model.pkl")
 ONLINE_TRANSACTION_MODEL_PATH = os.path.join(MODEL_DIR, "online_transaction_model.pkl")
+KEYSTROKE_PROFILES_PATH = os.path.join(MODEL_DIR, "keystroke_profiles.npz")
+TRANSFER_GRAPH_PATH = os.path.join(MODEL_DIR, "transfer_graph.npz")
+LOGIN_BASELINE_PATH = os.path.join(MODEL_DIR, "login_baseline.npz")
+LOGIN_REFERENCE_PATH = os.path.join(MODEL_DIR, "login_feature_reference.npz")
+TRANSACTION_REFERENCE_PATH = os.path.join(MODEL_DIR, "transaction_feature_reference.npz")
+LOGIN_DRIFT_PATH = os.path.join(MODEL_DIR, "login_drift.npz")
+TRANSACTION_DRIFT_PATH = os.path.join(MODEL_DIR, "transaction_drift.npz")
+AUDIT_DIR = os.path.join(MODEL_DIR, "audit")
+SESSION_CONTEXT_PATH = os.path.join(MODEL_DIR, "session_context.npz")
+LOGIN_FEEDBACK_LEDGER_PATH = os.path.join(MODEL_DIR, "login_feedback_ledger.jsonl")
+TRANSACTION_FEEDBACK_LEDGER_PATH = os.path.join(MODEL_DIR, "transaction_feedback_ledger.jsonl")
+
+# Attribute of the pickled online model holding the last feedback batch it has learned (see feedback_ingestion.py)
+FEEDBACK_BATCH_ATTRIBUTE = "feedback_batch"
 
 # Create models directory if it doesn't exist
 os.makedirs(MODEL_DIR, exist_ok=True)
 
+# Feature order of the static model matrices (also the keys of the online feature dicts)
+LOGIN_FEATURES = [
+    'typing_speed', 'cursor_movements', 'session_duration', 'hour',
+    'latitude', 'longitude', 'keystroke_variance'
+]
+TRANSACTION_FEATURES = [
+    'transaction_amount', 'from_balance', 'amount_ratio', 'transaction_frequency',
+    'session_duration', 'hour', 'latitude', 'longitude', 'cursor_movements'
+]
+
+# How often a model without artifacts checks whether the background build has finished
+MODEL_RELOAD_INTERVAL_SECONDS = 1.0
+
+# Weights of the static ensemble members; members that are not loaded are left out and the rest renormalized
+# (iforest only scores with the isolation and hybrid backends, see isolation_backend.py)
+STATIC_MEMBER_WEIGHTS = {"rf": 0.6, "xgb": 0.4, "iforest": 0.3}
+
+# Share of the online model in the final score (the static ensemble gets the rest) and the score
+# above which an event is flagged; evaluation_harness.py sweeps both against labeled history
+ONLINE_MEMBER_WEIGHT = 0.3
+DECISION_THRESHOLD = 0.7
+
+# Size and seed of the synthetic set the initial static models are trained on
+INITIAL_TRAINING_ROWS = 1000
+INITIAL_TRAINING_SEED = 42
+
+def _as_number(value: Any) -> float:
+    """A request's numeric feature as a float; missing, non-numeric or non-finite values count as 0"""
+    try:
+        number = float(value) if value is not None else 0.0
+    except (TypeError, ValueError):
+        logger.warning(f"Ignoring non-numeric feature value {value!r}")
+        return 0.0
+    return number if np.isfinite(number) else 0.0
+
+
+def _timings_variance(timings: Any) -> float:
+    """Variance of the keystroke timings; 0 when there are fewer than two or they are not numeric"""
+    if not isinstance(timings, (list, tuple)) or len(timings) < 2:
+        return 0.0
+    try:
+        return float(np.var(np.asarray(timings, dtype=np.float64)))
+    except (TypeError, ValueError):
+        logger.warning("Ignoring non-numeric keystroke timings")
+        return 0.0
+
+
+def train_initial_models(model_type: str):
+    """
+    Train initial models on synthetic data and save them atomically
+    Only called from the build step (build_models.py), never on the request path
+    """
+    rf_model_path = LOGIN_RF_MODEL_PATH if model_type == "login" else TRANSACTION_RF_MODEL_PATH
+    xgb_model_path = LOGIN_XGB_MODEL_PATH if model_type == "login" else TRANSACTION_XGB_MODEL_PATH
+    scaler_path = LOGIN_SCALER_PATH if model_type == "login" else TRANSACTION_SCALER_PATH
+    
+    try:
+        logger.info(f"Training initial {model_type} models")
+        
+        # Seeded synthetic data (see synthetic_data.py), so rebuilding gives the same models
+        X, y = generate_matrix(model_type, INITIAL_TRAINING_ROWS, seed=INITIAL_TRAINING_SEED)
+        
+        # Create and fit the scaler
+        scaler = StandardScaler()
+        X_scaled = scaler.fit_transform(X)
+        
+        # Train Random Forest model
+        rf_model = RandomForestClassifier(n_estimators=100, random_state=42)
+        rf_model.fit(X_scaled, y)
+        
+        # Train XGBoost model
+        xgb_model = xgb.XGBClassifier(n_estimators=100, random_state=42)
+        xgb_model.fit(X_scaled, y)
+        
+        # Save models; readers only ever see complete files
+        for artifact, path in ((rf_model, rf_model_path), (xgb_model, xgb_model_path), (scaler, scaler_path)):
+            joblib.dump(artifact, path + ".tmp")
+            os.replace(path + ".tmp", path)
+        
+        # Native copy, which loads faster and survives sklearn/xgboost upgrades (see native_artifacts.py)
+        feature_names = LOGIN_FEATURES if model_type == "login" else TRANSACTION_FEATURES
+        try:
+            export_native(native_directory(MODEL_DIR, model_type), model_type, feature_names, rf_model, xgb_model, scaler)
+        except Exception as e:
+            logger.error(f"Error exporting native {model_type} artifacts: {str(e)}", exc_info=True)
+        
+        # Binned training distribution that incoming features are compared with (see feature_drift.py)
+        try:
+            save_reference(LOGIN_REFERENCE_PATH if model_type == "login" else TRANSACTION_REFERENCE_PATH, feature_names, X)
+        except Exception as e:
+            logger.error(f"Error saving {model_type} feature reference: {str(e)}", exc_info=True)
+        
+        logger.info(f"Initial {model_type} models trained and saved successfully")
+        
+        return rf_model, xgb_model, scaler
+    
+    except Exception as e:
+        logger.error(f"Error training initial {model_type} models: {str(e)}", exc_info=True)
+        raise
+
+
+def prepare_features(model_type: str, features: Dict[str, Any], out: np.ndarray = None) -> np.ndarray:
+    """
+    The static models' feature row of one request (LOGIN_FEATURES / TRANSACTION_FEATURES order)
+    out: optional (1, n_features) float64 row to fill instead of allocating a new one
+    """
+    if model_type == "login":
+        # Extract login features
+        typing_speed = _as_number(features.get('typing_speed'))
+        cursor_movements = _as_number(features.get('cursor_movements'))
+        session_duration = _as_number(features.get('session_duration'))
+        latitude = _as_number(features.get('latitude'))
+        longitude = _as_number(features.get('longitude'))
+
+        # Calculate keystroke variance if available
+        keystroke_variance = _timings_variance(features.get('keystroke_timings'))
+
+        # Parse timestamp to get hour
+        timestamp = features.get('timestamp')
+        try:
+            hour = datetime.fromisoformat(timestamp.replace('Z', '+00:00')).hour
+        except:
+            hour = datetime.now().hour
+
+        values = (
+            typing_speed,
+            cursor_movements,
+            session_duration,
+            hour,
+            latitude,
+            longitude,
+            keystroke_variance
+        )
+    else:
+        # Extract transaction features
+        transaction_amount = _as_number(features.get('transaction_amount'))
+        from_balance = _as_number(features.get('from_balance'))
+        transaction_frequency = _as_number(features.get('transaction_frequency'))
+        session_duration = _as_number(features.get('session_duration'))
+        cursor_movements = _as_number(features.get('cursor_movements'))
+        latitude = _as_number(features.get('latitude'))
+        longitude = _as_number(features.get('longitude'))
+
+        # Calculate amount ratio
+        amount_ratio = transaction_amount / from_balance if from_balance > 0 else 0
+
+        # Parse timestamp to get hour
+        timestamp = features.get('timestamp')
+        try:
+            hour = datetime.fromisoformat(timestamp.replace('Z', '+00:00')).hour
+        except:
+            hour = datetime.now().hour
+
+        values = (
+            transaction_amount,
+            from_balance,
+            amount_ratio,
+            transaction_frequency,
+            session_duration,
+            hour,
+            latitude,
+            longitude,
+            cursor_movements
+        )
+
+    # Return features array
+    if out is None:
+        return np.array(values).reshape(1, -1)
+    out[0] = values
+    return out
+
+
+def learned_state_paths(model_type: str) -> List[str]:
+    """Files under MODEL_DIR that a model of this type learns into while scoring (see state_dir)"""
+    if model_type == "login":
+        return [ONLINE_LOGIN_MODEL_PATH, LOGIN_FEEDBACK_LEDGER_PATH, KEYSTROKE_PROFILES_PATH,
+                update_log_path(KEYSTROKE_PROFILES_PATH), LOGIN_BASELINE_PATH, update_log_path(LOGIN_BASELINE_PATH),
+                LOGIN_DRIFT_PATH, SESSION_CONTEXT_PATH, update_log_path(SESSION_CONTEXT_PATH)]
+    return [ONLINE_TRANSACTION_MODEL_PATH, TRANSACTION_FEEDBACK_LEDGER_PATH, TRANSFER_GRAPH_PATH,
+            update_log_path(TRANSFER_GRAPH_PATH), TRANSACTION_DRIFT_PATH, SESSION_CONTEXT_PATH,
+            update_log_path(SESSION_CONTEXT_PATH)]
+
 class AnomalyDetectionModel:
     """Base class for anomaly detection models"""
     
-    def __init__(self, model_type: str):
+    def __init__(self, model_type: str, read_only: bool = False, memory_budget_mb: float = None,
+                 hot_path: bool = None, backend: str = None, state_dir: str = None):
         self.model_type = model_type
+        # Directory of what the model learns while scoring (online model, per-user stores, drift
+        # counts, audit store); the trained static models are always read from MODEL_DIR
+        self.state_dir = MODEL_DIR if state_dir is None else state_dir
+        # Static members to score with: supervised (rf + xgb), isolation (iforest) or hybrid (all three)
+        self.backend = default_backend() if backend is None else backend
+        if self.backend not in BACKENDS:
+            raise ValueError(f"Unknown backend {self.backend!r}; expected one of {', '.join(BACKENDS)}")
+        self.static_members = BACKENDS[self.backend]
+        # Read-only models (benchmarks, replays) never write learned state back to disk
+        self.read_only = read_only
+        # Score single events through preallocated per-thread buffers (see hot_path.py)
+        self.hot_path = hot_path_enabled() if hot_path is None else hot_path
+        self._hot_path_scorer = None
+        # Runs the members concurrently when a request has a deadline
+        self.member_runner = MemberRunner(model_type)
+        # River models are not thread-safe, and late members keep running after a deadline
+        self._online_lock = threading.Lock()
+        # Whether the online model has learned since it was last saved
+        self._online_dirty = False
+        # Serializes updates of the per-user stores; and whether the drift counts changed since the last save
+        self._state_lock = threading.Lock()
+        self._drift_dirty = False
+        # Verdict audit store (see score_audit.py), opened on the first verdict
+        self._audit_store = None
         self.rf_model_path = LOGIN_RF_MODEL_PATH if model_type == "login" else TRANSACTION_RF_MODEL_PATH
         self.xgb_model_path = LOGIN_XGB_MODEL_PATH if model_type == "login" else TRANSACTION_XGB_MODEL_PATH
         self.scaler_path = LOGIN_SCALER_PATH if model_type == "login" else TRANSACTION_SCALER_PATH
-        self.online_model_path = ONLINE_LOGIN_MODEL_PATH if model_type == "login" else ONLINE_TRANSACTION_MODEL_PATH
+        self.iforest_model_path = LOGIN_IFOREST_MODEL_PATH if model_type == "login" else TRANSACTION_IFOREST_MODEL_PATH
+        self.online_model_path = self._state_path(ONLINE_LOGIN_MODEL_PATH if model_type == "login" else ONLINE_TRANSACTION_MODEL_PATH)
+        self.native_dir = native_directory(MODEL_DIR, model_type)
+        self.feature_names = LOGIN_FEATURES if model_type == "login" else TRANSACTION_FEATURES
+        
+        # Skip the largest members up front if the artifacts would not fit the memory budget
+        self.memory_budget_bytes = resolve_memory_budget(memory_budget_mb)
+        self.skipped_members = plan_within_budget(self.artifact_paths(), self.memory_budget_bytes, memory_policy())
+        if self.skipped_members:
+            logger.warning(f"Memory budget exceeded: {self.model_type} scoring without {', '.join(self.skipped_members)}")
         
         # Load or train models
-        self.rf_model, self.xgb_model, self.scaler = self._load_or_train_models()
-        self.online_model = self._load_or_create_online_model()
+        self.rss_before_load = current_rss_bytes()
+        if "xgb" in self.static_members:
+            self.rf_model, self.xgb_model, self.scaler = self._load_or_train_models()
+        else:
+            self.rf_model = self.xgb_model = self.scaler = None
+            self._last_load_attempt = time.monotonic()
+        self.iforest_model = load_member(self.iforest_model_path) if "iforest" in self.static_members else None
+        if "iforest" in self.static_members and self.iforest_model is None:
+            logger.warning(f"No {self.model_type} IsolationForest at {self.iforest_model_path}; "
+                           f"train one with isolation_backend.py")
+        self.online_model = self._load_or_create_online_model() if "online" not in self.skipped_members else None
         
-    def _train_initial_models(self):
-        """Train initial models if they don't exist"""
-        try:
-            logger.info(f"Training initial {self.model_type} models")
-            
-            # Create synthetic data for initial training
-            n_samples = 1000
-            
-            # Generate normal behavior data (80% of samples)
-            normal_samples = int(n_samples * 0.8)
-            anomaly_samples = n_samples - normal_samples
-            
-            if self.model_type == "login":
-                # Features for login: typing_speed, cursor_movements, session_duration, hour, latitude, longitude, keystroke_variance
-                normal_data = np.random.rand(normal_samples, 7)
-                # Normalize to realistic ranges
-                normal_data[:, 0] *= 10  # typing_speed: 0-10 chars/sec
-                normal_data[:, 1] *= 100  # cursor_movements: 0-100 movements
-                normal_data[:, 2] = normal_data[:, 2] * 120 + 30  # session_duration: 30-150 seconds
-                normal_data[:, 3] = np.random.randint(8, 20, size=normal_samples)  # hour: 8am-8pm
-                normal_data[:, 4] = np.random.uniform(10, 40, size=normal_samples)  # latitude: 10-40
-                normal_data[:, 5] = np.random.uniform(70, 100, size=normal_samples)  # longitude: 70-100
-                normal_data[:, 6] = np.random.uniform(0.01, 0.2, size=normal_samples)  # keystroke_variance: 0.01-0.2 seconds
-                
-                # Generate anomaly data (20% of samples)
-                anomaly_data = np.random.rand(anomaly_samples, 7)
-                # Make anomalies more extreme
-                anomaly_data[:, 0] = np.random.choice([0.5, 15], size=anomaly_samples)  # very slow or very fast typing
-                anomaly_data[:, 1] = np.random.choice([5, 200], size=anomaly_samples)  # very few or many cursor movements
-                anomaly_data[:, 2] = np.random.choice([10, 300], size=anomaly_samples)  # very short or long sessions
-                anomaly_data[:, 3] = np.random.choice([1, 3, 23], size=anomaly_samples)  # unusual hours (night)
-                anomaly_data[:, 4] = np.random.uniform(-90, 90, size=anomaly_samples)  # random latitudes
-                anomaly_data[:, 5] = np.random.uniform(-180, 180, size=anomaly_samples)  # random longitudes
-                anomaly_data[:, 6] = np.random.uniform(0.5, 2.0, size=anomaly_samples)  # high keystroke variance
-            else:
-                # Features for transaction: transaction_amount, from_balance, amount_ratio, transaction_frequency, 
-                # session_duration, hour, latitude, longitude, cursor_movements
-                normal_data = np.random.rand(normal_samples, 9)
-                # Normalize to realistic ranges
-                normal_data[:, 0] *= 5000  # transaction_amount: 0-5000
-                normal_data[:, 1] = normal_data[:, 0] * 10  # from_balance: 10x transaction amount
-                normal_data[:, 2] = normal_data[:, 0] / normal_data[:, 1]  # amount_ratio: transaction/balance
-                normal_data[:, 3] = np.random.randint(1, 20, size=normal_samples)  # transaction_frequency: 1-20
-                normal_data[:, 4] = np.random.randint(30, 300, size=normal_samples)  # session_duration: 30-300 seconds
-                normal_data[:, 5] = np.random.randint(8, 20, size=normal_samples)  # hour: 8am-8pm
-                normal_data[:, 6] = np.random.uniform(10, 40, size=normal_samples)  # latitude: 10-40
-                normal_data[:, 7] = np.random.uniform(70, 100, size=normal_samples)  # longitude: 70-100
-                normal_data[:, 8] = np.random.randint(10, 100, size=normal_samples)  # cursor_movements: 10-100
-                
-                # Generate anomaly data (20% of samples)
-                anomaly_data = np.random.rand(anomaly_samples, 9)
-                # Make anomalies more extreme
-                anomaly_data[:, 0] = np.random.uniform(8000, 20000, size=anomaly_samples)  # very large transactions
-                anomaly_data[:, 1] = np.random.uniform(5000, 15000, size=anomaly_samples)  # lower balances
-                anomaly_data[:, 2] = anomaly_data[:, 0] / anomaly_data[:, 1]  # high amount_ratio
-                anomaly_data[:, 3] = np.random.choice([0, 30], size=anomaly_samples)  # very low or high frequency
-                anomaly_data[:, 4] = np.random.choice([5, 600], size=anomaly_samples)  # very short or long sessions
-                anomaly_data[:, 5] = np.random.choice([1, 3, 23], size=anomaly_samples)  # unusual hours (night)
-                anomaly_data[:, 6] = np.random.uniform(-90, 90, size=anomaly_samples)  # random latitudes
-                anomaly_data[:, 7] = np.random.uniform(-180, 180, size=anomaly_samples)  # random longitudes
-                anomaly_data[:, 8] = np.random.choice([5, 200], size=anomaly_samples)  # unusual cursor movements
-            
-            # Combine data and create labels
-            X = np.vstack([normal_data, anomaly_data])
-            y = np.hstack([np.zeros(normal_samples), np.ones(anomaly_samples)])
-            
-            # Shuffle the data
-            indices = np.arange(n_samples)
-            np.random.shuffle(indices)
-            X = X[indices]
-            y = y[indices]
-            
-            # Create and fit the scaler
-            scaler = StandardScaler()
-            X_scaled = scaler.fit_transform(X)
-            
-            # Train Random Forest model
-            rf_model = RandomForestClassifier(n_estimators=100, random_state=42)
-            rf_model.fit(X_scaled, y)
-            
-            # Train XGBoost model
-            xgb_model = xgb.XGBClassifier(n_estimators=100, random_state=42)
-            xgb_model.fit(X_scaled, y)
-            
-            # Save models
-            joblib.dump(rf_model, self.rf_model_path)
-            joblib.dump(xgb_model, self.xgb_model_path)
-            joblib.dump(scaler, self.scaler_path)
-            
-            logger.info(f"Initial {self.model_type} models trained and saved successfully")
-            
-            return rf_model, xgb_model, scaler
+        # Confirmed labels logged by feedback_ingestion.py, learned by every process with an online model
+        self.feedback_ledger_path = self._state_path(
+            LOGIN_FEEDBACK_LEDGER_PATH if model_type == "login" else TRANSACTION_FEEDBACK_LEDGER_PATH
+        )
+        self._feedback_offset = 0
+        self.apply_logged_feedback()
+        self.rss_after_load = current_rss_bytes()
+        
+        if "rf" in self.skipped_members:
+            self.rf_model = None
+        
+        # Logs of the per-user store updates, shared with the other scoring processes (see state_persistence.py)
+        self.update_logs = []
+        
+        # Per-user typing rhythm profiles (login only)
+        self.keystroke_profiles_path = self._state_path(KEYSTROKE_PROFILES_PATH)
+        self.keystroke_profiles = (self._load_logged(self.keystroke_profiles_path, KeystrokeProfileStore.load)
+                                   if model_type == "login" else None)
+        
+        # Ring of each user's recent login feature vectors (login only)
+        self.login_baseline_path = self._state_path(LOGIN_BASELINE_PATH)
+        self.login_baseline = (self._load_logged(self.login_baseline_path,
+                                                 lambda path: LoginBaselineIndex.load(path, len(LOGIN_FEATURES)))
+                               if model_type == "login" else None)
         
+        # Sender -> recipient transfer history (transaction only)
+        self.transfer_graph_path = self._state_path(TRANSFER_GRAPH_PATH)
+        self.transfer_graph = (self._load_logged(self.transfer_graph_path, TransferGraphIndex.load)
+                               if model_type == "transaction" else None)
+        
+        # Login context of the current session, shared by the login and transaction models of this process
+        # and, through its update log, with the other scoring processes (see session_cache.py)
+        self.session_cache = get_session_cache(LOGIN_FEATURES, self._state_path(SESSION_CONTEXT_PATH),
+                                               journal=not self.read_only)
+        if self.session_cache is not None and not self.read_only:
+            self.update_logs.append(self.session_cache.journal)
+        
+        # Per-feature contributions explaining flagged events (see feature_attribution.py)
+        self.explainer = AttributionExplainer(self.feature_names, STATIC_MEMBER_WEIGHTS)
+        
+        # Histograms of the scored features, checked against the training distribution
+        self.reference_path = LOGIN_REFERENCE_PATH if model_type == "login" else TRANSACTION_REFERENCE_PATH
+        self.drift_path = self._state_path(LOGIN_DRIFT_PATH if model_type == "login" else TRANSACTION_DRIFT_PATH)
+        self.drift_monitor = self._load_drift_monitor()
+        
+        # Learned state is written by a background thread, never on the request path (see state_persistence.py)
+        self.state_saver = None
+        if not self.read_only:
+            self.state_saver = StateSaver(f"{model_type} model")
+            if self.online_model is not None:
+                self.state_saver.add(self._sync_online_model)
+            self.state_saver.add(self.save_state)
+        
+    def _load_logged(self, path: str, load_snapshot):
+        """A per-user store with every process's logged updates, recording its own updates unless read-only"""
+        update_log = UpdateLog(path, load_snapshot)
+        store = update_log.load()
+        if not self.read_only:
+            store.journal = update_log
+            self.update_logs.append(update_log)
+        return store
+    
+    def _state_path(self, path: str) -> str:
+        """Where a learned-state file or directory under MODEL_DIR lives for this model"""
+        return os.path.join(self.state_dir, os.path.relpath(path, MODEL_DIR))
+    
+    def close(self):
+        """Save the learned state one last time and stop the background saves"""
+        if self.state_saver is not None:
+            self.state_saver.close()
+        
+    def _load_drift_monitor(self) -> FeatureDriftMonitor:
+        """The feature drift monitor with its saved counts (None when ANOMALY_DRIFT_INTERVAL_SECONDS is 0)"""
+        interval = drift_interval_seconds()
+        if interval <= 0:
+            return None
+        try:
+            reference = load_reference(self.reference_path, self.feature_names)
+            if reference is None:
+                # Built before references were saved; the initial training data is seeded, so it is regenerated
+                X, _ = generate_matrix(self.model_type, INITIAL_TRAINING_ROWS, seed=INITIAL_TRAINING_SEED)
+                edges = bin_edges(X)
+                reference = (edges, bin_counts(X, edges))
+            return FeatureDriftMonitor.load(self.drift_path, self.feature_names, *reference, interval_seconds=interval)
+        except Exception as e:
+            logger.error(f"Error setting up {self.model_type} feature drift monitoring: {str(e)}", exc_info=True)
+            return None
+    
+    def _observe_features(self, model_features: np.ndarray):
+        """Count scored feature rows towards the drift histograms; they are saved in the background after each check"""
+        if self.drift_monitor is None:
+            return
+        try:
+            if self.drift_monitor.observe(model_features):
+                self._drift_dirty = True
         except Exception as e:
-            logger.error(f"Error training initial {self.model_type} models: {str(e)}", exc_info=True)
-            raise
+            logger.error(f"Error monitoring {self.model_type} feature drift: {str(e)}", exc_info=True)
     
     def _load_or_train_models(self):
-        """Load existing models or train new ones if they don't exist"""
+        """
+        Load existing models, preferring the native artifacts over the pickles; if they are missing
+        or corrupt, start training them in the background and return no models so requests are
+        served by the heuristic fallback
+        """
+        self._last_load_attempt = time.monotonic()
+        pickle_paths = [self.rf_model_path, self.xgb_model_path, self.scaler_path]
+        if not training_in_progress(self.model_type) and native_is_current(self.native_dir, pickle_paths):
+            try:
+                logger.info(f"Loading native {self.model_type} models")
+                members = [name for name in ("rf", "xgb", "scaler") if name not in self.skipped_members]
+                return load_native(self.native_dir, self.feature_names, members)
+            except Exception as e:
+                logger.error(f"Error loading native {self.model_type} models: {str(e)}", exc_info=True)
+        
         try:
             if (os.path.exists(self.rf_model_path) and 
                 os.path.exists(self.xgb_model_path) and 
-                os.path.exists(self.scaler_path)):
+                os.path.exists(self.scaler_path) and
+                not training_in_progress(self.model_type)):
                 
                 logger.info(f"Loading existing {self.model_type} models")
-                rf_model = joblib.load(self.rf_model_path)
+                rf_model = joblib.load(self.rf_model_path) if "rf" not in self.skipped_members else None
                 xgb_model = joblib.load(self.xgb_model_path)
                 scaler = joblib.load(self.scaler_path)
-            else:
-                logger.info(f"Training new {self.model_type} models")
-                rf_model, xgb_model, scaler = self._train_initial_models()
-                
-            return rf_model, xgb_model, scaler
+                return rf_model, xgb_model, scaler
         
         except Exception as e:
             logger.error(f"Error loading {self.model_type} models: {str(e)}", exc_info=True)
-            # Train new models as fallback
-            logger.info(f"Training new {self.model_type} models as fallback")
-            return self._train_initial_models()
+        
+        if start_background_build(self.model_type):
+            logger.info(f"Training new {self.model_type} models in the background")
+        return None, None, None
+    
+    def is_ready(self) -> bool:
+        """
+        Whether trained static models are loaded
+        While they are not, newly built artifacts are picked up at most once per second
+        """
+        if self.backend == "isolation":
+            if self.iforest_model is None and time.monotonic() - self._last_load_attempt >= MODEL_RELOAD_INTERVAL_SECONDS:
+                self._last_load_attempt = time.monotonic()
+                self.iforest_model = load_member(self.iforest_model_path)
+            return self.iforest_model is not None
+        
+        if self.xgb_model is not None and self.scaler is not None:
+            return True
+        
+        if time.monotonic() - self._last_load_attempt >= MODEL_RELOAD_INTERVAL_SECONDS:
+            rf_model, xgb_model, scaler = self._load_or_train_models()
+            if xgb_model is not None and scaler is not None:
+                self.rf_model, self.xgb_model, self.scaler = rf_model, xgb_model, scaler
+                logger.info(f"{self.model_type.capitalize()} models are ready")
+        
+        return self.xgb_model is not None and self.scaler is not None
+    
+    def _not_ready_result(self, features: Dict[str, Any]) -> Dict[str, Any]:
+        """Heuristic result served while the static models are being built"""
+        if self.model_type == "login":
+            result = self._login_fallback_detection(features)
+        else:
+            result = self._transaction_fallback_detection(features)
+        result["model_status"] = "training" if training_in_progress(self.model_type) else "unavailable"
+        return result
     
     def _load_or_create_online_model(self):
-        """Load or create online learning model"""
+        """Load or create online learning model of the configured backend (see online_backends.py)"""
         try:
             # Check if River is available
             try:
-                from river import anomaly, preprocessing, ensemble
-                river_available = True
+                import river
             except ImportError:
                 logger.warning("River package not available. Online learning disabled.")
                 return None
             
-            if os.path.exists(self.online_model_path):
-                logger.info(f"Loading existing online {self.model_type} model")
-                with open(self.online_model_path, 'rb') as f:
-                    return pickle.load(f)
-            
-            logger.info(f"Creating new online {self.model_type} model")
-            
-            if self.model_type == "login":
-                # For login anomaly detection
-                return preprocessing.StandardScaler() | anomaly.HalfSpaceTrees(
-                    n_trees=50,
-                    height=10,
-                    window_size=256,
-                    seed=42
-                )
-            else:
-                # For transaction anomaly detection
-                return preprocessing.StandardScaler() | ensemble.AdaptiveRandomForestClassifier(
-                    n_models=10,
-                    seed=42
-                )
+            return load_or_build_online_model(self.online_model_path, self.model_type)
         
         except Exception as e:
             logger.error(f"Error creating online {self.model_type} model: {str(e)}", exc_info=True)
             return None
     
+    def apply_logged_feedback(self) -> int:
+        """
+        Learn the feedback batches logged since the online model's last one (see feedback_ingestion.py)
+        Every process with the online model does this at load and before each background save, so a
+        snapshot saved by any of them has all the feedback logged before it, and the batches logged
+        after it are learned by whoever loads it next
+        Returns: number of batches learned
+        """
+        if self.online_model is None or not os.path.exists(self.feedback_ledger_path):
+            return 0
+        applied = 0
+        try:
+            with open(self.feedback_ledger_path, 'rb') as f:
+                if os.fstat(f.fileno()).st_size < self._feedback_offset:
+                    # Rewritten by the ingestor; batches already learned are skipped by their number
+                    self._feedback_offset = 0
+                f.seek(self._feedback_offset)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break    # still being appended
+                    self._feedback_offset += len(line)
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    # Batches logged before the ledger kept their rows cannot be learned again
+                    if "rows" not in entry:
+                        continue
+                    if self.learn_feedback_rows(entry["rows"], entry["labels"], entry["batch"]) is not None:
+                        applied += 1
+        except OSError as e:
+            logger.error(f"Error reading the {self.model_type} feedback ledger: {str(e)}", exc_info=True)
+        if applied:
+            logger.info(f"Learned {applied} logged {self.model_type} feedback batches")
+        return applied
+    
+    def _sync_online_model(self):
+        """Learn newly logged feedback, then save the online model if it changed (run by the background saver)"""
+        self.apply_logged_feedback()
+        self._save_online_model()
+    
     def _save_online_model(self):
-        """Save online model to disk"""
-        if self.online_model is None:
+        """Save online model to disk if it has learned since the last save"""
+        if self.online_model is None or self.read_only or not self._online_dirty:
             return
             
         try:
             logger.info(f"Saving online {self.model_type} model")
-            with open(self.online_model_path, 'wb') as f:
-                pickle.dump(self.online_model, f)
+            # Only the pickling holds up scoring; the file is written after the lock is released
+            with self._online_lock:
+                snapshot = pickle.dumps(self.online_model)
+                self._online_dirty = False
+            # Written to a temporary file first so a crash never leaves a truncated model behind
+            tmp_path = self.online_model_path + ".tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(snapshot)
+            os.replace(tmp_path, self.online_model_path)
         except Exception as e:
             logger.error(f"Error saving online {self.model_type} model: {str(e)}", exc_info=True)
     
-    def _prepare_features(self, features: Dict[str, Any]) -> np.ndarray:
-        """Prepare features for the model"""
-        if self.model_type == "login":
-            # Extract login features
-            typing_speed = features.get('typing_speed', 0) or 0
-            cursor_movements = features.get('cursor_movements', 0) or 0
-            session_duration = features.get('session_duration', 0) or 0
-            latitude = features.get('latitude', 0) or 0
-            longitude = features.get('longitude', 0) or 0
-            
-            # Calculate keystroke variance if available
-            keystroke_variance = 0.0
-            keystroke_timings = features.get('keystroke_timings', [])
-            if keystroke_timings and len(keystroke_timings) > 1:
-                keystroke_variance = np.var(keystroke_timings)
-            
-            # Parse timestamp to get hour
-            timestamp = features.get('timestamp')
+    def artifact_paths(self) -> Dict[str, str]:
+        """Paths of the artifacts of each ensemble member the backend loads"""
+        paths = {}
+        if "xgb" in self.static_members:
+            paths.update(rf=self.rf_model_path, xgb=self.xgb_model_path, scaler=self.scaler_path)
+        if "iforest" in self.static_members:
+            paths["iforest"] = self.iforest_model_path
+        paths["online"] = self.online_model_path
+        return paths
+    
+    def memory_report(self, sample_features: Dict[str, Any] = None) -> Dict[str, Any]:
+        """
+        Report the memory footprint of the loaded models
+        Returns: deep size per model, RSS around loading and, if sample_features is given,
+        tracemalloc allocation hot spots while scoring it
+        """
+        return build_memory_report(self, sample_features)
+    
+    def isolated_copy(self) -> "AnomalyDetectionModel":
+        """
+        A copy sharing the static models that scores without changing this model's state
+        Its online model is a private copy, and it has no audit store, session cache, per-user stores,
+        drift monitor or background saver, so nothing it scores is learned, saved or recorded
+        """
+        scratch = copy.copy(self)
+        scratch.read_only = True
+        scratch._audit_store = None
+        scratch.session_cache = None
+        scratch.keystroke_profiles = None
+        scratch.login_baseline = None
+        scratch.transfer_graph = None
+        scratch.drift_monitor = None
+        scratch.state_saver = None
+        scratch.update_logs = []
+        scratch._online_lock = threading.Lock()
+        with self._online_lock:
+            scratch.online_model = copy.deepcopy(self.online_model)
+        return scratch
+    
+    def _scale(self, model_features: np.ndarray) -> np.ndarray:
+        """Scaled features for the supervised members (None when the backend has none)"""
+        return self.scaler.transform(model_features) if self.scaler is not None else None
+    
+    def _static_probabilities(self, model_features: np.ndarray, scaled_features: np.ndarray) -> Dict[str, np.ndarray]:
+        """Anomaly probability of each loaded static model for every row"""
+        probabilities = {}
+        if self.rf_model is not None:
+            probabilities["rf"] = self.rf_model.predict_proba(scaled_features)[:, 1]
+        if self.xgb_model is not None:
+            probabilities["xgb"] = self.xgb_model.predict_proba(scaled_features)[:, 1]
+        if self.iforest_model is not None:
+            # The forest works on the raw features
+            probabilities["iforest"] = self.iforest_model.predict_proba(model_features)
+        return probabilities
+    
+    def _static_ensemble(self, probabilities: Dict[str, np.ndarray]) -> np.ndarray:
+        """Weighted average of the static model probabilities"""
+        total_weight = sum(STATIC_MEMBER_WEIGHTS[name] for name in probabilities)
+        return sum(STATIC_MEMBER_WEIGHTS[name] * prob for name, prob in probabilities.items()) / total_weight
+    
+    def save_state(self):
+        """
+        Save the drift counts if they changed, and append the per-user store updates to their logs
+        Run by the background saver (see state_persistence.py), not on the request path
+        """
+        if self.read_only:
+            return
+        
+        if self._drift_dirty and self.drift_monitor is not None:
+            self._drift_dirty = False
             try:
-                hour = datetime.fromisoformat(timestamp.replace('Z', '+00:00')).hour
-            except:
-                hour = datetime.now().hour
-            
-            # Return features array
-            return np.array([
-                typing_speed,
-                cursor_movements,
-                session_duration,
-                hour,
-                latitude,
-                longitude,
-                keystroke_variance
-            ]).reshape(1, -1)
-        else:
-            # Extract transaction features
-            transaction_amount = features.get('transaction_amount', 0) or 0
-            from_balance = features.get('from_balance', 0) or 0
-            transaction_frequency = features.get('transaction_frequency', 0) or 0
-            session_duration = features.get('session_duration', 0) or 0
-            cursor_movements = features.get('cursor_movements', 0) or 0
-            latitude = features.get('latitude', 0) or 0
-            longitude = features.get('longitude', 0) or 0
-            
-            # Calculate amount ratio
-            amount_ratio = transaction_amount / from_balance if from_balance > 0 else 0
-            
-            # Parse timestamp to get hour
-            timestamp = features.get('timestamp')
+                self.drift_monitor.save(self.drift_path)
+            except Exception as e:
+                logger.error(f"Error saving {self.model_type} feature drift counts: {str(e)}", exc_info=True)
+        
+        for update_log in self.update_logs:
             try:
-                hour = datetime.fromisoformat(timestamp.replace('Z', '+00:00')).hour
-            except:
-                hour = datetime.now().hour
-            
-            # Return features array
-            return np.array([
-                transaction_amount,
-                from_balance,
-                amount_ratio,
-                transaction_frequency,
-                session_duration,
-                hour,
-                latitude,
-                longitude,
-                cursor_movements
-            ]).reshape(1, -1)
+                update_log.flush()
+            except Exception as e:
+                logger.error(f"Error writing {update_log.path}: {str(e)}", exc_info=True)
+    
+    def _signals(self, features_list: List[Dict[str, Any]], model_features: np.ndarray) -> List[Dict[str, Any]]:
+        """
+        Contextual signals from the per-user state, learning from the same events
+        Returns: one dict per event, or None when this model type keeps no per-user state
+        """
+        with self._state_lock:
+            return self._store_signals(features_list, model_features)
+    
+    def _store_signals(self, features_list: List[Dict[str, Any]], model_features: np.ndarray) -> List[Dict[str, Any]]:
+        """_signals without the lock"""
+        if self.keystroke_profiles is not None:
+            signals = self._keystroke_signals(features_list)
+            baselines = self._baseline_signals([features.get('user_id') for features in features_list], model_features)
+            for signal, baseline in zip(signals, baselines):
+                signal.update(baseline)
+            return signals
+        if self.transfer_graph is not None:
+            signals = self._transfer_signals(features_list)
+            if self.session_cache is not None:
+                for signal, session in zip(signals, self._session_signals(features_list)):
+                    signal.update(session)
+            return signals
+        return None
+    
+    def _keystroke_signals(self, features_list: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Robust keystroke statistics and the deviation from each user's own typing profile"""
+        try:
+            stats = keystroke_statistics_batch([features.get('keystroke_timings') for features in features_list])
+            deviations = self.keystroke_profiles.observe_batch(
+                [features.get('user_id') for features in features_list], stats
+            )
+            signals = []
+            for row, deviation in zip(stats, deviations):
+                signal = {f"keystroke_{name}": float(value) for name, value in zip(KEYSTROKE_STATS, row)}
+                signal["keystroke_profile_deviation"] = deviation
+                signals.append(signal)
+            return signals
+        except Exception as e:
+            logger.error(f"Error computing keystroke signals: {str(e)}", exc_info=True)
+            return [{} for _ in features_list]
+    
+    def _baseline_signals(self, user_ids: List[Any], model_features: np.ndarray) -> List[Dict[str, Any]]:
+        """Distance of each login to the same user's recent logins, in the static scaler's units"""
+        try:
+            # The isolation backend loads no scaler; its forest keeps the same per-feature scale
+            scale = self.scaler.scale_ if self.scaler is not None else self.iforest_model.feature_scale
+            return self.login_baseline.observe_batch(user_ids, model_features, scale)
+        except Exception as e:
+            logger.error(f"Error computing login baseline signals: {str(e)}", exc_info=True)
+            return [{} for _ in user_ids]
+    
+    def _transfer_signals(self, features_list: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Recipient novelty and fan-out of each transfer from the sender -> recipient graph"""
+        try:
+            graph_features = self.transfer_graph.observe_batch([
+                (features.get('from_account_id'), features.get('to_account_id'), event_time(features))
+                for features in features_list
+            ])
+            return [signal or {} for signal in graph_features]
+        except Exception as e:
+            logger.error(f"Error computing transfer graph signals: {str(e)}", exc_info=True)
+            return [{} for _ in features_list]
+    
+    def _session_signals(self, features_list: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        What the login that started each transfer's session looked like (see session_cache.py)
+        A transfer is linked by session_id, else by user_id, else by from_account_id as the login account
+        """
+        try:
+            signals = []
+            for features in features_list:
+                at = event_time(features)
+                context = self.session_cache.lookup_transfer(features, at)
+                signals.append(self.session_cache.signals(context, features.get('latitude'), features.get('longitude'), at))
+            return signals
+        except Exception as e:
+            logger.error(f"Error computing session signals: {str(e)}", exc_info=True)
+            return [{} for _ in features_list]
+    
+    def _remember_sessions(self, features_list: List[Dict[str, Any]], results: List[Dict[str, Any]]):
+        """Store each login's feature vector and verdict as the context of its session"""
+        if self.session_cache is None or self.model_type != "login":
+            return
+        try:
+            indices = [i for i, features in enumerate(features_list) if features.get('user_id')]
+            if not indices:
+                return
+            vectors = self._prepare_features_batch([features_list[i] for i in indices])
+            for i, vector in zip(indices, vectors):
+                features = features_list[i]
+                self.session_cache.remember_login_event(features, vector, results[i], event_time(features))
+        except Exception as e:
+            logger.error(f"Error storing login session context: {str(e)}", exc_info=True)
+    
+    def _prepare_features(self, features: Dict[str, Any], out: np.ndarray = None) -> np.ndarray:
+        """
+        Prepare features for the model (see prepare_features)
+        out: optional (1, n_features) float64 row to fill instead of allocating a new one
+        """
+        return prepare_features(self.model_type, features, out)
+    
+    def _prepare_features_batch(self, features_list: List[Dict[str, Any]]) -> np.ndarray:
+        """Prepare a feature matrix with one row per event"""
+        return np.vstack([self._prepare_features(features) for features in features_list])
     
     def _prepare_online_features(self, features: Dict[str, Any]) -> Dict[str, float]:
         """Prepare features for online model"""
         if self.model_type == "login":
             # Extract login features
-            typing_speed = features.get('typing_speed', 0) or 0
-            cursor_movements = features.get('cursor_movements', 0) or 0
-            session_duration = features.get('session_duration', 0) or 0
-            latitude = features.get('latitude', 0) or 0
-            longitude = features.get('longitude', 0) or 0
+            typing_speed = _as_number(features.get('typing_speed'))
+            cursor_movements = _as_number(features.get('cursor_movements'))
+            session_duration = _as_number(features.get('session_duration'))
+            latitude = _as_number(features.get('latitude'))
+            longitude = _as_number(features.get('longitude'))
             
             # Calculate keystroke variance if available
-            keystroke_variance = 0.0
-            keystroke_timings = features.get('keystroke_timings', [])
-            if keystroke_timings and len(keystroke_timings) > 1:
-                keystroke_variance = np.var(keystroke_timings)
+            keystroke_variance = _timings_variance(features.get('keystroke_timings'))
             
             # Parse timestamp to get hour
             timestamp = features.get('timestamp')
@@ -324,13 +782,13 @@ class AnomalyDetectionModel:
             }
         else:
             # Extract transaction features
-            transaction_amount = features.get('transaction_amount', 0) or 0
-            from_balance = features.get('from_balance', 0) or 0
-            transaction_frequency = features.get('transaction_frequency', 0) or 0
-            session_duration = features.get('session_duration', 0) or 0
-            cursor_movements = features.get('cursor_movements', 0) or 0
-            latitude = features.get('latitude', 0) or 0
-            longitude = features.get('longitude', 0) or 0
+            transaction_amount = _as_number(features.get('transaction_amount'))
+            from_balance = _as_number(features.get('from_balance'))
+            transaction_frequency = _as_number(features.get('transaction_frequency'))
+            session_duration = _as_number(features.get('session_duration'))
+            cursor_movements = _as_number(features.get('cursor_movements'))
+            latitude = _as_number(features.get('latitude'))
+            longitude = _as_number(features.get('longitude'))
             
             # Calculate amount ratio
             amount_ratio = transaction_amount / from_balance if from_balance > 0 else 0
@@ -355,137 +813,173 @@ class AnomalyDetectionModel:
                 'cursor_movements': cursor_movements
             }
     
+    def _rule_columns(self, model_features: np.ndarray) -> Dict[str, np.ndarray]:
+        """Columns of a feature matrix by name, as the rule engine takes them"""
+        return dict(zip(self.feature_names, model_features.T))
+    
     def _determine_anomaly_type(self, features: Dict[str, Any], is_anomaly: bool) -> str:
-        """Determine the type of anomaly based on feature analysis"""
+        """Determine the type of anomaly based on feature analysis (see anomaly_rules.json)"""
         if not is_anomaly:
             return None
-        
-        if self.model_type == "login":
-            typing_speed = features.get('typing_speed', 0) or 0
-            session_duration = features.get('session_duration', 0) or 0
-            keystroke_timings = features.get('keystroke_timings', [])
-            keystroke_variance = np.var(keystroke_timings) if keystroke_timings and len(keystroke_timings) > 1 else 0
-            
-            timestamp = features.get('timestamp')
-            try:
-                hour = datetime.fromisoformat(timestamp.replace('Z', '+00:00')).hour
-            except:
-                hour = datetime.now().hour
-            
-            # Analyze which features contributed most to the anomaly
-            if typing_speed < 1 or typing_speed > 12:
-                return "Unusual typing pattern"
-            elif session_duration < 10:
-                return "Unusually quick login"
-            elif hour >= 0 and hour <= 5:
-                return "Unusual login time (night)"
-            elif keystroke_variance > 0.5:
-                return "Inconsistent typing rhythm"
-            else:
-                return "Suspicious login behavior"
-        else:
-            transaction_amount = features.get('transaction_amount', 0) or 0
-            from_balance = features.get('from_balance', 0) or 0
-            amount_ratio = transaction_amount / from_balance if from_balance > 0 else 0
-            session_duration = features.get('session_duration', 0) or 0
-            
-            timestamp = features.get('timestamp')
-            try:
-                hour = datetime.fromisoformat(timestamp.replace('Z', '+00:00')).hour
-            except:
-                hour = datetime.now().hour
-            
-            # Analyze which features contributed most to the anomaly
-            if amount_ratio > 0.7:
-                return "Unusually large transaction relative to balance"
-            elif transaction_amount > 10000:
-                return "Unusually large transaction amount!! \nAnomaly logged and staff alert created"
-            elif session_duration < 10:
-                return "Unusually quick transaction"
-            elif hour >= 0 and hour <= 5:
-                return "Unusual transaction time (night)"
-            else:
-                return "Suspicious transaction pattern"
+        return self._determine_anomaly_types(self._prepare_features(features), np.array([True]))[0]
     
-    def detect_anomaly(self, features: Dict[str, Any]) -> Dict[str, Any]:
+    def detect_anomaly(self, features: Dict[str, Any], deadline_ms: float = None) -> Dict[str, Any]:
         """
-        Detect anomalies using both static and online models
-        Returns: dict with is_anomalous, anomaly_type, and score
+        Detect anomalies using both static and online models, and record the verdict in the audit store
+        (and, for a login, as the context of its session; see session_cache.py)
+        deadline_ms: latency budget (default ANOMALY_DEADLINE_MS); when it runs out the verdict
+        comes from the members that have finished, with their weights renormalized
+        Returns: dict with is_anomalous, anomaly_type, score, the members that contributed and their
+        probabilities (member_scores)
         """
+        with profiled(f"{self.model_type}.detect_anomaly", self.model_type, [features]):
+            result = self._detect_anomaly(features, deadline_ms)
+            self._audit([features], [result])
+            self._remember_sessions([features], [result])
+        return result
+    
+    def _detect_anomaly(self, features: Dict[str, Any], deadline_ms: float = None) -> Dict[str, Any]:
+        """detect_anomaly without the audit record"""
+        deadline = deadline_after(deadline_ms)
+        
+        if not self.is_ready():
+            logger.info(f"{self.model_type.capitalize()} models not ready, using heuristic detection")
+            return self._not_ready_result(features)
+        
+        if self.hot_path and deadline is None:
+            return self._detect_anomaly_hot(features)
+        
         try:
             logger.info(f"Starting {self.model_type} anomaly detection with features: {features}")
             
             # Prepare features for static models
             model_features = self._prepare_features(features)
+            self._observe_features(model_features)
             
             # Scale features
-            scaled_features = self.scaler.transform(model_features)
+            scaled_features = self._scale(model_features)
             
-            # Make predictions with both models
-            rf_pred = self.rf_model.predict(scaled_features)[0]
-            rf_prob = self.rf_model.predict_proba(scaled_features)[0][1]
+            # Run the ensemble members (within the deadline, if there is one)
+            online_features_list = [self._prepare_online_features(features)] if self.online_model is not None else []
+            probabilities = self._member_probabilities(model_features, scaled_features, online_features_list, deadline)
             
-            xgb_pred = self.xgb_model.predict(scaled_features)[0]
-            xgb_prob = self.xgb_model.predict_proba(scaled_features)[0][1]
+            member_log = ", ".join(
+                f"{name.upper()}: {int(prob[0] > 0.5)} ({prob[0]:.3f})" for name, prob in probabilities.items()
+            )
+            logger.info(f"Member predictions - {member_log or 'none in time'}")
             
-            # Ensemble prediction (weighted average)
-            ensemble_prob = 0.6 * rf_prob + 0.4 * xgb_prob
-            ensemble_pred = 1 if ensemble_prob > 0.7 else 0
+            # Ensemble prediction (weighted average of the members that finished)
+            ensemble_prob, members = self._combine_members(probabilities)
+            if ensemble_prob is None:
+                result = self._fallback_detection(features)
+                logger.info(f"No ensemble member finished in time, heuristic result: {result}")
+                return result
+            ensemble_prob = float(ensemble_prob[0])
+            ensemble_pred = 1 if ensemble_prob > DECISION_THRESHOLD else 0
+            
+            # Determine anomaly type
+            anomaly_types, attributions = self._explain(model_features, np.array([ensemble_pred == 1]),
+                                                        np.array([ensemble_prob]))
+            
+            result = {
+                "is_anomalous": bool(ensemble_pred == 1),
+                "anomaly_type": anomaly_types[0],
+                "score": float(ensemble_prob),
+                "members": members,
+                "member_scores": {name: float(prob[0]) for name, prob in probabilities.items()}
+            }
+            if attributions is not None and attributions[0] is not None:
+                result["attributions"] = attributions[0]
+            
+            signals = self._signals([features], model_features)
+            if signals is not None:
+                result["signals"] = signals[0]
+            
+            logger.info(f"{self.model_type.capitalize()} anomaly detection result: {result}")
+            return result
+            
+        except Exception as e:
+            logger.error(f"Error in {self.model_type} anomaly detection: {str(e)}", exc_info=True)
             
-            logger.info(f"Static model predictions - RF: {rf_pred} ({rf_prob:.3f}), XGB: {xgb_pred} ({xgb_prob:.3f}), Ensemble: {ensemble_pred} ({ensemble_prob:.3f})")
+            # Fall back to a simple heuristic approach
+            if self.model_type == "login":
+                return self._login_fallback_detection(features)
+            else:
+                return self._transaction_fallback_detection(features)
+    
+    def _hot_scorer(self) -> HotPathScorer:
+        """The hot path scorer of the currently loaded static models"""
+        scorer = self._hot_path_scorer
+        if scorer is None or not scorer.matches(self.rf_model, self.xgb_model, self.scaler):
+            scorer = HotPathScorer(self.rf_model, self.xgb_model, self.scaler, len(self.feature_names))
+            self._hot_path_scorer = scorer
+        return scorer
+    
+    def _detect_anomaly_hot(self, features: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        detect_anomaly through the calling thread's preallocated buffers, with the same result
+        Only the result is logged, and only at debug level, to keep formatting off the hot path
+        """
+        try:
+            scorer = self._hot_scorer()
+            buffers = scorer.buffers
+            model_features = self._prepare_features(features, out=buffers.raw)
+            self._observe_features(model_features)
+            scaled_features = scorer.scale_row()
             
-            # Use online model if available
-            online_pred = 0
-            online_prob = 0.0
+            probabilities = {}
+            if self.rf_model is not None:
+                probabilities["rf"] = scorer.rf_probability(scaled_features)
+            if self.xgb_model is not None:
+                probabilities["xgb"] = scorer.xgb_probability(scaled_features)
+            if self.iforest_model is not None:
+                probabilities["iforest"] = self.iforest_model.predict_proba(model_features)[0]
+            ensemble_prob = self._static_ensemble(probabilities)
+            ensemble_pred = 1 if ensemble_prob > DECISION_THRESHOLD else 0
+            members = list(probabilities)
             
             if self.online_model is not None:
                 try:
-                    # Prepare features for online model
-                    online_features = self._prepare_online_features(features)
+                    # Reused dict, refilled from the feature row instead of parsing the event again
+                    online_features = buffers.online_features
+                    online_features.update(zip(self.feature_names, model_features[0].tolist()))
                     
-                    # Make prediction with online model
-                    if self.model_type == "login":
-                        # For anomaly detection models
-                        online_prob = self.online_model.score_one(online_features)
-                        online_pred = 1 if online_prob > 0.7 else 0
-                    else:
-                        # For classification models
-                        pred_proba = self.online_model.predict_proba_one(online_features)
-                        online_prob = pred_proba.get(1, 0.0)
-                        online_pred = 1 if online_prob > 0.7 else 0
+                    with self._online_lock:
+                        if self.model_type == "login":
+                            online_prob = self.online_model.score_one(online_features)
+                            self.online_model.learn_one(online_features)
+                        else:
+                            online_prob = self.online_model.predict_proba_one(online_features).get(1, 0.0)
+                            self.online_model.learn_one(online_features, ensemble_pred)
+                        self._online_dirty = True
                     
-                    logger.info(f"Online model prediction: {online_pred} ({online_prob:.3f})")
-                    
-                    # Update online model with this data point
-                    # In a real system, you would want to confirm if this was actually an anomaly
-                    if self.model_type == "login":
-                        # For anomaly detection models
-                        self.online_model.learn_one(online_features)
-                    else:
-                        # For classification models
-                        self.online_model.learn_one(online_features, ensemble_pred)
-                    
-                    # Save updated model
-                    self._save_online_model()
-                    
-                    # Combine predictions from static and online models
-                    ensemble_prob = (0.7 * ensemble_prob + 0.3 * online_prob)
-                    ensemble_pred = 1 if ensemble_prob > 0.7 else 0
+                    probabilities["online"] = online_prob
+                    members.append("online")
+                    ensemble_prob = ((1 - ONLINE_MEMBER_WEIGHT) * ensemble_prob + ONLINE_MEMBER_WEIGHT * online_prob)
+                    ensemble_pred = 1 if ensemble_prob > DECISION_THRESHOLD else 0
                 except Exception as e:
                     logger.error(f"Error using online model: {str(e)}", exc_info=True)
             
-            # Determine anomaly type
-            anomaly_type = self._determine_anomaly_type(features, ensemble_pred == 1)
-            
+            anomaly_types, attributions = self._explain(model_features, np.array([ensemble_pred == 1]),
+                                                        np.array([ensemble_prob]))
             result = {
                 "is_anomalous": bool(ensemble_pred == 1),
-                "anomaly_type": anomaly_type,
-                "score": float(ensemble_prob)
+                "anomaly_type": anomaly_types[0],
+                "score": float(ensemble_prob),
+                "members": members,
+                "member_scores": {name: float(prob) for name, prob in probabilities.items()}
             }
+            if attributions is not None and attributions[0] is not None:
+                result["attributions"] = attributions[0]
             
-            logger.info(f"{self.model_type.capitalize()} anomaly detection result: {result}")
-            return result
+            signals = self._signals([features], model_features)
+            if signals is not None:
+                result["signals"] = signals[0]
             
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"{self.model_type.capitalize()} anomaly detection result: {result}")
+            return result
+        
         except Exception as e:
             logger.error(f"Error in {self.model_type} anomaly detection: {str(e)}", exc_info=True)
             
@@ -495,96 +989,398 @@ class AnomalyDetectionModel:
             else:
                 return self._transaction_fallback_detection(features)
     
-    def _login_fallback_detection(self, features: Dict[str, Any]) -> Dict[str, Any]:
-        """Fallback login anomaly detection using simple heuristics"""
-        anomaly_score = 0.0
-        anomaly_type = None
+    def _online_probabilities(self, online_features_list: List[Dict[str, float]], labels: np.ndarray = None) -> np.ndarray:
+        """
+        Online model probability for every row, learning from each row right after scoring it
+        labels: static ensemble verdicts the transaction classifier learns from (None: learn later)
+        """
+        with self._online_lock:
+            # The online models only take one dict at a time
+            online_prob = np.zeros(len(online_features_list))
+            for i, online_features in enumerate(online_features_list):
+                if self.model_type == "login":
+                    online_prob[i] = self.online_model.score_one(online_features)
+                    self.online_model.learn_one(online_features)
+                else:
+                    online_prob[i] = self.online_model.predict_proba_one(online_features).get(1, 0.0)
+                    if labels is not None:
+                        self.online_model.learn_one(online_features, int(labels[i]))
+            
+            # Saved in the background (see state_persistence.py)
+            if self.model_type == "login" or labels is not None:
+                self._online_dirty = True
+        return online_prob
+    
+    def _online_learn(self, online_features_list: List[Dict[str, float]], labels: np.ndarray):
+        """Teach the transaction classifier the verdicts of a batch it has already scored"""
+        try:
+            with self._online_lock:
+                for online_features, label in zip(online_features_list, labels):
+                    self.online_model.learn_one(online_features, int(label))
+                self._online_dirty = True
+        except Exception as e:
+            logger.error(f"Error updating online model: {str(e)}", exc_info=True)
+    
+    def learn_feedback(self, features_list: List[Dict[str, Any]], labels: List[int]) -> int:
+        """
+        Teach the online model a batch of confirmed labels; the caller saves the model afterwards
+        Returns: number of events learned
+        """
+        return self.learn_feedback_rows([self._prepare_online_features(features) for features in features_list], labels)
+    
+    def learn_feedback_rows(self, rows: List[Dict[str, float]], labels: List[int], batch: int = None) -> Optional[int]:
+        """
+        Teach the online model confirmed labels of prepared rows (see _prepare_online_features)
+        The login Half-Space Trees model is unsupervised and models normal behaviour, so it only
+        learns from events confirmed normal; the transaction classifier learns every label
+        batch: the feedback ledger batch the rows form; a batch the model has already learned is skipped
+        Returns: number of events learned, or None when the batch was skipped
+        """
+        learned = 0
+        with self._online_lock:
+            if batch is not None and batch <= getattr(self.online_model, FEEDBACK_BATCH_ATTRIBUTE, 0):
+                return None
+            for online_features, label in zip(rows, labels):
+                if self.model_type == "login":
+                    if label:
+                        continue
+                    self.online_model.learn_one(online_features)
+                else:
+                    self.online_model.learn_one(online_features, int(label))
+                learned += 1
+            if batch is not None:
+                setattr(self.online_model, FEEDBACK_BATCH_ATTRIBUTE, batch)
+            # Even an empty batch moves the feedback batch counter saved with the model
+            self._online_dirty = True
+        return learned
+    
+    def _member_probabilities(self, model_features: np.ndarray, scaled_features: np.ndarray,
+                              online_features_list: List[Dict[str, float]], deadline: float = None) -> Dict[str, np.ndarray]:
+        """
+        Anomaly probability of each ensemble member for every row
+        Without a deadline every loaded member runs to completion, one after the other. With one (a
+        time.monotonic() value) they run concurrently and only the members finished by then are
+        returned; the others count as deadline misses (see ensemble_members.py)
+        """
+        if deadline is None:
+            # One predict_proba call per model for the whole batch
+            probabilities = self._static_probabilities(model_features, scaled_features)
+            if self.online_model is not None:
+                try:
+                    static_pred = (self._static_ensemble(probabilities) > DECISION_THRESHOLD).astype(int)
+                    probabilities["online"] = self._online_probabilities(online_features_list, static_pred)
+                except Exception as e:
+                    logger.error(f"Error using online model: {str(e)}", exc_info=True)
+            return probabilities
         
-        # Extract features
-        typing_speed = features.get('typing_speed', 0) or 0
-        session_duration = features.get('session_duration', 0) or 0
+        tasks = {}
+        if self.rf_model is not None:
+            tasks["rf"] = lambda: self.rf_model.predict_proba(scaled_features)[:, 1]
+        if self.xgb_model is not None:
+            tasks["xgb"] = lambda: self.xgb_model.predict_proba(scaled_features)[:, 1]
+        if self.iforest_model is not None:
+            tasks["iforest"] = lambda: self.iforest_model.predict_proba(model_features)
+        if self.online_model is not None:
+            tasks["online"] = lambda: self._online_probabilities(online_features_list)
+        probabilities = self.member_runner.run(tasks, deadline)
         
-        # Parse timestamp to get hour
-        timestamp = features.get('timestamp')
-        try:
-            hour = datetime.fromisoformat(timestamp.replace('Z', '+00:00')).hour
-        except:
-            hour = datetime.now().hour
+        # The transaction classifier learns from the static verdict once it is known, off the request path
+        static = {name: prob for name, prob in probabilities.items() if name in STATIC_MEMBER_WEIGHTS}
+        if self.model_type == "transaction" and self.online_model is not None and static:
+            static_pred = (self._static_ensemble(static) > DECISION_THRESHOLD).astype(int)
+            self.member_runner.submit(self._online_learn, online_features_list, static_pred)
+        return probabilities
+    
+    def _combine_members(self, probabilities: Dict[str, np.ndarray]) -> Tuple[np.ndarray, List[str]]:
+        """
+        Ensemble probability from the members that produced one, weights renormalized over them
+        Returns: (probability per row or None if no member finished, contributing member names)
+        """
+        static = {name: prob for name, prob in probabilities.items() if name in STATIC_MEMBER_WEIGHTS}
+        online_prob = probabilities.get("online")
+        if static:
+            ensemble_prob = self._static_ensemble(static)
+            if online_prob is not None:
+                # Combine predictions from static and online models
+                ensemble_prob = (1 - ONLINE_MEMBER_WEIGHT) * ensemble_prob + ONLINE_MEMBER_WEIGHT * online_prob
+        else:
+            ensemble_prob = online_prob
+        return ensemble_prob, list(probabilities)
+    
+    def _score_matrix(self, model_features: np.ndarray, online_features_list: List[Dict[str, float]],
+                      deadline: float = None) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+        """
+        Ensemble probability for every row of a feature matrix
+        online_features_list: the online model's input dict for each row, in the same order
+        Returns: (probability per row or None if no member finished by the deadline,
+        per-row probabilities of the contributing members)
+        """
+        scaled_features = self._scale(model_features)
+        probabilities = self._member_probabilities(model_features, scaled_features, online_features_list, deadline)
+        ensemble_prob, members = self._combine_members(probabilities)
         
-        # Check typing speed (if unusually slow or fast)
-        if typing_speed < 1 or typing_speed > 12:
-            anomaly_score += 0.3
-            anomaly_type = "Unusual typing pattern"
+        if ensemble_prob is not None:
+            logger.info(f"Batch predictions from {', '.join(members)} - {len(ensemble_prob)} events, "
+                        f"{int((ensemble_prob > DECISION_THRESHOLD).sum())} flagged by ensemble")
+        return ensemble_prob, probabilities
+    
+    def detect_anomaly_batch(self, features_list: List[Dict[str, Any]], deadline_ms: float = None) -> List[Dict[str, Any]]:
+        """
+        Detect anomalies for many events at once, scoring one matrix per static model
+        deadline_ms: latency budget for the whole batch (see detect_anomaly)
+        Returns: list of dicts with is_anomalous, anomaly_type, score, members and member_scores
+        (same order as input)
+        """
+        with profiled(f"{self.model_type}.detect_anomaly_batch", self.model_type, features_list):
+            results = self._detect_anomaly_batch(features_list, deadline_ms)
+            self._audit(features_list, results)
+            self._remember_sessions(features_list, results)
+        return results
+    
+    def _detect_anomaly_batch(self, features_list: List[Dict[str, Any]], deadline_ms: float = None) -> List[Dict[str, Any]]:
+        """detect_anomaly_batch without the audit records"""
+        deadline = deadline_after(deadline_ms)
         
-        # Check session duration (if too quick)
-        if session_duration < 10:
-            anomaly_score += 0.4
-            anomaly_type = anomaly_type or "Unusually quick login"
+        if not features_list:
+            return []
         
-        # Check login time (if unusual)
-        if hour >= 0 and hour <= 5:
-            anomaly_score += 0.3
-            anomaly_type = anomaly_type or "Unusual login time (night)"
+        if not self.is_ready():
+            logger.info(f"{self.model_type.capitalize()} models not ready, using heuristic detection")
+            return [self._not_ready_result(features) for features in features_list]
         
-        # Determine if this is an anomaly
-        is_anomalous = anomaly_score >= 0.7
+        # A lone event (e.g. a micro-batch window that caught one request) takes the hot path
+        if self.hot_path and deadline is None and len(features_list) == 1:
+            return [self._detect_anomaly_hot(features_list[0])]
         
-        result = {
-            "is_anomalous": is_anomalous,
-            "anomaly_type": anomaly_type if is_anomalous else None,
-            "score": anomaly_score
-        }
+        try:
+            for features in features_list:
+                logger.info(f"Starting {self.model_type} anomaly detection with features: {features}")
+            
+            # Prepare the whole batch as a single matrix
+            model_features = self._prepare_features_batch(features_list)
+            self._observe_features(model_features)
+            online_features_list = (
+                [self._prepare_online_features(features) for features in features_list]
+                if self.online_model is not None else []
+            )
+            ensemble_prob, probabilities = self._score_matrix(model_features, online_features_list, deadline)
+            if ensemble_prob is None:
+                logger.info(f"No ensemble member finished in time, using heuristic detection")
+                return [self._fallback_detection(features) for features in features_list]
+            
+            ensemble_pred = ensemble_prob > DECISION_THRESHOLD
+            
+            anomaly_types, attributions = self._explain(model_features, ensemble_pred, ensemble_prob)
+            
+            members = list(probabilities)
+            member_rows = np.column_stack([probabilities[name] for name in members]).tolist()
+            results = []
+            for is_anomaly, anomaly_type, prob, member_row in zip(ensemble_pred, anomaly_types, ensemble_prob, member_rows):
+                results.append({
+                    "is_anomalous": bool(is_anomaly),
+                    "anomaly_type": anomaly_type,
+                    "score": float(prob),
+                    "members": members,
+                    "member_scores": dict(zip(members, member_row))
+                })
+            if attributions is not None:
+                for result, attribution in zip(results, attributions):
+                    if attribution is not None:
+                        result["attributions"] = attribution
+            
+            signals = self._signals(features_list, model_features)
+            if signals is not None:
+                for result, signal in zip(results, signals):
+                    result["signals"] = signal
+            
+            logger.info(f"{self.model_type.capitalize()} batch anomaly detection finished for {len(results)} events")
+            return results
         
-        logger.info(f"Fallback login anomaly detection result: {result}")
-        return result
+        except Exception as e:
+            logger.error(f"Error in batched {self.model_type} anomaly detection: {str(e)}", exc_info=True)
+            
+            # Score events one by one so a single bad event only affects itself
+            return [self._detect_anomaly_or_error(features, deadline_ms) for features in features_list]
     
-    def _transaction_fallback_detection(self, features: Dict[str, Any]) -> Dict[str, Any]:
-        """Fallback transaction anomaly detection using simple heuristics"""
-        anomaly_score = 0.0
-        anomaly_type = None
+    def _detect_anomaly_or_error(self, features: Dict[str, Any], deadline_ms: float = None) -> Dict[str, Any]:
+        """_detect_anomaly for one event of a failed batch; if even that fails, a verdict carrying the error"""
+        try:
+            return self._detect_anomaly(features, deadline_ms)
+        except Exception as e:
+            logger.error(f"Error scoring {self.model_type} event: {str(e)}", exc_info=True)
+            return {"is_anomalous": False, "anomaly_type": None, "score": 0.0, "fallback": True, "error": str(e)}
+    
+    def _determine_anomaly_types(self, model_features: np.ndarray, is_anomaly: np.ndarray) -> np.ndarray:
+        """_determine_anomaly_type for every row of a feature matrix (None for normal rows)"""
+        return get_rules(self.model_type).anomaly_types(self._rule_columns(model_features), is_anomaly)
+    
+    def _explain(self, model_features: np.ndarray, is_anomaly: np.ndarray,
+                 scores: np.ndarray) -> Tuple[np.ndarray, List[Dict[str, float]]]:
+        """
+        Anomaly types of every row, taken from the features that drove the score where the
+        attribution budget allows (see feature_attribution.py) and from the rules elsewhere
+        Returns: (anomaly type per row, top feature contributions per row or None where not explained)
+        """
+        rules = get_rules(self.model_type)
+        anomaly_types = rules.anomaly_types(self._rule_columns(model_features), is_anomaly)
+        try:
+            explained = self.explainer.explain(self.rf_model, self.xgb_model, self.scaler, model_features,
+                                               scores, is_anomaly, rules.feature_labels)
+        except Exception as e:
+            logger.error(f"Error attributing {self.model_type} scores: {str(e)}", exc_info=True)
+            explained = None
+        if explained is None:
+            return anomaly_types, None
+        reasons, attributions = explained
+        has_reason = np.not_equal(reasons, None)
+        anomaly_types[has_reason] = reasons[has_reason]
+        return anomaly_types, attributions
+    
+    def _fallback_columns(self, model_features: np.ndarray) -> Dict[str, np.ndarray]:
+        """The heuristic fallback detections for every row of a feature matrix, as result columns"""
+        results = get_rules(self.model_type).fallback(self._rule_columns(model_features))
+        results["fallback"] = np.ones(len(model_features), dtype=bool)
+        return results
+    
+    def detect_anomaly_columns(self, columns: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+        """
+        Detect anomalies for a columnar payload (see columnar_io) without building per-event dicts
+        Returns: dict of result columns is_anomalous, anomaly_type, score and fallback
+        (plus the keystroke signal columns for login payloads with keystroke timings)
+        """
+        model_features = build_feature_matrix(columns, self.feature_names)
+        n = len(model_features)
+        if n == 0:
+            return self._fallback_columns(model_features)
         
-        # Extract features
-        transaction_amount = features.get('transaction_amount', 0) or 0
-        from_balance = features.get('from_balance', 0) or 0
-        amount_ratio = transaction_amount / from_balance if from_balance > 0 else 0
-        session_duration = features.get('session_duration', 0) or 0
+        if not self.is_ready():
+            logger.info(f"{self.model_type.capitalize()} models not ready, using heuristic detection")
+            return self._fallback_columns(model_features)
         
-        # Parse timestamp to get hour
-        timestamp = features.get('timestamp')
         try:
-            hour = datetime.fromisoformat(timestamp.replace('Z', '+00:00')).hour
-        except:
-            hour = datetime.now().hour
+            logger.info(f"Starting {self.model_type} columnar anomaly detection for {n} events")
+            self._observe_features(model_features)
+            
+            # The online models get plain dicts built from the matrix rows
+            ensemble_prob, probabilities = self._score_matrix(
+                model_features,
+                [dict(zip(self.feature_names, row)) for row in model_features.tolist()] if self.online_model is not None else []
+            )
+            ensemble_pred = ensemble_prob > DECISION_THRESHOLD
+            
+            results = {
+                "is_anomalous": ensemble_pred,
+                "anomaly_type": self._explain(model_features, ensemble_pred, ensemble_prob)[0],
+                "score": ensemble_prob.astype(float),
+                "fallback": np.zeros(n, dtype=bool)
+            }
+            
+            with self._state_lock:
+                if self.keystroke_profiles is not None and KEYSTROKE_OFFSETS in columns:
+                    stats = keystroke_statistics_batch(ragged_rows(columns[KEYSTROKE_VALUES], columns[KEYSTROKE_OFFSETS]))
+                    user_ids = id_values(columns["user_id"]) if "user_id" in columns else [None] * n
+                    deviations = self.keystroke_profiles.observe_batch(user_ids, stats)
+                    for j, name in enumerate(KEYSTROKE_STATS):
+                        results[f"keystroke_{name}"] = stats[:, j]
+                    results["keystroke_profile_deviation"] = np.array(
+                        [np.nan if deviation is None else deviation for deviation in deviations]
+                    )
+                
+                if self.login_baseline is not None and "user_id" in columns:
+                    baselines = self._baseline_signals(id_values(columns["user_id"]), model_features)
+                    for name in BASELINE_SIGNALS:
+                        results[name] = np.array([
+                            np.nan if baseline.get(name) is None else baseline[name] for baseline in baselines
+                        ])
+                
+                if self.transfer_graph is not None and "from_account_id" in columns and "to_account_id" in columns:
+                    timestamps = (timestamp_seconds(columns["timestamp"]) if "timestamp" in columns
+                                  else np.full(n, time.time()))
+                    graph_features = self.transfer_graph.observe_batch(list(zip(
+                        id_values(columns["from_account_id"]), id_values(columns["to_account_id"]), timestamps.tolist()
+                    )))
+                    for name in TRANSFER_GRAPH_FEATURES:
+                        results[name] = np.array([signal[name] if signal else np.nan for signal in graph_features])
+            
+            self._audit_columns(columns, {**results, **probabilities}, n)
+            
+            logger.info(f"{self.model_type.capitalize()} columnar anomaly detection finished for {n} events")
+            return results
         
-        # Check transaction amount (if unusually large)
-        if transaction_amount > 10000:
-            anomaly_score += 0.3
-            anomaly_type = "Unusually large transaction"
-        
-        # Check amount ratio (if high percentage of balance)
-        if amount_ratio > 0.7:
-            anomaly_score += 0.4
-            anomaly_type = anomaly_type or "High percentage of available balance"
-        
-        # Check session duration (if too quick)
-        if session_duration < 10:
-            anomaly_score += 0.3
-            anomaly_type = anomaly_type or "Unusually quick transaction"
-        
-        # Check transaction time (if unusual)
-        if hour >= 0 and hour <= 5:
-            anomaly_score += 0.2
-            anomaly_type = anomaly_type or "Unusual transaction time (night)"
-        
-        # Determine if this is an anomaly
-        is_anomalous = anomaly_score >= 0.7
-        
-        result = {
-            "is_anomalous": is_anomalous,
-            "anomaly_type": anomaly_type if is_anomalous else None,
-            "score": anomaly_score
+        except Exception as e:
+            logger.error(f"Error in columnar {self.model_type} anomaly detection: {str(e)}", exc_info=True)
+            return self._fallback_columns(model_features)
+    
+    def _audit_entity(self) -> str:
+        """Feature naming the entity a verdict is recorded under in the audit store"""
+        return "user_id" if self.model_type == "login" else "from_account_id"
+    
+    def _audit_store_or_none(self) -> ScoreAuditStore:
+        """The audit store, opened on first use; None for read-only models or when auditing is off"""
+        if self._audit_store is None and not self.read_only:
+            directory = audit_directory(self._state_path(AUDIT_DIR))
+            if directory is not None:
+                self._audit_store = ScoreAuditStore(directory)
+        return self._audit_store
+    
+    def _audit(self, features_list: List[Dict[str, Any]], results: List[Dict[str, Any]]):
+        """Record verdicts in the audit store; a failing store never fails the request"""
+        try:
+            store = self._audit_store_or_none()
+            if store is not None:
+                entity = self._audit_entity()
+                store.append(self.model_type, results, [features.get(entity) for features in features_list])
+        except Exception as e:
+            logger.error(f"Error writing {self.model_type} verdicts to the audit store: {str(e)}", exc_info=True)
+    
+    def _audit_columns(self, columns: Dict[str, np.ndarray], results: Dict[str, np.ndarray], n: int):
+        """_audit for columnar results (with the member probability columns merged in)"""
+        try:
+            store = self._audit_store_or_none()
+            if store is not None:
+                entity = self._audit_entity()
+                store.append_columns(self.model_type, results,
+                                     id_values(columns[entity]) if entity in columns else [None] * n)
+        except Exception as e:
+            logger.error(f"Error writing {self.model_type} verdicts to the audit store: {str(e)}", exc_info=True)
+    
+    def _fallback_detection(self, features: Dict[str, Any]) -> Dict[str, Any]:
+        """Fallback anomaly detection for one event using the heuristic rules (see anomaly_rules.json)"""
+        columns = self._fallback_columns(self._prepare_features(features))
+        return {
+            "is_anomalous": bool(columns["is_anomalous"][0]),
+            "anomaly_type": columns["anomaly_type"][0],
+            "score": float(columns["score"][0]),
+            "fallback": True,
+            "members": []
         }
-        
+    
+    def _fallback_detection_batch(self, features_list: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """_fallback_detection for many events with one pass of the rules (used when load is shed)"""
+        columns = self._fallback_columns(self._prepare_features_batch(features_list))
+        results = [
+            {
+                "is_anomalous": bool(is_anomalous),
+                "anomaly_type": anomaly_type,
+                "score": float(score),
+                "fallback": True,
+                "members": []
+            }
+            for is_anomalous, anomaly_type, score in zip(columns["is_anomalous"], columns["anomaly_type"], columns["score"])
+        ]
+        self._audit(features_list, results)
+        self._remember_sessions(features_list, results)
+        return results
+    
+    def _login_fallback_detection(self, features: Dict[str, Any]) -> Dict[str, Any]:
+        """Fallback login anomaly detection using simple heuristics"""
+        result = self._fallback_detection(features)
+        logger.info(f"Fallback login anomaly detection result: {result}")
+        return result
+    
+    def _transaction_fallback_detection(self, features: Dict[str, Any]) -> Dict[str, Any]:
+        """Fallback transaction anomaly detection using simple heuristics"""
+        result = self._fallback_detection(features)
         logger.info(f"Fallback transaction anomaly detection result: {result}")
         return result
 
@@ -601,18 +1397,51 @@ def detect_anomaly(features: Dict[str, Any], model_type: str) -> Dict[str, Any]:
     model = AnomalyDetectionModel(model_type)
     return model.detect_anomaly(features)
 
+def read_features_argument(argument: str) -> Dict[str, Any]:
+    """
+    Features from the command line: inline JSON, "-" for JSON on stdin, or "@path" for a JSON file
+    stdin and files avoid the OS limit on argument length for long keystroke_timings
+    """
+    if argument == "-":
+        return json.load(sys.stdin)
+    if argument.startswith("@"):
+        with open(argument[1:], 'r', encoding='utf-8') as f:
+            return json.load(f)
+    return json.loads(argument)
+
 # Entry point for command line execution
 if __name__ == "__main__":
+    # Readiness signal: python anomaly_detection_model.py status
+    if len(sys.argv) == 2 and sys.argv[1] == "status":
+        print(json.dumps({model_type: model_status(model_type) for model_type in ("login", "transaction")}))
+        sys.exit(0)
+    
     if len(sys.argv) < 3:
-        print(json.dumps({"error": "Missing arguments. Usage: python anomaly_detection_model.py <model_type> <features_json>"}))
+        print(json.dumps({"error": "Missing arguments. Usage: python anomaly_detection_model.py <model_type> <features_json|-|@file>"}))
         sys.exit(1)
     
     model_type = sys.argv[1]  # "login" or "transaction"
-    features_json = sys.argv[2]
-    features = json.loads(features_json)
     
-    # Detect anomalies
-    result = detect_anomaly(features, model_type)
+    # Bulk scoring: python anomaly_detection_model.py <model_type> --columnar <input> <output>
+    if sys.argv[2] == "--columnar":
+        if len(sys.argv) < 5:
+            print(json.dumps({"error": "Usage: python anomaly_detection_model.py <model_type> --columnar <input> <output>"}))
+            sys.exit(1)
+        with profiled(f"cli.{model_type}.columnar", model_type, []):
+            results = AnomalyDetectionModel(model_type).detect_anomaly_columns(read_columns(sys.argv[3]))
+        write_columns(sys.argv[4], results)
+        print(json.dumps({
+            "events": int(len(results["score"])),
+            "anomalies": int(np.sum(results["is_anomalous"])),
+            "output": sys.argv[4]
+        }))
+        sys.exit(0)
+    
+    features = read_features_argument(sys.argv[2])
+    
+    # Detect anomalies; the profile of a CLI request includes loading the models
+    with profiled(f"cli.{model_type}", model_type, [features]):
+        result = detect_anomaly(features, model_type)
     
     # Output result as JSON
     print(json.dumps(result))
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# Build the static model artifacts ahead of deployment, or in a single background job
+#
+# Usage:
+#   python build_models.py [login|transaction|all] [--force]
+#   python build_models.py status
+#
+# Scoring never trains on the request path: when artifacts are missing or corrupt the
+# scorer calls start_background_build(), which takes a lock file and spawns this script
+# detached, and serves heuristic fallback results until the artifacts appear.
+
+import os
+import sys
+import json
+import time
+import argparse
+import logging
+import subprocess
+from typing import Dict, Any, Iterable
+
+logger = logging.getLogger(__name__)
+
+MODEL_DIR = "models"
+BUILD_SCRIPT_PATH = os.path.abspath(__file__)
+TRAINING_LOCK_STALE_SECONDS = 30 * 60
+
+# Static artifacts that must all exist before a model type is ready
+ARTIFACT_PATHS = {
+    model_type: [
+        os.path.join(MODEL_DIR, f"{model_type}_rf_model.pkl"),
+        os.path.join(MODEL_DIR, f"{model_type}_xgb_model.pkl"),
+        os.path.join(MODEL_DIR, f"{model_type}_scaler.pkl")
+    ]
+    for model_type in ("login", "transaction")
+}
+
+
+class ModelsNotReady(RuntimeError):
+    """Raised when trained artifacts are not available yet"""
+
+
+def _lock_path(model_type: str) -> str:
+    return os.path.join(MODEL_DIR, f".{model_type}_training.lock")
+
+
+def _lock_is_stale(path: str) -> bool:
+    try:
+        with open(path) as f:
+            pid, started = f.read().split()
+        if time.time() - float(started) > TRAINING_LOCK_STALE_SECONDS:
+            return True
+        os.kill(int(pid), 0)
+        return False
+    except ProcessLookupError:
+        return True
+    except (OSError, ValueError):
+        # Unreadable or half-written lock; only treat it as stale once it is old
+        try:
+            return time.time() - os.path.getmtime(path) > TRAINING_LOCK_STALE_SECONDS
+        except OSError:
+            return True
+
+
+def training_in_progress(model_type: str) -> bool:
+    """Whether a live training job holds the lock for this model type"""
+    path = _lock_path(model_type)
+    return os.path.exists(path) and not _lock_is_stale(path)
+
+
+def artifacts_present(model_type: str) -> bool:
+    """Whether every static artifact for this model type exists, as pickles or as a native export"""
+    return (all(os.path.exists(path) for path in ARTIFACT_PATHS[model_type]) or
+            os.path.exists(os.path.join(MODEL_DIR, f"{model_type}_native", "manifest.json")))
+
+
+def model_status(model_type: str) -> Dict[str, Any]:
+    """Readiness signal for callers: artifacts present and whether training is running"""
+    return {
+        "ready": artifacts_present(model_type) and not training_in_progress(model_type),
+        "artifacts_present": artifacts_present(model_type),
+        "training": training_in_progress(model_type)
+    }
+
+
+def _acquire_lock(model_type: str, pid: int) -> bool:
+    """Atomically create the lock file; a stale lock is replaced"""
+    os.makedirs(MODEL_DIR, exist_ok=True)
+    path = _lock_path(model_type)
+    for _ in range(2):
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            if not _lock_is_stale(path):
+                return False
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            continue
+        with os.fdopen(fd, 'w') as f:
+            f.write(f"{pid} {time.time()}")
+        return True
+    return False
+
+
+def _release_lock(model_type: str):
+    try:
+        os.remove(_lock_path(model_type))
+    except FileNotFoundError:
+        pass
+
+
+def start_background_build(model_type: str) -> bool:
+    """
+    Start one detached training job for this model type unless one is already running
+    Returns: True if this call started the job
+    """
+    if not _acquire_lock(model_type, os.getpid()):
+        return False
+
+    try:
+        process = subprocess.Popen(
+            [sys.executable, BUILD_SCRIPT_PATH, model_type, "--force", "--lock-held"],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True
+        )
+    except Exception as e:
+        logger.error(f"Error starting background {model_type} training: {str(e)}", exc_info=True)
+        _release_lock(model_type)
+        return False
+
+    # Hand the lock over to the training process so it stays valid after this request exits
+    with open(_lock_path(model_type), 'w') as f:
+        f.write(f"{process.pid} {time.time()}")
+    logger.info(f"Started background {model_type} training (pid {process.pid})")
+    return True
+
+
+def build(model_types: Iterable[str], force: bool = False, lock_held: bool = False) -> Dict[str, Any]:
+    """Train and atomically save the static artifacts for the given model types"""
+    from anomaly_detection_model import train_initial_models
+
+    report = {}
+    for model_type in model_types:
+        if not force and artifacts_present(model_type):
+            report[model_type] = "present"
+            continue
+
+        if not lock_held and not _acquire_lock(model_type, os.getpid()):
+            report[model_type] = "already training"
+            continue
+
+        started = time.perf_counter()
+        try:
+            train_initial_models(model_type)
+            report[model_type] = f"trained in {time.perf_counter() - started:.1f}s"
+        except Exception as e:
+            logger.error(f"Error building {model_type} models: {str(e)}", exc_info=True)
+            report[model_type] = f"failed: {str(e)}"
+        finally:
+            _release_lock(model_type)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the static anomaly detection model artifacts")
+    parser.add_argument("target", nargs="?", choices=["login", "transaction", "all", "status"], default="all")
+    parser.add_argument("--force", action="store_true", help="Retrain even if the artifacts exist")
+    parser.add_argument("--lock-held", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.target == "status":
+        print(json.dumps({model_type: model_status(model_type) for model_type in ARTIFACT_PATHS}))
+    else:
+        model_types = list(ARTIFACT_PATHS) if args.target == "all" else [args.target]
+        report = build(model_types, force=args.force, lock_held=args.lock_held)
+        print(json.dumps(report))
+        sys.exit(1 if any(str(status).startswith("failed") for status in report.values()) else 0)
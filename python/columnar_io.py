@@ -0,0 +1,359 @@
+#!/usr/bin/env python
+# Columnar request and result formats for bulk scoring (.npz, .npy and Arrow IPC)
+#
+# Usage:
+#   python anomaly_detection_model.py <model_type> --columnar <input> <output>
+#   python columnar_io.py bench [--events 100000]
+#
+# A columnar payload holds one column per feature (see LOGIN_FEATURES / TRANSACTION_FEATURES)
+# plus "timestamp" and, optionally, "user_id". Keystroke timings are ragged and are stored as
+# two columns, keystroke_timings_values (all timings back to back) and keystroke_timings_offsets
+# (n + 1 row boundaries); in Arrow files a list<float64> column "keystroke_timings" is used
+# directly. A precomputed "hour" or "keystroke_variance" column takes precedence over the raw data.
+
+import os
+import json
+import time
+import argparse
+import logging
+import tempfile
+from datetime import datetime
+from typing import Dict, Any, List
+
+import numpy as np
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+KEYSTROKE_VALUES = "keystroke_timings_values"
+KEYSTROKE_OFFSETS = "keystroke_timings_offsets"
+ARROW_SUFFIXES = (".arrow", ".feather", ".ipc")
+
+# Epoch values above this are taken to be milliseconds rather than seconds
+_EPOCH_MS_THRESHOLD = 1e11
+
+
+def _read_arrow(path: str) -> Dict[str, np.ndarray]:
+    if not PYARROW_AVAILABLE:
+        raise ImportError("pyarrow is required to read Arrow IPC files")
+
+    source = pa.memory_map(path, 'r')
+    try:
+        table = pa.ipc.open_file(source).read_all()
+    except pa.ArrowInvalid:
+        source.seek(0)
+        table = pa.ipc.open_stream(source).read_all()
+
+    columns = {}
+    for name in table.column_names:
+        column = table.column(name).combine_chunks()
+        if pa.types.is_list(column.type) or pa.types.is_large_list(column.type):
+            # Offsets index straight into the child array, so the values are used without copying rows
+            columns[KEYSTROKE_VALUES if name == "keystroke_timings" else f"{name}_values"] = \
+                column.values.to_numpy(zero_copy_only=False).astype(float, copy=False)
+            columns[KEYSTROKE_OFFSETS if name == "keystroke_timings" else f"{name}_offsets"] = \
+                column.offsets.to_numpy().astype(np.int64, copy=False)
+        elif pa.types.is_string(column.type) or pa.types.is_large_string(column.type):
+            columns[name] = np.asarray(column.fill_null("").to_numpy(zero_copy_only=False), dtype=str)
+        elif pa.types.is_timestamp(column.type):
+            columns[name] = column.to_numpy(zero_copy_only=False)
+        else:
+            if column.null_count:
+                column = column.fill_null(False if pa.types.is_boolean(column.type) else 0)
+            columns[name] = column.to_numpy(zero_copy_only=False)
+    return columns
+
+
+def read_columns(path: str) -> Dict[str, np.ndarray]:
+    """
+    Read a columnar payload from .npz, .npy (structured array) or an Arrow IPC file
+    Returns: dict of column name -> 1-D array (keystroke timings as values + offsets)
+    """
+    if path.endswith(ARROW_SUFFIXES):
+        return _read_arrow(path)
+
+    if path.endswith(".npy"):
+        # A single structured array; it cannot hold the ragged keystroke column
+        array = np.load(path, allow_pickle=False)
+        if array.dtype.names is None:
+            raise ValueError(".npy payloads must be structured arrays with one field per column")
+        return {name: array[name] for name in array.dtype.names}
+
+    with np.load(path, allow_pickle=False) as data:
+        return {name: data[name] for name in data.files}
+
+
+def column_length(columns: Dict[str, np.ndarray]) -> int:
+    """Number of events in a columnar payload"""
+    for name, column in columns.items():
+        if name == KEYSTROKE_VALUES:
+            continue
+        if name == KEYSTROKE_OFFSETS:
+            return len(column) - 1
+        return len(column)
+    return 0
+
+
+def timestamp_hours(timestamps: np.ndarray) -> np.ndarray:
+    """
+    Hour of day for a column of timestamps without parsing them one by one
+    Accepts ISO 8601 strings (the hour as written, like datetime.fromisoformat), epoch seconds or
+    milliseconds, or datetime64. Missing or unparseable values get the current hour.
+    """
+    timestamps = np.asarray(timestamps)
+    n = len(timestamps)
+
+    if np.issubdtype(timestamps.dtype, np.datetime64):
+        return (timestamps.astype('datetime64[h]').astype(np.int64) % 24).astype(float)
+
+    if np.issubdtype(timestamps.dtype, np.number):
+        seconds = np.where(timestamps > _EPOCH_MS_THRESHOLD, timestamps / 1000.0, timestamps)
+        return (np.floor(seconds / 3600.0) % 24).astype(float)
+
+    # Fixed-width unicode: each character is one uint32 code point, so "HH" sits at columns 11-12
+    codes = np.asarray(timestamps, dtype='U13').view(np.uint32).reshape(n, 13)
+    digits = codes.astype(np.int64) - ord('0')
+    tens, ones = digits[:, 11], digits[:, 12]
+    hours = tens * 10 + ones
+    valid = (
+        np.isin(codes[:, 10], [ord('T'), ord(' ')]) &
+        (tens >= 0) & (tens <= 9) & (ones >= 0) & (ones <= 9) & (hours < 24)
+    )
+    # A bare date parses as midnight
+    date_only = (codes[:, 10] == 0) & (codes[:, 9] != 0)
+
+    return np.where(valid, hours, np.where(date_only, 0, datetime.now().hour)).astype(float)
+
+
+def timestamp_seconds(timestamps: np.ndarray) -> np.ndarray:
+    """
+    Epoch seconds for a column of timestamps (ISO 8601 strings, epoch seconds or milliseconds, or datetime64)
+    Strings are parsed one by one; missing or unparseable values get the current time
+    """
+    timestamps = np.asarray(timestamps)
+    if np.issubdtype(timestamps.dtype, np.datetime64):
+        return timestamps.astype('datetime64[ms]').astype(np.int64) / 1000.0
+    if np.issubdtype(timestamps.dtype, np.number):
+        return np.where(timestamps > _EPOCH_MS_THRESHOLD, timestamps / 1000.0, timestamps).astype(float)
+
+    now = time.time()
+    seconds = np.empty(len(timestamps))
+    for i, value in enumerate(timestamps.tolist()):
+        try:
+            seconds[i] = datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+        except (AttributeError, ValueError):
+            seconds[i] = now
+    return seconds
+
+
+def id_values(column: np.ndarray) -> List[Any]:
+    """
+    An ID column as Python values the way the JSON path sees them: missing values (NaN, "") become
+    None and integral floats become ints, so 12.0 and 12 name the same account
+    """
+    column = np.asarray(column)
+    if np.issubdtype(column.dtype, np.floating):
+        return [None if value != value else int(value) if value.is_integer() else value for value in column.tolist()]
+    return [None if value == "" else value for value in column.tolist()]
+
+
+def ragged_variance(values: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    """Population variance (np.var) of each row of a ragged column; rows with fewer than 2 values get 0"""
+    values = np.asarray(values, dtype=float)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    counts = np.diff(offsets)
+    variance = np.zeros(len(counts))
+
+    rows = counts > 0
+    if not rows.any():
+        return variance
+
+    # reduceat sums from each start to the next one, so empty rows are left out of the starts
+    base = offsets[0]
+    segment = values[base:offsets[-1]]
+    starts = offsets[:-1][rows] - base
+    means = np.add.reduceat(segment, starts) / counts[rows]
+
+    # Two passes, like np.var, to avoid cancellation on millisecond-scale timings
+    deviations = segment - np.repeat(means, counts[rows])
+    variance[rows] = np.add.reduceat(deviations * deviations, starts) / counts[rows]
+    variance[counts < 2] = 0.0
+    return variance
+
+
+def ragged_rows(values: np.ndarray, offsets: np.ndarray) -> List[np.ndarray]:
+    """Split a ragged column into one view per row"""
+    values = np.asarray(values, dtype=float)
+    return [values[start:end] for start, end in zip(offsets[:-1].tolist(), offsets[1:].tolist())]
+
+
+def _numeric(columns: Dict[str, np.ndarray], name: str, n: int) -> np.ndarray:
+    # Missing columns and missing values are 0, as features.get(name, 0) or 0
+    if name not in columns:
+        return np.zeros(n)
+    return np.nan_to_num(np.asarray(columns[name], dtype=float), nan=0.0)
+
+
+def build_feature_matrix(columns: Dict[str, np.ndarray], feature_names: List[str]) -> np.ndarray:
+    """
+    Feature matrix in feature_names order, computed column-wise
+    Returns: the same values AnomalyDetectionModel._prepare_features_batch gives for the equivalent dicts
+    """
+    n = column_length(columns)
+    matrix = np.empty((n, len(feature_names)))
+
+    for j, name in enumerate(feature_names):
+        if name in columns:
+            matrix[:, j] = _numeric(columns, name, n)
+        elif name == "hour":
+            matrix[:, j] = (timestamp_hours(columns["timestamp"]) if "timestamp" in columns
+                            else datetime.now().hour)
+        elif name == "keystroke_variance":
+            matrix[:, j] = (ragged_variance(columns[KEYSTROKE_VALUES], columns[KEYSTROKE_OFFSETS])
+                            if KEYSTROKE_OFFSETS in columns else 0.0)
+        elif name == "amount_ratio":
+            amount = _numeric(columns, "transaction_amount", n)
+            balance = _numeric(columns, "from_balance", n)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                matrix[:, j] = np.where(balance > 0, amount / balance, 0.0)
+        else:
+            matrix[:, j] = 0.0
+    return matrix
+
+
+def write_columns(path: str, columns: Dict[str, np.ndarray]):
+    """
+    Write result columns in the format given by the file extension
+    Missing anomaly types are written as null in Arrow and as "" in NumPy files
+    """
+    tmp_path = path + ".tmp"
+    if path.endswith(ARROW_SUFFIXES):
+        if not PYARROW_AVAILABLE:
+            raise ImportError("pyarrow is required to write Arrow IPC files")
+        table = pa.table({
+            name: pa.array(column.tolist() if column.dtype == object else column)
+            for name, column in columns.items()
+        })
+        with pa.OSFile(tmp_path, 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+    else:
+        plain = {
+            name: np.array(["" if value is None else value for value in column], dtype=str)
+            if column.dtype == object else column
+            for name, column in columns.items()
+        }
+        with open(tmp_path, 'wb') as f:
+            if path.endswith(".npy"):
+                structured = np.empty(len(next(iter(plain.values()))),
+                                      dtype=[(name, column.dtype) for name, column in plain.items()])
+                for name, column in plain.items():
+                    structured[name] = column
+                np.save(f, structured)
+            else:
+                np.savez(f, **plain)
+    os.replace(tmp_path, path)
+
+
+def columns_from_records(features_list: List[Dict[str, Any]]) -> Dict[str, np.ndarray]:
+    """Convert feature dicts to a columnar payload (for exports and the benchmark)"""
+    names = sorted({name for features in features_list for name in features} - {"keystroke_timings"})
+    columns = {}
+    for name in names:
+        values = [features.get(name) for features in features_list]
+        if all(isinstance(value, int) and not isinstance(value, bool) for value in values):
+            columns[name] = np.array(values, dtype=np.int64)
+        elif all(isinstance(value, (int, float)) or value is None for value in values):
+            columns[name] = np.array([value if value is not None else np.nan for value in values], dtype=float)
+        else:
+            columns[name] = np.array(["" if value is None else str(value) for value in values], dtype=str)
+
+    timings = [features.get("keystroke_timings") or [] for features in features_list]
+    if any(timings):
+        lengths = np.fromiter((len(t) for t in timings), dtype=np.int64, count=len(timings))
+        columns[KEYSTROKE_OFFSETS] = np.concatenate([[0], np.cumsum(lengths)])
+        columns[KEYSTROKE_VALUES] = np.fromiter(
+            (value for t in timings for value in t), dtype=float, count=int(lengths.sum())
+        )
+    return columns
+
+
+def bench(n_events: int = 100000) -> Dict[str, Any]:
+    """
+    Parse-to-feature-matrix cost for n login events: JSON lines with per-row dicts vs the columnar formats
+    Model scoring is not included; only getting from bytes on disk to the feature matrix
+    """
+    from anomaly_detection_model import LOGIN_FEATURES
+    from synthetic_data import generate_events
+
+    events, _ = generate_events("login", n_events, seed=7)
+    columns = columns_from_records(events)
+    report = {"events": n_events}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        json_path = os.path.join(tmp, "events.jsonl")
+        with open(json_path, 'w', encoding='utf-8') as f:
+            for features in events:
+                f.write(json.dumps(features) + "\n")
+        paths = {"jsonl": json_path, "npz": os.path.join(tmp, "events.npz")}
+        np.savez(paths["npz"], **columns)
+        if PYARROW_AVAILABLE:
+            paths["arrow"] = os.path.join(tmp, "events.arrow")
+            arrow_columns = {name: column for name, column in columns.items()
+                             if name not in (KEYSTROKE_VALUES, KEYSTROKE_OFFSETS)}
+            arrow_columns["keystroke_timings"] = pa.ListArray.from_arrays(
+                pa.array(columns[KEYSTROKE_OFFSETS].astype(np.int32)), pa.array(columns[KEYSTROKE_VALUES])
+            )
+            table = pa.table(arrow_columns)
+            with pa.OSFile(paths["arrow"], 'wb') as sink:
+                with pa.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+
+        # Reference path: one dict per line, then the same per-row feature extraction the scorer uses
+        from anomaly_detection_model import AnomalyDetectionModel
+        row_model = AnomalyDetectionModel("login", read_only=True)
+
+        started = time.perf_counter()
+        with open(json_path, 'r', encoding='utf-8') as f:
+            parsed = [json.loads(line) for line in f]
+        parse_seconds = time.perf_counter() - started
+        reference = row_model._prepare_features_batch(parsed)
+        report["jsonl"] = {
+            "bytes": os.path.getsize(json_path),
+            "parse_s": parse_seconds,
+            "total_s": time.perf_counter() - started
+        }
+
+        for name in ("npz", "arrow"):
+            if name not in paths:
+                continue
+            started = time.perf_counter()
+            loaded = read_columns(paths[name])
+            parse_seconds = time.perf_counter() - started
+            matrix = build_feature_matrix(loaded, LOGIN_FEATURES)
+            total = time.perf_counter() - started
+            report[name] = {
+                "bytes": os.path.getsize(paths[name]),
+                "parse_s": parse_seconds,
+                "total_s": total,
+                "speedup": report["jsonl"]["total_s"] / total if total > 0 else None,
+                "max_rel_diff": float(np.max(np.abs(matrix - reference) / np.maximum(np.abs(reference), 1.0)))
+            }
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Columnar request formats for bulk anomaly scoring")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    bench_parser = subparsers.add_parser("bench", help="Compare JSON and columnar parse cost")
+    bench_parser.add_argument("--events", type=int, default=100000)
+    args = parser.parse_args()
+
+    if args.command == "bench":
+        print(json.dumps(bench(args.events), indent=2))
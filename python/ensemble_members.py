@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# Deadline-aware execution of ensemble members
+#
+# With a deadline, every member is submitted to a small thread pool at once and the caller waits
+# only until the deadline. Members that have not finished by then are left out of the verdict and
+# counted as deadline misses; they keep running in the background (a thread cannot be interrupted)
+# and their result is dropped. A member still busy with an earlier request is not submitted again,
+# so one slow model cannot pile up work in the pool - it simply misses until it catches up.
+#
+# The default budget for every request comes from ANOMALY_DEADLINE_MS (unset: no deadline).
+
+import os
+import time
+import logging
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Dict, Any, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+DEADLINE_ENV = "ANOMALY_DEADLINE_MS"
+
+
+def default_deadline_ms() -> Optional[float]:
+    """Latency budget of requests that do not bring their own, from ANOMALY_DEADLINE_MS"""
+    value = os.environ.get(DEADLINE_ENV)
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        logger.warning(f"Ignoring invalid {DEADLINE_ENV}={value!r}")
+        return None
+
+
+def deadline_after(deadline_ms: Optional[float]) -> Optional[float]:
+    """Absolute time.monotonic() deadline for a budget in milliseconds (None: no deadline)"""
+    if deadline_ms is None:
+        deadline_ms = default_deadline_ms()
+    return None if deadline_ms is None else time.monotonic() + max(0.0, deadline_ms) / 1000.0
+
+
+class MemberRunner:
+    """Runs the members of one model concurrently and keeps per-member deadline statistics"""
+
+    def __init__(self, name: str, max_workers: int = 4):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"members-{name}")
+        self.calls = Counter()
+        self.misses = Counter()
+        self.errors = Counter()
+        self._running = {}
+        self._lock = threading.Lock()
+
+    def run(self, tasks: Dict[str, Callable[[], Any]], deadline: float) -> Dict[str, Any]:
+        """
+        Start every task and wait until all have finished or the deadline has passed
+        Returns: results of the tasks that finished in time without an error, in task order
+        """
+        # Nothing is started once the budget is already spent; its result would be dropped anyway
+        expired = deadline <= time.monotonic()
+        futures = {}
+        with self._lock:
+            for name, task in tasks.items():
+                self.calls[name] += 1
+                running = self._running.get(name)
+                if expired or (running is not None and not running.done()):
+                    continue
+                futures[name] = self._running[name] = self.executor.submit(task)
+
+        wait(futures.values(), timeout=max(0.0, deadline - time.monotonic()))
+
+        results = {}
+        late = []
+        for name in tasks:
+            future = futures.get(name)
+            if future is None or not future.done():
+                late.append(name)
+                with self._lock:
+                    self.misses[name] += 1
+                continue
+            try:
+                results[name] = future.result()
+            except Exception as e:
+                with self._lock:
+                    self.errors[name] += 1
+                logger.error(f"Error in ensemble member {name}: {str(e)}", exc_info=True)
+
+        if late:
+            logger.warning(f"Deadline passed without {', '.join(late)}; scoring with {', '.join(results) or 'no members'}")
+        return results
+
+    def submit(self, task: Callable, *args):
+        """Run follow-up work (e.g. online learning) off the request path"""
+        return self.executor.submit(task, *args)
+
+    def stats(self) -> Dict[str, Any]:
+        """Calls, deadline misses and errors per member"""
+        with self._lock:
+            return {
+                name: {"calls": self.calls[name], "deadline_misses": self.misses[name], "errors": self.errors[name]}
+                for name in self.calls
+            }
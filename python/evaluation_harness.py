@@ -0,0 +1,407 @@
+#!/usr/bin/env python
+# Offline evaluation and threshold / weight calibration against a labeled corpus
+#
+# Usage:
+#   python evaluation_harness.py <login|transaction> <labeled.jsonl> [--backend hybrid] [--refresh]
+#   python evaluation_harness.py <login|transaction> --synthetic 200000 [--seed 42]
+#       [--thresholds 0.05:1:0.01] [--weight-grid 0,0.2,0.4,0.6,0.8,1] [--online-weights 0,0.1,0.2,0.3,0.5,1]
+#       [--max-fpr 0.01] [--objective f1|recall] [--top 10]
+#
+# The labeled corpus ({"model_type", "features", "label"} JSON lines, see incremental_retrain.py) is
+# scored once: every ensemble member's probability for every event, the time each member took and
+# the labels are cached in models/evaluation/, keyed by the corpus, the backend and the model
+# artifacts, so later runs reuse them until one of those changes. The sweep then combines the cached
+# probabilities for every weight configuration with one matrix product and counts true and false
+# positives at every threshold with one bincount per block of configurations, so thousands of
+# configurations take seconds instead of one rescoring each.
+#
+# Weights are compared the way AnomalyDetectionModel combines them: the static members' weights are
+# renormalized over the loaded members and the online model gets its share of what remains, so a
+# configuration is its effective weight per member. Latency cost is what the members with a nonzero
+# weight take to score, per event in batches and per single event.
+
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import logging
+import itertools
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+
+from build_models import ModelsNotReady, model_status
+from anomaly_detection_model import (
+    AnomalyDetectionModel, DECISION_THRESHOLD, MODEL_DIR, ONLINE_MEMBER_WEIGHT, STATIC_MEMBER_WEIGHTS
+)
+from incremental_retrain import load_outcomes
+from isolation_backend import default_backend
+from native_artifacts import MANIFEST_NAME
+from synthetic_data import DEFAULT_SEED, generate_events
+
+logger = logging.getLogger(__name__)
+
+EVALUATION_DIR = os.path.join(MODEL_DIR, "evaluation")
+
+# Events per scoring call while filling the cache
+SCORE_CHUNK_ROWS = 8192
+# Events scored one at a time per member to measure single-event latency
+LATENCY_SAMPLE_EVENTS = 200
+# Weight configurations scored per matrix product (bounds the n x block score matrix)
+CONFIG_BLOCK = 64
+
+DEFAULT_THRESHOLDS = np.arange(5, 100) / 100
+DEFAULT_WEIGHT_GRID = (0.0, 0.2, 0.4, 0.6, 0.8, 1.0)
+DEFAULT_ONLINE_WEIGHTS = (0.0, 0.1, 0.2, 0.3, 0.5, 1.0)
+
+# Members that run on the scaled features and so also pay for the scaler
+SCALED_MEMBERS = ("rf", "xgb")
+
+
+def _file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def cache_key(model: AnomalyDetectionModel, corpus_id: str) -> str:
+    """Digest of the corpus, the backend and the size and mtime of every artifact the model loaded from"""
+    digest = hashlib.sha256(f"{corpus_id}|{model.model_type}|{model.backend}".encode())
+    paths = sorted(model.artifact_paths().values()) + [os.path.join(model.native_dir, MANIFEST_NAME)]
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            digest.update(f"|{path}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+        except OSError:
+            digest.update(f"|{path}:missing".encode())
+    return digest.hexdigest()[:16]
+
+
+def _timed(timings: Dict[str, float], name: str, score, *args):
+    started = time.perf_counter()
+    result = score(*args)
+    timings[name] = timings.get(name, 0.0) + time.perf_counter() - started
+    return result
+
+
+def _score_chunk(model: AnomalyDetectionModel, model_features: np.ndarray,
+                 online_features_list: List[Dict[str, float]], timings: Dict[str, float]) -> Dict[str, np.ndarray]:
+    """
+    Every loaded member's probability for a chunk, as the batch path computes it without a deadline,
+    adding each member's scoring time to timings
+    """
+    probabilities = {}
+    scaled_features = (_timed(timings, "scaler", model._scale, model_features)
+                       if model.scaler is not None else None)
+    if model.rf_model is not None:
+        probabilities["rf"] = _timed(timings, "rf", lambda: model.rf_model.predict_proba(scaled_features)[:, 1])
+    if model.xgb_model is not None:
+        probabilities["xgb"] = _timed(timings, "xgb", lambda: model.xgb_model.predict_proba(scaled_features)[:, 1])
+    if model.iforest_model is not None:
+        probabilities["iforest"] = _timed(timings, "iforest", model.iforest_model.predict_proba, model_features)
+    if model.online_model is not None:
+        # The transaction classifier learns the static verdicts as it goes, like it does when serving
+        static_pred = (
+            (model._static_ensemble(probabilities) > DECISION_THRESHOLD).astype(int) if probabilities else None
+        )
+        probabilities["online"] = _timed(timings, "online", model._online_probabilities,
+                                         online_features_list, static_pred)
+    return probabilities
+
+
+def _single_event_ms(model: AnomalyDetectionModel, model_features: np.ndarray,
+                     online_features_list: List[Dict[str, float]]) -> Dict[str, float]:
+    """Median time in ms each member (and the scaler) takes to score one event"""
+    samples = {}
+    for i in range(min(LATENCY_SAMPLE_EVENTS, len(model_features))):
+        timings = {}
+        _score_chunk(model, model_features[i:i + 1], online_features_list[i:i + 1], timings)
+        for name, seconds in timings.items():
+            samples.setdefault(name, []).append(seconds)
+    return {name: float(np.median(seconds) * 1000) for name, seconds in samples.items()}
+
+
+def score_corpus(model: AnomalyDetectionModel, features_list: List[Dict[str, Any]], labels: np.ndarray) -> Dict[str, Any]:
+    """
+    Score a labeled corpus once with every loaded member
+    Returns: dict of members, probabilities (events x members), labels, batch_us_per_event and
+    single_event_ms (per member, plus "scaler"), and scoring_seconds
+    """
+    if not model.is_ready():
+        raise RuntimeError(f"{model.model_type} models are not built yet (see build_models.py)")
+    started = time.perf_counter()
+    model_features = model._prepare_features_batch(features_list)
+    online_features_list = (
+        [model._prepare_online_features(features) for features in features_list]
+        if model.online_model is not None else [None] * len(features_list)
+    )
+
+    timings, chunks = {}, []
+    for start in range(0, len(model_features), SCORE_CHUNK_ROWS):
+        end = start + SCORE_CHUNK_ROWS
+        chunks.append(_score_chunk(model, model_features[start:end], online_features_list[start:end], timings))
+    members = list(chunks[0]) if chunks else []
+    if not members:
+        raise RuntimeError(f"No {model.model_type} ensemble member is loaded")
+    probabilities = np.column_stack([np.concatenate([chunk[name] for chunk in chunks]) for name in members])
+
+    n = max(1, len(model_features))
+    return {
+        "members": members,
+        "probabilities": probabilities.astype(np.float64),
+        "labels": np.asarray(labels, dtype=bool),
+        "batch_us_per_event": {name: seconds / n * 1e6 for name, seconds in timings.items()},
+        "single_event_ms": _single_event_ms(model, model_features, online_features_list),
+        "scoring_seconds": time.perf_counter() - started
+    }
+
+
+def _save_scores(path: str, scores: Dict[str, Any]):
+    timed = sorted(scores["batch_us_per_event"])
+    tmp_path = path + ".tmp.npz"
+    np.savez(
+        tmp_path,
+        members=np.array(scores["members"]),
+        probabilities=scores["probabilities"],
+        labels=scores["labels"],
+        timed=np.array(timed),
+        batch_us_per_event=np.array([scores["batch_us_per_event"][name] for name in timed]),
+        single_event_ms=np.array([scores["single_event_ms"].get(name, np.nan) for name in timed]),
+        scoring_seconds=np.float64(scores["scoring_seconds"])
+    )
+    os.replace(tmp_path, path)
+
+
+def _load_scores(path: str) -> Dict[str, Any]:
+    with np.load(path) as data:
+        timed = data["timed"].tolist()
+        return {
+            "members": data["members"].tolist(),
+            "probabilities": data["probabilities"],
+            "labels": data["labels"],
+            "batch_us_per_event": dict(zip(timed, data["batch_us_per_event"].tolist())),
+            "single_event_ms": dict(zip(timed, data["single_event_ms"].tolist())),
+            "scoring_seconds": float(data["scoring_seconds"])
+        }
+
+
+def load_or_score(model_type: str, corpus_path: str = None, synthetic_events: int = None,
+                  seed: int = DEFAULT_SEED, backend: str = None, refresh: bool = False) -> Tuple[Dict[str, Any], str, bool]:
+    """
+    Cached member probabilities of a labeled corpus file or of a synthetic corpus, scoring it on a miss
+    Returns: (scores as from score_corpus, cache path, whether the cache was used)
+    """
+    if (corpus_path is None) == (synthetic_events is None):
+        raise ValueError("Give either a corpus file or a synthetic corpus size")
+    # Checked before loading: a model without artifacts would start a background build, which an
+    # evaluation should not leave behind
+    status = model_status(model_type)
+    if status["training"]:
+        raise ModelsNotReady(f"{model_type} models are being built; evaluate once `python build_models.py status` "
+                             f"shows them ready")
+    if not status["ready"]:
+        raise ModelsNotReady(f"{model_type} models are not built yet; run `python build_models.py {model_type}` first")
+    # Read-only: the online model keeps learning while the corpus is scored, but never on disk
+    model = AnomalyDetectionModel(model_type, read_only=True, backend=backend)
+    corpus_id = (f"file:{_file_digest(corpus_path)}" if corpus_path is not None
+                 else f"synthetic:{synthetic_events}:{seed}")
+    os.makedirs(EVALUATION_DIR, exist_ok=True)
+    path = os.path.join(EVALUATION_DIR, f"{model_type}-{cache_key(model, corpus_id)}.npz")
+
+    if not refresh and os.path.exists(path):
+        try:
+            return _load_scores(path), path, True
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable evaluation cache {path}: {str(e)}")
+
+    if corpus_path is not None:
+        features_list, labels = load_outcomes(corpus_path, model_type)
+    else:
+        features_list, labels = generate_events(model_type, synthetic_events, seed=seed)
+    if not features_list:
+        raise ValueError(f"No labeled {model_type} events to evaluate")
+    logger.info(f"Scoring {len(features_list)} labeled {model_type} events once for the evaluation cache")
+    scores = score_corpus(model, features_list, labels)
+    _save_scores(path, scores)
+    return scores, path, False
+
+
+def weight_configurations(members: List[str], weight_grid=DEFAULT_WEIGHT_GRID,
+                          online_weights=DEFAULT_ONLINE_WEIGHTS) -> np.ndarray:
+    """
+    Effective weight of each member (columns in `members` order) for every configuration on the grid,
+    the deployed configuration first and duplicates (same ratios) removed
+    Returns: configurations x members array, each row summing to 1
+    """
+    static = [i for i, name in enumerate(members) if name in STATIC_MEMBER_WEIGHTS]
+    online = members.index("online") if "online" in members else None
+
+    def effective(static_weights, online_weight):
+        row = np.zeros(len(members))
+        total = sum(static_weights)
+        if total > 0:
+            row[static] = np.asarray(static_weights) / total
+            if online is not None:
+                row *= 1 - online_weight
+                row[online] = online_weight
+        elif online is not None:
+            row[online] = 1.0
+        return row
+
+    rows = [effective([STATIC_MEMBER_WEIGHTS[members[i]] for i in static], ONLINE_MEMBER_WEIGHT)]
+    for static_weights in itertools.product(weight_grid, repeat=len(static)):
+        if sum(static_weights) == 0 and online is None:
+            continue
+        for online_weight in (online_weights if online is not None else (0.0,)):
+            rows.append(effective(static_weights, online_weight))
+
+    configurations = np.array(rows)
+    _, first = np.unique(np.round(configurations, 9), axis=0, return_index=True)
+    return configurations[np.sort(first)]
+
+
+def sweep(probabilities: np.ndarray, labels: np.ndarray, configurations: np.ndarray,
+          thresholds: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    Confusion counts and rates of every configuration at every threshold (flagged when score > threshold)
+    thresholds must be sorted ascending
+    Returns: dict of configurations x thresholds arrays flagged, tp, fp, precision, recall, fpr and f1
+    """
+    n_thresholds = len(thresholds)
+    labels = np.asarray(labels, dtype=bool)
+    flagged = np.empty((len(configurations), n_thresholds), dtype=np.int64)
+    tp = np.empty_like(flagged)
+    for start in range(0, len(configurations), CONFIG_BLOCK):
+        block = configurations[start:start + CONFIG_BLOCK]
+        scores = probabilities @ block.T
+        # Number of thresholds each score is above, offset per configuration so one bincount counts them all
+        bins = np.searchsorted(thresholds, scores, side='left') + (n_thresholds + 1) * np.arange(len(block))
+        size = len(block) * (n_thresholds + 1)
+        for counts, out in ((np.bincount(bins.ravel(), minlength=size), flagged),
+                            (np.bincount(bins[labels].ravel(), minlength=size), tp)):
+            # A score lands in bin b when it is above thresholds[:b], so the count above threshold j
+            # is the sum of bins j+1 onwards
+            above = np.cumsum(counts.reshape(len(block), n_thresholds + 1)[:, ::-1], axis=1)[:, ::-1]
+            out[start:start + len(block)] = above[:, 1:]
+
+    positives = int(labels.sum())
+    negatives = len(labels) - positives
+    fp = flagged - tp
+    with np.errstate(divide='ignore', invalid='ignore'):
+        precision = np.where(flagged > 0, tp / flagged, 0.0)
+        recall = tp / positives if positives else np.zeros(tp.shape)
+        fpr = fp / negatives if negatives else np.zeros(fp.shape)
+        f1 = np.where(precision + recall > 0, 2 * precision * recall / (precision + recall), 0.0)
+    return {"flagged": flagged, "tp": tp, "fp": fp, "precision": precision, "recall": recall, "fpr": fpr, "f1": f1}
+
+
+def latency_cost(members: List[str], configurations: np.ndarray, per_member: Dict[str, float]) -> np.ndarray:
+    """Cost of running the members with a nonzero weight (plus the scaler if any of them needs it)"""
+    active = configurations > 0
+    cost = active @ np.array([per_member.get(name, 0.0) for name in members])
+    scaled = [i for i, name in enumerate(members) if name in SCALED_MEMBERS]
+    if scaled:
+        cost = cost + active[:, scaled].any(axis=1) * per_member.get("scaler", 0.0)
+    return cost
+
+
+def evaluate(model_type: str, corpus_path: str = None, synthetic_events: int = None, seed: int = DEFAULT_SEED,
+             backend: str = None, refresh: bool = False, thresholds: np.ndarray = DEFAULT_THRESHOLDS,
+             weight_grid=DEFAULT_WEIGHT_GRID, online_weights=DEFAULT_ONLINE_WEIGHTS, max_fpr: float = None,
+             objective: str = "f1", top: int = 10) -> Dict[str, Any]:
+    """
+    Score (or reuse) a labeled corpus and sweep thresholds and member weights over it
+    Returns: report with the deployed configuration's metrics and the best configurations by
+    `objective` among those within max_fpr, cheapest first on ties
+    """
+    scores, cache_path, cached = load_or_score(model_type, corpus_path, synthetic_events, seed, backend, refresh)
+    members = scores["members"]
+    thresholds = np.unique(np.append(np.asarray(thresholds, dtype=float), DECISION_THRESHOLD))
+
+    started = time.perf_counter()
+    configurations = weight_configurations(members, weight_grid, online_weights)
+    metrics = sweep(scores["probabilities"], scores["labels"], configurations, thresholds)
+    batch_cost = latency_cost(members, configurations, scores["batch_us_per_event"])
+    single_cost = latency_cost(members, configurations, scores["single_event_ms"])
+    sweep_seconds = time.perf_counter() - started
+
+    def row(config: int, threshold: int) -> Dict[str, Any]:
+        return {
+            "weights": {name: round(float(w), 4) for name, w in zip(members, configurations[config]) if w > 0},
+            "threshold": float(thresholds[threshold]),
+            **{name: float(metrics[name][config, threshold]) for name in ("precision", "recall", "fpr", "f1")},
+            "flagged": int(metrics["flagged"][config, threshold]),
+            "batch_us_per_event": float(batch_cost[config]),
+            "single_event_ms": float(single_cost[config])
+        }
+
+    value = metrics[objective].astype(float)
+    if max_fpr is not None:
+        value = np.where(metrics["fpr"] <= max_fpr, value, -np.inf)
+    cost = np.broadcast_to(single_cost[:, None], value.shape)
+    order = np.lexsort((cost.ravel(), -value.ravel()))
+    best = [row(*divmod(int(i), len(thresholds))) for i in order[:top] if np.isfinite(value.ravel()[i])]
+
+    return {
+        "model_type": model_type,
+        "backend": backend or default_backend(),
+        "events": int(len(scores["labels"])),
+        "positives": int(scores["labels"].sum()),
+        "cache": cache_path,
+        "cached": cached,
+        "scoring_seconds": scores["scoring_seconds"],
+        "sweep_seconds": sweep_seconds,
+        "configurations": int(len(configurations)),
+        "thresholds": int(len(thresholds)),
+        "members": {
+            name: {"batch_us_per_event": scores["batch_us_per_event"].get(name),
+                   "single_event_ms": scores["single_event_ms"].get(name)}
+            for name in members + ["scaler"] if name in scores["batch_us_per_event"]
+        },
+        "deployed": row(0, int(np.searchsorted(thresholds, DECISION_THRESHOLD))),
+        "objective": objective,
+        "max_fpr": max_fpr,
+        "best": best
+    }
+
+
+def _parse_grid(text: str) -> np.ndarray:
+    """A comma-separated list of values or a start:stop:step range"""
+    if ":" in text:
+        start, stop, step = (float(part) for part in text.split(":"))
+        return np.round(np.arange(start, stop - step / 2, step), 9)
+    return np.array([float(part) for part in text.split(",") if part.strip()])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sweep decision thresholds and ensemble weights over a labeled corpus")
+    parser.add_argument("model_type", choices=["login", "transaction"])
+    parser.add_argument("corpus", nargs="?", default=None, help="JSON-lines file of labeled events")
+    parser.add_argument("--synthetic", type=int, default=None, help="Evaluate on this many synthetic events instead")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    parser.add_argument("--backend", default=None, help="Static members to evaluate (default: ANOMALY_BACKEND)")
+    parser.add_argument("--refresh", action="store_true", help="Rescore the corpus even if it is cached")
+    parser.add_argument("--thresholds", type=_parse_grid, default=DEFAULT_THRESHOLDS)
+    parser.add_argument("--weight-grid", type=_parse_grid, default=DEFAULT_WEIGHT_GRID,
+                        help="Candidate weights of each static member")
+    parser.add_argument("--online-weights", type=_parse_grid, default=DEFAULT_ONLINE_WEIGHTS,
+                        help="Candidate shares of the online model in the final score")
+    parser.add_argument("--max-fpr", type=float, default=None, help="Only rank configurations within this FPR")
+    parser.add_argument("--objective", choices=["f1", "recall", "precision"], default="f1")
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    try:
+        report = evaluate(
+            args.model_type, corpus_path=args.corpus, synthetic_events=args.synthetic, seed=args.seed,
+            backend=args.backend, refresh=args.refresh, thresholds=args.thresholds, weight_grid=args.weight_grid,
+            online_weights=args.online_weights, max_fpr=args.max_fpr, objective=args.objective, top=args.top
+        )
+    except Exception as e:
+        logger.error(f"Evaluation failed: {str(e)}", exc_info=True)
+        sys.exit(1)
+    print(json.dumps(report, indent=2))
@@ -0,0 +1,329 @@
+#!/usr/bin/env python
+# Per-feature contributions to the static ensemble's score, explaining why an event was flagged
+#
+# Usage:
+#   python feature_attribution.py bench [login|transaction|all] [--rows 2000]
+#
+# XGBoost: the booster's own SHAP values (pred_contribs), which are in log-odds. They are moved to
+# probability units by spreading the member's change in probability over the features in
+# proportion to their log-odds contributions, so they add up to the member's probability minus
+# its base probability.
+# Random forest: Saabas path attributions. Every split from the root to the leaf credits its
+# feature with the change in the node's anomaly probability. A leaf's contributions depend only
+# on the leaf, so they are worked out once per forest and a batch costs one apply() per tree, the
+# same as scoring it on the hot path.
+# The members' contributions are averaged with the static ensemble weights. The isolation forest
+# and the online model are not attributed.
+#
+# Only rows over the decision threshold are explained, highest score first. Each call explains as
+# many rows as fit in ANOMALY_ATTRIBUTION_BUDGET_MS at the measured cost (0 turns attributions
+# off); the other rows keep the rule-based reason. An explained row's reason is the label the
+# anomaly_type rules give the highest-contributing feature that has one (see rule_engine.py).
+# The response also carries the top contributions.
+
+import os
+import json
+import time
+import argparse
+import logging
+import threading
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+import xgboost as xgb
+
+logger = logging.getLogger(__name__)
+
+ATTRIBUTION_BUDGET_ENV = "ANOMALY_ATTRIBUTION_BUDGET_MS"
+DEFAULT_ATTRIBUTION_BUDGET_MS = 5.0
+
+# Contributions returned per explained event
+ATTRIBUTION_TOP_FEATURES = 3
+
+# Smoothing of the measured costs per call and per explained row, and the rows the first estimate is timed on
+ROW_COST_SMOOTHING = 0.2
+COST_SAMPLE_ROWS = 64
+
+
+def attribution_budget_ms() -> float:
+    """Extra latency allowed per scoring call for explaining flagged events, from ANOMALY_ATTRIBUTION_BUDGET_MS"""
+    value = os.environ.get(ATTRIBUTION_BUDGET_ENV)
+    if not value:
+        return DEFAULT_ATTRIBUTION_BUDGET_MS
+    try:
+        return float(value)
+    except ValueError:
+        logger.warning(f"Ignoring invalid {ATTRIBUTION_BUDGET_ENV}={value!r}")
+        return DEFAULT_ATTRIBUTION_BUDGET_MS
+
+
+def _sigmoid(margin: np.ndarray) -> np.ndarray:
+    return 1.0 / (1.0 + np.exp(-margin))
+
+
+def forest_leaf_contributions(rf_model) -> Tuple[np.ndarray, np.ndarray, float]:
+    """
+    Saabas contributions of every node of every tree, concatenated tree after tree
+    Returns: (nodes x features contributions, node offset of each tree, mean root probability)
+    """
+    n_features = rf_model.n_features_in_
+    tables, offsets, roots = [], [0], []
+    for estimator in rf_model.estimators_:
+        tree = estimator.tree_
+        # Normalized exactly as DecisionTreeClassifier.predict_proba does
+        proba = tree.value[:, 0, :2]
+        normalizer = proba.sum(axis=1)
+        normalizer[normalizer == 0.0] = 1.0
+        probability = proba[:, 1] / normalizer
+
+        contributions = np.zeros((tree.node_count, n_features))
+        frontier = np.array([0])
+        while frontier.size:
+            parents = frontier[tree.children_left[frontier] >= 0]
+            features = tree.feature[parents]
+            children = []
+            for child in (tree.children_left[parents], tree.children_right[parents]):
+                contributions[child] = contributions[parents]
+                contributions[child, features] += probability[child] - probability[parents]
+                children.append(child)
+            frontier = np.concatenate(children)
+
+        tables.append(contributions)
+        offsets.append(offsets[-1] + tree.node_count)
+        roots.append(probability[0])
+    return np.concatenate(tables), np.array(offsets[:-1]), float(np.mean(roots))
+
+
+class FeatureAttributor:
+    """
+    Per-feature contributions of the static members of one loaded model
+    Built from the model's current rf_model, xgb_model and scaler; rebuilt when those change
+    """
+
+    def __init__(self, rf_model, xgb_model, scaler, weights: Dict[str, float]):
+        self.members = (rf_model, xgb_model, scaler)
+
+        self.trees = self.leaf_table = self.leaf_offsets = None
+        if rf_model is not None and rf_model.n_outputs_ == 1 and rf_model.n_classes_ == 2:
+            self.trees = [estimator.tree_ for estimator in rf_model.estimators_]
+            self.leaf_table, self.leaf_offsets, self.rf_base = forest_leaf_contributions(rf_model)
+
+        self.booster = None
+        if xgb_model is not None and xgb_model.get_params().get("objective") == "binary:logistic":
+            self.booster = xgb_model.get_booster()
+            self.missing = xgb_model.missing
+            try:
+                self.iteration_range = (0, xgb_model.best_iteration + 1)
+            except AttributeError:
+                self.iteration_range = (0, 0)
+
+        # Renormalized over the members that can be attributed, like the ensemble over the loaded ones
+        explained = [name for name, ready in (("rf", self.trees), ("xgb", self.booster)) if ready is not None]
+        total = sum(weights[name] for name in explained)
+        self.weights = {name: weights[name] / total for name in explained}
+
+    def matches(self, rf_model, xgb_model, scaler) -> bool:
+        return all(a is b for a, b in zip(self.members, (rf_model, xgb_model, scaler)))
+
+    def rf_contributions(self, scaled: np.ndarray) -> np.ndarray:
+        """Forest probability minus its mean root probability, split over the features"""
+        contributions = np.zeros((len(scaled), self.leaf_table.shape[1]))
+        for tree, offset in zip(self.trees, self.leaf_offsets):
+            contributions += self.leaf_table[offset + tree.apply(scaled)]
+        return contributions / len(self.trees)
+
+    def xgb_contributions(self, scaled: np.ndarray) -> np.ndarray:
+        """Booster probability minus its base probability, split over the features"""
+        shap = self.booster.predict(xgb.DMatrix(scaled, missing=self.missing), pred_contribs=True,
+                                    iteration_range=self.iteration_range)
+        margin = shap.sum(axis=1)
+        bias = shap[:, -1]
+        change = _sigmoid(margin) - _sigmoid(bias)
+        per_margin = np.divide(change, margin - bias, out=np.zeros(len(shap)), where=margin != bias)
+        return shap[:, :-1] * per_margin[:, np.newaxis]
+
+    def contributions(self, model_features: np.ndarray) -> np.ndarray:
+        """Weighted per-feature contributions of every row, in probability units"""
+        scaled = self.members[2].transform(model_features).astype(np.float32)
+        contributions = np.zeros(model_features.shape)
+        if "rf" in self.weights:
+            contributions += self.weights["rf"] * self.rf_contributions(scaled)
+        if "xgb" in self.weights:
+            contributions += self.weights["xgb"] * self.xgb_contributions(scaled)
+        return contributions
+
+
+class AttributionExplainer:
+    """Explains the flagged rows of each scoring call within the latency budget and keeps cost statistics"""
+
+    def __init__(self, feature_names: List[str], weights: Dict[str, float]):
+        self.feature_names = list(feature_names)
+        self.weights = dict(weights)
+        self._attributor = None
+        # Fixed cost of a call and smoothed cost of each further row, measured on this machine
+        self.call_seconds = None
+        self.row_seconds = None
+        self.calls = 0
+        self.explained = 0
+        self.skipped = 0
+        self.over_budget = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def attributor(self, rf_model, xgb_model, scaler, sample: np.ndarray) -> Optional[FeatureAttributor]:
+        """The attributor of the current members, built (and its per-call cost measured) on first use"""
+        attributor = self._attributor
+        if attributor is not None and attributor.matches(rf_model, xgb_model, scaler):
+            return attributor
+        with self._lock:
+            attributor = self._attributor
+            if attributor is None or not attributor.matches(rf_model, xgb_model, scaler):
+                started = time.perf_counter()
+                attributor = FeatureAttributor(rf_model, xgb_model, scaler, self.weights)
+                built = time.perf_counter() - started
+                if attributor.weights:
+                    # Warm up, then time one row (the fixed cost every call pays) and a few more
+                    # (the starting estimate of the cost per further row)
+                    attributor.contributions(sample[:1])
+                    started = time.perf_counter()
+                    attributor.contributions(sample[:1])
+                    self.call_seconds = time.perf_counter() - started
+                    rows = np.resize(sample, (COST_SAMPLE_ROWS, sample.shape[1]))
+                    started = time.perf_counter()
+                    attributor.contributions(rows)
+                    self.row_seconds = max(0.0, time.perf_counter() - started - self.call_seconds) / (COST_SAMPLE_ROWS - 1)
+                self._attributor = attributor
+                logger.info(f"Built feature attributor in {built * 1000:.1f} ms "
+                            f"(members {', '.join(attributor.weights) or 'none'})")
+        return attributor if attributor.weights else None
+
+    def _capacity(self, budget_seconds: float) -> int:
+        """Rows one call can explain within the budget at the measured costs"""
+        remaining = budget_seconds - self.call_seconds
+        if remaining < 0:
+            return 0
+        if not self.row_seconds:
+            return np.iinfo(np.int64).max
+        return 1 + int(remaining / self.row_seconds)
+
+    def explain(self, rf_model, xgb_model, scaler, model_features: np.ndarray, scores: np.ndarray,
+                is_anomalous: np.ndarray, feature_labels: Dict[str, str]) -> Optional[Tuple[np.ndarray, List[Optional[Dict[str, float]]]]]:
+        """
+        Contributions and reason of the flagged rows that fit the budget, highest score first
+        Returns: (reason per row, None where not explained or no contributing feature has a reason;
+        top contributions per row, None where not explained), or None when nothing was explained
+        """
+        flagged = np.flatnonzero(is_anomalous)
+        budget_ms = attribution_budget_ms()
+        if not flagged.size or budget_ms <= 0 or scaler is None:
+            return None
+        attributor = self.attributor(rf_model, xgb_model, scaler, model_features[flagged])
+        if attributor is None:
+            return None
+
+        capacity = self._capacity(budget_ms / 1000.0)
+        chosen = flagged[np.argsort(-np.asarray(scores)[flagged], kind='stable')[:capacity]]
+        if not chosen.size:
+            with self._lock:
+                self.skipped += len(flagged)
+            return None
+
+        started = time.perf_counter()
+        contributions = attributor.contributions(model_features[chosen])
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.calls += 1
+            self.explained += len(chosen)
+            self.skipped += len(flagged) - len(chosen)
+            self.total_seconds += elapsed
+            self.max_seconds = max(self.max_seconds, elapsed)
+            self.over_budget += elapsed * 1000 > budget_ms
+            if len(chosen) > 1:
+                row = max(0.0, elapsed - self.call_seconds) / (len(chosen) - 1)
+                self.row_seconds = (1 - ROW_COST_SMOOTHING) * self.row_seconds + ROW_COST_SMOOTHING * row
+            else:
+                self.call_seconds = (1 - ROW_COST_SMOOTHING) * self.call_seconds + ROW_COST_SMOOTHING * elapsed
+
+        n = len(model_features)
+        reasons = np.full(n, None, dtype=object)
+        attributions = [None] * n
+        for i, row in zip(chosen.tolist(), contributions):
+            ranked = [j for j in np.argsort(-row, kind='stable').tolist() if row[j] > 0]
+            names = [self.feature_names[j] for j in ranked]
+            reasons[i] = next((feature_labels[name] for name in names if name in feature_labels), None)
+            attributions[i] = {name: float(row[j]) for name, j in zip(names, ranked[:ATTRIBUTION_TOP_FEATURES])}
+        return reasons, attributions
+
+    def stats(self) -> Dict[str, Any]:
+        """Explained and budget-skipped rows, and the measured extra latency per call"""
+        with self._lock:
+            return {
+                "budget_ms": attribution_budget_ms(),
+                "calls": self.calls,
+                "explained": self.explained,
+                "skipped": self.skipped,
+                "over_budget": self.over_budget,
+                "mean_ms": self.total_seconds / self.calls * 1000 if self.calls else None,
+                "max_ms": self.max_seconds * 1000,
+                "call_overhead_ms": self.call_seconds * 1000 if self.call_seconds is not None else None,
+                "row_us": self.row_seconds * 1e6 if self.row_seconds is not None else None
+            }
+
+
+def bench(model_type: str, rows: int = 2000) -> Dict[str, Any]:
+    """
+    Cost of explaining flagged synthetic events one at a time and in one batch
+    Returns: timings, the largest gap between each member's probability and its base probability
+    plus its contributions, and how often each feature contributed most
+    """
+    from anomaly_detection_model import AnomalyDetectionModel, STATIC_MEMBER_WEIGHTS
+    from synthetic_data import generate_matrix
+
+    model = AnomalyDetectionModel(model_type, read_only=True)
+    if model.rf_model is None or model.xgb_model is None:
+        return {"model_type": model_type, "error": "models are not trained yet"}
+
+    X, y = generate_matrix(model_type, rows, seed=7)
+    X = X[y == 1]
+    attributor = FeatureAttributor(model.rf_model, model.xgb_model, model.scaler, STATIC_MEMBER_WEIGHTS)
+    attributor.contributions(X[:1])
+
+    started = time.perf_counter()
+    for i in range(min(len(X), 200)):
+        attributor.contributions(X[i:i + 1])
+    single_ms = (time.perf_counter() - started) / min(len(X), 200) * 1000
+
+    started = time.perf_counter()
+    contributions = attributor.contributions(X)
+    batch_ms = (time.perf_counter() - started) * 1000
+
+    scaled = model.scaler.transform(X).astype(np.float32)
+    rf_gap = np.abs(attributor.rf_contributions(scaled).sum(axis=1) + attributor.rf_base
+                    - model.rf_model.predict_proba(scaled)[:, 1]).max()
+    xgb_base = _sigmoid(attributor.booster.predict(xgb.DMatrix(scaled), pred_contribs=True)[:, -1])
+    xgb_gap = np.abs(attributor.xgb_contributions(scaled).sum(axis=1) + xgb_base
+                     - model.xgb_model.predict_proba(scaled)[:, 1]).max()
+    return {
+        "model_type": model_type,
+        "rows": int(len(X)),
+        "single_event_ms": single_ms,
+        "batch_ms": batch_ms,
+        "batch_us_per_row": batch_ms * 1000 / max(1, len(X)),
+        "rf_additivity_error": float(rf_gap),
+        "xgb_additivity_error": float(xgb_gap),
+        "top_features": dict(zip(*np.unique(np.array(model.feature_names)[np.argmax(contributions, axis=1)],
+                                            return_counts=True)))
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Model-based feature attributions for flagged events")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    bench_parser = subparsers.add_parser("bench", help="Measure the cost of explaining flagged events")
+    bench_parser.add_argument("model_type", nargs="?", choices=["login", "transaction", "all"], default="all")
+    bench_parser.add_argument("--rows", type=int, default=2000)
+    args = parser.parse_args()
+
+    model_types = ["login", "transaction"] if args.model_type == "all" else [args.model_type]
+    print(json.dumps([bench(model_type, args.rows) for model_type in model_types], indent=2, default=int))
@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+# Batched ingestion of confirmed labels into the online (River) models
+#
+# Usage:
+#   python feedback_ingestion.py <model_type> <feedback.jsonl|-> [<feedback.jsonl> ...]
+#                                [--batch-size 500] [--follow]
+#
+# Each line is {"event_id": ..., "features": {...}, "label": 0|1}, e.g. a reviewed anomaly_labels row
+# joined with the features in model_learning_logs. The label may also be given as "is_anomalous", and
+# lines whose "model_type" names the other model are skipped. "-" reads the lines from stdin, so
+# another process can pipe a queue of reviewed cases in; --follow keeps tailing the files instead.
+#
+# Labels are applied in mini-batches. Every event id is applied once: ids already in the ledger, or
+# repeated within the input, are skipped. Each batch is appended to the ledger under its batch number,
+# with the online feature rows and labels it teaches, before it is learned; the online model carries
+# the number of the last batch it has learned. The scoring server, the stream processor and every
+# other process with a writable online model keep saving their own copy of that model, so the ledger
+# is also how feedback reaches them: each process learns the batches newer than its model's number
+# when it loads the model and before every background save (see
+# AnomalyDetectionModel.apply_logged_feedback). Whichever process saves the snapshot last, it holds
+# every batch logged before that save, and later batches are learned again from the ledger on load.
+# Run one ingestor per model type at a time: batch numbers are assigned by the ingestor.
+
+import os
+import sys
+import json
+import time
+import signal
+import argparse
+import logging
+import threading
+from collections import Counter
+from typing import Dict, Any, List, Iterator, Optional
+
+from anomaly_detection_model import (
+    AnomalyDetectionModel, FEEDBACK_BATCH_ATTRIBUTE, LOGIN_FEEDBACK_LEDGER_PATH, TRANSACTION_FEEDBACK_LEDGER_PATH
+)
+from stream_processor import tail_lines
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 500
+
+# How often (in batches) progress is logged during a backfill
+PROGRESS_EVERY_BATCHES = 20
+
+
+def ledger_path(model_type: str) -> str:
+    return LOGIN_FEEDBACK_LEDGER_PATH if model_type == "login" else TRANSACTION_FEEDBACK_LEDGER_PATH
+
+
+class FeedbackLedger:
+    """Append-only record of the event ids applied to one online model, one line per batch"""
+
+    def __init__(self, path: str, committed_batch: int):
+        self.path = path
+        self.batch = committed_batch
+        self.applied = set()
+        if not os.path.exists(path):
+            return
+
+        kept, stale = [], 0
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A torn last line from a crash while appending
+                    stale += 1
+                    continue
+                if entry["batch"] <= committed_batch:
+                    kept.append(line if line.endswith("\n") else line + "\n")
+                    self.applied.update(entry["event_ids"])
+                else:
+                    stale += 1
+
+        if stale:
+            # Only batches logged without their rows (by older versions) are newer than the loaded model
+            logger.warning(f"Dropping {stale} ledger batches newer than the saved model; their labels will be applied again")
+            tmp_path = path + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.writelines(kept)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+
+    def __contains__(self, event_id: str) -> bool:
+        return event_id in self.applied
+
+    def record(self, batch: int, event_ids: List[str], rows: List[Dict[str, float]], labels: List[int]):
+        """Durably append a batch with the rows and labels every process with the online model learns"""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({"batch": batch, "event_ids": event_ids, "rows": rows, "labels": labels,
+                                "recorded_at": time.time()}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.batch = batch
+        self.applied.update(event_ids)
+
+
+class FeedbackIngestor:
+    """Collects labelled events into mini-batches and applies each batch to the online model"""
+
+    def __init__(self, model_type: str, batch_size: int = DEFAULT_BATCH_SIZE, model: AnomalyDetectionModel = None):
+        self.model_type = model_type
+        self.batch_size = max(1, batch_size)
+        self.model = model or AnomalyDetectionModel(model_type)
+        if self.model.online_model is None:
+            raise RuntimeError(f"No online {model_type} model is available to learn from feedback")
+
+        if self.model.state_saver is not None:
+            # flush() saves after every batch; a background save could learn a batch from the ledger first
+            self.model.state_saver.stop()
+
+        # The model has already learned every logged batch (see AnomalyDetectionModel.apply_logged_feedback)
+        committed = getattr(self.model.online_model, FEEDBACK_BATCH_ATTRIBUTE, 0)
+        self.ledger = FeedbackLedger(ledger_path(model_type), committed)
+        self._pending = []
+        self._pending_ids = set()
+        self.stats = Counter()
+        self.started = time.perf_counter()
+
+    def add(self, record: Dict[str, Any]):
+        """Queue one labelled event; a full mini-batch is applied right away"""
+        if record.get("model_type", self.model_type) != self.model_type:
+            self.stats["other_model_type"] += 1
+            return
+        event_id = record.get("event_id")
+        label = record.get("label", record.get("is_anomalous"))
+        if event_id in (None, "") or label is None or not isinstance(record.get("features"), dict):
+            self.stats["invalid"] += 1
+            return
+
+        self.stats["received"] += 1
+        event_id = str(event_id)
+        if event_id in self.ledger or event_id in self._pending_ids:
+            self.stats["duplicates"] += 1
+            return
+
+        self._pending.append((event_id, record["features"], int(bool(label))))
+        self._pending_ids.add(event_id)
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Apply the pending events and persist one snapshot for all of them"""
+        if not self._pending:
+            return
+        event_ids = [event_id for event_id, _, _ in self._pending]
+        rows = [self.model._prepare_online_features(features) for _, features, _ in self._pending]
+        labels = [label for _, _, label in self._pending]
+
+        # Logged first: from then on every process with the online model learns the batch
+        batch = self.ledger.batch + 1
+        self.ledger.record(batch, event_ids, rows, labels)
+        learned = self.model.learn_feedback_rows(rows, labels, batch) or 0
+        self.model._save_online_model()
+
+        self.stats["applied"] += len(event_ids)
+        self.stats["learned"] += learned
+        self.stats["batches"] += 1
+        self._pending = []
+        self._pending_ids = set()
+
+        if self.stats["batches"] % PROGRESS_EVERY_BATCHES == 0:
+            logger.info(f"Feedback ingestion progress: {self.report()}")
+
+    def report(self) -> Dict[str, Any]:
+        """Counters and throughput since the ingestor was created"""
+        elapsed = time.perf_counter() - self.started
+        return {
+            "model_type": self.model_type,
+            **self.stats,
+            "pending": len(self._pending),
+            "elapsed_s": elapsed,
+            "received_per_s": self.stats["received"] / elapsed if elapsed > 0 else 0.0,
+            "applied_per_s": self.stats["applied"] / elapsed if elapsed > 0 else 0.0
+        }
+
+
+def read_records(paths: List[str], stop: threading.Event, follow: bool = False,
+                 poll_interval: float = 1.0) -> Iterator[Optional[Dict[str, Any]]]:
+    """
+    Records from JSON-lines files ("-" for stdin), in order; malformed lines are logged and skipped
+    While following, None is yielded on every idle poll so the caller can flush a partial batch
+    """
+    for path in paths:
+        if path == "-":
+            lines = ((line.encode(), None) for line in sys.stdin)
+        else:
+            lines = tail_lines(path, 0, stop, poll_interval=poll_interval, follow=follow)
+        for line, _ in lines:
+            if line is None:
+                yield None
+                continue
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError as e:
+                logger.warning(f"Skipping malformed feedback line in {path}: {str(e)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply confirmed labels to the online anomaly models")
+    parser.add_argument("model_type", choices=["login", "transaction"])
+    parser.add_argument("inputs", nargs="+", help="JSON-lines feedback files, or - for stdin")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--follow", action="store_true", help="Keep tailing the files for new feedback")
+    parser.add_argument("--poll-interval", type=float, default=1.0)
+    args = parser.parse_args()
+
+    stop = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: stop.set())
+
+    try:
+        ingestor = FeedbackIngestor(args.model_type, batch_size=args.batch_size)
+    except Exception as e:
+        logger.error(f"Feedback ingestion failed: {str(e)}", exc_info=True)
+        print(json.dumps({"error": str(e)}))
+        sys.exit(1)
+
+    for record in read_records(args.inputs, stop, follow=args.follow, poll_interval=args.poll_interval):
+        if record is None:
+            # Idle: do not hold a partial batch back while waiting for more feedback
+            ingestor.flush()
+        else:
+            ingestor.add(record)
+        if stop.is_set():
+            break
+    ingestor.flush()
+
+    print(json.dumps(ingestor.report(), indent=2))
@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+# Single-event scoring through preallocated per-thread buffers
+#
+# Enabled per model with AnomalyDetectionModel(..., hot_path=True) or for every model with
+# ANOMALY_HOT_PATH=1.
+#
+# Usage:
+#   python hot_path.py bench [login|transaction|all] [--requests 500]
+#
+# The regular detect_anomaly path builds a Python list per event, turns it into a float64 array,
+# lets scaler.transform copy it, and then each predict_proba validates and copies it again (the
+# random forest also spins up its joblib machinery for a single row). Here each thread owns a
+# float64 input row, a float32 model row and an online-model dict per model type. The scaler is
+# applied in place with the stored mean_ and scale_, and the float32 row goes straight to the
+# forest's trees and to Booster.inplace_predict, which both take it without copying.
+#
+# Scores are identical to the regular path: the scaler arithmetic is the same float64 arithmetic,
+# and both backends cast to float32 before predicting.
+
+import os
+import json
+import time
+import shutil
+import tempfile
+import argparse
+import logging
+import threading
+import tracemalloc
+from typing import Dict, Any
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+HOT_PATH_ENV = "ANOMALY_HOT_PATH"
+
+
+def hot_path_enabled() -> bool:
+    """Whether models use the hot path unless told otherwise"""
+    return os.environ.get(HOT_PATH_ENV, "").strip().lower() in ("1", "true", "yes", "on")
+
+
+class RowBuffers(threading.local):
+    """Input, scaled and online-model buffers of one model type, allocated once per thread"""
+
+    def __init__(self, n_features: int):
+        self.raw = np.zeros((1, n_features))
+        self.scaled64 = np.zeros((1, n_features))
+        self.scaled = np.zeros((1, n_features), dtype=np.float32)
+        self.rf_proba = np.zeros(2)
+        self.online_features = {}
+
+
+class HotPathScorer:
+    """
+    Static ensemble members of one loaded model, unpacked for single-row scoring
+    Built from the model's current rf_model, xgb_model and scaler; rebuilt when those change
+    """
+
+    def __init__(self, rf_model, xgb_model, scaler, n_features: int):
+        self.members = (rf_model, xgb_model, scaler)
+        self.buffers = RowBuffers(n_features)
+
+        # No scaler with the isolation backend, whose forest takes the raw row
+        with_mean = scaler is not None and scaler.mean_ is not None and scaler.with_mean
+        with_std = scaler is not None and scaler.scale_ is not None and scaler.with_std
+        self.mean = scaler.mean_ if with_mean else np.zeros(n_features)
+        self.scale = scaler.scale_ if with_std else np.ones(n_features)
+
+        # Per-tree leaf probabilities, normalized exactly as DecisionTreeClassifier.predict_proba does
+        self.trees = None
+        if rf_model is not None and rf_model.n_outputs_ == 1 and rf_model.n_classes_ == 2:
+            self.trees = []
+            for estimator in rf_model.estimators_:
+                proba = estimator.tree_.value[:, 0, :2]
+                normalizer = proba.sum(axis=1)[:, np.newaxis]
+                normalizer[normalizer == 0.0] = 1.0
+                self.trees.append((estimator.tree_, proba / normalizer))
+
+        self.booster = None
+        self.iteration_range = (0, 0)
+        self.missing = np.nan
+        if xgb_model is not None and xgb_model.get_params().get("objective") == "binary:logistic":
+            self.booster = xgb_model.get_booster()
+            self.missing = xgb_model.missing
+            try:
+                self.iteration_range = (0, xgb_model.best_iteration + 1)
+            except AttributeError:
+                pass
+
+    def matches(self, rf_model, xgb_model, scaler) -> bool:
+        return all(a is b for a, b in zip(self.members, (rf_model, xgb_model, scaler)))
+
+    def scale_row(self) -> np.ndarray:
+        """Standardize the thread's raw row in place into its float32 model row"""
+        buffers = self.buffers
+        np.subtract(buffers.raw, self.mean, out=buffers.scaled64)
+        np.divide(buffers.scaled64, self.scale, out=buffers.scaled64)
+        np.copyto(buffers.scaled, buffers.scaled64, casting='same_kind')
+        return buffers.scaled
+
+    # Both probabilities keep the dtype predict_proba gives (float64 for the forest, float32 for
+    # XGBoost), so the ensemble average rounds exactly as it does on the regular path
+
+    def rf_probability(self, scaled: np.ndarray) -> np.float64:
+        """RandomForestClassifier.predict_proba(scaled)[0, 1], summed tree by tree in the same order"""
+        rf_model = self.members[0]
+        if self.trees is None:
+            return rf_model.predict_proba(scaled)[0, 1]
+        proba = self.buffers.rf_proba
+        proba.fill(0.0)
+        for tree, leaf_proba in self.trees:
+            np.add(proba, leaf_proba[tree.apply(scaled)[0]], out=proba)
+        return proba[1] / len(self.trees)
+
+    def xgb_probability(self, scaled: np.ndarray) -> np.float32:
+        """XGBClassifier.predict_proba(scaled)[0, 1] without the sklearn wrapper's validation and copies"""
+        xgb_model = self.members[1]
+        if self.booster is None:
+            return xgb_model.predict_proba(scaled)[0, 1]
+        return self.booster.inplace_predict(scaled, iteration_range=self.iteration_range, missing=self.missing)[0]
+
+
+def _measure(model, features: Dict[str, Any], requests: int) -> Dict[str, Any]:
+    """Latency and tracemalloc allocation figures of model.detect_anomaly over repeated requests"""
+    # Warm up buffers, caches and lazily built structures outside the measurement
+    for _ in range(5):
+        model.detect_anomaly(features)
+
+    started = time.perf_counter()
+    for _ in range(requests):
+        model.detect_anomaly(features)
+    elapsed = time.perf_counter() - started
+
+    tracemalloc.start()
+    try:
+        peaks = []
+        for _ in range(requests):
+            baseline = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            model.detect_anomaly(features)
+            peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+        before = tracemalloc.take_snapshot()
+        for _ in range(requests):
+            model.detect_anomaly(features)
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "latency_us": 1e6 * elapsed / requests,
+        "peak_allocated_bytes_per_request": float(np.mean(peaks)),
+        "retained_bytes_per_request": sum(stat.size_diff for stat in after.compare_to(before, "lineno")) / requests
+    }
+
+
+def bench(model_type: str, requests: int = 500) -> Dict[str, Any]:
+    """
+    Compare the regular and the hot single-event path on the same model
+    The model is writable, as when serving, but learns into a scratch copy of the deployed
+    learned state, so the benchmark requests never reach the deployed online model or per-user stores
+    Returns: per mode, mean latency, mean peak bytes allocated while scoring one request and the
+    net bytes left behind per request; the largest static score difference between the modes; and
+    the time one background save of the learned state takes (see state_persistence.py)
+    """
+    from anomaly_detection_model import AnomalyDetectionModel, MODEL_DIR, learned_state_paths
+    from memory_report import SAMPLE_FEATURES
+
+    with tempfile.TemporaryDirectory() as state_dir:
+        for path in learned_state_paths(model_type):
+            if os.path.exists(path):
+                shutil.copy(path, os.path.join(state_dir, os.path.relpath(path, MODEL_DIR)))
+        model = AnomalyDetectionModel(model_type, state_dir=state_dir)
+        # Saved only when asked below, so no background save lands inside a measurement
+        model.state_saver.stop()
+        try:
+            if not model.is_ready():
+                return {"model_type": model_type, "error": "models are not trained yet"}
+            return _bench_model(model, model_type, SAMPLE_FEATURES[model_type], requests)
+        finally:
+            model.close()
+
+
+def _bench_model(model, model_type: str, features: Dict[str, Any], requests: int) -> Dict[str, Any]:
+    report = {"model_type": model_type, "requests": requests}
+    for mode, hot_path in (("regular", False), ("hot_path", True)):
+        model.hot_path = hot_path
+        report[mode] = _measure(model, features, requests)
+
+    started = time.perf_counter()
+    model.state_saver.save()
+    report["state_save_ms"] = (time.perf_counter() - started) * 1000
+
+    # The online model keeps learning from every request, so compare the static ensemble only
+    online_model, model.online_model = model.online_model, None
+    try:
+        model.hot_path = False
+        regular = model.detect_anomaly(features)["score"]
+        model.hot_path = True
+        report["static_score_difference"] = abs(model.detect_anomaly(features)["score"] - regular)
+    finally:
+        model.online_model = online_model
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Allocation-light single-event scoring")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    bench_parser = subparsers.add_parser("bench", help="Compare allocations and latency with the regular path")
+    bench_parser.add_argument("model_type", nargs="?", choices=["login", "transaction", "all"], default="all")
+    bench_parser.add_argument("--requests", type=int, default=500)
+    args = parser.parse_args()
+
+    model_types = ["login", "transaction"] if args.model_type == "all" else [args.model_type]
+    print(json.dumps([bench(model_type, args.requests) for model_type in model_types], indent=2))
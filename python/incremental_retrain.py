@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+# Warm-start incremental retraining of the static RF/XGB models from confirmed outcomes
+#
+# Usage:
+#   python incremental_retrain.py <model_type> <outcomes.jsonl> [--eval holdout.jsonl] [--dry-run]
+#
+# Each line of the outcomes file is {"model_type": ..., "features": {...}, "label": 0|1}
+# (label may also be given as "is_anomalous"). The candidate models are only promoted
+# if they do at least as well as the current ones on the holdout set.
+
+import os
+import sys
+import copy
+import json
+import time
+import shutil
+import argparse
+import logging
+from datetime import datetime
+from typing import Dict, Any, List, Tuple
+
+import numpy as np
+import joblib
+import xgboost as xgb
+from sklearn.metrics import roc_auc_score, f1_score, precision_score, recall_score
+
+from anomaly_detection_model import AnomalyDetectionModel, DECISION_THRESHOLD, MODEL_DIR, STATIC_MEMBER_WEIGHTS
+from native_artifacts import export_native
+
+logger = logging.getLogger(__name__)
+
+BACKUP_DIR = os.path.join(MODEL_DIR, "backup")
+
+
+def load_outcomes(path: str, model_type: str) -> Tuple[List[Dict[str, Any]], np.ndarray]:
+    """Read confirmed outcomes for one model type"""
+    features_list, labels = [], []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if record.get("model_type", model_type) != model_type:
+                continue
+            label = record.get("label", record.get("is_anomalous"))
+            if label is None:
+                continue
+            features_list.append(record["features"])
+            labels.append(int(bool(label)))
+    return features_list, np.asarray(labels, dtype=int)
+
+
+def _rescale_rf_thresholds(rf_model, old_scaler, new_scaler):
+    """
+    Re-express the split thresholds of already-fitted trees in the new scaler's space
+    (x - m0) / s0 <= t  <=>  (x - m1) / s1 <= (t * s0 + m0 - m1) / s1, so old trees keep their decisions
+    """
+    for estimator in rf_model.estimators_:
+        tree = estimator.tree_
+        split = tree.feature >= 0
+        feature = tree.feature[split]
+        threshold = tree.threshold
+        raw = threshold[split] * old_scaler.scale_[feature] + old_scaler.mean_[feature]
+        # Trees compare float32 inputs, so thresholds sitting exactly on a value (integer features
+        # such as hour) must land on the same float32 grid point after the move
+        threshold[split] = np.float32((raw - new_scaler.mean_[feature]) / new_scaler.scale_[feature])
+
+
+def _rescale_xgb_thresholds(xgb_model, old_scaler, new_scaler):
+    """Same re-expression for the XGBoost booster, through its JSON model"""
+    booster = xgb_model.get_booster()
+    model = json.loads(booster.save_raw("json"))
+    for tree in model["learner"]["gradient_booster"]["model"]["trees"]:
+        left = np.asarray(tree["left_children"])
+        feature = np.asarray(tree["split_indices"])
+        condition = np.asarray(tree["split_conditions"], dtype=float)
+        # Leaves store their value in split_conditions and must not be touched
+        split = left >= 0
+        raw = condition[split] * old_scaler.scale_[feature[split]] + old_scaler.mean_[feature[split]]
+        condition[split] = (raw - new_scaler.mean_[feature[split]]) / new_scaler.scale_[feature[split]]
+        tree["split_conditions"] = condition.tolist()
+    booster.load_model(bytearray(json.dumps(model).encode()))
+
+
+def warm_start_update(model: AnomalyDetectionModel, X: np.ndarray, y: np.ndarray,
+                      add_trees: int = 20, max_trees: int = 100, add_rounds: int = 20,
+                      update_scaler: bool = True) -> Dict[str, Any]:
+    """
+    Build candidate RF, XGB and scaler from the current ones and a batch of labeled rows
+    Returns: dict with the candidate "rf", "xgb" and "scaler"
+    """
+    old_scaler = model.scaler
+    scaler = copy.deepcopy(old_scaler)
+    rf_model = copy.deepcopy(model.rf_model)
+    xgb_model = copy.deepcopy(model.xgb_model)
+
+    if update_scaler:
+        scaler.partial_fit(X)
+        _rescale_rf_thresholds(rf_model, old_scaler, scaler)
+        _rescale_xgb_thresholds(xgb_model, old_scaler, scaler)
+
+    X_scaled = scaler.transform(X)
+
+    # Random forest: grow new trees on the batch, then age out the oldest ones
+    rf_model.set_params(warm_start=True, n_estimators=len(rf_model.estimators_) + add_trees)
+    rf_model.fit(X_scaled, y)
+    if len(rf_model.estimators_) > max_trees:
+        rf_model.estimators_ = rf_model.estimators_[-max_trees:]
+    rf_model.set_params(warm_start=False, n_estimators=len(rf_model.estimators_))
+
+    # XGBoost: continue boosting from the current booster
+    candidate_xgb = xgb.XGBClassifier(**{**xgb_model.get_params(), "n_estimators": add_rounds})
+    candidate_xgb.fit(X_scaled, y, xgb_model=xgb_model.get_booster())
+
+    return {"rf": rf_model, "xgb": candidate_xgb, "scaler": scaler}
+
+
+def evaluate(rf_model, xgb_model, scaler, X: np.ndarray, y: np.ndarray) -> Dict[str, float]:
+    """Holdout metrics of the static ensemble"""
+    X_scaled = scaler.transform(X)
+    prob = (STATIC_MEMBER_WEIGHTS["rf"] * rf_model.predict_proba(X_scaled)[:, 1] +
+            STATIC_MEMBER_WEIGHTS["xgb"] * xgb_model.predict_proba(X_scaled)[:, 1])
+    pred = (prob > DECISION_THRESHOLD).astype(int)
+    metrics = {
+        "precision": float(precision_score(y, pred, zero_division=0)),
+        "recall": float(recall_score(y, pred, zero_division=0)),
+        "f1": float(f1_score(y, pred, zero_division=0)),
+    }
+    metrics["roc_auc"] = float(roc_auc_score(y, prob)) if len(np.unique(y)) == 2 else None
+    return metrics
+
+
+def _is_not_worse(candidate: Dict[str, float], current: Dict[str, float], tolerance: float) -> bool:
+    for metric in ("roc_auc", "f1"):
+        if candidate[metric] is None or current[metric] is None:
+            continue
+        if candidate[metric] < current[metric] - tolerance:
+            return False
+    return True
+
+
+def promote(model: AnomalyDetectionModel, candidate: Dict[str, Any]) -> str:
+    """Back up the current artifacts and atomically replace them with the candidate"""
+    backup_dir = os.path.join(BACKUP_DIR, f"{model.model_type}_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+    os.makedirs(backup_dir, exist_ok=True)
+
+    paths = {"rf": model.rf_model_path, "xgb": model.xgb_model_path, "scaler": model.scaler_path}
+    for name, path in paths.items():
+        if os.path.exists(path):
+            shutil.copy2(path, backup_dir)
+    for name, path in paths.items():
+        tmp_path = path + ".tmp"
+        joblib.dump(candidate[name], tmp_path)
+        os.replace(tmp_path, path)
+    # The loader prefers the native copy, so it has to move with the pickles
+    export_native(model.native_dir, model.model_type, model.feature_names,
+                  candidate["rf"], candidate["xgb"], candidate["scaler"])
+
+    logger.info(f"Promoted incrementally retrained {model.model_type} models (backup in {backup_dir})")
+    return backup_dir
+
+
+def incremental_retrain(model_type: str, outcomes_path: str, eval_path: str = None,
+                        holdout_fraction: float = 0.2, tolerance: float = 0.01, dry_run: bool = False,
+                        seed: int = 42, **update_kwargs) -> Dict[str, Any]:
+    """Update the static models from a batch of confirmed outcomes and promote them if they hold up"""
+    started = time.perf_counter()
+    model = AnomalyDetectionModel(model_type, read_only=True)
+
+    features_list, y = load_outcomes(outcomes_path, model_type)
+    if len(np.unique(y)) < 2:
+        raise ValueError("The outcome batch needs both normal and anomalous examples")
+    X = model._prepare_features_batch(features_list)
+
+    if eval_path:
+        eval_features, y_eval = load_outcomes(eval_path, model_type)
+        X_eval = model._prepare_features_batch(eval_features)
+        X_train, y_train = X, y
+    else:
+        order = np.random.default_rng(seed).permutation(len(y))
+        n_eval = max(1, int(len(y) * holdout_fraction))
+        X_eval, y_eval = X[order[:n_eval]], y[order[:n_eval]]
+        X_train, y_train = X[order[n_eval:]], y[order[n_eval:]]
+
+    # The current models are scored before the candidate is built from copies of them
+    current_metrics = evaluate(model.rf_model, model.xgb_model, model.scaler, X_eval, y_eval)
+
+    update_started = time.perf_counter()
+    candidate = warm_start_update(model, X_train, y_train, **update_kwargs)
+    update_seconds = time.perf_counter() - update_started
+
+    candidate_metrics = evaluate(candidate["rf"], candidate["xgb"], candidate["scaler"], X_eval, y_eval)
+    accepted = _is_not_worse(candidate_metrics, current_metrics, tolerance)
+
+    report = {
+        "model_type": model_type,
+        "train_rows": int(len(y_train)),
+        "eval_rows": int(len(y_eval)),
+        "current": current_metrics,
+        "candidate": candidate_metrics,
+        "rf_trees": len(candidate["rf"].estimators_),
+        "xgb_rounds": candidate["xgb"].get_booster().num_boosted_rounds(),
+        "accepted": accepted,
+        "promoted": False,
+        "update_seconds": update_seconds
+    }
+
+    if accepted and not dry_run:
+        report["backup_dir"] = promote(model, candidate)
+        report["promoted"] = True
+    elif not accepted:
+        logger.warning(f"Candidate {model_type} models rejected: {candidate_metrics} vs current {current_metrics}")
+
+    report["total_seconds"] = time.perf_counter() - started
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Warm-start retraining of the static anomaly models")
+    parser.add_argument("model_type", choices=["login", "transaction"])
+    parser.add_argument("outcomes", help="JSON-lines file of confirmed outcomes")
+    parser.add_argument("--eval", default=None, help="Separate JSON-lines holdout (default: split the batch)")
+    parser.add_argument("--holdout-fraction", type=float, default=0.2)
+    parser.add_argument("--add-trees", type=int, default=20, help="New random forest trees per run")
+    parser.add_argument("--max-trees", type=int, default=100, help="Oldest trees beyond this count are dropped")
+    parser.add_argument("--add-rounds", type=int, default=20, help="Additional XGBoost boosting rounds per run")
+    parser.add_argument("--keep-scaler", action="store_true", help="Do not partial_fit the scaler")
+    parser.add_argument("--tolerance", type=float, default=0.01, help="Allowed drop in ROC AUC / F1")
+    parser.add_argument("--dry-run", action="store_true", help="Evaluate the candidate without promoting it")
+    args = parser.parse_args()
+
+    try:
+        report = incremental_retrain(
+            args.model_type, args.outcomes, eval_path=args.eval, holdout_fraction=args.holdout_fraction,
+            tolerance=args.tolerance, dry_run=args.dry_run, add_trees=args.add_trees,
+            max_trees=args.max_trees, add_rounds=args.add_rounds, update_scaler=not args.keep_scaler
+        )
+    except Exception as e:
+        logger.error(f"Incremental retraining failed: {str(e)}", exc_info=True)
+        print(json.dumps({"error": str(e)}))
+        sys.exit(1)
+
+    print(json.dumps(report, indent=2))
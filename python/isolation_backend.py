@@ -0,0 +1,342 @@
+#!/usr/bin/env python
+# Unsupervised IsolationForest backend trained on unlabelled recorded traffic
+#
+# Usage:
+#   python isolation_backend.py <login|transaction> <corpus> [<corpus> ...] [--max-samples 256]
+#                               [--trees 100] [--contamination 0.02] [--dry-run]
+#
+# A corpus is read as traffic_replay.py reads it: an anomaly detection log or a JSON-lines export
+# of {"model_type": ..., "features": {...}}. No labels are needed. The script fits the forest,
+# saves it next to the static models and prints training time, per-row latency and artifact size
+# next to the RF + XGBoost pair.
+#
+# Scoring uses the backend chosen with AnomalyDetectionModel(..., backend=...) or ANOMALY_BACKEND:
+#   supervised  rf + xgb (default)
+#   isolation   iforest only; the RF, XGBoost and scaler artifacts are not loaded
+#   hybrid      rf + xgb + iforest
+#
+# The forest's anomaly score (sklearn's -score_samples, about 0.5 for ordinary events and up to 1)
+# is mapped onto the ensemble's probability scale with a piecewise-linear curve fitted on the
+# training traffic: its lowest score maps to 0, its median to 0.35, and the score exceeded by the
+# `contamination` share of it to 0.7, the ensemble's decision threshold, with 1 mapping to 1. So used
+# alone, the backend flags about that share of traffic like the training corpus.
+#
+# The forest runs on the raw feature matrix; isolation splits do not depend on feature scale, so a
+# refitted scaler never invalidates it. Trees are scored by walking all of them at once over
+# flattened node arrays, which gives sklearn's scores without its per-tree Python loop.
+
+import os
+import sys
+import json
+import time
+import argparse
+import logging
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+
+import numpy as np
+import joblib
+from sklearn.ensemble import IsolationForest
+
+logger = logging.getLogger(__name__)
+
+BACKEND_ENV = "ANOMALY_BACKEND"
+
+# Static members scored by each backend
+BACKENDS = {
+    "supervised": ("rf", "xgb"),
+    "isolation": ("iforest",),
+    "hybrid": ("rf", "xgb", "iforest")
+}
+
+DEFAULT_MAX_SAMPLES = 256
+DEFAULT_TREES = 100
+DEFAULT_CONTAMINATION = 0.02
+DECISION_THRESHOLD = 0.7
+
+# Probabilities at the lowest, median and (1 - contamination) training scores and at score 1
+ANCHOR_PROBABILITIES = np.array([0.0, 0.35, DECISION_THRESHOLD, 1.0])
+
+# Rows walked through the trees at once; keeps the (rows, trees) node index arrays in cache
+SCORE_CHUNK_ROWS = 256
+
+
+def default_backend() -> str:
+    """Backend of models that do not choose one, from ANOMALY_BACKEND"""
+    value = os.environ.get(BACKEND_ENV, "").strip().lower()
+    if not value:
+        return "supervised"
+    if value not in BACKENDS:
+        logger.warning(f"Ignoring unknown {BACKEND_ENV}={value!r}")
+        return "supervised"
+    return value
+
+
+def average_path_length(n_samples: np.ndarray) -> np.ndarray:
+    """Expected path length of an unsuccessful search in a binary tree of n samples (as sklearn computes it)"""
+    n_samples = np.asarray(n_samples, dtype=float)
+    result = np.zeros(n_samples.shape)
+    result[n_samples == 2] = 1.0
+    larger = n_samples > 2
+    result[larger] = (2.0 * (np.log(n_samples[larger] - 1.0) + np.euler_gamma)
+                      - 2.0 * (n_samples[larger] - 1.0) / n_samples[larger])
+    return result
+
+
+class IsolationMember:
+    """A fitted IsolationForest with its probability calibration, scored through flattened trees"""
+
+    def __init__(self, forest: IsolationForest, feature_names: List[str], anchors: np.ndarray,
+                 feature_scale: np.ndarray, trained_rows: int):
+        if forest.max_features != 1.0:
+            raise ValueError("IsolationMember needs a forest fitted on every feature (max_features=1.0)")
+        self.forest = forest
+        self.feature_names = list(feature_names)
+        self.anchors = anchors
+        # Standard deviation of each training feature (1 where constant), as StandardScaler.scale_
+        # would give; the login baseline measures distances in these units without the static scaler
+        self.feature_scale = feature_scale
+        self.trained_rows = trained_rows
+        self.trained_at = datetime.now().isoformat()
+        self._flatten()
+
+    def __getstate__(self):
+        # The node arrays are rebuilt on load rather than stored twice in the artifact
+        state = self.__dict__.copy()
+        for name in ("_children", "_feature", "_threshold", "_path", "_roots"):
+            state.pop(name, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._flatten()
+
+    def _flatten(self):
+        """
+        Concatenate every tree into one set of node arrays
+        Leaves point back to themselves, so walking max_depth steps from the roots lands every row on
+        its leaf in each tree; _path holds each leaf's path length as sklearn counts it
+        """
+        children, feature, threshold, path, roots = [], [], [], [], []
+        offset = 0
+        for estimator in self.forest.estimators_:
+            tree = estimator.tree_
+            nodes = np.arange(tree.node_count)
+            leaf = tree.children_left < 0
+            left = np.where(leaf, nodes, tree.children_left) + offset
+            right = np.where(leaf, nodes, tree.children_right) + offset
+            children.append(np.column_stack([left, right]).ravel())
+            feature.append(np.where(leaf, 0, tree.feature))
+            threshold.append(np.where(leaf, np.inf, tree.threshold))
+            path.append(tree.compute_node_depths() + average_path_length(tree.n_node_samples) - 1.0)
+            roots.append(offset)
+            offset += tree.node_count
+
+        self._children = np.concatenate(children).astype(np.intp)
+        self._feature = np.concatenate(feature).astype(np.intp)
+        self._threshold = np.concatenate(threshold)
+        self._path = np.concatenate(path)
+        self._roots = np.array(roots, dtype=np.intp)
+        self._max_depth = max(estimator.tree_.max_depth for estimator in self.forest.estimators_)
+        self._denominator = len(self._roots) * float(average_path_length(np.array([self.forest.max_samples_]))[0])
+
+    def anomaly_scores(self, model_features: np.ndarray) -> np.ndarray:
+        """IsolationForest anomaly score of every row (-score_samples: higher is more anomalous)"""
+        # The trees compare float32 inputs, as sklearn's do
+        X = np.asarray(model_features, dtype=np.float32)
+        scores = np.empty(len(X))
+        for lo in range(0, len(X), SCORE_CHUNK_ROWS):
+            rows = X[lo:lo + SCORE_CHUNK_ROWS]
+            row_index = np.arange(len(rows))[:, np.newaxis]
+            node = np.broadcast_to(self._roots, (len(rows), len(self._roots)))
+            for _ in range(self._max_depth):
+                go_right = rows[row_index, self._feature[node]] > self._threshold[node]
+                node = self._children[2 * node + go_right]
+            depths = self._path[node].sum(axis=1)
+            if self._denominator > 0:
+                scores[lo:lo + len(rows)] = 2 ** (-depths / self._denominator)
+            else:
+                scores[lo:lo + len(rows)] = 1.0
+        return scores
+
+    def predict_proba(self, model_features: np.ndarray) -> np.ndarray:
+        """Anomaly probability of every row on the ensemble's 0-1 scale"""
+        return np.interp(self.anomaly_scores(model_features), self.anchors, ANCHOR_PROBABILITIES)
+
+
+def fit_anchors(scores: np.ndarray, contamination: float) -> np.ndarray:
+    """Raw anomaly scores that map to ANCHOR_PROBABILITIES, strictly increasing"""
+    anchors = np.append(np.quantile(scores, [0.0, 0.5, 1.0 - contamination]), 1.0)
+    anchors = np.maximum.accumulate(anchors)
+    for i in range(1, len(anchors)):
+        if anchors[i] <= anchors[i - 1]:
+            anchors[i] = np.nextafter(anchors[i - 1], np.inf)
+    return anchors
+
+
+def train_isolation_member(model_features: np.ndarray, feature_names: List[str],
+                           max_samples: int = DEFAULT_MAX_SAMPLES, n_estimators: int = DEFAULT_TREES,
+                           contamination: float = DEFAULT_CONTAMINATION, random_state: int = 42) -> IsolationMember:
+    """Fit a forest on unlabelled events and calibrate its scores on the same events"""
+    forest = IsolationForest(
+        n_estimators=n_estimators, max_samples=min(max_samples, len(model_features)),
+        max_features=1.0, random_state=random_state
+    )
+    forest.fit(model_features)
+    scale = model_features.std(axis=0)
+    scale[scale == 0.0] = 1.0
+    member = IsolationMember(forest, feature_names, np.zeros(len(ANCHOR_PROBABILITIES)), scale, len(model_features))
+    member.anchors = fit_anchors(member.anomaly_scores(model_features), contamination)
+    return member
+
+
+def save_member(member: IsolationMember, path: str):
+    """Write the member atomically; readers only ever see complete files"""
+    joblib.dump(member, path + ".tmp")
+    os.replace(path + ".tmp", path)
+
+
+def load_member(path: str) -> Optional[IsolationMember]:
+    """The saved member, or None if there is none or it cannot be read"""
+    if not os.path.exists(path):
+        return None
+    try:
+        return joblib.load(path)
+    except Exception as e:
+        logger.error(f"Error loading IsolationForest model from {path}: {str(e)}", exc_info=True)
+        return None
+
+
+def _per_row_us(fn, X: np.ndarray, single_rows: int = 200) -> Dict[str, float]:
+    """Mean latency of fn on single rows and per row of the whole matrix, in microseconds"""
+    rows = X[:single_rows]
+    fn(rows[:1])
+    started = time.perf_counter()
+    for i in range(len(rows)):
+        fn(rows[i:i + 1])
+    single = (time.perf_counter() - started) / len(rows)
+    started = time.perf_counter()
+    fn(X)
+    batched = (time.perf_counter() - started) / len(X)
+    return {"single_row_us": 1e6 * single, "batched_per_row_us": 1e6 * batched}
+
+
+def compare_with_supervised(model, member: IsolationMember, X: np.ndarray, fit_seconds: float,
+                            member_path: str, contamination: float) -> Dict[str, Any]:
+    """
+    Training time, per-row latency, artifact size and flag rate of the forest next to the RF + XGBoost pair
+    The pair is refitted on the same rows only to time it; its labels are the current ensemble's top
+    `contamination` share, since the corpus has none
+    """
+    import xgboost as xgb
+    from sklearn.ensemble import RandomForestClassifier
+
+    iforest_proba = member.predict_proba(X)
+    report = {
+        "rows": int(len(X)),
+        "iforest": {
+            "fit_s": fit_seconds,
+            **_per_row_us(member.predict_proba, X),
+            "sklearn_score_samples": _per_row_us(member.forest.score_samples, X),
+            "artifact_bytes": os.path.getsize(member_path) if os.path.exists(member_path) else None,
+            "flag_rate": float(np.mean(iforest_proba > DECISION_THRESHOLD)),
+            "max_abs_difference_from_sklearn": float(np.max(np.abs(
+                member.anomaly_scores(X) + member.forest.score_samples(X)
+            )))
+        }
+    }
+
+    if model.rf_model is None or model.xgb_model is None or model.scaler is None:
+        report["rf_xgb"] = {"error": "the RF and XGBoost models are not loaded"}
+        return report
+
+    def supervised_proba(rows):
+        scaled = model.scaler.transform(rows)
+        return model._static_ensemble({
+            "rf": model.rf_model.predict_proba(scaled)[:, 1],
+            "xgb": model.xgb_model.predict_proba(scaled)[:, 1]
+        })
+
+    supervised = supervised_proba(X)
+    labels = (supervised >= np.quantile(supervised, 1.0 - contamination)).astype(int)
+    if labels.min() == labels.max():
+        labels[np.argmax(supervised)] = 1 - labels[0]
+    scaled = model.scaler.transform(X)
+    started = time.perf_counter()
+    RandomForestClassifier(n_estimators=100, random_state=42).fit(scaled, labels)
+    xgb.XGBClassifier(n_estimators=100, random_state=42).fit(scaled, labels)
+    refit_seconds = time.perf_counter() - started
+
+    report["rf_xgb"] = {
+        "fit_s": refit_seconds,
+        **_per_row_us(supervised_proba, X),
+        "artifact_bytes": sum(os.path.getsize(model.artifact_paths()[name]) for name in ("rf", "xgb", "scaler")),
+        "flag_rate": float(np.mean(supervised > DECISION_THRESHOLD))
+    }
+    flagged = supervised > DECISION_THRESHOLD
+    report["agreement"] = {
+        "both_flag": int(np.sum(flagged & (iforest_proba > DECISION_THRESHOLD))),
+        "score_correlation": float(np.corrcoef(supervised, iforest_proba)[0, 1]) if len(X) > 1 else None
+    }
+    return report
+
+
+def train_from_corpus(model_type: str, corpus_paths: List[str], max_samples: int = DEFAULT_MAX_SAMPLES,
+                      n_estimators: int = DEFAULT_TREES, contamination: float = DEFAULT_CONTAMINATION,
+                      dry_run: bool = False) -> Dict[str, Any]:
+    """Fit the forest on recorded events of one model type, save it and compare it with RF + XGBoost"""
+    from anomaly_detection_model import AnomalyDetectionModel
+    from traffic_replay import load_corpus
+
+    events = [features for _, features in load_corpus(corpus_paths, model_type)]
+    if len(events) < 2:
+        return {"model_type": model_type, "error": f"need at least 2 {model_type} events, found {len(events)}"}
+
+    model = AnomalyDetectionModel(model_type, read_only=True, backend="supervised")
+    X = model._prepare_features_batch(events)
+
+    started = time.perf_counter()
+    member = train_isolation_member(X, model.feature_names, max_samples, n_estimators, contamination)
+    fit_seconds = time.perf_counter() - started
+
+    path = model.iforest_model_path
+    if not dry_run:
+        save_member(member, path)
+        logger.info(f"Saved {model_type} IsolationForest trained on {len(X)} events to {path}")
+    else:
+        # Measure the artifact size without replacing the deployed one
+        path = path + ".dry-run"
+        save_member(member, path)
+
+    try:
+        report = compare_with_supervised(model, member, X, fit_seconds, path, contamination)
+    finally:
+        if dry_run:
+            os.remove(path)
+    return {"model_type": model_type, "saved": not dry_run, "max_samples": int(member.forest.max_samples_),
+            "trees": n_estimators, "contamination": contamination, **report}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train the unsupervised IsolationForest backend")
+    parser.add_argument("model_type", choices=["login", "transaction"])
+    parser.add_argument("corpus", nargs="+", help="Anomaly detection log(s) or JSON-lines export(s)")
+    parser.add_argument("--max-samples", type=int, default=DEFAULT_MAX_SAMPLES, help="Events drawn per tree")
+    parser.add_argument("--trees", type=int, default=DEFAULT_TREES)
+    parser.add_argument("--contamination", type=float, default=DEFAULT_CONTAMINATION,
+                        help="Share of the training traffic placed above the decision threshold")
+    parser.add_argument("--dry-run", action="store_true", help="Report without replacing the saved forest")
+    args = parser.parse_args()
+
+    # Build the member through the importable module so the artifact pickles as
+    # isolation_backend.IsolationMember rather than __main__.IsolationMember
+    import isolation_backend
+
+    try:
+        result = isolation_backend.train_from_corpus(args.model_type, args.corpus, args.max_samples, args.trees,
+                                   args.contamination, args.dry_run)
+    except Exception as e:
+        logger.error(f"IsolationForest training failed: {str(e)}", exc_info=True)
+        print(json.dumps({"error": str(e)}))
+        sys.exit(1)
+    print(json.dumps(result, indent=2))
@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+# Robust keystroke-dynamics statistics and bounded per-user typing profiles
+
+import os
+import logging
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Sequence
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Statistics computed for every keystroke timing sequence (timings are in ms)
+KEYSTROKE_STATS = [
+    'count',
+    'median',
+    'iqr',
+    'trimmed_mean',
+    'trimmed_variance',
+    'pause_count',
+    'pause_ratio',
+    'burst_rate'
+]
+
+# Statistics that make up a user's typing profile
+PROFILE_STATS = ['median', 'iqr', 'trimmed_mean', 'pause_ratio', 'burst_rate']
+_PROFILE_INDEX = [KEYSTROKE_STATS.index(name) for name in PROFILE_STATS]
+
+PAUSE_THRESHOLD_MS = 1000.0   # gaps longer than this are pauses, not typing rhythm
+BURST_THRESHOLD_MS = 100.0    # gaps shorter than this belong to a typing burst
+TRIM_FRACTION = 0.1           # fraction trimmed from each end for the trimmed statistics
+MIN_TRIM_LENGTH = 4           # from this length on at least one value is trimmed from each end
+
+
+def keystroke_statistics_batch(timings_list: Sequence[Optional[Sequence[float]]]) -> np.ndarray:
+    """
+    Compute KEYSTROKE_STATS for many timing sequences in one vectorized pass
+    Returns: array of shape (len(timings_list), len(KEYSTROKE_STATS))
+    """
+    n = len(timings_list)
+    lengths = np.fromiter((len(t) if t is not None else 0 for t in timings_list), dtype=np.int64, count=n)
+    width = max(int(lengths.max()) if n else 0, 1)
+
+    # Ragged sequences become one NaN-padded matrix
+    matrix = np.full((n, width), np.nan)
+    if lengths.sum() > 0:
+        valid = np.arange(width) < lengths[:, None]
+        matrix[valid] = np.concatenate([np.asarray(t, dtype=float) for t in timings_list if t is not None and len(t)])
+
+    # NaN padding sorts to the end of each row
+    ordered = np.sort(matrix, axis=1)
+    rows = np.arange(n)
+    last = np.maximum(lengths - 1, 0)
+
+    def quantile(q):
+        position = last * q
+        lower = np.floor(position).astype(np.int64)
+        upper = np.ceil(position).astype(np.int64)
+        fraction = position - lower
+        return ordered[rows, lower] + fraction * (ordered[rows, upper] - ordered[rows, lower])
+
+    median = quantile(0.5)
+    iqr = quantile(0.75) - quantile(0.25)
+
+    # Trimmed statistics drop the same number of values from each end of the sorted row; short
+    # sequences, where TRIM_FRACTION rounds down to nothing, still lose their extremes
+    trim = np.floor(lengths * TRIM_FRACTION).astype(np.int64)
+    trim = np.maximum(trim, (lengths >= MIN_TRIM_LENGTH).astype(np.int64))
+    columns = np.arange(width)
+    kept = (columns >= trim[:, None]) & (columns < (lengths - trim)[:, None])
+    kept_count = np.maximum(kept.sum(axis=1), 1)
+    trimmed = np.where(kept, ordered, 0.0)
+    trimmed_mean = trimmed.sum(axis=1) / kept_count
+    trimmed_variance = (np.where(kept, ordered - trimmed_mean[:, None], 0.0) ** 2).sum(axis=1) / kept_count
+
+    with np.errstate(invalid='ignore'):
+        pause_count = (matrix > PAUSE_THRESHOLD_MS).sum(axis=1)
+        burst_count = (matrix < BURST_THRESHOLD_MS).sum(axis=1)
+    safe_lengths = np.maximum(lengths, 1)
+
+    stats = np.column_stack([
+        lengths,
+        median,
+        iqr,
+        trimmed_mean,
+        trimmed_variance,
+        pause_count,
+        pause_count / safe_lengths,
+        burst_count / safe_lengths
+    ]).astype(float)
+
+    # Sequences too short to have a rhythm get all-zero statistics (as np.var did before)
+    stats[lengths < 2, 1:] = 0.0
+    return stats
+
+
+def keystroke_statistics(timings: Optional[Sequence[float]]) -> Dict[str, float]:
+    """Compute KEYSTROKE_STATS for a single timing sequence"""
+    return dict(zip(KEYSTROKE_STATS, keystroke_statistics_batch([timings])[0].tolist()))
+
+
+class KeystrokeProfileStore:
+    """
+    Bounded per-user typing profiles with O(1) incremental updates
+
+    Each user keeps an exponentially weighted mean and variance of PROFILE_STATS.
+    Memory per user is fixed and the least recently seen users are evicted first.
+    With a journal (a state_persistence.UpdateLog) every update is also recorded there, so other
+    processes' updates are merged rather than overwritten when the profiles are persisted.
+    """
+
+    def __init__(self, max_users: int = 10000, alpha: float = 0.1, min_history: int = 3):
+        self.max_users = max_users
+        self.alpha = alpha
+        self.min_history = min_history
+        # str(user_id) -> (count, array of shape (2, len(PROFILE_STATS)) holding mean and variance)
+        self._profiles = OrderedDict()
+        # Snapshot generation (see state_persistence.py) and where updates are recorded
+        self.generation = 0
+        self.journal = None
+
+    def __len__(self):
+        return len(self._profiles)
+
+    def deviation(self, user_id: str, stats: np.ndarray) -> Optional[float]:
+        """
+        Compare one row of KEYSTROKE_STATS with the user's profile
+        Returns: mean absolute z-score, or None until the user has enough history
+        """
+        entry = self._profiles.get(str(user_id))
+        if entry is None or entry[0] < self.min_history:
+            return None
+
+        mean, variance = entry[1]
+        values = stats[_PROFILE_INDEX]
+        # The relative floor keeps near-constant statistics from producing huge z-scores
+        scale = np.sqrt(variance) + 0.1 * np.abs(mean) + 1e-9
+        return float(np.mean(np.abs(values - mean) / scale))
+
+    def update(self, user_id: str, stats: np.ndarray):
+        """Fold one row of KEYSTROKE_STATS into the user's profile"""
+        user_id = str(user_id)
+        values = stats[_PROFILE_INDEX]
+        self._fold(user_id, values)
+        if self.journal is not None:
+            self.journal.record([user_id, values.tolist()])
+
+    def replay(self, entry: List[Any]):
+        """Apply an update recorded in the journal"""
+        user_id, values = entry
+        self._fold(str(user_id), np.asarray(values, dtype=float))
+
+    def _fold(self, user_id: str, values: np.ndarray):
+        entry = self._profiles.get(user_id)
+
+        if entry is None:
+            profile = np.zeros((2, len(PROFILE_STATS)))
+            profile[0] = values
+            self._profiles[user_id] = (1, profile)
+            if len(self._profiles) > self.max_users:
+                self._profiles.popitem(last=False)
+            return
+
+        count, profile = entry
+        # Exponentially weighted mean and variance (West's incremental form)
+        delta = values - profile[0]
+        profile[0] += self.alpha * delta
+        profile[1] = (1 - self.alpha) * (profile[1] + self.alpha * delta * delta)
+        self._profiles[user_id] = (count + 1, profile)
+        self._profiles.move_to_end(user_id)
+
+    def observe(self, user_id: str, stats: np.ndarray) -> Optional[float]:
+        """Score against the current profile, then learn from the same login"""
+        deviation = self.deviation(user_id, stats)
+        self.update(user_id, stats)
+        return deviation
+
+    def observe_batch(self, user_ids: List[Optional[str]], stats: np.ndarray) -> List[Optional[float]]:
+        """observe() for each row of a KEYSTROKE_STATS matrix; rows without a user are skipped"""
+        return [
+            self.observe(str(user_id), row) if user_id else None
+            for user_id, row in zip(user_ids, stats)
+        ]
+
+    def save(self, path: str):
+        """Write all profiles to a .npz snapshot, oldest first"""
+        user_ids = list(self._profiles.keys())
+        counts = np.array([entry[0] for entry in self._profiles.values()], dtype=np.int64)
+        profiles = (np.stack([entry[1] for entry in self._profiles.values()])
+                    if user_ids else np.zeros((0, 2, len(PROFILE_STATS))))
+
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, user_ids=np.array(user_ids, dtype=str), counts=counts, profiles=profiles,
+                     generation=np.int64(self.generation))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str, **kwargs) -> "KeystrokeProfileStore":
+        """Load a snapshot written by save(), or start empty if there is none"""
+        store = cls(**kwargs)
+        if not os.path.exists(path):
+            return store
+
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                for user_id, count, profile in zip(data['user_ids'], data['counts'], data['profiles']):
+                    store._profiles[str(user_id)] = (int(count), profile.copy())
+                store.generation = int(data['generation']) if 'generation' in data.files else 0
+            while len(store._profiles) > store.max_users:
+                store._profiles.popitem(last=False)
+        except Exception as e:
+            logger.error(f"Error loading keystroke profiles from {path}: {str(e)}. Starting empty.")
+            store._profiles.clear()
+            store.generation = 0
+        return store
@@ -9,9 +9,9 @@ import numpy as np
 from datetime import datetime
 import logging
 import joblib
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.preprocessing import StandardScaler
-import xgboost as xgb
+from build_models import ModelsNotReady, start_background_build, training_in_progress
+from rule_engine import columns_from_features, get_rules
+from request_profiler import profiled
 
 # Configure logging
 logging.basicConfig(
@@ -32,99 +32,30 @@ SCALER_PATH = "models/login_scaler.pkl"
 # Create models directory if it doesn't exist
 os.makedirs("models", exist_ok=True)
 
-def train_initial_models():
-    """
-    Train initial models if they don't exist
-    """
-    try:
-        # Create synthetic data for initial training
-        n_samples = 1000
-        
-        # Generate normal behavior data (80% of samples)
-        normal_samples = int(n_samples * 0.8)
-        anomaly_samples = n_samples - normal_samples
-        
-        # Features: typing_speed, cursor_movements, session_duration, hour, latitude, longitude, keystroke_variance
-        normal_data = np.random.rand(normal_samples, 7)
-        # Normalize to realistic ranges
-        normal_data[:, 0] *= 10  # typing_speed: 0-10 chars/sec
-        normal_data[:, 1] *= 100  # cursor_movements: 0-100 movements
-        normal_data[:, 2] = normal_data[:, 2] * 120 + 30  # session_duration: 30-150 seconds
-        normal_data[:, 3] = np.random.randint(8, 20, size=normal_samples)  # hour: 8am-8pm
-        normal_data[:, 4] = np.random.uniform(10, 40, size=normal_samples)  # latitude: 10-40
-        normal_data[:, 5] = np.random.uniform(70, 100, size=normal_samples)  # longitude: 70-100
-        normal_data[:, 6] = np.random.uniform(0.01, 0.2, size=normal_samples)  # keystroke_variance: 0.01-0.2 seconds
-        
-        # Generate anomaly data (20% of samples)
-        anomaly_data = np.random.rand(anomaly_samples, 7)
-        # Make anomalies more extreme
-        anomaly_data[:, 0] = np.random.choice([0.5, 15], size=anomaly_samples)  # very slow or very fast typing
-        anomaly_data[:, 1] = np.random.choice([5, 200], size=anomaly_samples)  # very few or many cursor movements
-        anomaly_data[:, 2] = np.random.choice([10, 300], size=anomaly_samples)  # very short or long sessions
-        anomaly_data[:, 3] = np.random.choice([1, 3, 23], size=anomaly_samples)  # unusual hours (night)
-        anomaly_data[:, 4] = np.random.uniform(-90, 90, size=anomaly_samples)  # random latitudes
-        anomaly_data[:, 5] = np.random.uniform(-180, 180, size=anomaly_samples)  # random longitudes
-        anomaly_data[:, 6] = np.random.uniform(0.5, 2.0, size=anomaly_samples)  # high keystroke variance
-        
-        # Combine data and create labels
-        X = np.vstack([normal_data, anomaly_data])
-        y = np.hstack([np.zeros(normal_samples), np.ones(anomaly_samples)])
-        
-        # Shuffle the data
-        indices = np.arange(n_samples)
-        np.random.shuffle(indices)
-        X = X[indices]
-        y = y[indices]
-        
-        # Create and fit the scaler
-        scaler = StandardScaler()
-        X_scaled = scaler.fit_transform(X)
-        
-        # Train Random Forest model
-        rf_model = RandomForestClassifier(n_estimators=100, random_state=42)
-        rf_model.fit(X_scaled, y)
-        
-        # Train XGBoost model
-        xgb_model = xgb.XGBClassifier(n_estimators=100, random_state=42)
-        xgb_model.fit(X_scaled, y)
-        
-        # Save models
-        joblib.dump(rf_model, RF_MODEL_PATH)
-        joblib.dump(xgb_model, XGB_MODEL_PATH)
-        joblib.dump(scaler, SCALER_PATH)
-        
-        logger.info("Initial models trained and saved successfully")
-        
-        return rf_model, xgb_model, scaler
-    
-    except Exception as e:
-        logger.error(f"Error training initial models: {str(e)}", exc_info=True)
-        raise
-
 def load_or_train_models():
     """
-    Load existing models or train new ones if they don't exist
+    Load existing models
+    Missing or corrupt artifacts are rebuilt by a single background job (see build_models.py);
+    until then ModelsNotReady is raised and the caller falls back to heuristics
     """
     try:
         if (os.path.exists(RF_MODEL_PATH) and 
             os.path.exists(XGB_MODEL_PATH) and 
-            os.path.exists(SCALER_PATH)):
+            os.path.exists(SCALER_PATH) and
+            not training_in_progress("login")):
             
             logger.info("Loading existing models")
             rf_model = joblib.load(RF_MODEL_PATH)
             xgb_model = joblib.load(XGB_MODEL_PATH)
             scaler = joblib.load(SCALER_PATH)
-        else:
-            logger.info("Training new models")
-            rf_model, xgb_model, scaler = train_initial_models()
-            
-        return rf_model, xgb_model, scaler
+            return rf_model, xgb_model, scaler
     
     except Exception as e:
         logger.error(f"Error loading models: {str(e)}", exc_info=True)
-        # Train new models as fallback
-        logger.info("Training new models as fallback")
-        return train_initial_models()
+    
+    if start_background_build("login"):
+        logger.info("Training new models in the background")
+    raise ModelsNotReady("Login models are not available yet")
 
 def detect_login_anomaly(features):
     """
@@ -133,9 +64,6 @@ def detect_login_anomaly(features):
     try:
         logger.info(f"Starting login anomaly detection with features: {features}")
         
-        # Load or train models
-        rf_model, xgb_model, scaler = load_or_train_models()
-        
         # Extract features
         user_id = features.get('user_id')
         typing_speed = features.get('typing_speed')
@@ -157,6 +85,16 @@ def detect_login_anomaly(features):
         except:
             hour = datetime.now().hour
         
+        # Inputs of the anomaly-type and fallback rules (missing values never match a rule)
+        rule_columns = columns_from_features(
+            {'typing_speed': typing_speed, 'session_duration': session_duration, 'hour': hour,
+             'keystroke_variance': keystroke_variance},
+            ['typing_speed', 'session_duration', 'hour', 'keystroke_variance']
+        )
+        
+        # Load models (raises ModelsNotReady while they are being built)
+        rf_model, xgb_model, scaler = load_or_train_models()
+        
         # Prepare features for the model
         model_features = np.array([
             typing_speed if typing_speed is not None else 0,
@@ -187,19 +125,8 @@ def detect_login_anomaly(features):
         logger.info(f"Model predictions - RF: {rf_pred} ({rf_prob:.3f}), XGB: {xgb_pred} ({xgb_prob:.3f}), Ensemble: {ensemble_pred} ({ensemble_prob:.3f})")
         
         # Determine anomaly type based on feature analysis
-        anomaly_type = None
-        if ensemble_pred == 1:
-            # Analyze which features contributed most to the anomaly
-            if typing_speed is not None and (typing_speed < 1 or typing_speed > 12):
-                anomaly_type = "Unusual typing pattern"
-            elif session_duration is not None and session_duration < 10:
-                anomaly_type = "Unusually quick login"
-            elif hour >= 0 and hour <= 5:
-                anomaly_type = "Unusual login time (night)"
-            elif keystroke_variance > 0.5:
-                anomaly_type = "Inconsistent typing rhythm"
-            else:
-                anomaly_type = "Suspicious login behavior"
+        # Analyze which features contributed most to the anomaly (rules in anomaly_rules.json)
+        anomaly_type = get_rules("login").anomaly_types(rule_columns, [ensemble_pred == 1])[0]
         
         # Update models with this data point (online learning)
         # In a real system, you would want to confirm if this was actually an anomaly
@@ -217,33 +144,13 @@ def detect_login_anomaly(features):
     except Exception as e:
         logger.error(f"Error in login anomaly detection: {str(e)}", exc_info=True)
         
-        # Fall back to a simple heuristic approach
-        anomaly_score = 0.0
-        anomaly_type = None
-        
-        # Check typing speed (if unusually slow or fast)
-        if typing_speed is not None:
-            if typing_speed < 1 or typing_speed > 12:
-                anomaly_score += 0.3
-                anomaly_type = "Unusual typing pattern"
-        
-        # Check session duration (if too quick)
-        if session_duration is not None and session_duration < 10:
-            anomaly_score += 0.4
-            anomaly_type = anomaly_type or "Unusually quick login"
-        
-        # Check login time (if unusual for this user)
-        if hour >= 0 and hour <= 5:
-            anomaly_score += 0.3
-            anomaly_type = anomaly_type or "Unusual login time (night)"
-        
-        # Determine if this is an anomaly
-        is_anomalous = anomaly_score >= 0.7
+        # Fall back to the heuristic rules (see anomaly_rules.json)
+        fallback = get_rules("login").fallback(rule_columns)
         
         result = {
-            "is_anomalous": is_anomalous,
-            "anomaly_type": anomaly_type if is_anomalous else None,
-            "score": anomaly_score
+            "is_anomalous": bool(fallback["is_anomalous"][0]),
+            "anomaly_type": fallback["anomaly_type"][0],
+            "score": float(fallback["score"][0])
         }
         
         logger.info(f"Fallback anomaly detection result: {result}")
@@ -255,7 +162,8 @@ if __name__ == "__main__":
     features = json.loads(features_json)
     
     # Detect anomalies
-    result = detect_login_anomaly(features)
+    with profiled("cli.detect_login_anomaly", "login", [features]):
+        result = detect_login_anomaly(features)
     
     # Output result as JSON
     print(json.dumps(result))
@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+# Memory footprint accounting and budgets for the loaded anomaly detection models
+#
+# Usage:
+#   python memory_report.py [login|transaction|all] [--budget-mb 512]
+
+import os
+import sys
+import json
+import argparse
+import resource
+import tracemalloc
+from typing import Dict, Any, Optional, List
+
+import numpy as np
+
+# Environment variables for the artifact memory budget
+MEMORY_BUDGET_ENV = "ANOMALY_MEMORY_BUDGET_MB"    # megabytes, or "container" for the cgroup limit
+MEMORY_POLICY_ENV = "ANOMALY_MEMORY_POLICY"        # "fail" (default) or "degrade"
+
+# Ensemble members dropped, in order, when the "degrade" policy has to shrink the footprint
+DEGRADE_ORDER = ["online", "rf"]
+
+
+class MemoryBudgetExceeded(MemoryError):
+    """Raised when the model artifacts do not fit the configured memory budget"""
+
+
+def deep_sizeof(obj, _seen: Optional[set] = None) -> int:
+    """Approximate number of bytes held by an object and everything it references"""
+    if _seen is None:
+        _seen = set()
+    if id(obj) in _seen:
+        return 0
+    _seen.add(id(obj))
+
+    if isinstance(obj, np.ndarray):
+        # getsizeof includes the data buffer only when the array owns it, so views are not double counted
+        size = sys.getsizeof(obj)
+        if obj.dtype == object:
+            size += sum(deep_sizeof(item, _seen) for item in obj.ravel())
+        return size
+
+    # XGBoost keeps its trees in native memory; the raw model buffer is the closest measure
+    if type(obj).__name__ == "Booster" and hasattr(obj, "save_raw"):
+        return sys.getsizeof(obj) + len(obj.save_raw())
+    if hasattr(obj, "get_booster") and hasattr(obj, "_Booster"):
+        try:
+            return sys.getsizeof(obj) + deep_sizeof(obj.get_booster(), _seen) + deep_sizeof(obj.__dict__, _seen)
+        except Exception:
+            pass
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(k, _seen) + deep_sizeof(v, _seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_sizeof(item, _seen) for item in obj)
+    elif isinstance(obj, (str, bytes, bytearray, int, float, bool, type(None))):
+        pass
+    elif hasattr(obj, "__dict__"):
+        size += deep_sizeof(vars(obj), _seen)
+    elif hasattr(obj, "__getstate__"):
+        # Extension types such as sklearn's Tree expose their arrays through __getstate__
+        try:
+            size += deep_sizeof(obj.__getstate__(), _seen)
+        except Exception:
+            pass
+
+    for slot in getattr(type(obj), "__slots__", ()):
+        if hasattr(obj, slot):
+            size += deep_sizeof(getattr(obj, slot), _seen)
+    return size
+
+
+def current_rss_bytes() -> int:
+    """Resident set size of this process"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        # Peak RSS is the best portable approximation (kB on Linux, bytes on macOS)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def container_memory_limit_bytes() -> Optional[int]:
+    """Memory limit of the surrounding cgroup, or None when unlimited"""
+    for path in ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        if value == "max":
+            return None
+        limit = int(value)
+        # cgroup v1 reports "unlimited" as a huge page-aligned number
+        return limit if limit < 1 << 60 else None
+    return None
+
+
+def resolve_memory_budget(budget_mb: Optional[float] = None) -> Optional[int]:
+    """Budget in bytes from the argument or ANOMALY_MEMORY_BUDGET_MB, or None for no budget"""
+    if budget_mb is not None:
+        return int(budget_mb * 1024 * 1024)
+
+    value = os.environ.get(MEMORY_BUDGET_ENV, "").strip()
+    if not value:
+        return None
+    if value == "container":
+        return container_memory_limit_bytes()
+    return int(float(value) * 1024 * 1024)
+
+
+def memory_policy() -> str:
+    """What to do when the budget is exceeded: "fail" or "degrade\""""
+    policy = os.environ.get(MEMORY_POLICY_ENV, "fail").strip().lower()
+    return policy if policy in ("fail", "degrade") else "fail"
+
+
+def artifact_sizes(paths: Dict[str, str]) -> Dict[str, int]:
+    """On-disk size of each artifact, a close estimate of its loaded size for array-heavy models"""
+    return {name: os.path.getsize(path) for name, path in paths.items() if os.path.exists(path)}
+
+
+def plan_within_budget(paths: Dict[str, str], budget_bytes: Optional[int], policy: str) -> List[str]:
+    """
+    Decide which ensemble members to skip so the artifacts fit the budget
+    Returns: the members to skip (empty when everything fits)
+    Raises: MemoryBudgetExceeded when the policy is "fail" or nothing more can be dropped
+    """
+    if budget_bytes is None:
+        return []
+
+    sizes = artifact_sizes(paths)
+    baseline = current_rss_bytes()
+    needed = baseline + sum(sizes.values())
+    if needed <= budget_bytes:
+        return []
+
+    if policy != "degrade":
+        raise MemoryBudgetExceeded(
+            f"Model artifacts need ~{needed / 2**20:.1f} MB (RSS {baseline / 2**20:.1f} MB + "
+            f"artifacts {sum(sizes.values()) / 2**20:.1f} MB) but the budget is {budget_bytes / 2**20:.1f} MB"
+        )
+
+    skipped = []
+    for member in DEGRADE_ORDER:
+        if needed <= budget_bytes:
+            break
+        if member in sizes:
+            needed -= sizes[member]
+            skipped.append(member)
+
+    if needed > budget_bytes:
+        raise MemoryBudgetExceeded(
+            f"Even the smallest backend needs ~{needed / 2**20:.1f} MB but the budget is {budget_bytes / 2**20:.1f} MB"
+        )
+    return skipped
+
+
+def allocation_hotspots(fn, *args, top: int = 10, **kwargs) -> Dict[str, Any]:
+    """
+    Run fn under tracemalloc
+    Returns: peak traced memory during the run and the source lines still holding the most new memory
+    """
+    already_tracing = tracemalloc.is_tracing()
+    if not already_tracing:
+        tracemalloc.start(25)
+    try:
+        before = tracemalloc.take_snapshot()
+        baseline = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        fn(*args, **kwargs)
+        peak = tracemalloc.get_traced_memory()[1]
+        after = tracemalloc.take_snapshot()
+    finally:
+        if not already_tracing:
+            tracemalloc.stop()
+
+    stats = sorted(after.compare_to(before, "lineno"), key=lambda stat: stat.size_diff, reverse=True)
+    return {
+        "peak_traced_bytes": peak - baseline,
+        "hotspots": [
+            {
+                "location": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+                "size_bytes": stat.size_diff,
+                "allocations": stat.count_diff
+            }
+            for stat in stats[:top]
+            if stat.size_diff > 0
+        ]
+    }
+
+
+def build_memory_report(model, sample_features: Optional[Dict[str, Any]] = None, runs: int = 20) -> Dict[str, Any]:
+    """Memory report for a loaded AnomalyDetectionModel (see AnomalyDetectionModel.memory_report)"""
+    members = {
+        "rf": model.rf_model,
+        "xgb": model.xgb_model,
+        "scaler": model.scaler,
+        "iforest": model.iforest_model,
+        "online": model.online_model,
+        "keystroke_profiles": model.keystroke_profiles,
+        "login_baseline": model.login_baseline,
+        "transfer_graph": model.transfer_graph
+    }
+    report = {
+        "model_type": model.model_type,
+        "deep_size_bytes": {name: deep_sizeof(obj) for name, obj in members.items() if obj is not None},
+        "artifact_size_bytes": artifact_sizes(model.artifact_paths()),
+        "skipped_members": list(model.skipped_members),
+        "rss_before_load_bytes": model.rss_before_load,
+        "rss_after_load_bytes": model.rss_after_load,
+        "rss_now_bytes": current_rss_bytes(),
+        "budget_bytes": model.memory_budget_bytes,
+        "container_limit_bytes": container_memory_limit_bytes()
+    }
+
+    if sample_features is not None:
+        # The sample is scored by a copy, so it is not learned, audited or kept as a user's history
+        scratch = model.isolated_copy()
+        report["scoring_allocations"] = allocation_hotspots(
+            lambda: [scratch.detect_anomaly(sample_features) for _ in range(runs)]
+        )
+
+    return report
+
+
+SAMPLE_FEATURES = {
+    "login": {
+        'user_id': 'memory-report', 'typing_speed': 3.5, 'cursor_movements': 150, 'session_duration': 40,
+        'keystroke_timings': [222, 224, 225, 247, 241, 247, 280, 248, 240, 520, 184, 256, 288, 199],
+        'latitude': 13.05, 'longitude': 80.28, 'timestamp': '2025-04-18T06:48:18.659Z'
+    },
+    "transaction": {
+        'transaction_amount': 2500, 'from_balance': 40000, 'transaction_frequency': 6,
+        'cursor_movements': 80, 'session_duration': 120, 'latitude': 13.05, 'longitude': 80.28,
+        'timestamp': '2025-04-18T06:48:18.659Z'
+    }
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report the memory footprint of the anomaly detection models")
+    parser.add_argument("model_type", nargs="?", choices=["login", "transaction", "all"], default="all")
+    parser.add_argument("--budget-mb", type=float, default=None)
+    args = parser.parse_args()
+
+    from anomaly_detection_model import AnomalyDetectionModel
+
+    model_types = ["login", "transaction"] if args.model_type == "all" else [args.model_type]
+    reports = []
+    for model_type in model_types:
+        try:
+            model = AnomalyDetectionModel(model_type, read_only=True, memory_budget_mb=args.budget_mb)
+        except MemoryBudgetExceeded as e:
+            reports.append({"model_type": model_type, "error": str(e)})
+            continue
+        reports.append(model.memory_report(SAMPLE_FEATURES[model_type]))
+
+    print(json.dumps(reports, indent=2))
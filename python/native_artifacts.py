@@ -0,0 +1,374 @@
+#!/usr/bin/env python
+# Version-independent export/import of the static RF, XGBoost and scaler artifacts
+#
+# Usage:
+#   python native_artifacts.py export [login|transaction|all]
+#   python native_artifacts.py bench [login|transaction|all] [--repeats 20]
+#
+# Pickles tie the artifacts to the sklearn/xgboost versions that wrote them, and unpickling a
+# forest is the slowest part of loading the static models. The native format lives in
+# models/<type>_native/:
+#   manifest.json        format version, feature order, estimator parameters and the file names
+#   xgb-<sha>.ubj        the booster in XGBoost's own UBJSON model format
+#   rf-<sha>.npz         the node arrays of every tree, concatenated, with per-tree offsets
+#   scaler-<sha>.npz     the scaler's mean_, var_, scale_ and n_samples_seen_
+# File names carry a prefix of their SHA-256, checked on load. The manifest is replaced last, so a
+# reader sees either the old or the new set of files, never a mix. The loader rebuilds genuine
+# sklearn estimators, so warm-start retraining and the hot path work on them unchanged.
+
+import io
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import logging
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+NATIVE_FORMAT_VERSION = 1
+MANIFEST_NAME = "manifest.json"
+
+# Per-node tree fields stored by name, so the loader can fill whichever node layout the installed
+# sklearn uses (fields it does not know are dropped, fields missing here are left at zero)
+TREE_NODE_FIELDS = {
+    'left_child': 'children_left',
+    'right_child': 'children_right',
+    'feature': 'feature',
+    'threshold': 'threshold',
+    'impurity': 'impurity',
+    'n_node_samples': 'n_node_samples',
+    'weighted_n_node_samples': 'weighted_n_node_samples',
+    'missing_go_to_left': 'missing_go_to_left'
+}
+
+SCALER_ARRAYS = ('mean_', 'var_', 'scale_', 'n_samples_seen_')
+
+
+def native_directory(model_dir: str, model_type: str) -> str:
+    return os.path.join(model_dir, f"{model_type}_native")
+
+
+def _jsonable(params: Dict[str, Any]) -> Dict[str, Any]:
+    """Estimator parameters that survive JSON (objects such as a template estimator are left out)"""
+    kept = {}
+    for name, value in params.items():
+        if isinstance(value, np.generic):
+            value = value.item()
+        if value is None or isinstance(value, (bool, int, float, str)):
+            kept[name] = value
+    return kept
+
+
+def _accepted(estimator_class, params: Dict[str, Any]) -> Dict[str, Any]:
+    """The saved parameters the installed version of an estimator still takes"""
+    known = estimator_class().get_params()
+    return {name: value for name, value in params.items() if name in known}
+
+
+def _npz_bytes(arrays: Dict[str, np.ndarray]) -> bytes:
+    buffer = io.BytesIO()
+    np.savez(buffer, **arrays)
+    return buffer.getvalue()
+
+
+def _write_hashed(directory: str, prefix: str, extension: str, data: bytes) -> str:
+    """Write data as <prefix>-<sha>.<extension> unless that file already exists; returns the name"""
+    name = f"{prefix}-{hashlib.sha256(data).hexdigest()[:16]}.{extension}"
+    path = os.path.join(directory, name)
+    if not os.path.exists(path):
+        with open(path + ".tmp", 'wb') as f:
+            f.write(data)
+        os.replace(path + ".tmp", path)
+    return name
+
+
+def _read_hashed(directory: str, name: str) -> bytes:
+    with open(os.path.join(directory, name), 'rb') as f:
+        data = f.read()
+    expected = name.rsplit("-", 1)[-1].split(".", 1)[0]
+    if not hashlib.sha256(data).hexdigest().startswith(expected):
+        raise ValueError(f"Native artifact {name} does not match its checksum")
+    return data
+
+
+def forest_arrays(rf_model) -> Tuple[Dict[str, np.ndarray], Dict[str, Any]]:
+    """
+    The node arrays of every tree of a fitted RandomForestClassifier, concatenated
+    Returns: (arrays, metadata for the manifest)
+    """
+    if rf_model.n_outputs_ != 1:
+        raise ValueError("Only single-output forests can be exported")
+    trees = [estimator.tree_ for estimator in rf_model.estimators_]
+    arrays = {
+        field: np.concatenate([getattr(tree, attribute) for tree in trees])
+        for field, attribute in TREE_NODE_FIELDS.items() if hasattr(trees[0], attribute)
+    }
+    arrays['value'] = np.concatenate([tree.value for tree in trees])
+    arrays['offsets'] = np.concatenate([[0], np.cumsum([tree.node_count for tree in trees])]).astype(np.int64)
+    arrays['max_depth'] = np.array([tree.max_depth for tree in trees], dtype=np.int64)
+    arrays['random_state'] = np.array([estimator.random_state for estimator in rf_model.estimators_], dtype=np.int64)
+    arrays['classes'] = np.asarray(rf_model.classes_)
+
+    first = rf_model.estimators_[0]
+    metadata = {
+        "params": _jsonable(rf_model.get_params()),
+        "tree_params": _jsonable({name: value for name, value in first.get_params().items() if name != "random_state"}),
+        "n_features": int(rf_model.n_features_in_),
+        "max_features_": int(first.max_features_),
+        "n_samples": getattr(rf_model, "_n_samples", None),
+        "n_samples_bootstrap": getattr(rf_model, "_n_samples_bootstrap", None)
+    }
+    return arrays, metadata
+
+
+def build_forest(arrays: Dict[str, np.ndarray], metadata: Dict[str, Any]):
+    """A fitted RandomForestClassifier from forest_arrays() output, in the installed sklearn's layout"""
+    from sklearn.ensemble import RandomForestClassifier
+    from sklearn.tree import DecisionTreeClassifier
+    from sklearn.tree._tree import Tree, NODE_DTYPE
+
+    classes = arrays['classes']
+    n_features = metadata["n_features"]
+    n_classes = np.array([len(classes)], dtype=np.intp)
+    offsets = arrays['offsets']
+    values = np.ascontiguousarray(arrays['value'], dtype=np.float64)
+    fields = [field for field in NODE_DTYPE.names if field in arrays]
+    tree_params = _accepted(DecisionTreeClassifier, metadata["tree_params"])
+
+    estimators = []
+    for i, (start, end) in enumerate(zip(offsets[:-1], offsets[1:])):
+        nodes = np.zeros(end - start, dtype=NODE_DTYPE)
+        for field in fields:
+            nodes[field] = arrays[field][start:end]
+        tree = Tree(n_features, n_classes, 1)
+        tree.__setstate__({
+            "max_depth": int(arrays['max_depth'][i]),
+            "node_count": int(end - start),
+            "nodes": nodes,
+            "values": values[start:end]
+        })
+
+        estimator = DecisionTreeClassifier(**tree_params, random_state=int(arrays['random_state'][i]))
+        estimator.n_features_in_ = n_features
+        estimator.n_outputs_ = 1
+        estimator.classes_ = classes
+        estimator.n_classes_ = np.int64(len(classes))
+        estimator.max_features_ = metadata["max_features_"]
+        estimator.tree_ = tree
+        estimators.append(estimator)
+
+    forest = RandomForestClassifier(**_accepted(RandomForestClassifier, metadata["params"]))
+    forest.estimator_ = DecisionTreeClassifier()
+    forest.estimators_ = estimators
+    forest.n_features_in_ = n_features
+    forest.n_outputs_ = 1
+    forest.classes_ = classes
+    forest.n_classes_ = len(classes)
+    if metadata.get("n_samples") is not None:
+        forest._n_samples = metadata["n_samples"]
+    if metadata.get("n_samples_bootstrap") is not None:
+        forest._n_samples_bootstrap = metadata["n_samples_bootstrap"]
+    return forest
+
+
+def build_scaler(arrays: Dict[str, np.ndarray], metadata: Dict[str, Any]):
+    """A fitted StandardScaler from its saved arrays"""
+    from sklearn.preprocessing import StandardScaler
+
+    scaler = StandardScaler(**_accepted(StandardScaler, metadata["params"]))
+    scaler.n_features_in_ = metadata["n_features"]
+    for name in SCALER_ARRAYS:
+        setattr(scaler, name, arrays[name] if name in arrays else None)
+    if np.ndim(scaler.n_samples_seen_) == 0 and scaler.n_samples_seen_ is not None:
+        scaler.n_samples_seen_ = np.int64(scaler.n_samples_seen_)
+    return scaler
+
+
+def read_manifest(directory: str) -> Optional[Dict[str, Any]]:
+    """The manifest of a native artifact directory, or None if there is none"""
+    path = os.path.join(directory, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def export_native(directory: str, model_type: str, feature_names: Sequence[str], rf_model, xgb_model, scaler) -> Dict[str, Any]:
+    """
+    Write the static artifacts in the native format and switch the manifest over to them
+    Files of the previous manifest are kept (a reader may still be loading them); older ones are removed
+    Returns: the new manifest
+    """
+    import sklearn
+    import xgboost as xgb
+
+    os.makedirs(directory, exist_ok=True)
+    previous = read_manifest(directory)
+
+    files = {}
+    rf_arrays, rf_metadata = forest_arrays(rf_model)
+    files["rf"] = _write_hashed(directory, "rf", "npz", _npz_bytes(rf_arrays))
+
+    tmp_path = os.path.join(directory, "xgb.ubj.tmp")
+    xgb_model.save_model(tmp_path)
+    with open(tmp_path, 'rb') as f:
+        files["xgb"] = _write_hashed(directory, "xgb", "ubj", f.read())
+    os.remove(tmp_path)
+
+    scaler_arrays = {name: np.asarray(getattr(scaler, name)) for name in SCALER_ARRAYS
+                     if getattr(scaler, name, None) is not None}
+    files["scaler"] = _write_hashed(directory, "scaler", "npz", _npz_bytes(scaler_arrays))
+
+    manifest = {
+        "format": NATIVE_FORMAT_VERSION,
+        "model_type": model_type,
+        "feature_names": list(feature_names),
+        "created": datetime.now().isoformat(),
+        "exported_with": {"sklearn": sklearn.__version__, "xgboost": xgb.__version__, "numpy": np.__version__},
+        "files": files,
+        "rf": rf_metadata,
+        "scaler": {"params": _jsonable(scaler.get_params()), "n_features": int(scaler.n_features_in_)}
+    }
+    path = os.path.join(directory, MANIFEST_NAME)
+    with open(path + ".tmp", 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+    keep = set(files.values()) | set((previous or {}).get("files", {}).values()) | {MANIFEST_NAME}
+    for name in os.listdir(directory):
+        if name not in keep and not name.endswith(".tmp"):
+            os.remove(os.path.join(directory, name))
+
+    logger.info(f"Exported native {model_type} artifacts to {directory}")
+    return manifest
+
+
+def load_native(directory: str, feature_names: Optional[Sequence[str]] = None,
+                members: Sequence[str] = ("rf", "xgb", "scaler")) -> Tuple[Any, Any, Any]:
+    """
+    Load the static artifacts written by export_native()
+    members: which of rf, xgb and scaler to load (the others come back as None)
+    Returns: (rf_model, xgb_model, scaler)
+    Raises: FileNotFoundError without a manifest, ValueError when the format, feature order or a checksum does not match
+    """
+    manifest = read_manifest(directory)
+    if manifest is None:
+        raise FileNotFoundError(f"No native artifacts in {directory}")
+    if manifest.get("format", 0) > NATIVE_FORMAT_VERSION:
+        raise ValueError(f"Native artifacts in {directory} use format {manifest['format']}; "
+                         f"this version reads up to {NATIVE_FORMAT_VERSION}")
+    if feature_names is not None and manifest["feature_names"] != list(feature_names):
+        raise ValueError(f"Native artifacts in {directory} were trained on features {manifest['feature_names']}")
+
+    files = manifest["files"]
+    rf_model = xgb_model = scaler = None
+    if "rf" in members:
+        with np.load(io.BytesIO(_read_hashed(directory, files["rf"])), allow_pickle=False) as data:
+            rf_model = build_forest(dict(data), manifest["rf"])
+    if "xgb" in members:
+        import xgboost as xgb
+        xgb_model = xgb.XGBClassifier()
+        xgb_model.load_model(bytearray(_read_hashed(directory, files["xgb"])))
+    if "scaler" in members:
+        with np.load(io.BytesIO(_read_hashed(directory, files["scaler"])), allow_pickle=False) as data:
+            scaler = build_scaler(dict(data), manifest["scaler"])
+    return rf_model, xgb_model, scaler
+
+
+def native_is_current(directory: str, pickle_paths: Sequence[str]) -> bool:
+    """Whether a native export exists and is at least as new as every existing pickle it could stand in for"""
+    manifest_path = os.path.join(directory, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return False
+    manifest_time = os.path.getmtime(manifest_path)
+    stale = [path for path in pickle_paths if os.path.exists(path) and os.path.getmtime(path) > manifest_time]
+    if stale:
+        logger.warning(f"Native artifacts in {directory} are older than {', '.join(stale)}; loading the pickles. "
+                       f"Re-export with: python native_artifacts.py export")
+        return False
+    return True
+
+
+def _pickle_paths(model_type: str) -> Tuple[str, str, str]:
+    from anomaly_detection_model import MODEL_DIR
+    return tuple(os.path.join(MODEL_DIR, f"{model_type}_{name}.pkl") for name in ("rf_model", "xgb_model", "scaler"))
+
+
+def export_from_pickles(model_type: str) -> Dict[str, Any]:
+    """Convert the current pickled artifacts of a model type to the native format"""
+    import joblib
+    from anomaly_detection_model import MODEL_DIR, LOGIN_FEATURES, TRANSACTION_FEATURES
+
+    rf_model, xgb_model, scaler = (joblib.load(path) for path in _pickle_paths(model_type))
+    feature_names = LOGIN_FEATURES if model_type == "login" else TRANSACTION_FEATURES
+    return export_native(native_directory(MODEL_DIR, model_type), model_type, feature_names, rf_model, xgb_model, scaler)
+
+
+def bench(model_type: str, repeats: int = 20, rows: int = 5000, seed: int = 42) -> Dict[str, Any]:
+    """
+    Load time of the pickles against the native artifacts, and whether both give identical predictions
+    Returns: dict with median load times in ms per artifact and the round-trip check
+    """
+    import joblib
+    from anomaly_detection_model import MODEL_DIR
+
+    directory = native_directory(MODEL_DIR, model_type)
+    rf_path, xgb_path, scaler_path = _pickle_paths(model_type)
+
+    def median_ms(load) -> float:
+        times = []
+        for _ in range(repeats):
+            started = time.perf_counter()
+            load()
+            times.append((time.perf_counter() - started) * 1000.0)
+        return float(np.median(times))
+
+    report = {
+        "pickle_ms": {
+            "rf": median_ms(lambda: joblib.load(rf_path)),
+            "xgb": median_ms(lambda: joblib.load(xgb_path)),
+            "scaler": median_ms(lambda: joblib.load(scaler_path))
+        },
+        "native_ms": {
+            member: median_ms(lambda: load_native(directory, members=(member,)))
+            for member in ("rf", "xgb", "scaler")
+        }
+    }
+    report["pickle_ms"]["total"] = sum(report["pickle_ms"].values())
+    report["native_ms"]["total"] = sum(report["native_ms"].values())
+
+    rf_model, xgb_model, scaler = (joblib.load(path) for path in (rf_path, xgb_path, scaler_path))
+    native_rf, native_xgb, native_scaler = load_native(directory)
+    X = np.random.default_rng(seed).normal(size=(rows, scaler.n_features_in_)) * scaler.scale_ + scaler.mean_
+    scaled = scaler.transform(X)
+    report["identical"] = {
+        "scaler": bool(np.array_equal(scaled, native_scaler.transform(X))),
+        "rf": bool(np.array_equal(rf_model.predict_proba(scaled), native_rf.predict_proba(scaled))),
+        "xgb": bool(np.array_equal(xgb_model.predict_proba(scaled), native_xgb.predict_proba(scaled)))
+    }
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the static models to the native artifact format")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export_parser = subparsers.add_parser("export", help="Convert the pickled artifacts")
+    export_parser.add_argument("target", nargs="?", choices=["login", "transaction", "all"], default="all")
+    bench_parser = subparsers.add_parser("bench", help="Compare load times and round-trip predictions")
+    bench_parser.add_argument("target", nargs="?", choices=["login", "transaction", "all"], default="all")
+    bench_parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+
+    model_types = ["login", "transaction"] if args.target == "all" else [args.target]
+    if args.command == "export":
+        print(json.dumps({model_type: export_from_pickles(model_type)["files"] for model_type in model_types}, indent=2))
+    else:
+        results = {model_type: bench(model_type, args.repeats) for model_type in model_types}
+        print(json.dumps(results, indent=2))
+        sys.exit(0 if all(all(result["identical"].values()) for result in results.values()) else 1)
@@ -10,6 +10,8 @@ from datetime import datetime
 import logging
 from typing import Dict, Any, Tuple
 import joblib
+from request_profiler import profiled
+from online_backends import load_or_build_online_model
 
 # Configure logging
 logging.basicConfig(
@@ -54,37 +56,11 @@ class OnlineAnomalyDetector:
             logger.warning(f"River not available. Cannot initialize online {self.model_type} model.")
             return None
             
-        # Try to load existing model
-        if os.path.exists(self.model_path):
-            try:
-                logger.info(f"Loading online {self.model_type} model from {self.model_path}")
-                with open(self.model_path, 'rb') as f:
-                    return pickle.load(f)
-            except Exception as e:
-                logger.error(f"Error loading model: {str(e)}. Creating new model.")
-        
-        # Create new model based on type
-        logger.info(f"Creating new online {self.model_type} model")
-        if self.model_type == "login":
-            # For login anomaly detection
-            return compose.Pipeline(
-                preprocessing.StandardScaler(),
-                anomaly.HalfSpaceTrees(
-                    n_trees=50,
-                    height=10,
-                    window_size=256,
-                    seed=42
-                )
-            )
-        else:
-            # For transaction anomaly detection
-            return compose.Pipeline(
-                preprocessing.StandardScaler(),
-                ensemble.AdaptiveRandomForestClassifier(
-                    n_models=10,
-                    seed=42
-                )
-            )
+        try:
+            return load_or_build_online_model(self.model_path, self.model_type)
+        except Exception as e:
+            logger.error(f"Error creating online {self.model_type} model: {str(e)}")
+            return None
     
     def _initialize_drift_detector(self):
         """Initialize drift detector to detect concept drift"""
@@ -305,7 +281,8 @@ if __name__ == "__main__":
     features = json.loads(features_json)
     
     # Detect anomalies
-    result = detect_anomaly(features, model_type)
+    with profiled(f"cli.online.{model_type}", model_type, [features]):
+        result = detect_anomaly(features, model_type)
     
     # Output result as JSON
     print(json.dumps(result))
@@ -0,0 +1,332 @@
+#!/usr/bin/env python
+# Catalog of River pipelines for the online models, with a prequential benchmark to choose between them
+#
+# Usage:
+#   python online_backends.py list
+#   python online_backends.py bench <login|transaction> [<corpus> ...] [--synthetic 20000] [--seed 42]
+#                             [--candidates "hst;hst-small;hst:n_trees=25"] [--warmup 500] [--workers 4]
+#
+# Each model type's online model is picked with ANOMALY_ONLINE_LOGIN_BACKEND or
+# ANOMALY_ONLINE_TRANSACTION_BACKEND. A backend is a catalog name, optionally followed by parameter
+# overrides: "hst", "hst:n_trees=25,height=8" or "arf:n_models=5". Every pipeline standardizes the
+# features first. The defaults, hst and arf, are the models the scorer has always used. Saved models
+# remember their backend, and a saved model of another backend is replaced by a new one of the
+# configured backend rather than used.
+#
+# Login backends are unsupervised anomaly scorers and transaction backends are binary classifiers.
+# Both give a score in [0, 1], which the scorer blends into the ensemble probability. Unbounded
+# scorers such as LODA or OneClassSVM are therefore not in the catalog.
+#
+# The benchmark replays a corpus through every candidate at once, one process each. It uses a
+# labeled JSON-lines file (see incremental_retrain.py), a traffic_replay.py corpus (no labels:
+# timings only, and login only) or seeded synthetic data. Each event is first scored and then learned
+# (prequential evaluation). Login models learn every event, as when serving; transaction models
+# learn the event's label, so they are only benchmarked on labeled events. Candidates are separated
+# by semicolons, since a backend's parameter overrides are separated by commas. The report gives score quality after the warm-up events, microseconds
+# per score_one / learn_one and the pickled snapshot size.
+
+import os
+import sys
+import json
+import time
+import pickle
+import argparse
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+ONLINE_BACKEND_ENV = {
+    "login": "ANOMALY_ONLINE_LOGIN_BACKEND",
+    "transaction": "ANOMALY_ONLINE_TRANSACTION_BACKEND"
+}
+DEFAULT_ONLINE_BACKENDS = {"login": "hst", "transaction": "arf"}
+
+DEFAULT_WARMUP_EVENTS = 500
+
+
+def _half_space_trees(**params):
+    from river import anomaly
+    return anomaly.HalfSpaceTrees(**params)
+
+
+def _adaptive_random_forest(**params):
+    # Renamed forest.ARFClassifier in River 0.19; ensemble.AdaptiveRandomForestClassifier before that
+    from river import forest, ensemble
+    estimator = getattr(forest, "ARFClassifier", None) or ensemble.AdaptiveRandomForestClassifier
+    return estimator(**params)
+
+
+def _hoeffding_adaptive_tree(**params):
+    from river import tree
+    return tree.HoeffdingAdaptiveTreeClassifier(**params)
+
+
+def _mondrian_forest(**params):
+    from river import forest
+    return forest.AMFClassifier(**params)
+
+
+def _logistic_regression(**params):
+    from river import linear_model
+    return linear_model.LogisticRegression(**params)
+
+
+# name -> (estimator factory, default parameters, description) per model type
+ONLINE_BACKENDS = {
+    "login": {
+        "hst": (_half_space_trees, {"n_trees": 50, "height": 10, "window_size": 256, "seed": 42},
+                "Half-Space Trees (the original login model)"),
+        "hst-small": (_half_space_trees, {"n_trees": 15, "height": 8, "window_size": 256, "seed": 42},
+                      "Half-Space Trees with fewer, shallower trees")
+    },
+    "transaction": {
+        "arf": (_adaptive_random_forest, {"n_models": 10, "seed": 42},
+                "Adaptive Random Forest (the original transaction model)"),
+        "arf-small": (_adaptive_random_forest, {"n_models": 3, "seed": 42},
+                      "Adaptive Random Forest with three trees"),
+        "hat": (_hoeffding_adaptive_tree, {"grace_period": 200, "seed": 42},
+                "A single Hoeffding Adaptive Tree"),
+        "amf": (_mondrian_forest, {"n_estimators": 10, "seed": 42},
+                "Aggregated Mondrian Forest"),
+        "logistic": (_logistic_regression, {"l2": 0.0},
+                     "Logistic regression trained by SGD")
+    }
+}
+
+
+def _parse_value(text: str) -> Any:
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+
+def parse_backend(model_type: str, spec: str) -> Tuple[str, Dict[str, Any]]:
+    """
+    Catalog name and full parameters of a backend spec such as "hst:n_trees=25,height=8"
+    Raises: ValueError for an unknown backend or parameter
+    """
+    name, _, overrides = spec.strip().partition(":")
+    catalog = ONLINE_BACKENDS.get(model_type, {})
+    if name not in catalog:
+        raise ValueError(f"Unknown online {model_type} backend {name!r}; expected one of {', '.join(catalog)}")
+    params = dict(catalog[name][1])
+    for item in filter(None, (part.strip() for part in overrides.split(","))):
+        key, separator, value = item.partition("=")
+        if not separator:
+            raise ValueError(f"Invalid online backend parameter {item!r}; expected key=value")
+        params[key.strip()] = _parse_value(value.strip())
+    return name, params
+
+
+def canonical_backend(model_type: str, spec: str) -> str:
+    """A backend spec with every parameter spelled out in a fixed order, so equal backends compare equal"""
+    name, params = parse_backend(model_type, spec)
+    return f"{name}:" + ",".join(f"{key}={json.dumps(value)}" for key, value in sorted(params.items()))
+
+
+def configured_backend(model_type: str) -> str:
+    """Online backend of a model type, from ANOMALY_ONLINE_<TYPE>_BACKEND"""
+    default = DEFAULT_ONLINE_BACKENDS[model_type]
+    value = os.environ.get(ONLINE_BACKEND_ENV[model_type], "").strip()
+    if not value:
+        return default
+    try:
+        parse_backend(model_type, value)
+    except ValueError as e:
+        logger.warning(f"Ignoring {ONLINE_BACKEND_ENV[model_type]}={value!r}: {str(e)}")
+        return default
+    return value
+
+
+def build_online_model(model_type: str, spec: str = None):
+    """A new River pipeline for a backend spec (default: the configured backend), tagged with the spec"""
+    from river import preprocessing
+
+    spec = configured_backend(model_type) if spec is None else spec
+    name, params = parse_backend(model_type, spec)
+    model = preprocessing.StandardScaler() | ONLINE_BACKENDS[model_type][name][0](**params)
+    model.online_backend = canonical_backend(model_type, spec)
+    return model
+
+
+def load_or_build_online_model(path: str, model_type: str, spec: str = None):
+    """
+    The online model saved at path if it was built from the configured backend, else a new one
+    Models saved before backends were tagged count as the default backend, which is what they were
+    """
+    spec = configured_backend(model_type) if spec is None else spec
+    wanted = canonical_backend(model_type, spec)
+    if os.path.exists(path):
+        try:
+            with open(path, 'rb') as f:
+                model = pickle.load(f)
+            saved = getattr(model, "online_backend", None) or canonical_backend(model_type, DEFAULT_ONLINE_BACKENDS[model_type])
+            if saved == wanted:
+                logger.info(f"Loaded online {model_type} model ({saved}) from {path}")
+                return model
+            logger.warning(f"Online {model_type} model at {path} is {saved}, configured {wanted}; starting a new one")
+        except Exception as e:
+            logger.error(f"Error loading online {model_type} model from {path}: {str(e)}. Creating a new one.")
+    logger.info(f"Creating new online {model_type} model ({wanted})")
+    return build_online_model(model_type, spec)
+
+
+def _prequential(model_type: str, spec: str, events: List[Dict[str, float]], labels: Optional[np.ndarray],
+                 warmup: int, threshold: float) -> Dict[str, Any]:
+    """Score then learn every event with a fresh model of one backend"""
+    try:
+        model = build_online_model(model_type, spec)
+    except Exception as e:
+        return {"backend": spec, "error": str(e)}
+
+    n = len(events)
+    scores = np.zeros(n)
+    score_ns = np.zeros(n, dtype=np.int64)
+    learn_ns = np.zeros(n, dtype=np.int64)
+    clock = time.perf_counter_ns
+    for i, x in enumerate(events):
+        started = clock()
+        if model_type == "login":
+            scores[i] = model.score_one(x)
+            scored = clock()
+            model.learn_one(x)
+        else:
+            scores[i] = model.predict_proba_one(x).get(1, 0.0)
+            scored = clock()
+            model.learn_one(x, int(labels[i]))
+        learn_ns[i] = clock() - scored
+        score_ns[i] = scored - started
+
+    started = time.perf_counter()
+    snapshot = pickle.dumps(model)
+    pickle_ms = (time.perf_counter() - started) * 1000
+
+    report = {
+        "backend": canonical_backend(model_type, spec),
+        "events": n,
+        "score_us": float(score_ns.mean() / 1000),
+        "score_p99_us": float(np.percentile(score_ns, 99) / 1000),
+        "learn_us": float(learn_ns.mean() / 1000),
+        "learn_p99_us": float(np.percentile(learn_ns, 99) / 1000),
+        "snapshot_bytes": len(snapshot),
+        "snapshot_ms": pickle_ms,
+        "flag_rate": float((scores[warmup:] > threshold).mean()) if n > warmup else None
+    }
+    if labels is not None and n > warmup and len(np.unique(labels[warmup:])) == 2:
+        from sklearn.metrics import average_precision_score, precision_score, recall_score, roc_auc_score
+        y, s = labels[warmup:], scores[warmup:]
+        report.update(
+            roc_auc=float(roc_auc_score(y, s)),
+            average_precision=float(average_precision_score(y, s)),
+            precision=float(precision_score(y, s > threshold, zero_division=0)),
+            recall=float(recall_score(y, s > threshold, zero_division=0))
+        )
+    return report
+
+
+def _load_events(model_type: str, corpus_paths: List[str], synthetic: Optional[int],
+                 seed: int) -> Tuple[List[Dict[str, float]], Optional[np.ndarray]]:
+    """Online-model feature dicts of the corpus, in order, and their labels (None when unlabeled)"""
+    if synthetic:
+        from synthetic_data import feature_columns, generate_matrix
+        X, y = generate_matrix(model_type, synthetic, seed=seed)
+        names = feature_columns(model_type)
+        return [dict(zip(names, row)) for row in X.tolist()], y
+
+    from anomaly_detection_model import AnomalyDetectionModel
+    from incremental_retrain import load_outcomes
+    from traffic_replay import load_corpus
+
+    features_list, labels = [], []
+    for path in corpus_paths:
+        path_features, path_labels = load_outcomes(path, model_type) if path.endswith(".jsonl") else ([], [])
+        features_list.extend(path_features)
+        labels.extend(path_labels)
+    if not features_list:
+        features_list = [features for _, features in load_corpus(corpus_paths, model_type)]
+        labels = None
+    # Only the feature extraction is used; nothing is scored or saved
+    model = AnomalyDetectionModel(model_type, read_only=True)
+    events = [model._prepare_online_features(features) for features in features_list]
+    return events, (np.asarray(labels, dtype=int) if labels is not None else None)
+
+
+def bench(model_type: str, corpus_paths: List[str] = (), synthetic: int = None, seed: int = 42,
+          candidates: List[str] = None, warmup: int = DEFAULT_WARMUP_EVENTS, workers: int = None) -> Dict[str, Any]:
+    """
+    Prequential run of every candidate backend over the same events, one process per candidate
+    Returns: per candidate timings, snapshot size and (with labels) ROC AUC, average precision and
+    precision / recall at the decision threshold, best ROC AUC first
+    """
+    # Imported here: anomaly_detection_model imports this module
+    from anomaly_detection_model import DECISION_THRESHOLD
+
+    events, labels = _load_events(model_type, list(corpus_paths), synthetic, seed)
+    if not events:
+        raise ValueError(f"No {model_type} events to replay")
+    if labels is None and model_type == "transaction":
+        # Transaction backends are classifiers: without labels every candidate would learn label 0
+        raise ValueError("Transaction backends learn from labels; give a labeled JSON-lines corpus or --synthetic")
+    candidates = list(candidates or ONLINE_BACKENDS[model_type])
+    for spec in candidates:
+        parse_backend(model_type, spec)
+
+    started = time.perf_counter()
+    workers = workers or min(len(candidates), os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_prequential, model_type, spec, events, labels, warmup, DECISION_THRESHOLD)
+                   for spec in candidates]
+        results = [future.result() for future in futures]
+    results.sort(key=lambda result: -result.get("roc_auc", -1.0))
+    return {
+        "model_type": model_type,
+        "events": len(events),
+        "labeled": labels is not None,
+        "warmup": warmup,
+        "workers": workers,
+        "wall_seconds": time.perf_counter() - started,
+        "candidates": results
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Online model backends and their prequential benchmark")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("list", help="Show the catalog and the configured backends")
+    bench_parser = subparsers.add_parser("bench", help="Replay a corpus through candidate backends")
+    bench_parser.add_argument("model_type", choices=["login", "transaction"])
+    bench_parser.add_argument("corpus", nargs="*", help="Labeled JSON-lines file(s) or traffic_replay corpora")
+    bench_parser.add_argument("--synthetic", type=int, default=None, help="Replay this many synthetic events instead")
+    bench_parser.add_argument("--seed", type=int, default=42)
+    bench_parser.add_argument("--candidates", default=None,
+                              help="Semicolon-separated backend specs (default: every catalog entry)")
+    bench_parser.add_argument("--warmup", type=int, default=DEFAULT_WARMUP_EVENTS,
+                              help="Leading events left out of the quality figures")
+    bench_parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.command == "list":
+        print(json.dumps({
+            model_type: {
+                "configured": canonical_backend(model_type, configured_backend(model_type)),
+                "catalog": {name: {"params": params, "description": description}
+                            for name, (_, params, description) in catalog.items()}
+            }
+            for model_type, catalog in ONLINE_BACKENDS.items()
+        }, indent=2))
+    else:
+        if not args.corpus and not args.synthetic:
+            parser.error("give a corpus or --synthetic")
+        candidates = [spec for spec in args.candidates.split(";") if spec.strip()] if args.candidates else None
+        try:
+            report = bench(args.model_type, args.corpus, synthetic=args.synthetic, seed=args.seed,
+                           candidates=candidates, warmup=args.warmup, workers=args.workers)
+        except Exception as e:
+            logger.error(f"Online backend benchmark failed: {str(e)}", exc_info=True)
+            sys.exit(1)
+        print(json.dumps(report, indent=2))
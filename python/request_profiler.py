@@ -0,0 +1,357 @@
+#!/usr/bin/env python
+# Opt-in profiling of scoring requests, with dumps kept in a bounded directory
+#
+# Usage:
+#   python request_profiler.py report [--dir models/profiles] [--top 30] [--since-hours 24] [--kind sampled]
+#
+# Configuration (all off unless set):
+#   ANOMALY_PROFILE_RATE       fraction of requests run under cProfile, e.g. 0.01
+#   ANOMALY_PROFILE_SLOW_MS    requests slower than this always leave a dump
+#   ANOMALY_PROFILE_DIR        dump directory (default models/profiles)
+#   ANOMALY_PROFILE_MAX_DUMPS  dumps kept, oldest removed first (default 200)
+#
+# A request picked by the rate runs under cProfile, which records every call in its thread. Every
+# other request is watched by a sampler thread while slow-request capture is on. Every 5 ms it reads
+# the stack of each thread inside a request with sys._current_frames(). The samples of a request
+# that finishes under the threshold are dropped. So a request that turns out slow leaves a profile
+# without paying cProfile's overhead on all traffic. Requests shorter than one sampling interval
+# are never sampled.
+#
+# Each dump is one JSON file: request name, model type, latency, a summary of the features (numbers
+# as-is, strings and lists by length only, so ids and raw keystrokes stay out) and a per-function
+# table of self and cumulative seconds; sampled dumps also keep their collapsed stacks. The report
+# adds the tables of all dumps up and ranks functions by self time.
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import logging
+import threading
+import cProfile
+import pstats
+from collections import Counter, defaultdict
+from contextlib import contextmanager, nullcontext
+from typing import Dict, Any, List, Optional
+
+logger = logging.getLogger(__name__)
+
+PROFILE_RATE_ENV = "ANOMALY_PROFILE_RATE"
+PROFILE_SLOW_MS_ENV = "ANOMALY_PROFILE_SLOW_MS"
+PROFILE_DIR_ENV = "ANOMALY_PROFILE_DIR"
+PROFILE_MAX_DUMPS_ENV = "ANOMALY_PROFILE_MAX_DUMPS"
+
+DEFAULT_PROFILE_DIR = os.path.join("models", "profiles")
+DEFAULT_MAX_DUMPS = 200
+SAMPLE_INTERVAL_SECONDS = 0.005
+MAX_STACK_DEPTH = 64
+
+# Rows of each dump's function table, and collapsed stacks kept per sampled dump
+DUMP_FUNCTIONS = 200
+DUMP_STACKS = 50
+
+
+def _env_float(name: str) -> Optional[float]:
+    value = os.environ.get(name)
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        logger.warning(f"Ignoring invalid {name}={value!r}")
+        return None
+
+
+def feature_summary(features_list: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Shape of the request's features without identifying values"""
+    def summarize(features):
+        summary = {}
+        for name, value in features.items():
+            if isinstance(value, (bool, int, float)) or value is None:
+                summary[name] = value
+            elif isinstance(value, str) and name == "timestamp":
+                summary[name] = value
+            elif isinstance(value, (str, list, tuple, dict)):
+                summary[name] = {"length": len(value)}
+            else:
+                summary[name] = type(value).__name__
+        return summary
+
+    summary = {"events": len(features_list)}
+    if features_list:
+        summary["first"] = summarize(features_list[0])
+    return summary
+
+
+def _function_label(code) -> str:
+    return f"{code[2]} ({code[0]}:{code[1]})"
+
+
+class _Capture:
+    """Stack samples of one request, collected by the sampler thread"""
+
+    def __init__(self):
+        self.stacks = Counter()
+        self.samples = 0
+
+
+class _StackSampler:
+    """Background thread sampling the stacks of the threads that are inside a request"""
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL_SECONDS):
+        self.interval = interval
+        self._captures = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def watch(self, thread_id: int) -> _Capture:
+        capture = _Capture()
+        with self._lock:
+            self._captures[thread_id] = capture
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+                self._thread.start()
+        self._wake.set()
+        return capture
+
+    def unwatch(self, thread_id: int):
+        with self._lock:
+            self._captures.pop(thread_id, None)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                idle = not self._captures
+                if idle:
+                    self._wake.clear()
+            if idle:
+                # Sleep until the next request instead of waking every interval
+                self._wake.wait()
+                continue
+            time.sleep(self.interval)
+
+            with self._lock:
+                captures = dict(self._captures)
+            frames = sys._current_frames()
+            for thread_id, capture in captures.items():
+                frame = frames.get(thread_id)
+                stack = []
+                while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                    code = frame.f_code
+                    stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+                    frame = frame.f_back
+                if stack:
+                    capture.stacks[tuple(reversed(stack))] += 1
+                    capture.samples += 1
+
+
+class RequestProfiler:
+    """Decides which requests to profile and writes their dumps"""
+
+    def __init__(self, rate: float = 0.0, slow_ms: Optional[float] = None, directory: str = DEFAULT_PROFILE_DIR,
+                 max_dumps: int = DEFAULT_MAX_DUMPS):
+        self.rate = max(0.0, min(1.0, rate))
+        self.slow_ms = slow_ms
+        self.directory = directory
+        self.max_dumps = max(1, max_dumps)
+        self.sampler = _StackSampler() if slow_ms is not None else None
+        self._local = threading.local()
+        self._sequence = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0.0 or self.slow_ms is not None
+
+    @contextmanager
+    def profile(self, name: str, model_type: str, features_list: List[Dict[str, Any]]):
+        """Profile the enclosed request if it is picked by the rate, or keep its samples if it runs slow"""
+        # Nested requests (the CLI around detect_anomaly) belong to the outermost one
+        if getattr(self._local, "active", False):
+            yield
+            return
+
+        self._local.active = True
+        profiler = cProfile.Profile() if self.rate > 0.0 and random.random() < self.rate else None
+        capture = None
+        thread_id = threading.get_ident()
+        started_at = time.time()
+        started = time.perf_counter()
+        try:
+            if profiler is not None:
+                try:
+                    profiler.enable()
+                except ValueError:
+                    # Python 3.12+ allows one active profiler per process; sample this request instead
+                    profiler = None
+            if profiler is None and self.sampler is not None:
+                capture = self.sampler.watch(thread_id)
+            yield
+        finally:
+            elapsed_ms = 1e3 * (time.perf_counter() - started)
+            if profiler is not None:
+                profiler.disable()
+            elif capture is not None:
+                self.sampler.unwatch(thread_id)
+            self._local.active = False
+
+            slow = self.slow_ms is not None and elapsed_ms >= self.slow_ms
+            try:
+                if profiler is not None:
+                    self._dump(name, model_type, features_list, started_at, elapsed_ms, slow,
+                               "cprofile", functions=self._cprofile_functions(profiler))
+                elif slow and capture is not None and capture.samples:
+                    self._dump(name, model_type, features_list, started_at, elapsed_ms, slow,
+                               "sampled", **self._sampled_functions(capture))
+            except Exception as e:
+                logger.error(f"Error writing request profile: {str(e)}", exc_info=True)
+
+    @staticmethod
+    def _cprofile_functions(profiler: cProfile.Profile) -> List[Dict[str, Any]]:
+        stats = pstats.Stats(profiler).stats
+        functions = [
+            {"function": _function_label(code), "calls": int(calls), "self_s": tottime, "cumulative_s": cumtime}
+            for code, (_, calls, tottime, cumtime, _) in stats.items()
+        ]
+        functions.sort(key=lambda entry: entry["self_s"], reverse=True)
+        return functions[:DUMP_FUNCTIONS]
+
+    def _sampled_functions(self, capture: _Capture) -> Dict[str, Any]:
+        interval = self.sampler.interval
+        self_samples = Counter()
+        cumulative_samples = Counter()
+        for stack, count in capture.stacks.items():
+            self_samples[stack[-1]] += count
+            # A recursive function counts once per sample
+            for code in set(stack):
+                cumulative_samples[code] += count
+        functions = [
+            {"function": _function_label(code), "samples": count, "self_s": self_samples[code] * interval,
+             "cumulative_s": count * interval}
+            for code, count in cumulative_samples.items()
+        ]
+        functions.sort(key=lambda entry: entry["self_s"], reverse=True)
+        stacks = {
+            ";".join(code[2] for code in stack): count for stack, count in capture.stacks.most_common(DUMP_STACKS)
+        }
+        return {"functions": functions[:DUMP_FUNCTIONS], "stacks": stacks, "samples": capture.samples,
+                "interval_s": interval}
+
+    def _dump(self, name: str, model_type: str, features_list: List[Dict[str, Any]], started_at: float,
+              elapsed_ms: float, slow: bool, kind: str, **profile):
+        os.makedirs(self.directory, exist_ok=True)
+        with self._lock:
+            self._sequence += 1
+            sequence = self._sequence
+        path = os.path.join(self.directory, f"{int(started_at * 1000)}-{os.getpid()}-{sequence}-{kind}.json")
+        record = {
+            "request": name,
+            "model_type": model_type,
+            "kind": kind,
+            "slow": slow,
+            "started_at": started_at,
+            "elapsed_ms": elapsed_ms,
+            "features": feature_summary(features_list),
+            **profile
+        }
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(record, f)
+        os.replace(tmp_path, path)
+        if slow:
+            logger.warning(f"Slow {name} request ({elapsed_ms:.0f} ms); profile written to {path}")
+        self._prune()
+
+    def _prune(self):
+        """Remove the oldest dumps beyond max_dumps (file names start with the request time)"""
+        dumps = sorted(name for name in os.listdir(self.directory) if name.endswith(".json"))
+        for name in dumps[:max(0, len(dumps) - self.max_dumps)]:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+
+
+_profiler = None
+_profiler_lock = threading.Lock()
+
+
+def get_profiler() -> RequestProfiler:
+    """The process-wide profiler, configured from the environment on first use"""
+    global _profiler
+    if _profiler is None:
+        with _profiler_lock:
+            if _profiler is None:
+                _profiler = RequestProfiler(
+                    rate=_env_float(PROFILE_RATE_ENV) or 0.0,
+                    slow_ms=_env_float(PROFILE_SLOW_MS_ENV),
+                    directory=os.environ.get(PROFILE_DIR_ENV) or DEFAULT_PROFILE_DIR,
+                    max_dumps=int(_env_float(PROFILE_MAX_DUMPS_ENV) or DEFAULT_MAX_DUMPS)
+                )
+    return _profiler
+
+
+def profiled(name: str, model_type: str, features_list: List[Dict[str, Any]]):
+    """Context manager around one request; does nothing unless profiling is configured"""
+    profiler = get_profiler()
+    if not profiler.enabled:
+        return nullcontext()
+    return profiler.profile(name, model_type, features_list)
+
+
+def report(directory: str = DEFAULT_PROFILE_DIR, top: int = 30, since: float = None,
+           kind: str = None) -> Dict[str, Any]:
+    """
+    Add up the function tables of the dumps in a directory
+    Returns: dump counts, the slowest requests and the functions ranked by total self time, with
+    their cumulative time and the number of dumps they appear in
+    """
+    totals = defaultdict(lambda: {"self_s": 0.0, "cumulative_s": 0.0, "dumps": 0})
+    requests = []
+    kinds = Counter()
+    names = sorted(name for name in os.listdir(directory) if name.endswith(".json")) if os.path.isdir(directory) else []
+    for name in names:
+        try:
+            with open(os.path.join(directory, name), "r", encoding="utf-8") as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if (since is not None and record["started_at"] < since) or (kind is not None and record["kind"] != kind):
+            continue
+        kinds[record["kind"]] += 1
+        requests.append({key: record[key] for key in ("request", "model_type", "kind", "elapsed_ms", "features")}
+                        | {"dump": name})
+        for entry in record["functions"]:
+            total = totals[entry["function"]]
+            total["self_s"] += entry["self_s"]
+            total["cumulative_s"] += entry["cumulative_s"]
+            total["dumps"] += 1
+
+    profiled_s = sum(total["self_s"] for total in totals.values())
+    ranked = sorted(totals.items(), key=lambda item: item[1]["self_s"], reverse=True)[:top]
+    return {
+        "dumps": len(requests),
+        "kinds": dict(kinds),
+        "slowest": sorted(requests, key=lambda request: request["elapsed_ms"], reverse=True)[:5],
+        "functions": [
+            {"function": function, **total, "self_share": total["self_s"] / profiled_s if profiled_s else 0.0}
+            for function, total in ranked
+        ]
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Aggregate request profile dumps")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    report_parser = subparsers.add_parser("report", help="Rank functions by self time over the dumps")
+    report_parser.add_argument("--dir", default=os.environ.get(PROFILE_DIR_ENV) or DEFAULT_PROFILE_DIR)
+    report_parser.add_argument("--top", type=int, default=30)
+    report_parser.add_argument("--since-hours", type=float, default=None)
+    report_parser.add_argument("--kind", choices=["cprofile", "sampled"], default=None)
+    args = parser.parse_args()
+
+    since = time.time() - args.since_hours * 3600 if args.since_hours is not None else None
+    print(json.dumps(report(args.dir, args.top, since, args.kind), indent=2))
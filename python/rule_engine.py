@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+# Declarative anomaly-typing and fallback rules, compiled to vectorized NumPy masks
+#
+# Rules live in anomaly_rules.json next to this file (or the file named by ANOMALY_RULES_PATH).
+# The file is re-read when it changes, so thresholds can be tuned without a redeploy.
+#
+# A condition is {"feature": name, "op": "<"|"<="|">"|">="|"=="|"!=", "value": number}, or
+# {"all": [...]}, {"any": [...]} or {"not": condition}. Features are columns of equal length;
+# a missing value is NaN and fails every comparison, like the "x is not None and ..." guards.
+#
+#   anomaly_type: the label of the first matching rule, or "default" when none matches
+#   fallback:     score = sum of the weights of the matching rules, in order; anomalous when
+#                 score >= threshold, with the label of the first matching rule
+#
+# The anomaly_type rules also name the reason for each feature they test (the label of the first
+# rule testing it), which feature_attribution.py gives to the feature that drove a model's score.
+
+import os
+import json
+import time
+import logging
+import threading
+from typing import Dict, Any, List, Callable, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+RULES_PATH_ENV = "ANOMALY_RULES_PATH"
+DEFAULT_RULES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "anomaly_rules.json")
+
+# How often the rules file is checked for changes
+RULES_RELOAD_INTERVAL_SECONDS = 1.0
+
+_COMPARISONS = {
+    "<": np.less,
+    "<=": np.less_equal,
+    ">": np.greater,
+    ">=": np.greater_equal,
+    "==": np.equal,
+    "!=": np.not_equal
+}
+
+Columns = Dict[str, np.ndarray]
+Mask = Callable[[Columns], np.ndarray]
+
+
+class RuleConfigError(ValueError):
+    """Raised when a rules file does not describe a valid rule set"""
+
+
+def compile_condition(condition: Dict[str, Any]) -> Mask:
+    """Compile one condition into a function from columns to a boolean mask"""
+    if "all" in condition or "any" in condition:
+        combine = np.logical_and if "all" in condition else np.logical_or
+        parts = [compile_condition(part) for part in condition.get("all", condition.get("any"))]
+        if not parts:
+            raise RuleConfigError(f"Empty condition list in {condition}")
+
+        def combined(columns: Columns) -> np.ndarray:
+            mask = parts[0](columns)
+            for part in parts[1:]:
+                mask = combine(mask, part(columns))
+            return mask
+        return combined
+
+    if "not" in condition:
+        inner = compile_condition(condition["not"])
+        return lambda columns: np.logical_not(inner(columns))
+
+    try:
+        feature, comparison, value = condition["feature"], _COMPARISONS[condition["op"]], float(condition["value"])
+    except (KeyError, TypeError, ValueError):
+        raise RuleConfigError(f"Invalid condition {condition}")
+
+    def compare(columns: Columns) -> np.ndarray:
+        # NaN compares False, so missing values never match
+        with np.errstate(invalid='ignore'):
+            return comparison(columns[feature], value)
+    return compare
+
+
+def condition_features(condition: Dict[str, Any]) -> List[str]:
+    """Features a condition tests, in the order they appear"""
+    if "all" in condition or "any" in condition:
+        parts = condition.get("all", condition.get("any"))
+        return [feature for part in parts for feature in condition_features(part)]
+    if "not" in condition:
+        return condition_features(condition["not"])
+    return [condition["feature"]]
+
+
+class CompiledRules:
+    """The anomaly_type and fallback rules of one model type, compiled once"""
+
+    def __init__(self, spec: Dict[str, Any]):
+        try:
+            typing = spec["anomaly_type"]
+            fallback = spec["fallback"]
+            self.type_ids = [rule["id"] for rule in typing["rules"]]
+            self.type_labels = [rule["label"] for rule in typing["rules"]]
+            self.type_masks = [compile_condition(rule["when"]) for rule in typing["rules"]]
+            self.default_label = typing["default"]
+            self.feature_labels = {}
+            for rule in typing["rules"]:
+                for feature in condition_features(rule["when"]):
+                    self.feature_labels.setdefault(feature, rule["label"])
+
+            self.fallback_ids = [rule["id"] for rule in fallback["rules"]]
+            self.fallback_labels = [rule["label"] for rule in fallback["rules"]]
+            self.fallback_weights = [float(rule["weight"]) for rule in fallback["rules"]]
+            self.fallback_masks = [compile_condition(rule["when"]) for rule in fallback["rules"]]
+            self.fallback_threshold = float(fallback["threshold"])
+        except (KeyError, TypeError) as e:
+            raise RuleConfigError(f"Incomplete rule set: missing {str(e)}")
+
+    @staticmethod
+    def _labels(ids: List[str], labels: List[str], overrides: Optional[Dict[str, str]]) -> List[str]:
+        if not overrides:
+            return labels
+        return [overrides.get(rule_id, label) for rule_id, label in zip(ids, labels)]
+
+    @staticmethod
+    def _first_match(masks: List[np.ndarray], labels: List[str], default: Optional[str], n: int) -> np.ndarray:
+        result = np.full(n, default, dtype=object)
+        unmatched = np.ones(n, dtype=bool)
+        for mask, label in zip(masks, labels):
+            hit = unmatched & mask
+            result[hit] = label
+            unmatched &= ~mask
+        return result
+
+    def anomaly_types(self, columns: Columns, is_anomalous: np.ndarray,
+                      labels: Optional[Dict[str, str]] = None) -> np.ndarray:
+        """
+        Anomaly type of every row (None where is_anomalous is False)
+        labels: optional rule id -> label overrides
+        """
+        is_anomalous = np.asarray(is_anomalous, dtype=bool)
+        masks = [mask(columns) for mask in self.type_masks]
+        result = self._first_match(masks, self._labels(self.type_ids, self.type_labels, labels),
+                                   self.default_label, len(is_anomalous))
+        result[~is_anomalous] = None
+        return result
+
+    def fallback(self, columns: Columns, labels: Optional[Dict[str, str]] = None) -> Dict[str, np.ndarray]:
+        """
+        Heuristic scores for every row
+        Returns: dict with is_anomalous, anomaly_type (None when not anomalous) and score columns
+        """
+        masks = [mask(columns) for mask in self.fallback_masks]
+        n = len(masks[0]) if masks else 0
+
+        # Added one rule at a time, in order, so the sums are bit-for-bit those of "score += weight"
+        score = np.zeros(n)
+        for mask, weight in zip(masks, self.fallback_weights):
+            score = np.where(mask, score + weight, score)
+        is_anomalous = score >= self.fallback_threshold
+
+        anomaly_types = self._first_match(masks, self._labels(self.fallback_ids, self.fallback_labels, labels), None, n)
+        anomaly_types[~is_anomalous] = None
+        return {"is_anomalous": is_anomalous, "anomaly_type": anomaly_types, "score": score}
+
+
+def columns_from_features(features: Dict[str, Any], names: List[str]) -> Columns:
+    """One-row columns from already extracted feature values; None becomes NaN (missing)"""
+    return {name: np.array([np.nan if features.get(name) is None else features[name]], dtype=float) for name in names}
+
+
+class RuleBook:
+    """Compiled rules per model type, recompiled when the rules file changes"""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.environ.get(RULES_PATH_ENV) or DEFAULT_RULES_PATH
+        self._lock = threading.Lock()
+        self._rules = None
+        self._last_check = 0.0
+        self._mtime = os.path.getmtime(self.path)
+        self._load()
+
+    def _load(self):
+        with open(self.path, 'r', encoding='utf-8') as f:
+            spec = json.load(f)
+        if not isinstance(spec, dict):
+            raise RuleConfigError(f"{self.path} must hold one rule set per model type")
+        self._rules = {model_type: CompiledRules(rules) for model_type, rules in spec.items()}
+        logger.info(f"Loaded anomaly rules from {self.path}")
+
+    def rules(self, model_type: str) -> CompiledRules:
+        """The compiled rules of one model type; a changed file is picked up within a second"""
+        now = time.monotonic()
+        if now - self._last_check >= RULES_RELOAD_INTERVAL_SECONDS:
+            with self._lock:
+                self._last_check = now
+                try:
+                    mtime = os.path.getmtime(self.path)
+                    if mtime != self._mtime:
+                        # Recorded first, so a broken file is reported once rather than every second
+                        self._mtime = mtime
+                        self._load()
+                except Exception as e:
+                    # Keep serving the last good rules
+                    logger.error(f"Error reloading anomaly rules from {self.path}: {str(e)}", exc_info=True)
+        return self._rules[model_type]
+
+
+_rule_book = None
+
+
+def get_rules(model_type: str) -> CompiledRules:
+    """Compiled rules of a model type from the process-wide rule book"""
+    global _rule_book
+    if _rule_book is None:
+        _rule_book = RuleBook()
+    return _rule_book.rules(model_type)
@@ -0,0 +1,473 @@
+#!/usr/bin/env python
+# Append-only, memory-mapped columnar store of every verdict, with hourly rollups
+#
+# Usage:
+#   python score_audit.py summary [--since-hours 168] [--model-type transaction] [--dir models/audit]
+#   python score_audit.py hourly [--since-hours 24] [--model-type login]
+#   python score_audit.py bench [--rows 20000000]
+#
+# Each column is a file of fixed-width values (<column>.col) grown in chunks and mapped with
+# np.memmap; a 16-byte header holds the committed row count and the last timestamp. Appends take an
+# exclusive fcntl lock on the directory's lock file (so the scoring server, the stream processor and
+# the per-request CLI processes can all write), fill the next rows and only then bump the row count,
+# so readers never see a partial row. Timestamps are the write time, kept non-decreasing under the
+# lock, which lets range queries find their rows with a binary search.
+#
+# Anomaly types are stored as codes; anomaly_types.json maps each label to its code and grows as new
+# labels appear (the labels come from the editable rules file). Code 0 means "not anomalous".
+# Entity ids (user or sender account) are stored as 64-bit BLAKE2b hashes, never in clear.
+#
+# Rollups (rollups.npz) hold per-hour, per-model-type counts, anomaly counts, score sums and a score
+# histogram. rollup() only folds in the rows written since the previous call.
+
+import os
+import json
+import time
+import hashlib
+import argparse
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Dict, Any, List, Optional, Sequence
+
+import numpy as np
+
+try:
+    import fcntl
+    FCNTL_AVAILABLE = True
+except ImportError:
+    # Without fcntl (Windows) appends are only serialized within one process
+    FCNTL_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+AUDIT_DIR_ENV = "ANOMALY_AUDIT_DIR"    # directory of the store, or "off" to disable auditing
+
+MODEL_TYPE_CODES = {"login": 0, "transaction": 1}
+MODEL_TYPES = {code: name for name, code in MODEL_TYPE_CODES.items()}
+MEMBERS = ("rf", "xgb", "online", "iforest")
+
+COLUMNS = {
+    "timestamp": np.float64,     # epoch seconds of the write
+    "model_type": np.uint8,      # MODEL_TYPE_CODES
+    "score": np.float32,
+    "rf": np.float32,            # member probabilities, NaN when the member did not contribute
+    "xgb": np.float32,
+    "online": np.float32,
+    "iforest": np.float32,
+    "anomaly_type": np.uint16,   # code from anomaly_types.json, 0 when not anomalous
+    "flags": np.uint8,           # FLAG_ANOMALOUS | FLAG_FALLBACK
+    "entity_hash": np.uint64
+}
+
+FLAG_ANOMALOUS = 1
+FLAG_FALLBACK = 2
+
+CHUNK_ROWS = 1 << 20
+HISTOGRAM_BINS = 20
+QUANTILE_RESOLUTION = 1000
+HOUR = 3600
+
+_HEADER_DTYPE = np.dtype([("rows", "<u8"), ("last_timestamp", "<f8")])
+
+
+def audit_directory(default: str) -> Optional[str]:
+    """Directory of the audit store from ANOMALY_AUDIT_DIR (default if unset), or None when disabled"""
+    value = os.environ.get(AUDIT_DIR_ENV)
+    if value is None:
+        return default
+    return None if value.strip().lower() in ("", "0", "off", "false", "no") else value
+
+
+def entity_hash(entity_id) -> int:
+    """Stable 64-bit hash of an entity id (0 for no entity)"""
+    if entity_id in (None, ""):
+        return 0
+    return int.from_bytes(hashlib.blake2b(str(entity_id).encode(), digest_size=8).digest(), "little")
+
+
+class ScoreAuditStore:
+    """Appends verdicts to, and answers range queries over, one audit directory"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._thread_lock = threading.Lock()
+        self._lock_file = open(os.path.join(directory, "lock"), "a+b")
+
+        header_path = os.path.join(directory, "header")
+        with self._locked():
+            if not os.path.exists(header_path) or os.path.getsize(header_path) < _HEADER_DTYPE.itemsize:
+                np.zeros(1, dtype=_HEADER_DTYPE).tofile(header_path)
+            self._add_missing_columns(header_path)
+        self._header = np.memmap(header_path, dtype=_HEADER_DTYPE, mode="r+", shape=(1,)).view(np.ndarray)
+        self._columns = {}
+        self._capacity = 0
+        self._map_columns()
+
+        self._codes_path = os.path.join(directory, "anomaly_types.json")
+        self._codes = self._read_codes()
+
+    def _column_path(self, name: str) -> str:
+        return os.path.join(self.directory, f"{name}.col")
+
+    def _add_missing_columns(self, header_path: str):
+        """
+        Create the column files a new store, or a store written before a column existed, lacks (under the lock)
+        Added columns match the capacity of the existing ones; the rows already written get NaN
+        (floats) or 0 in them
+        """
+        existing = [os.path.getsize(self._column_path(name)) // np.dtype(dtype).itemsize
+                    for name, dtype in COLUMNS.items() if os.path.exists(self._column_path(name))]
+        capacity = max(existing, default=CHUNK_ROWS)
+        rows = int(np.fromfile(header_path, dtype=_HEADER_DTYPE, count=1)["rows"][0])
+        for name, dtype in COLUMNS.items():
+            path = self._column_path(name)
+            if os.path.exists(path):
+                continue
+            with open(path, "wb") as f:
+                f.truncate(capacity * np.dtype(dtype).itemsize)
+            if rows and np.issubdtype(dtype, np.floating):
+                column = np.memmap(path, dtype=dtype, mode="r+", shape=(rows,))
+                column[:] = np.nan
+                column.flush()
+                del column
+
+    def _map_columns(self):
+        """
+        (Re)map every column file at its current size
+        Columns are kept as plain ndarray views of the maps: slicing an np.memmap goes through its
+        Python-level __getitem__ and __array_finalize__, which dominates a single-row append
+        """
+        capacity = min(os.path.getsize(self._column_path(name)) // np.dtype(dtype).itemsize
+                       for name, dtype in COLUMNS.items())
+        self._columns = {
+            name: np.memmap(self._column_path(name), dtype=dtype, mode="r+", shape=(capacity,)).view(np.ndarray)
+            for name, dtype in COLUMNS.items()
+        }
+        self._capacity = capacity
+
+    @contextmanager
+    def _locked(self):
+        with self._thread_lock:
+            if FCNTL_AVAILABLE:
+                fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if FCNTL_AVAILABLE:
+                    fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _ensure_capacity(self, rows: int):
+        """Grow every column file by whole chunks until it holds rows (under the lock)"""
+        if rows > self._capacity:
+            self._map_columns()    # another process may already have grown the files
+        if rows <= self._capacity:
+            return
+        capacity = -(-rows // CHUNK_ROWS) * CHUNK_ROWS
+        for name, dtype in COLUMNS.items():
+            with open(self._column_path(name), "r+b") as f:
+                f.truncate(capacity * np.dtype(dtype).itemsize)
+        self._map_columns()
+
+    def _read_codes(self) -> Dict[str, int]:
+        try:
+            with open(self._codes_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def _code(self, label: Optional[str]) -> int:
+        """Code of an anomaly type label, registering new labels (under the lock)"""
+        if label is None:
+            return 0
+        code = self._codes.get(label)
+        if code is None:
+            # Another process may have registered it since we last read the table
+            self._codes = self._read_codes()
+            code = self._codes.get(label)
+        if code is None:
+            code = len(self._codes) + 1
+            self._codes[label] = code
+            tmp_path = self._codes_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self._codes, f, indent=2)
+            os.replace(tmp_path, self._codes_path)
+        return code
+
+    @property
+    def rows(self) -> int:
+        return int(self._header["rows"][0])
+
+    def append(self, model_type: str, results: Sequence[Dict[str, Any]], entity_ids: Sequence[Any]):
+        """Append one row per verdict (dicts with score, is_anomalous, anomaly_type, member_scores, fallback)"""
+        k = len(results)
+        if k == 0:
+            return
+        values = {
+            "model_type": np.full(k, MODEL_TYPE_CODES[model_type], dtype=np.uint8),
+            "score": np.array([result.get("score", np.nan) for result in results], dtype=np.float32),
+            "flags": np.array([
+                (FLAG_ANOMALOUS if result.get("is_anomalous") else 0) | (FLAG_FALLBACK if result.get("fallback") else 0)
+                for result in results
+            ], dtype=np.uint8),
+            "entity_hash": np.array([entity_hash(entity_id) for entity_id in entity_ids], dtype=np.uint64)
+        }
+        for member in MEMBERS:
+            values[member] = np.array(
+                [(result.get("member_scores") or {}).get(member, np.nan) for result in results], dtype=np.float32
+            )
+        self._write(values, [result.get("anomaly_type") for result in results])
+
+    def append_columns(self, model_type: str, columns: Dict[str, np.ndarray], entity_ids: Sequence[Any]):
+        """append() for columnar results (score, is_anomalous, anomaly_type, fallback and member columns)"""
+        k = len(columns["score"])
+        if k == 0:
+            return
+        values = {
+            "model_type": np.full(k, MODEL_TYPE_CODES[model_type], dtype=np.uint8),
+            "score": np.asarray(columns["score"], dtype=np.float32),
+            "flags": (np.where(columns["is_anomalous"], FLAG_ANOMALOUS, 0)
+                      | np.where(columns.get("fallback", False), FLAG_FALLBACK, 0)).astype(np.uint8),
+            "entity_hash": np.array([entity_hash(entity_id) for entity_id in entity_ids], dtype=np.uint64)
+        }
+        for member in MEMBERS:
+            values[member] = np.asarray(columns.get(member, np.full(k, np.nan)), dtype=np.float32)
+        self._write(values, list(columns["anomaly_type"]))
+
+    def _write(self, values: Dict[str, np.ndarray], labels: List[Optional[str]]):
+        k = len(labels)
+        with self._locked():
+            codes = np.array([self._code(label) for label in labels], dtype=np.uint16)
+            n = self.rows
+            self._ensure_capacity(n + k)
+            timestamp = max(time.time(), float(self._header["last_timestamp"][0]))
+            self._columns["timestamp"][n:n + k] = timestamp
+            self._columns["anomaly_type"][n:n + k] = codes
+            for name, column in values.items():
+                self._columns[name][n:n + k] = column
+            # Committed last, so readers never see a half-written row
+            self._header["last_timestamp"] = timestamp
+            self._header["rows"] = n + k
+
+    def _append_synthetic(self, values: Dict[str, np.ndarray]):
+        """Bulk append of ready-made columns, timestamps included (benchmarks only)"""
+        k = len(values["timestamp"])
+        with self._locked():
+            n = self.rows
+            self._ensure_capacity(n + k)
+            for name, column in values.items():
+                self._columns[name][n:n + k] = column
+            self._header["last_timestamp"] = float(values["timestamp"][-1])
+            self._header["rows"] = n + k
+
+    def _view(self) -> Dict[str, np.ndarray]:
+        """Committed rows of every column"""
+        n = self.rows
+        if n > self._capacity:
+            self._map_columns()
+        return {name: column[:n] for name, column in self._columns.items()}
+
+    def query(self, start: float = None, end: float = None, model_type: str = None,
+              columns: Sequence[str] = None) -> Dict[str, np.ndarray]:
+        """
+        Columns of the rows written in [start, end) (epoch seconds), optionally for one model type
+        columns: the columns to return (default all); fewer columns means less to filter
+        """
+        view = self._view()
+        timestamps = view["timestamp"]
+        lo = 0 if start is None else int(np.searchsorted(timestamps, start, side="left"))
+        hi = len(timestamps) if end is None else int(np.searchsorted(timestamps, end, side="left"))
+        rows = {name: view[name][lo:hi] for name in (columns or COLUMNS)}
+        if model_type is not None:
+            mask = view["model_type"][lo:hi] == MODEL_TYPE_CODES[model_type]
+            rows = {name: column[mask] for name, column in rows.items()}
+        return rows
+
+    def score_distribution(self, start: float = None, end: float = None, model_type: str = None,
+                           bins: int = HISTOGRAM_BINS) -> Dict[str, Any]:
+        """
+        Count, anomaly rate, score quantiles and histogram over a time range
+        Quantiles are read off a 1/QUANTILE_RESOLUTION-wide histogram instead of sorting the scores
+        """
+        rows = self.query(start, end, model_type, columns=("score", "flags", "anomaly_type"))
+        scores = rows["score"]
+        if len(scores) == 0:
+            return {"count": 0}
+        histogram, edges = np.histogram(scores, bins=bins, range=(0.0, 1.0))
+        fine = np.bincount(np.clip((scores * QUANTILE_RESOLUTION).astype(np.int64), 0, QUANTILE_RESOLUTION - 1),
+                           minlength=QUANTILE_RESOLUTION)
+        p50, p95, p99 = (np.searchsorted(np.cumsum(fine), np.array([0.5, 0.95, 0.99]) * len(scores)) + 1) / QUANTILE_RESOLUTION
+        codes = {code: label for label, code in self._read_codes().items()}
+        type_counts = np.bincount(rows["anomaly_type"])
+        type_codes = np.flatnonzero(type_counts[1:]) + 1
+        type_counts = type_counts[type_codes]
+        return {
+            "count": int(len(scores)),
+            "anomalies": int(np.count_nonzero(rows["flags"] & FLAG_ANOMALOUS)),
+            "fallback": int(np.count_nonzero(rows["flags"] & FLAG_FALLBACK)),
+            "mean_score": float(scores.mean(dtype=np.float64)),
+            "quantiles": {"p50": float(p50), "p95": float(p95), "p99": float(p99)},
+            "histogram": {"edges": edges.tolist(), "counts": histogram.tolist()},
+            "anomaly_types": {codes.get(int(code), str(code)): int(count) for code, count in zip(type_codes, type_counts)}
+        }
+
+    def rollup(self) -> Dict[str, np.ndarray]:
+        """Fold the rows written since the previous rollup into the hourly rollups and return them"""
+        path = os.path.join(self.directory, "rollups.npz")
+        with self._locked():
+            rollups = self._load_rollups(path)
+            view = self._view()
+            watermark, n = int(rollups["watermark"]), len(view["timestamp"])
+            if n > watermark:
+                rollups = self._fold(rollups, {name: column[watermark:n] for name, column in view.items()})
+                rollups["watermark"] = np.int64(n)
+                tmp_path = path + ".tmp"
+                with open(tmp_path, "wb") as f:
+                    np.savez(f, **rollups)
+                os.replace(tmp_path, path)
+        return rollups
+
+    @staticmethod
+    def _load_rollups(path: str) -> Dict[str, np.ndarray]:
+        if os.path.exists(path):
+            with np.load(path) as data:
+                return {name: data[name] for name in data.files}
+        n_types = len(MODEL_TYPE_CODES)
+        return {
+            "watermark": np.int64(0),
+            "first_hour": np.int64(0),
+            "count": np.zeros((0, n_types), dtype=np.int64),
+            "anomalies": np.zeros((0, n_types), dtype=np.int64),
+            "score_sum": np.zeros((0, n_types)),
+            "histogram": np.zeros((0, n_types, HISTOGRAM_BINS), dtype=np.int64)
+        }
+
+    @staticmethod
+    def _fold(rollups: Dict[str, np.ndarray], rows: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+        n_types = len(MODEL_TYPE_CODES)
+        hours = (rows["timestamp"] // HOUR).astype(np.int64)
+        if len(rollups["count"]) == 0:
+            first_hour, last_hour, offset = int(hours.min()), int(hours.max()), 0
+        else:
+            # Re-base the existing arrays if the new rows reach further back or forward
+            first_hour = min(int(rollups["first_hour"]), int(hours.min()))
+            last_hour = max(int(rollups["first_hour"]) + len(rollups["count"]) - 1, int(hours.max()))
+            offset = int(rollups["first_hour"]) - first_hour
+        n_hours = last_hour - first_hour + 1
+
+        grown = {}
+        for name in ("count", "anomalies", "score_sum", "histogram"):
+            array = np.zeros((n_hours,) + rollups[name].shape[1:], dtype=rollups[name].dtype)
+            array[offset:offset + len(rollups[name])] = rollups[name]
+            grown[name] = array
+
+        cell = (hours - first_hour) * n_types + rows["model_type"]
+        size = n_hours * n_types
+        grown["count"] += np.bincount(cell, minlength=size).reshape(n_hours, n_types)
+        grown["anomalies"] += np.bincount(cell, weights=rows["flags"] & FLAG_ANOMALOUS, minlength=size).astype(np.int64).reshape(n_hours, n_types)
+        grown["score_sum"] += np.bincount(cell, weights=rows["score"], minlength=size).reshape(n_hours, n_types)
+        score_bin = np.clip((rows["score"] * HISTOGRAM_BINS).astype(np.int64), 0, HISTOGRAM_BINS - 1)
+        grown["histogram"] += np.bincount(cell * HISTOGRAM_BINS + score_bin, minlength=size * HISTOGRAM_BINS).reshape(
+            n_hours, n_types, HISTOGRAM_BINS)
+
+        return {"watermark": rollups["watermark"], "first_hour": np.int64(first_hour), **grown}
+
+    def hourly(self, start: float = None, end: float = None, model_type: str = None) -> Dict[str, Any]:
+        """Per-hour count, anomalies and mean score from the (freshly updated) rollups"""
+        rollups = self.rollup()
+        first_hour = int(rollups["first_hour"])
+        lo = 0 if start is None else max(0, int(start // HOUR) - first_hour)
+        hi = len(rollups["count"]) if end is None else max(lo, int(-(-end // HOUR)) - first_hour)
+        columns = slice(None) if model_type is None else [MODEL_TYPE_CODES[model_type]]
+        count = rollups["count"][lo:hi, columns].sum(axis=1)
+        score_sum = rollups["score_sum"][lo:hi, columns].sum(axis=1)
+        return {
+            "hour_start": ((np.arange(lo, lo + len(count)) + first_hour) * HOUR).tolist(),
+            "count": count.tolist(),
+            "anomalies": rollups["anomalies"][lo:hi, columns].sum(axis=1).tolist(),
+            "mean_score": np.divide(score_sum, count, out=np.full(len(count), np.nan), where=count > 0).tolist(),
+            "histogram": rollups["histogram"][lo:hi, columns].sum(axis=1).tolist()
+        }
+
+    def close(self):
+        self._lock_file.close()
+
+
+def bench(rows: int = 20_000_000, directory: str = None) -> Dict[str, Any]:
+    """Write synthetic rows spread over 30 days, then time single appends, rollups and range queries"""
+    import tempfile
+    import shutil
+
+    directory = directory or tempfile.mkdtemp(prefix="score_audit_bench_")
+    store = ScoreAuditStore(directory)
+    rng = np.random.default_rng(42)
+    now = time.time()
+    report = {"rows": rows, "directory": directory}
+
+    started = time.perf_counter()
+    chunk = 1_000_000
+    for lo in range(0, rows, chunk):
+        k = min(chunk, rows - lo)
+        scores = rng.beta(1, 8, k).astype(np.float32)
+        store._append_synthetic({
+            "timestamp": now - 30 * 86400 + (lo + np.arange(k)) * (30 * 86400 / rows),
+            "model_type": rng.integers(0, 2, k).astype(np.uint8),
+            "score": scores,
+            "rf": scores, "xgb": scores, "online": np.full(k, np.nan, dtype=np.float32),
+            "iforest": np.full(k, np.nan, dtype=np.float32),
+            "anomaly_type": np.where(scores > 0.7, 1, 0).astype(np.uint16),
+            "flags": (scores > 0.7).astype(np.uint8),
+            "entity_hash": rng.integers(0, 2**63, k, dtype=np.uint64)
+        })
+    report["bulk_write_s"] = time.perf_counter() - started
+
+    result = {"score": 0.42, "is_anomalous": False, "anomaly_type": None, "member_scores": {"rf": 0.4, "xgb": 0.45}}
+    started = time.perf_counter()
+    for _ in range(2000):
+        store.append("transaction", [result], ["ACC-1"])
+    report["append_us_per_verdict"] = 1e6 * (time.perf_counter() - started) / 2000
+
+    started = time.perf_counter()
+    store.rollup()
+    report["first_rollup_s"] = time.perf_counter() - started
+    store.append("transaction", [result], ["ACC-1"])
+    started = time.perf_counter()
+    store.rollup()
+    report["incremental_rollup_ms"] = 1e3 * (time.perf_counter() - started)
+
+    started = time.perf_counter()
+    distribution = store.score_distribution(now - 7 * 86400, None, "transaction")
+    report["week_distribution_ms"] = 1e3 * (time.perf_counter() - started)
+    report["week_transaction_rows"] = distribution["count"]
+
+    started = time.perf_counter()
+    store.hourly(now - 7 * 86400, None, "transaction")
+    report["week_hourly_ms"] = 1e3 * (time.perf_counter() - started)
+
+    store.close()
+    shutil.rmtree(directory, ignore_errors=True)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query the verdict audit store")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    for name in ("summary", "hourly"):
+        command = subparsers.add_parser(name)
+        command.add_argument("--dir", default=os.path.join("models", "audit"))
+        command.add_argument("--since-hours", type=float, default=168.0)
+        command.add_argument("--model-type", choices=list(MODEL_TYPE_CODES), default=None)
+    bench_parser = subparsers.add_parser("bench")
+    bench_parser.add_argument("--rows", type=int, default=20_000_000)
+    args = parser.parse_args()
+
+    if args.command == "bench":
+        print(json.dumps(bench(args.rows), indent=2))
+    else:
+        store = ScoreAuditStore(args.dir)
+        start = time.time() - args.since_hours * HOUR
+        if args.command == "summary":
+            print(json.dumps(store.score_distribution(start, None, args.model_type), indent=2))
+        else:
+            print(json.dumps(store.hourly(start, None, args.model_type)))
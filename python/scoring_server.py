@@ -0,0 +1,603 @@
+#!/usr/bin/env python
+# Long-running asyncio scoring server that micro-batches concurrent requests
+#
+# Usage:
+#   python scoring_server.py serve [--host 127.0.0.1] [--port 8765] [--window-ms 5] [--max-batch-size 64]
+#                                  [--max-queue 1024] [--wait-budget-ms 200] [--concurrent-batches 1]
+#   python scoring_server.py bench [--windows 0,1,2,5,10] [--batch-sizes 1,16,64] [--requests 2000] [--concurrency 64]
+#   python scoring_server.py overload [--login-rps 2000] [--transaction-rps 20] [--seconds 10]
+#
+# Protocol: one JSON object per line over TCP.
+#   {"id": 1, "model_type": "login", "features": {...}}  ->  {"id": 1, "is_anomalous": ..., "anomaly_type": ..., "score": ..., "members": [...]}
+#   optional "deadline_ms": latency budget from arrival; a batch is scored within its tightest budget
+#   {"op": "stats"}                                      ->  latency / batch size / lane / member deadline /
+#                                                            attribution cost / feature drift statistics
+#   {"op": "ready"}                                      ->  whether each model type has trained models loaded
+#   {"op": "logout", "session_id": ...} or {"op": "logout", "user_id": ...}
+#                                                        ->  drops the session's (or all the user's) login context
+#
+# Each model type has its own bounded lane, and batches from the lanes share --concurrent-batches
+# scoring slots (default 1, so a login storm cannot starve transfers of CPU). When a slot frees up
+# the transaction lane is served first. A request is shed when its lane is full, when the
+# estimated wait before its batch would start exceeds the wait budget (the tighter of
+# --wait-budget-ms and its own deadline_ms), or when it has already waited that long by the time a
+# slot frees up. A shed request gets the heuristic fallback verdict at once, with "degraded": true and
+# a "degraded_reason". Queue depth, wait percentiles and shed counts per lane are in the stats.
+
+import json
+import time
+import asyncio
+import argparse
+import logging
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional
+
+import numpy as np
+
+from anomaly_detection_model import AnomalyDetectionModel
+from build_models import model_status
+from synthetic_data import generate_events
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+DEFAULT_WINDOW_MS = 5.0
+DEFAULT_MAX_BATCH_SIZE = 64
+DEFAULT_MAX_QUEUE = 1024
+DEFAULT_WAIT_BUDGET_MS = 200.0
+MODEL_TYPES = ("login", "transaction")
+
+# Lanes in the order free scoring slots are offered to them
+LANE_PRIORITY = ("transaction", "login")
+
+# Weight of the newest batch in each lane's moving average of batch scoring time
+BATCH_TIME_SMOOTHING = 0.2
+
+
+class ScoringStats:
+    """Rolling latency and batch size statistics"""
+
+    def __init__(self, max_samples: int = 10000):
+        self.latencies_ms = deque(maxlen=max_samples)
+        self.batch_sizes = deque(maxlen=max_samples)
+        self.requests = 0
+        self.batches = 0
+        self.started = time.perf_counter()
+
+    def record_batch(self, size: int):
+        self.batches += 1
+        self.batch_sizes.append(size)
+
+    def record_request(self, latency_ms: float):
+        self.requests += 1
+        self.latencies_ms.append(latency_ms)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Return the current statistics as a JSON-serializable dict"""
+        elapsed = time.perf_counter() - self.started
+        latencies = np.asarray(self.latencies_ms) if self.latencies_ms else np.zeros(1)
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+        return {
+            "requests": self.requests,
+            "batches": self.batches,
+            "mean_batch_size": float(np.mean(self.batch_sizes)) if self.batch_sizes else 0.0,
+            "throughput_rps": self.requests / elapsed if elapsed > 0 else 0.0,
+            "latency_ms": {"p50": float(p50), "p95": float(p95), "p99": float(p99)}
+        }
+
+
+class Lane:
+    """Bounded queue of one model type with its admission statistics"""
+
+    def __init__(self, max_queue: int, max_samples: int = 10000):
+        self.max_queue = max_queue
+        self.pending = []
+        self.in_flight = 0
+        # Moving average of the time one batch of this lane takes to score (0 until one has run)
+        self.batch_seconds = 0.0
+        self.admitted = 0
+        self.shed = Counter()
+        self.queue_wait_ms = deque(maxlen=max_samples)
+
+    def record_batch_time(self, seconds: float):
+        if self.batch_seconds == 0.0:
+            self.batch_seconds = seconds
+        else:
+            self.batch_seconds += BATCH_TIME_SMOOTHING * (seconds - self.batch_seconds)
+
+    def snapshot(self) -> Dict[str, Any]:
+        shed = sum(self.shed.values())
+        waits = np.asarray(self.queue_wait_ms) if self.queue_wait_ms else np.zeros(1)
+        p50, p95, p99 = np.percentile(waits, [50, 95, 99])
+        return {
+            "queued": len(self.pending),
+            "in_flight": self.in_flight,
+            "admitted": self.admitted,
+            "shed": dict(self.shed),
+            "shed_rate": shed / (shed + self.admitted) if shed + self.admitted else 0.0,
+            "queue_wait_ms": {"p50": float(p50), "p95": float(p95), "p99": float(p99)},
+            "batch_ms": 1000.0 * self.batch_seconds
+        }
+
+
+class MicroBatchScorer:
+    """
+    Gathers requests that arrive within a short window into one matrix per model type
+    and scores it on a worker thread, then fans the results back out to the callers
+    Requests that would wait longer than the wait budget get the heuristic verdict instead
+    """
+
+    def __init__(self, models: Dict[str, AnomalyDetectionModel],
+                 window_ms: float = DEFAULT_WINDOW_MS,
+                 max_batch_size: int = DEFAULT_MAX_BATCH_SIZE,
+                 max_queue: int = DEFAULT_MAX_QUEUE,
+                 wait_budget_ms: Optional[float] = DEFAULT_WAIT_BUDGET_MS,
+                 concurrent_batches: int = 1):
+        self.models = models
+        self.window = window_ms / 1000.0
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.wait_budget = wait_budget_ms / 1000.0 if wait_budget_ms else None
+        self.concurrent_batches = max(1, int(concurrent_batches))
+        self.stats = ScoringStats()
+        self.lane_order = [model_type for model_type in LANE_PRIORITY if model_type in models]
+        self.lane_order += [model_type for model_type in models if model_type not in self.lane_order]
+        self._lanes = {model_type: Lane(max(1, int(max_queue))) for model_type in models}
+        self._running = 0
+        # Shed requests waiting for the next flush, per lane: (features, future, reason)
+        self._shedding = {model_type: [] for model_type in models}
+        self._flush_scheduled = False
+        # One worker thread per model type keeps the online models single-threaded
+        self._executors = {
+            model_type: ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"score-{model_type}")
+            for model_type in models
+        }
+        # Shed requests get their heuristic verdicts (and audit records) here, off the event loop
+        # and without waiting behind the batches on the scoring threads
+        self._shed_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shed")
+        self._wakeup = None
+        self._full = None
+        self._dispatcher = None
+
+    def start(self):
+        """Start the dispatch loop on the running event loop"""
+        self._wakeup = asyncio.Event()
+        self._full = asyncio.Event()
+        self._dispatcher = asyncio.ensure_future(self._dispatch_loop())
+
+    async def stop(self):
+        """Stop dispatching and shut down the worker threads"""
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            try:
+                await self._dispatcher
+            except asyncio.CancelledError:
+                pass
+        for executor in self._executors.values():
+            executor.shutdown(wait=True)
+        self._shed_executor.shutdown(wait=True)
+
+    def lane_stats(self) -> Dict[str, Any]:
+        return {model_type: lane.snapshot() for model_type, lane in self._lanes.items()}
+
+    def _budget(self, deadline_ms: Optional[float]) -> Optional[float]:
+        """Longest queue wait in seconds for a request with this deadline (None: unlimited)"""
+        budgets = [budget for budget in (self.wait_budget, deadline_ms / 1000.0 if deadline_ms is not None else None)
+                   if budget is not None]
+        return min(budgets) if budgets else None
+
+    def _expected_wait(self, model_type: str) -> float:
+        """
+        Estimated seconds before a request joining this lane now would start scoring: the batches
+        already running and queued in this lane and in the lanes served before it, at each lane's
+        recent batch time, spread over the scoring slots
+        """
+        work = 0.0
+        for other in self.lane_order[:self.lane_order.index(model_type) + 1]:
+            lane = self._lanes[other]
+            if other == model_type:
+                # Only the full batches in front of the new request delay it
+                batches = len(lane.pending) // self.max_batch_size
+            else:
+                batches = -(-len(lane.pending) // self.max_batch_size)
+            work += (batches + lane.in_flight) * lane.batch_seconds
+        return work / self.concurrent_batches
+
+    def _shed(self, model_type: str, features: Dict[str, Any], future: asyncio.Future, reason: str):
+        """
+        Give a request the heuristic verdict instead of a model score
+        Shed requests are collected on the next event loop pass and scored together on the shed
+        thread, since under overload scoring them one by one would take the CPU the admitted requests need
+        """
+        self._lanes[model_type].shed[reason] += 1
+        self._shedding[model_type].append((features, future, reason))
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            asyncio.get_running_loop().call_soon(self._flush_shed)
+
+    def _flush_shed(self):
+        self._flush_scheduled = False
+        for model_type, shed in self._shedding.items():
+            if not shed:
+                continue
+            self._shedding[model_type] = []
+            asyncio.ensure_future(self._score_shed(model_type, shed))
+
+    async def _score_shed(self, model_type: str, shed: List[tuple]):
+        """Heuristic verdicts for a group of shed requests, computed on the shed thread"""
+        loop = asyncio.get_running_loop()
+        try:
+            results = await loop.run_in_executor(self._shed_executor, self.models[model_type]._fallback_detection_batch,
+                                                 [request[0] for request in shed])
+        except Exception as e:
+            logger.error(f"Error scoring shed {model_type} requests: {str(e)}", exc_info=True)
+            for _, future, _ in shed:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        logger.debug(f"Shed {len(shed)} {model_type} requests to the heuristic fallback")
+        for (_, future, reason), result in zip(shed, results):
+            result["degraded"] = True
+            result["degraded_reason"] = reason
+            if not future.done():
+                future.set_result(result)
+
+    async def score(self, model_type: str, features: Dict[str, Any], deadline_ms: float = None) -> Dict[str, Any]:
+        """Queue one event for the next batch and wait for its result (or the heuristic one if shed)"""
+        if model_type not in self.models:
+            raise ValueError(f"Unknown model type: {model_type}")
+
+        lane = self._lanes[model_type]
+        budget = self._budget(deadline_ms)
+        future = asyncio.get_running_loop().create_future()
+        if len(lane.pending) >= lane.max_queue:
+            self._shed(model_type, features, future, "queue_full")
+            return await future
+        if budget is not None and self._expected_wait(model_type) > budget:
+            self._shed(model_type, features, future, "wait_budget")
+            return await future
+
+        enqueued = time.perf_counter()
+        deadline = enqueued + deadline_ms / 1000.0 if deadline_ms is not None else None
+        lane.pending.append((features, future, enqueued, deadline, budget))
+        lane.admitted += 1
+
+        self._wakeup.set()
+        if len(lane.pending) >= self.max_batch_size:
+            self._full.set()
+
+        return await future
+
+    async def _dispatch_loop(self):
+        while True:
+            await self._wakeup.wait()
+
+            # Hold the window open so concurrent requests can join, unless a batch is already full
+            if self.window > 0 and not self._full.is_set():
+                try:
+                    await asyncio.wait_for(self._full.wait(), timeout=self.window)
+                except asyncio.TimeoutError:
+                    pass
+
+            self._wakeup.clear()
+            self._full.clear()
+            self._start_batches()
+
+    def _start_batches(self):
+        """Hand free scoring slots to the lanes in priority order, shedding requests that waited too long"""
+        now = time.perf_counter()
+        for model_type in self.lane_order:
+            lane = self._lanes[model_type]
+            if not lane.pending:
+                continue
+
+            waiting = []
+            for request in lane.pending:
+                features, future, enqueued, _, budget = request
+                if budget is not None and now - enqueued > budget:
+                    self._shed(model_type, features, future, "wait_budget")
+                else:
+                    waiting.append(request)
+            lane.pending = waiting
+
+            # A lane has at most one batch in flight: its worker thread scores one at a time
+            if not lane.pending or lane.in_flight or self._running >= self.concurrent_batches:
+                continue
+            batch = lane.pending[:self.max_batch_size]
+            del lane.pending[:self.max_batch_size]
+            for _, _, enqueued, _, _ in batch:
+                lane.queue_wait_ms.append((now - enqueued) * 1000.0)
+            lane.in_flight += 1
+            self._running += 1
+            asyncio.ensure_future(self._run_batch(model_type, batch))
+
+        # Whatever is still queued goes into the next round if it can start; otherwise the next
+        # finished batch wakes the dispatcher
+        startable = [lane for lane in self._lanes.values() if lane.pending and not lane.in_flight]
+        if startable and self._running < self.concurrent_batches:
+            self._wakeup.set()
+            if any(len(lane.pending) >= self.max_batch_size for lane in startable):
+                self._full.set()
+
+    async def _run_batch(self, model_type: str, batch: List[tuple]):
+        loop = asyncio.get_running_loop()
+        lane = self._lanes[model_type]
+        features_list = [request[0] for request in batch]
+
+        # What is left of the tightest budget in the batch once it reaches its worker thread
+        deadlines = [request[3] for request in batch if request[3] is not None]
+
+        def run():
+            deadline_ms = (min(deadlines) - time.perf_counter()) * 1000.0 if deadlines else None
+            return self.models[model_type].detect_anomaly_batch(features_list, deadline_ms)
+
+        started = time.perf_counter()
+        try:
+            results = await loop.run_in_executor(self._executors[model_type], run)
+        except Exception as e:
+            logger.error(f"Error scoring {model_type} batch: {str(e)}", exc_info=True)
+            for request in batch:
+                if not request[1].done():
+                    request[1].set_exception(e)
+            return
+        finally:
+            lane.record_batch_time(time.perf_counter() - started)
+            lane.in_flight -= 1
+            self._running -= 1
+            # Requests queued meanwhile have waited long enough; start the next batch right away
+            if any(other.pending for other in self._lanes.values()):
+                self._wakeup.set()
+                self._full.set()
+
+        self.stats.record_batch(len(batch))
+        now = time.perf_counter()
+        for (_, future, enqueued, _, _), result in zip(batch, results):
+            self.stats.record_request((now - enqueued) * 1000.0)
+            if not future.done():
+                future.set_result(result)
+
+
+async def _handle_request(scorer: MicroBatchScorer, request: Dict[str, Any]) -> Dict[str, Any]:
+    if request.get("op") == "stats":
+        return {
+            **scorer.stats.snapshot(),
+            "lanes": scorer.lane_stats(),
+            "members": {model_type: model.member_runner.stats() for model_type, model in scorer.models.items()},
+            "attributions": {model_type: model.explainer.stats() for model_type, model in scorer.models.items()},
+            "drift": {
+                model_type: model.drift_monitor.stats() if model.drift_monitor is not None else None
+                for model_type, model in scorer.models.items()
+            }
+        }
+    if request.get("op") == "ready":
+        return {
+            model_type: {"loaded": model.xgb_model is not None and model.scaler is not None, **model_status(model_type)}
+            for model_type, model in scorer.models.items()
+        }
+    if request.get("op") == "logout":
+        # The login and transaction models share one session cache
+        cache = next(iter(scorer.models.values())).session_cache
+        invalidated = cache.logout(request.get("session_id"), request.get("user_id")) if cache is not None else 0
+        response = {"invalidated": invalidated}
+        if "id" in request:
+            response["id"] = request["id"]
+        return response
+
+    try:
+        deadline_ms = request.get("deadline_ms")
+        result = await scorer.score(request.get("model_type"), request.get("features") or {},
+                                    float(deadline_ms) if deadline_ms is not None else None)
+        response = dict(result)
+    except Exception as e:
+        response = {"error": str(e)}
+
+    if "id" in request:
+        response["id"] = request["id"]
+    return response
+
+
+async def _handle_connection(scorer: MicroBatchScorer, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    """Serve one client; pipelined requests are scored concurrently so they can share a batch"""
+    tasks = set()
+
+    async def respond(request):
+        response = await _handle_request(scorer, request)
+        writer.write((json.dumps(response) + "\n").encode())
+        await writer.drain()
+
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            try:
+                request = json.loads(line)
+            except json.JSONDecodeError as e:
+                writer.write((json.dumps({"error": f"Invalid JSON: {str(e)}"}) + "\n").encode())
+                continue
+            task = asyncio.ensure_future(respond(request))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+    finally:
+        writer.close()
+
+
+async def serve(host: str, port: int, window_ms: float, max_batch_size: int, max_queue: int = DEFAULT_MAX_QUEUE,
+                wait_budget_ms: Optional[float] = DEFAULT_WAIT_BUDGET_MS, concurrent_batches: int = 1):
+    """Load both models once and serve requests until cancelled"""
+    models = {model_type: AnomalyDetectionModel(model_type) for model_type in MODEL_TYPES}
+    scorer = MicroBatchScorer(models, window_ms=window_ms, max_batch_size=max_batch_size, max_queue=max_queue,
+                              wait_budget_ms=wait_budget_ms, concurrent_batches=concurrent_batches)
+    scorer.start()
+
+    server = await asyncio.start_server(
+        lambda reader, writer: _handle_connection(scorer, reader, writer), host, port
+    )
+    logger.info(f"Scoring server listening on {host}:{port} (window {window_ms} ms, max batch {max_batch_size})")
+
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await scorer.stop()
+        # Final save of what the models learned (periodic saves run in the background meanwhile)
+        for model in models.values():
+            model.close()
+
+
+async def _bench_config(models: Dict[str, AnomalyDetectionModel], window_ms: float, max_batch_size: int,
+                        n_requests: int, concurrency: int, seed: int) -> Dict[str, Any]:
+    rng = np.random.default_rng(seed)
+    order = rng.choice(MODEL_TYPES, size=n_requests)
+    events = {model_type: iter(generate_events(model_type, int((order == model_type).sum()), seed=seed)[0])
+              for model_type in MODEL_TYPES}
+    requests = [(model_type, next(events[model_type])) for model_type in order]
+
+    # Shedding would hide the latency of the configuration being measured
+    scorer = MicroBatchScorer(models, window_ms=window_ms, max_batch_size=max_batch_size,
+                              max_queue=n_requests, wait_budget_ms=None)
+    scorer.start()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(model_type, features):
+        async with semaphore:
+            await scorer.score(model_type, features)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(model_type, features) for model_type, features in requests))
+    elapsed = time.perf_counter() - started
+    await scorer.stop()
+
+    stats = scorer.stats.snapshot()
+    stats["throughput_rps"] = n_requests / elapsed
+    stats.update({"window_ms": window_ms, "max_batch_size": max_batch_size})
+    return stats
+
+
+def bench(windows: List[float], batch_sizes: List[int], n_requests: int, concurrency: int, seed: int = 42):
+    """Measure the latency/throughput curve over a grid of window and batch size settings"""
+    # Benchmark runs must not keep rewriting the deployed online models
+    models = {model_type: AnomalyDetectionModel(model_type, read_only=True) for model_type in MODEL_TYPES}
+
+    results = []
+    for window_ms in windows:
+        for max_batch_size in batch_sizes:
+            stats = asyncio.run(_bench_config(models, window_ms, max_batch_size, n_requests, concurrency, seed))
+            logger.info(f"Bench window={window_ms}ms batch={max_batch_size}: {stats}")
+            results.append(stats)
+    return results
+
+
+async def _overload_run(models: Dict[str, AnomalyDetectionModel], rates: Dict[str, float], seconds: float,
+                        wait_budget_ms: float, max_queue: int, seed: int) -> Dict[str, Any]:
+    """Send open-loop Poisson traffic at the given per-type rates and collect per-lane outcomes"""
+    rng = np.random.default_rng(seed)
+    scorer = MicroBatchScorer(models, max_queue=max_queue, wait_budget_ms=wait_budget_ms)
+    scorer.start()
+    latencies = {model_type: [] for model_type in rates}
+    degraded = Counter()
+
+    async def one(model_type, features):
+        started = time.perf_counter()
+        result = await scorer.score(model_type, features)
+        latencies[model_type].append((time.perf_counter() - started) * 1000.0)
+        if result.get("degraded"):
+            degraded[model_type] += 1
+
+    # Draw the whole schedule up front so generating load does not compete with scoring it
+    schedule = []
+    for model_type, rate in rates.items():
+        if rate > 0:
+            due = np.cumsum(rng.exponential(1.0 / rate, size=int(rate * seconds * 1.2) + 1))
+            due = due[due < seconds]
+            events, _ = generate_events(model_type, len(due), seed=seed)
+            schedule += [(float(at), model_type, features) for at, features in zip(due, events)]
+    schedule.sort(key=lambda arrival: arrival[0])
+
+    # Arrivals follow the schedule whether or not earlier requests have finished
+    tasks = []
+    start = time.perf_counter()
+    for at, model_type, features in schedule:
+        delay = start + at - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.ensure_future(one(model_type, features)))
+    await asyncio.gather(*tasks)
+    await scorer.stop()
+
+    summary = {"lanes": scorer.lane_stats()}
+    for model_type, values in latencies.items():
+        if values:
+            p50, p99 = np.percentile(values, [50, 99])
+            summary[model_type] = {"requests": len(values), "degraded": degraded[model_type],
+                                   "latency_ms": {"p50": float(p50), "p99": float(p99)}}
+    return summary
+
+
+def overload(login_rps: float, transaction_rps: float, seconds: float, wait_budget_ms: float = DEFAULT_WAIT_BUDGET_MS,
+             max_queue: int = DEFAULT_MAX_QUEUE, seed: int = 42) -> Dict[str, Any]:
+    """
+    Synthetic overload test: transaction latency with and without a login storm on top
+    Returns:
+        Dict with the "baseline" (transactions only) and "storm" runs
+    """
+    models = {model_type: AnomalyDetectionModel(model_type, read_only=True) for model_type in MODEL_TYPES}
+    baseline = asyncio.run(_overload_run(models, {"transaction": transaction_rps}, seconds,
+                                         wait_budget_ms, max_queue, seed))
+    storm = asyncio.run(_overload_run(models, {"transaction": transaction_rps, "login": login_rps}, seconds,
+                                      wait_budget_ms, max_queue, seed))
+    logger.info(f"Overload baseline: {baseline}")
+    logger.info(f"Overload storm: {storm}")
+    return {"baseline": baseline, "storm": storm}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Micro-batching anomaly scoring server")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = subparsers.add_parser("serve", help="Run the scoring server")
+    serve_parser.add_argument("--host", default=DEFAULT_HOST)
+    serve_parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    serve_parser.add_argument("--window-ms", type=float, default=DEFAULT_WINDOW_MS)
+    serve_parser.add_argument("--max-batch-size", type=int, default=DEFAULT_MAX_BATCH_SIZE)
+    serve_parser.add_argument("--max-queue", type=int, default=DEFAULT_MAX_QUEUE, help="Queued requests per lane")
+    serve_parser.add_argument("--wait-budget-ms", type=float, default=DEFAULT_WAIT_BUDGET_MS,
+                              help="Longest queue wait before a request is shed to the heuristics (0: never)")
+    serve_parser.add_argument("--concurrent-batches", type=int, default=1, help="Batches scored at the same time")
+
+    bench_parser = subparsers.add_parser("bench", help="Measure latency/throughput for window and batch settings")
+    bench_parser.add_argument("--windows", default="0,1,2,5,10", help="Comma-separated batch windows in ms")
+    bench_parser.add_argument("--batch-sizes", default="1,16,64", help="Comma-separated maximum batch sizes")
+    bench_parser.add_argument("--requests", type=int, default=2000)
+    bench_parser.add_argument("--concurrency", type=int, default=64)
+
+    overload_parser = subparsers.add_parser("overload", help="Check transaction latency and shedding under a login storm")
+    overload_parser.add_argument("--login-rps", type=float, default=2000.0)
+    overload_parser.add_argument("--transaction-rps", type=float, default=20.0)
+    overload_parser.add_argument("--seconds", type=float, default=10.0)
+    overload_parser.add_argument("--wait-budget-ms", type=float, default=DEFAULT_WAIT_BUDGET_MS)
+    overload_parser.add_argument("--max-queue", type=int, default=DEFAULT_MAX_QUEUE)
+
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        try:
+            asyncio.run(serve(args.host, args.port, args.window_ms, args.max_batch_size, args.max_queue,
+                              args.wait_budget_ms, args.concurrent_batches))
+        except KeyboardInterrupt:
+            pass
+    elif args.command == "overload":
+        print(json.dumps(overload(args.login_rps, args.transaction_rps, args.seconds,
+                                  args.wait_budget_ms, args.max_queue), indent=2))
+    else:
+        results = bench(
+            [float(w) for w in args.windows.split(",")],
+            [int(b) for b in args.batch_sizes.split(",")],
+            args.requests,
+            args.concurrency
+        )
+        print(json.dumps(results, indent=2))
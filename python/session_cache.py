@@ -0,0 +1,480 @@
+#!/usr/bin/env python
+# TTL-bounded session context linking each login's features and verdict to the transfers that follow it
+#
+# Usage:
+#   python session_cache.py check
+#   python session_cache.py logout [--session-id ID] [--user-id ID]
+#
+# A transfer is linked to its login by session_id, else by user_id, else by the account it is made
+# from: logins are also indexed by the account the user logged in with.
+# The app scores every request in a new Python process (app/api/ml-model/route.ts), so the cache is
+# kept like the other per-user stores (see state_persistence.py): logins and logouts are appended to
+# an update log next to a .npz snapshot of the live sessions, and each process loads the snapshot
+# with the log replayed over it. A long-running scorer (scoring_server.py, stream_processor.py) sees
+# the sessions logged before it started and those it scores itself.
+# `check` runs the payloads the login and transfer routes send through the cache, within one process
+# and across two, and fails unless the transfer finds its login. `logout` invalidates sessions for
+# every process; no app route calls it yet.
+
+import os
+import sys
+import json
+import math
+import argparse
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional
+
+import numpy as np
+
+from state_persistence import UpdateLog
+
+logger = logging.getLogger(__name__)
+
+SESSION_TTL_ENV = "ANOMALY_SESSION_TTL_SECONDS"
+SESSION_MAX_PER_USER_ENV = "ANOMALY_SESSION_MAX_PER_USER"
+SESSION_MAX_USERS_ENV = "ANOMALY_SESSION_MAX_USERS"
+
+DEFAULT_TTL_SECONDS = 30 * 60
+DEFAULT_MAX_SESSIONS_PER_USER = 4
+DEFAULT_MAX_USERS = 100000
+
+# A login that was not flagged but scored at least this high counts as borderline
+# (logins are flagged above 0.7, see AnomalyDetectionModel)
+BORDERLINE_SCORE = 0.5
+
+# Distance between the login and the transfer beyond which the location counts as changed
+LOCATION_CHANGE_KM = 50.0
+
+# Signals added to every transaction (None where there is no login context)
+SESSION_SIGNALS = [
+    'session_login_found',           # 1.0 when the transfer could be linked to a login within the TTL
+    'seconds_since_login',
+    'login_score',
+    'login_anomalous',
+    'login_borderline',              # not flagged, but scored at least BORDERLINE_SCORE
+    'location_change_km',            # great-circle distance between the login and the transfer
+    'location_changed_since_login'   # location_change_km above LOCATION_CHANGE_KM
+]
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Great-circle distance between two points in kilometres"""
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * 6371.0 * math.asin(math.sqrt(min(1.0, a)))
+
+
+class LoginContext:
+    """The login that opened a session: its model feature vector, verdict and event time"""
+
+    __slots__ = ("user_id", "session_id", "account_id", "vector", "score", "is_anomalous", "anomaly_type",
+                 "login_time")
+
+    def __init__(self, user_id: str, session_id: str, vector: np.ndarray, score: float,
+                 is_anomalous: bool, anomaly_type: Optional[str], login_time: float, account_id: Optional[str] = None):
+        self.user_id = user_id
+        self.session_id = session_id
+        self.account_id = account_id
+        self.vector = vector
+        self.score = score
+        self.is_anomalous = is_anomalous
+        self.anomaly_type = anomaly_type
+        self.login_time = login_time
+
+
+class SessionContextCache:
+    """
+    Login contexts by session id, by user and by login account, expiring ttl_seconds after the login
+
+    Each user keeps at most max_sessions_per_user sessions (the oldest is dropped) and at most
+    max_users users are held (the least recently logged in is dropped), so memory is bounded at
+    max_users * max_sessions_per_user contexts of one float32 login vector each, plus at most
+    max_users account -> user entries.
+    Times are event times (see transfer_graph.event_time), so replays of old traffic expire
+    contexts the same way live traffic does. Lookups and updates are O(1) and thread-safe:
+    logins and transfers are scored on different threads.
+    """
+
+    def __init__(self, feature_names: List[str], ttl_seconds: float = DEFAULT_TTL_SECONDS,
+                 max_sessions_per_user: int = DEFAULT_MAX_SESSIONS_PER_USER, max_users: int = DEFAULT_MAX_USERS):
+        self.feature_names = list(feature_names)
+        self._latitude = self.feature_names.index('latitude')
+        self._longitude = self.feature_names.index('longitude')
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions_per_user = max(1, int(max_sessions_per_user))
+        self.max_users = max(1, int(max_users))
+        # user_id -> OrderedDict(session_id -> LoginContext), least recently logged in user first
+        self._users = OrderedDict()
+        self._sessions = {}
+        # account_id -> user_id of the latest login with that account, least recently used first
+        self._accounts = OrderedDict()
+        self._newest = -math.inf
+        self._lock = threading.Lock()
+        # Snapshot generation (see state_persistence.py) and where logins and logouts are recorded
+        self.generation = 0
+        self.journal = None
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def _drop(self, context: LoginContext):
+        self._sessions.pop(context.session_id, None)
+        sessions = self._users.get(context.user_id)
+        if sessions is not None:
+            sessions.pop(context.session_id, None)
+            if not sessions:
+                del self._users[context.user_id]
+
+    def _expire(self):
+        """Drop users whose newest login is past the TTL (they sit at the front of the LRU order)"""
+        horizon = self._newest - self.ttl_seconds
+        while self._users:
+            user_id, sessions = next(iter(self._users.items()))
+            if next(reversed(sessions.values())).login_time >= horizon:
+                break
+            for context in list(sessions.values()):
+                self._sessions.pop(context.session_id, None)
+            del self._users[user_id]
+
+    def remember_login(self, user_id: str, session_id: Optional[str], vector: np.ndarray,
+                       result: Dict[str, Any], login_time: float, account_id: Optional[str] = None):
+        """
+        Store a login's feature vector and verdict; without a session id the user id stands in for it
+        The account the user logged in with (if given) is linked to the user for lookup()
+        """
+        user_id = str(user_id)
+        session_id = str(session_id) if session_id else user_id
+        account_id = str(account_id) if account_id else None
+        context = LoginContext(user_id, session_id, np.asarray(vector, dtype=np.float32),
+                               float(result.get("score", 0.0)), bool(result.get("is_anomalous")),
+                               result.get("anomaly_type"), float(login_time), account_id)
+        self._add(context)
+        if self.journal is not None:
+            self.journal.record(["login", user_id, session_id, account_id, context.vector.tolist(), context.score,
+                                 context.is_anomalous, context.anomaly_type, context.login_time])
+
+    def _add(self, context: LoginContext):
+        user_id, session_id, account_id = context.user_id, context.session_id, context.account_id
+        with self._lock:
+            if account_id is not None:
+                self._accounts[account_id] = user_id
+                self._accounts.move_to_end(account_id)
+                if len(self._accounts) > self.max_users:
+                    self._accounts.popitem(last=False)
+
+            previous = self._sessions.get(session_id)
+            if previous is not None:
+                self._drop(previous)
+
+            sessions = self._users.get(user_id)
+            if sessions is None:
+                if len(self._users) >= self.max_users:
+                    _, evicted = self._users.popitem(last=False)
+                    for old in evicted.values():
+                        self._sessions.pop(old.session_id, None)
+                sessions = self._users[user_id] = OrderedDict()
+            else:
+                self._users.move_to_end(user_id)
+            while len(sessions) >= self.max_sessions_per_user:
+                _, old = sessions.popitem(last=False)
+                self._sessions.pop(old.session_id, None)
+
+            sessions[session_id] = context
+            self._sessions[session_id] = context
+            self._newest = max(self._newest, context.login_time)
+            self._expire()
+
+    def lookup(self, session_id: Optional[str] = None, user_id: Optional[str] = None,
+               at: Optional[float] = None, account_id: Optional[str] = None) -> Optional[LoginContext]:
+        """
+        The login context of a session, or else the user's most recent login, or else the most recent
+        login of the user who last logged in with the account
+        Returns: None when there is none, or it is older than the TTL at event time `at`
+        """
+        with self._lock:
+            context = self._sessions.get(str(session_id)) if session_id else None
+            if context is None and user_id:
+                sessions = self._users.get(str(user_id))
+                context = next(reversed(sessions.values())) if sessions else None
+            if context is None and account_id:
+                sessions = self._users.get(self._accounts.get(str(account_id)))
+                context = next(reversed(sessions.values())) if sessions else None
+        if context is None or (at is not None and at - context.login_time > self.ttl_seconds):
+            return None
+        return context
+
+    def remember_login_event(self, features: Dict[str, Any], vector: np.ndarray, result: Dict[str, Any],
+                             login_time: float):
+        """remember_login() keyed by the fields of a login event (user_id, session_id, account_id)"""
+        self.remember_login(features['user_id'], features.get('session_id'), vector, result, login_time,
+                            features.get('account_id'))
+
+    def lookup_transfer(self, features: Dict[str, Any], at: float) -> Optional[LoginContext]:
+        """lookup() keyed by the fields of a transfer (session_id, user_id, from_account_id)"""
+        return self.lookup(features.get('session_id'), features.get('user_id'), at, features.get('from_account_id'))
+
+    def logout(self, session_id: Optional[str] = None, user_id: Optional[str] = None) -> int:
+        """
+        Invalidate one session, or every session of a user when only the user is given
+        Returns: number of contexts dropped
+        """
+        if self.journal is not None and (session_id or user_id):
+            self.journal.record(["logout", str(session_id) if session_id else None, str(user_id) if user_id else None])
+        return self._logout(session_id, user_id)
+
+    def _logout(self, session_id: Optional[str], user_id: Optional[str]) -> int:
+        with self._lock:
+            if session_id:
+                context = self._sessions.get(str(session_id))
+                if context is None:
+                    return 0
+                self._drop(context)
+                return 1
+            sessions = self._users.pop(str(user_id), None) if user_id else None
+            if not sessions:
+                return 0
+            for context in sessions.values():
+                self._sessions.pop(context.session_id, None)
+            return len(sessions)
+
+    def replay(self, entry: List[Any]):
+        """Apply a login or logout recorded in the journal"""
+        if entry[0] == "login":
+            _, user_id, session_id, account_id, vector, score, is_anomalous, anomaly_type, login_time = entry
+            self._add(LoginContext(user_id, session_id, np.asarray(vector, dtype=np.float32), score, is_anomalous,
+                                   anomaly_type, login_time, account_id))
+        elif entry[0] == "logout":
+            self._logout(entry[1], entry[2])
+
+    def save(self, path: str):
+        """Write the live sessions and the account links to a .npz snapshot, oldest login first"""
+        with self._lock:
+            contexts = sorted(self._sessions.values(), key=lambda context: context.login_time)
+            accounts = list(self._accounts.items())
+        vectors = (np.stack([context.vector for context in contexts]) if contexts
+                   else np.zeros((0, len(self.feature_names)), dtype=np.float32))
+
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f,
+                     user_ids=np.array([context.user_id for context in contexts], dtype=str),
+                     session_ids=np.array([context.session_id for context in contexts], dtype=str),
+                     account_ids=np.array([context.account_id or "" for context in contexts], dtype=str),
+                     vectors=vectors,
+                     scores=np.array([context.score for context in contexts], dtype=np.float64),
+                     anomalous=np.array([context.is_anomalous for context in contexts], dtype=bool),
+                     anomaly_types=np.array([context.anomaly_type or "" for context in contexts], dtype=str),
+                     login_times=np.array([context.login_time for context in contexts], dtype=np.float64),
+                     accounts=np.array([account for account, _ in accounts], dtype=str),
+                     account_users=np.array([user for _, user in accounts], dtype=str),
+                     generation=np.int64(self.generation))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str, feature_names: List[str], **kwargs) -> "SessionContextCache":
+        """Load a snapshot written by save(), or start empty if there is none"""
+        cache = cls(feature_names, **kwargs)
+        if not os.path.exists(path):
+            return cache
+
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                columns = {name: data[name] for name in data.files}
+            login_times = columns['login_times']
+            # Only sessions within the TTL of the newest login would survive being added
+            live = (np.flatnonzero(login_times >= login_times.max() - cache.ttl_seconds)
+                    if len(login_times) else np.zeros(0, dtype=np.int64))
+            rows = zip(*(columns[name][live].tolist() for name in
+                         ('user_ids', 'session_ids', 'account_ids', 'scores', 'anomalous', 'anomaly_types', 'login_times')),
+                       columns['vectors'][live])
+            for user_id, session_id, account_id, score, is_anomalous, anomaly_type, login_time, vector in rows:
+                cache._add(LoginContext(user_id, session_id, vector, score, is_anomalous, anomaly_type or None,
+                                        login_time, account_id or None))
+            cache._accounts = OrderedDict(zip(columns['accounts'].tolist(), columns['account_users'].tolist()))
+            cache.generation = int(columns['generation'])
+        except Exception as e:
+            logger.error(f"Error loading session contexts from {path}: {str(e)}. Starting empty.")
+            cache = cls(feature_names, **kwargs)
+        return cache
+
+    def signals(self, context: Optional[LoginContext], latitude: Optional[float], longitude: Optional[float],
+                at: float) -> Dict[str, Any]:
+        """SESSION_SIGNALS for a transfer made at event time `at` from the given location"""
+        if context is None:
+            return {**dict.fromkeys(SESSION_SIGNALS), 'session_login_found': 0.0}
+
+        change_km = None
+        if latitude is not None and longitude is not None:
+            change_km = haversine_km(float(context.vector[self._latitude]), float(context.vector[self._longitude]),
+                                     float(latitude), float(longitude))
+        return {
+            'session_login_found': 1.0,
+            'seconds_since_login': at - context.login_time,
+            'login_score': context.score,
+            'login_anomalous': float(context.is_anomalous),
+            'login_borderline': float(not context.is_anomalous and context.score >= BORDERLINE_SCORE),
+            'location_change_km': change_km,
+            'location_changed_since_login': float(change_km > LOCATION_CHANGE_KM) if change_km is not None else None
+        }
+
+
+def _env_number(name: str, default: float) -> float:
+    value = os.environ.get(name)
+    if not value:
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        logger.warning(f"Ignoring {name}={value!r}: not a number")
+        return default
+
+
+# Process-wide caches and their update logs, by snapshot path
+_session_caches = {}
+_session_logs = {}
+_session_cache_lock = threading.Lock()
+
+
+def get_session_cache(feature_names: List[str], path: Optional[str] = None,
+                      journal: bool = False) -> Optional[SessionContextCache]:
+    """
+    The process-wide session cache shared by the login and transaction models
+    path: its snapshot; the cache is loaded with every process's logged logins and logouts replayed over it
+    journal: record this process's logins and logouts in the snapshot's update log (see state_persistence.py)
+    Returns: None when ANOMALY_SESSION_TTL_SECONDS is 0
+    """
+    ttl = _env_number(SESSION_TTL_ENV, DEFAULT_TTL_SECONDS)
+    if ttl <= 0:
+        return None
+    with _session_cache_lock:
+        cache = _session_caches.get(path)
+        if cache is None:
+            settings = dict(
+                ttl_seconds=ttl,
+                max_sessions_per_user=int(_env_number(SESSION_MAX_PER_USER_ENV, DEFAULT_MAX_SESSIONS_PER_USER)),
+                max_users=int(_env_number(SESSION_MAX_USERS_ENV, DEFAULT_MAX_USERS))
+            )
+            if path is None:
+                cache = SessionContextCache(feature_names, **settings)
+            else:
+                update_log = UpdateLog(path, lambda snapshot: SessionContextCache.load(snapshot, feature_names, **settings))
+                cache = update_log.load()
+                _session_logs[path] = update_log
+            _session_caches[path] = cache
+        if journal and path is not None:
+            cache.journal = _session_logs[path]
+    return cache
+
+
+def check() -> Dict[str, Any]:
+    """
+    Whether transfers are linked to their login, for the payloads the login and transfer routes send
+    (app/api/auth/login/route.ts and app/api/transactions/transfer/route.ts), within one process and
+    when the login and the transfer are scored by different processes, as the app does
+    """
+    import tempfile
+    from anomaly_detection_model import LOGIN_FEATURES
+    from transfer_graph import event_time
+
+    login = {
+        'user_id': "70ab2081-1b96-459c-96c3-16e50ce38486", 'account_id': "123456789012",
+        'typing_speed': 5.2, 'cursor_movements': 140, 'session_duration': 95.0,
+        'keystroke_timings': [120.0, 135.0, 110.0], 'key_press_count': 24,
+        'latitude': 13.0827, 'longitude': 80.2707, 'login_time_of_day': 10.5,
+        'timestamp': "2025-06-02T10:30:00Z"
+    }
+    transfer = {
+        'user_id': login['user_id'], 'from_account_id': login['account_id'], 'to_account_id': "210987654321",
+        'transaction_amount': 100000, 'from_balance': 250000, 'to_balance': 0, 'transaction_frequency': 3,
+        'cursor_movements': 60, 'session_duration': 240.0, 'latitude': 12.9716, 'longitude': 77.5946,
+        'timestamp': "2025-06-02T10:34:00Z"
+    }
+    without_user = {name: value for name, value in transfer.items() if name != 'user_id'}
+    other_account = {**without_user, 'from_account_id': "999999999999"}
+    late = {**transfer, 'timestamp': "2025-06-02T11:30:00Z"}
+
+    cache = SessionContextCache(LOGIN_FEATURES)
+    vector = np.zeros(len(LOGIN_FEATURES))
+    vector[cache._latitude], vector[cache._longitude] = login['latitude'], login['longitude']
+    cache.remember_login_event(login, vector, {"score": 0.3, "is_anomalous": False}, event_time(login))
+
+    def found(features):
+        at = event_time(features)
+        return cache.signals(cache.lookup_transfer(features, at), features['latitude'], features['longitude'],
+                             at)['session_login_found']
+
+    linked = {
+        "transfer_route": found(transfer),
+        "by_account_only": found(without_user),
+        "other_account": found(other_account),
+        "after_ttl": found(late)
+    }
+
+    # Each UpdateLog below stands for another process: it sees only the snapshot and the log
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "session_context.npz")
+
+        def process(compact_bytes: int = 1 << 20):
+            update_log = UpdateLog(path, lambda snapshot: SessionContextCache.load(snapshot, LOGIN_FEATURES),
+                                   compact_bytes=compact_bytes)
+            other = update_log.load()
+            other.journal = update_log
+            return other, update_log
+
+        login_process, update_log = process()
+        login_process.remember_login_event(login, vector, {"score": 0.3, "is_anomalous": False}, event_time(login))
+        update_log.flush()
+        cache, _ = process()
+        linked["other_process"] = found(transfer)
+        cache, _ = process()
+        linked["other_process_by_account_only"] = found(without_user)
+
+        # Folded into the snapshot (the same login logged again), then logged out by yet another process
+        compacting, update_log = process(compact_bytes=0)
+        compacting.remember_login_event(login, vector, {"score": 0.3, "is_anomalous": False}, event_time(login))
+        update_log.flush()
+        cache, _ = process()
+        linked["after_compaction"] = found(transfer)
+        logout_process, update_log = process()
+        logout_process.logout(session_id=None, user_id=login['user_id'])
+        update_log.flush()
+        cache, _ = process()
+        linked["after_logout"] = found(transfer)
+
+    expected = {"transfer_route": 1.0, "by_account_only": 1.0, "other_account": 0.0, "after_ttl": 0.0,
+                "other_process": 1.0, "other_process_by_account_only": 1.0, "after_compaction": 1.0,
+                "after_logout": 0.0}
+    return {"session_login_found": linked, "ok": linked == expected}
+
+
+def logout(session_id: Optional[str] = None, user_id: Optional[str] = None) -> int:
+    """Invalidate a session, or all of a user's, for every process that loads the session cache"""
+    from anomaly_detection_model import LOGIN_FEATURES, SESSION_CONTEXT_PATH
+
+    cache = get_session_cache(LOGIN_FEATURES, SESSION_CONTEXT_PATH, journal=True)
+    if cache is None:
+        return 0
+    dropped = cache.logout(session_id=session_id, user_id=user_id)
+    cache.journal.flush()
+    return dropped
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Session context linking logins to transfers")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("check", help="Link the login route's payload to the transfer route's")
+    logout_parser = subparsers.add_parser("logout", help="Invalidate a session, or every session of a user")
+    logout_parser.add_argument("--session-id", default=None)
+    logout_parser.add_argument("--user-id", default=None)
+    args = parser.parse_args()
+
+    if args.command == "logout":
+        if not args.session_id and not args.user_id:
+            parser.error("give --session-id or --user-id")
+        print(json.dumps({"dropped": logout(args.session_id, args.user_id)}))
+    else:
+        result = check()
+        print(json.dumps(result, indent=2))
+        sys.exit(0 if result["ok"] else 1)
@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+# Writing learned state to disk off the request path
+#
+# Scoring learns from every event: the online model and the per-user stores change with each
+# request. Saving them after every request put a full pickle or .npz rewrite on each request.
+# Instead, a model registers its save functions with a StateSaver. The saver runs them on a
+# background thread every ANOMALY_STATE_SAVE_INTERVAL_SECONDS (default 30; 0 saves only at exit)
+# and once more when the process exits or the model is closed. Each save function decides for
+# itself whether anything changed since its last run.
+#
+# The per-user stores are shared by every process that scores (the server, the stream processor
+# and one CLI process per request), so rewriting a whole snapshot would drop the updates other
+# processes made since it was loaded. Their updates go to an UpdateLog instead: an append-only
+# log next to the .npz snapshot, written under an exclusive fcntl lock. Loading replays the log
+# over the snapshot, so every process's updates end up in the state. Once the log outgrows
+# UPDATE_LOG_COMPACT_BYTES it is folded into a new snapshot, under the same lock. The snapshot
+# carries a generation number and the log's first line names the generation it applies to, so a
+# log that has been folded in is never replayed again, even after a crash half way through.
+
+import os
+import json
+import atexit
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, List, Optional
+
+try:
+    import fcntl
+    FCNTL_AVAILABLE = True
+except ImportError:
+    # Without fcntl (Windows) the log is only serialized within one process
+    FCNTL_AVAILABLE = False
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+STATE_SAVE_INTERVAL_ENV = "ANOMALY_STATE_SAVE_INTERVAL_SECONDS"
+DEFAULT_STATE_SAVE_INTERVAL_SECONDS = 30.0
+
+# A log this large is folded into the snapshot; replaying it costs tens of milliseconds at load
+UPDATE_LOG_COMPACT_BYTES = 1 << 20
+
+
+def state_save_interval_seconds() -> float:
+    """Seconds between background saves, from ANOMALY_STATE_SAVE_INTERVAL_SECONDS (0: only at exit)"""
+    value = os.environ.get(STATE_SAVE_INTERVAL_ENV)
+    if not value:
+        return DEFAULT_STATE_SAVE_INTERVAL_SECONDS
+    try:
+        return float(value)
+    except ValueError:
+        logger.warning(f"Ignoring invalid {STATE_SAVE_INTERVAL_ENV}={value!r}")
+        return DEFAULT_STATE_SAVE_INTERVAL_SECONDS
+
+
+class StateSaver:
+    """Runs save functions on a daemon thread every interval, and once more at exit or close()"""
+
+    def __init__(self, name: str, interval_seconds: float = None):
+        self.name = name
+        self.interval_seconds = state_save_interval_seconds() if interval_seconds is None else interval_seconds
+        self._tasks: List[Callable[[], None]] = []
+        # One save at a time, whether from the timer, close() or exit
+        self._save_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self.saves = 0
+        atexit.register(self.save)
+
+    def add(self, task: Callable[[], None]):
+        """Register a save function and start the timer with the first one"""
+        self._tasks.append(task)
+        if self._thread is None and self.interval_seconds > 0 and not self._stopped.is_set():
+            self._thread = threading.Thread(target=self._run, name=f"save-{self.name}", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval_seconds):
+            self.save()
+
+    def save(self):
+        """Run every save function now; a failing one is logged and does not stop the others"""
+        with self._save_lock:
+            for task in self._tasks:
+                try:
+                    task()
+                except Exception as e:
+                    logger.error(f"Error saving {self.name} state: {str(e)}", exc_info=True)
+            self.saves += 1
+
+    def stop(self):
+        """Stop the timer; from then on state is only saved by save(), close() or at exit"""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def close(self):
+        """Stop the timer and save one last time"""
+        self.stop()
+        atexit.unregister(self.save)
+        self.save()
+
+
+def update_log_path(snapshot_path: str) -> str:
+    """Path of the update log kept next to a snapshot"""
+    return snapshot_path + ".log"
+
+
+class UpdateLog:
+    """
+    Append-only log of a store's updates, shared by every process that uses the snapshot
+    The store needs a generation attribute, save(path) (which writes the generation into the
+    snapshot) and replay(entry) (which applies one logged update). It calls record(entry) for every
+    update it makes; the entries are appended to the log by flush(), from the background saver.
+    """
+
+    def __init__(self, snapshot_path: str, load_snapshot: Callable[[str], Any],
+                 compact_bytes: int = UPDATE_LOG_COMPACT_BYTES):
+        self.snapshot_path = snapshot_path
+        self.path = update_log_path(snapshot_path)
+        self._lock_path = snapshot_path + ".lock"
+        self._load_snapshot = load_snapshot
+        self.compact_bytes = compact_bytes
+        self._pending = []
+        self._pending_lock = threading.Lock()
+        self.compactions = 0
+
+    @contextmanager
+    def _locked(self):
+        os.makedirs(os.path.dirname(self._lock_path) or ".", exist_ok=True)
+        with open(self._lock_path, "a+b") as lock_file:
+            if FCNTL_AVAILABLE:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if FCNTL_AVAILABLE:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _snapshot_generation(self) -> int:
+        if not os.path.exists(self.snapshot_path):
+            return 0
+        with np.load(self.snapshot_path, allow_pickle=False) as data:
+            return int(data["generation"]) if "generation" in data.files else 0
+
+    def _log_generation(self) -> Optional[int]:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return int(json.loads(f.readline())["generation"])
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def _start_log(self, generation: int):
+        """Replace the log with an empty one for a snapshot generation (under the lock)"""
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"generation": generation}) + "\n")
+        os.replace(tmp_path, self.path)
+
+    def _replay(self, store) -> int:
+        """Apply the log to a store loaded from the snapshot (under the lock); Returns: updates applied"""
+        if not os.path.exists(self.path) or self._log_generation() != store.generation:
+            # No log yet, or one already folded into this snapshot
+            return 0
+        applied = skipped = 0
+        with open(self.path, "r", encoding="utf-8") as f:
+            f.readline()
+            for line in f:
+                try:
+                    store.replay(json.loads(line))
+                    applied += 1
+                except Exception:
+                    skipped += 1
+        if skipped:
+            logger.warning(f"Skipped {skipped} unreadable updates in {self.path}")
+        return applied
+
+    def load(self):
+        """The snapshot with every process's logged updates replayed over it"""
+        with self._locked():
+            store = self._load_snapshot(self.snapshot_path)
+            self._replay(store)
+        return store
+
+    def record(self, entry: List[Any]):
+        """Queue one update (a JSON-serializable list) for the next flush"""
+        with self._pending_lock:
+            self._pending.append(entry)
+
+    def flush(self) -> int:
+        """Append the queued updates to the log, compacting it if it has grown too large; Returns: updates written"""
+        with self._pending_lock:
+            pending, self._pending = self._pending, []
+        if not pending:
+            return 0
+        lines = "".join(json.dumps(entry, separators=(",", ":")) + "\n" for entry in pending)
+        with self._locked():
+            generation = self._snapshot_generation()
+            if self._log_generation() != generation:
+                self._start_log(generation)
+            with open(self.path, "a+b") as f:
+                # A writer that died mid-line must not glue its partial line to these
+                if f.tell():
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b"\n":
+                        f.write(b"\n")
+                f.write(lines.encode("utf-8"))
+                size = f.tell()
+            if size > self.compact_bytes:
+                self._compact(generation)
+        return len(pending)
+
+    def _compact(self, generation: int):
+        """Fold the log into a new snapshot generation (under the lock)"""
+        store = self._load_snapshot(self.snapshot_path)
+        self._replay(store)
+        store.generation = generation + 1
+        store.save(self.snapshot_path)
+        self._start_log(generation + 1)
+        self.compactions += 1
@@ -0,0 +1,353 @@
+#!/usr/bin/env python
+# Continuous scoring of append-only JSON-lines event files, outside the Next.js API
+#
+# Usage:
+#   python stream_processor.py <events.jsonl> [<events.jsonl> ...] --output verdicts.jsonl
+#                              [--checkpoint models/stream_checkpoint.json] [--once]
+#
+# Each input line is {"model_type": "login"|"transaction", "features": {...}} with an optional
+# "event_id". Every input file is tailed by its own reader thread; one scorer thread groups
+# events into micro-batches for detect_anomaly_batch, and one writer thread appends verdicts to
+# the sink. The queues between them are bounded, so a slow sink blocks the scorer, which in turn
+# blocks the readers: memory in flight never exceeds the queue sizes.
+#
+# Read offsets are checkpointed only after the verdicts up to them are flushed to the sink, together
+# with the sink's size at that point. On restart the sink is truncated back to that size and every
+# input resumes from its checkpointed offset, so each event gets exactly one verdict line.
+# An event that cannot be scored gets a verdict with an "error" instead, and its offset is committed
+# like any other, so a bad line is never replayed forever.
+
+import os
+import sys
+import json
+import time
+import queue
+import signal
+import argparse
+import logging
+import threading
+from typing import Dict, Any, List, Optional, Iterator, Tuple
+
+from anomaly_detection_model import AnomalyDetectionModel, MODEL_DIR
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHECKPOINT_PATH = os.path.join(MODEL_DIR, "stream_checkpoint.json")
+MODEL_TYPES = ("login", "transaction")
+
+# Marks the end of a queue once every producer is done
+_END = object()
+
+
+def tail_lines(path: str, offset: int, stop: threading.Event, poll_interval: float = 0.5,
+               follow: bool = True) -> Iterator[Tuple[Optional[bytes], int]]:
+    """
+    Yield (line, offset after the line) for every complete line of an append-only file from offset
+    A trailing line without its newline is left for later, as the writer may still be appending it.
+    A file that shrinks below the offset was truncated or rotated and is read again from the start.
+    With follow=False the generator ends at the current end of the file. While following, it yields
+    (None, offset) once per idle poll so the consumer can notice a stop request.
+    """
+    while not stop.is_set():
+        try:
+            f = open(path, 'rb')
+            break
+        except FileNotFoundError:
+            if not follow:
+                return
+            yield None, offset
+            time.sleep(poll_interval)
+    else:
+        return
+
+    with f:
+        if os.fstat(f.fileno()).st_size < offset:
+            logger.warning(f"{path} is shorter than the checkpointed offset {offset}; reading it from the start")
+            offset = 0
+        f.seek(offset)
+
+        while not stop.is_set():
+            line = f.readline()
+            if line.endswith(b"\n"):
+                offset += len(line)
+                yield line, offset
+                continue
+
+            # Partial or no line: rewind to its start and wait for the rest
+            f.seek(offset)
+            if not follow:
+                return
+            if os.stat(path).st_size < offset:
+                logger.warning(f"{path} was truncated; reading it from the start")
+                offset = 0
+                f.seek(0)
+                continue
+            yield None, offset
+            time.sleep(poll_interval)
+
+
+def parse_events(lines: Iterator[Tuple[Optional[bytes], int]]) -> Iterator[Tuple[Optional[Dict[str, Any]], int]]:
+    """
+    Turn raw lines into (record, offset); malformed lines give (None, offset) so their offset is still committed
+    Idle polls are dropped
+    """
+    for line, offset in lines:
+        if line is None:
+            continue
+        if not line.strip():
+            yield None, offset
+            continue
+        try:
+            record = json.loads(line)
+            if record.get("model_type") not in MODEL_TYPES or not isinstance(record.get("features"), dict):
+                raise ValueError("expected model_type and a features object")
+            yield record, offset
+        except (ValueError, AttributeError) as e:
+            logger.warning(f"Skipping malformed event at offset {offset}: {str(e)}")
+            yield None, offset
+
+
+class Checkpoint:
+    """Committed read offset per input file and the sink size they correspond to"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.offsets = {}
+        self.sink_size = None
+        if os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    state = json.load(f)
+                self.offsets = {source: int(offset) for source, offset in state.get("offsets", {}).items()}
+                self.sink_size = state.get("sink_size")
+            except (OSError, ValueError) as e:
+                logger.error(f"Error reading checkpoint {path}: {str(e)}. Starting from the beginning.")
+
+    def offset(self, source: str) -> int:
+        return self.offsets.get(os.path.abspath(source), 0)
+
+    def commit(self, offsets: Dict[str, int], sink_size: Optional[int]):
+        """Atomically record new offsets; only called once the matching verdicts are durable in the sink"""
+        self.offsets.update(offsets)
+        self.sink_size = sink_size
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"offsets": self.offsets, "sink_size": sink_size, "updated_at": time.time()}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+
+class JsonLinesSink:
+    """Append verdicts to a JSON-lines file ("-" for stdout)"""
+
+    def __init__(self, path: str, resume_size: Optional[int] = None):
+        self.path = path
+        if path == "-":
+            self.stream = sys.stdout
+            return
+        self.stream = open(path, 'a', encoding='utf-8')
+        # Drop verdicts written after the last checkpoint; their events will be scored again
+        if resume_size is not None and os.path.getsize(path) > resume_size:
+            logger.info(f"Truncating {path} to the checkpointed size {resume_size}")
+            self.stream.truncate(resume_size)
+
+    def write(self, verdicts: List[Dict[str, Any]]):
+        self.stream.write("".join(json.dumps(verdict) + "\n" for verdict in verdicts))
+
+    def flush(self) -> Optional[int]:
+        """Make the written verdicts durable; Returns: the sink size, or None for stdout"""
+        self.stream.flush()
+        if self.stream is sys.stdout:
+            return None
+        os.fsync(self.stream.fileno())
+        return self.stream.tell()
+
+    def close(self):
+        if self.stream is not sys.stdout:
+            self.stream.close()
+
+
+class StreamProcessor:
+    """Tail input files, score them in micro-batches and write verdicts with checkpointed offsets"""
+
+    def __init__(self, inputs: List[str], sink: JsonLinesSink, checkpoint: Checkpoint,
+                 batch_size: int = 32, max_wait_ms: float = 50.0, queue_size: int = 1024,
+                 poll_interval: float = 0.5, follow: bool = True, models: Dict[str, AnomalyDetectionModel] = None):
+        self.inputs = [os.path.abspath(path) for path in inputs]
+        self.sink = sink
+        self.checkpoint = checkpoint
+        self.batch_size = batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.poll_interval = poll_interval
+        self.follow = follow
+        self.models = models or {model_type: AnomalyDetectionModel(model_type) for model_type in MODEL_TYPES}
+
+        # Bounded hand-offs: readers -> scorer (events), scorer -> writer (batches of verdicts)
+        self.events = queue.Queue(maxsize=queue_size)
+        self.verdicts = queue.Queue(maxsize=max(1, queue_size // batch_size))
+        self.stop_event = threading.Event()
+        # Set once the scorer has put its last batch, so the writer stops at the empty queue
+        self._scoring_done = threading.Event()
+        self.stats = {"events": 0, "malformed": 0, "errors": 0, "batches": 0, "backpressure_s": 0.0}
+
+    def _put(self, target: queue.Queue, item) -> bool:
+        """Blocking put that still notices a stop request; time spent blocked is backpressure"""
+        started = time.perf_counter()
+        while not self.stop_event.is_set():
+            try:
+                target.put(item, timeout=0.1)
+                self.stats["backpressure_s"] += time.perf_counter() - started
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _read(self, source: str):
+        lines = tail_lines(source, self.checkpoint.offset(source), self.stop_event,
+                           poll_interval=self.poll_interval, follow=self.follow)
+        for record, offset in parse_events(lines):
+            if not self._put(self.events, (source, offset, record)):
+                return
+
+    def _score(self, batch: List[Tuple[str, int, Optional[Dict[str, Any]]]]) -> List[Tuple[str, int, Optional[Dict[str, Any]]]]:
+        """Score one micro-batch, one detect_anomaly_batch call per model type, keeping input order"""
+        verdicts = [None] * len(batch)
+        for model_type in MODEL_TYPES:
+            indices = [i for i, (_, _, record) in enumerate(batch) if record and record["model_type"] == model_type]
+            if not indices:
+                continue
+            features_list = [batch[i][2]["features"] for i in indices]
+            try:
+                results = self.models[model_type].detect_anomaly_batch(features_list)
+            except Exception as e:
+                logger.error(f"Error scoring {model_type} batch, scoring its events one by one: {str(e)}", exc_info=True)
+                results = [self._score_one(model_type, features) for features in features_list]
+            for i, result in zip(indices, results):
+                source, offset, record = batch[i]
+                verdict = {"source": source, "offset": offset, "model_type": model_type}
+                if "event_id" in record:
+                    verdict["event_id"] = record["event_id"]
+                verdict.update(result)
+                verdicts[i] = verdict
+
+        self.stats["malformed"] += sum(1 for _, _, record in batch if record is None)
+        self.stats["events"] += len(batch)
+        self.stats["batches"] += 1
+        return [(source, offset, verdict) for (source, offset, _), verdict in zip(batch, verdicts)]
+
+    def _score_one(self, model_type: str, features: Dict[str, Any]) -> Dict[str, Any]:
+        """Score one event of a failed batch; Returns: its verdict, or an error verdict if it fails too"""
+        try:
+            return self.models[model_type].detect_anomaly_batch([features])[0]
+        except Exception as e:
+            logger.warning(f"Error scoring {model_type} event: {str(e)}")
+            self.stats["errors"] += 1
+            return {"error": str(e)}
+
+    def _scorer(self, readers: List[threading.Thread]):
+        try:
+            self._score_batches(readers)
+        finally:
+            self._scoring_done.set()
+            try:
+                self.verdicts.put_nowait(_END)
+            except queue.Full:
+                pass    # the writer stops at the empty queue instead
+
+    def _score_batches(self, readers: List[threading.Thread]):
+        while True:
+            batch = []
+            deadline = None
+            while len(batch) < self.batch_size:
+                timeout = 0.1 if deadline is None else max(0.0, deadline - time.monotonic())
+                try:
+                    batch.append(self.events.get(timeout=timeout))
+                    deadline = deadline or time.monotonic() + self.max_wait
+                except queue.Empty:
+                    if batch or self.stop_event.is_set() or not any(reader.is_alive() for reader in readers):
+                        break
+
+            if batch:
+                if not self._put(self.verdicts, self._score(batch)):
+                    break
+            elif self.stop_event.is_set() or (self.events.empty() and not any(r.is_alive() for r in readers)):
+                break
+
+    def _writer(self):
+        try:
+            self._write_batches()
+        except Exception as e:
+            # Nothing more can be committed; stop the readers and the scorer instead of blocking them
+            logger.error(f"Error writing verdicts to {self.sink.path}: {str(e)}", exc_info=True)
+            self.stop_event.set()
+
+    def _write_batches(self):
+        while True:
+            try:
+                item = self.verdicts.get(timeout=0.1)
+            except queue.Empty:
+                if self._scoring_done.is_set() or self.stop_event.is_set():
+                    return
+                continue
+            if item is _END:
+                return
+            self.sink.write([verdict for _, _, verdict in item if verdict is not None])
+            sink_size = self.sink.flush()
+
+            # Within one source events arrive in order, so the last offset of the batch covers all before it
+            offsets = {}
+            for source, offset, _ in item:
+                offsets[source] = offset
+            self.checkpoint.commit(offsets, sink_size)
+
+    def run(self) -> Dict[str, Any]:
+        """Process until stopped (or, without follow, until every input is drained)"""
+        started = time.perf_counter()
+        readers = [threading.Thread(target=self._read, args=(source,), daemon=True) for source in self.inputs]
+        for reader in readers:
+            reader.start()
+        writer = threading.Thread(target=self._writer, daemon=True)
+        writer.start()
+
+        try:
+            self._scorer(readers)
+        finally:
+            self.stop_event.set()
+            writer.join()
+            for reader in readers:
+                reader.join(timeout=self.poll_interval + 1.0)
+            self.sink.close()
+
+        return {**self.stats, "elapsed_s": time.perf_counter() - started, "offsets": dict(self.checkpoint.offsets)}
+
+    def stop(self):
+        self.stop_event.set()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Score append-only JSON-lines event files continuously")
+    parser.add_argument("inputs", nargs="+", help="Event files to tail")
+    parser.add_argument("--output", default="-", help="JSON-lines verdict sink (default: stdout)")
+    parser.add_argument("--checkpoint", default=DEFAULT_CHECKPOINT_PATH)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--max-wait-ms", type=float, default=50.0, help="Longest a partial batch waits for more events")
+    parser.add_argument("--queue-size", type=int, default=1024, help="Events buffered between the readers and the scorer")
+    parser.add_argument("--poll-interval", type=float, default=0.5, help="Seconds between checks for new data")
+    parser.add_argument("--once", action="store_true", help="Drain the current contents of the inputs and exit")
+    args = parser.parse_args()
+
+    checkpoint = Checkpoint(args.checkpoint)
+    processor = StreamProcessor(
+        args.inputs, JsonLinesSink(args.output, checkpoint.sink_size), checkpoint,
+        batch_size=args.batch_size, max_wait_ms=args.max_wait_ms, queue_size=args.queue_size,
+        poll_interval=args.poll_interval, follow=not args.once
+    )
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: processor.stop())
+
+    summary = processor.run()
+    print(json.dumps(summary), file=sys.stderr)
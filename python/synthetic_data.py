@@ -0,0 +1,410 @@
+#!/usr/bin/env python
+# Seeded, chunked generator of synthetic login and transaction data
+#
+# Usage:
+#   python synthetic_data.py events <login|transaction> <n> [--out events.jsonl] [--seed 42]
+#                            [--anomaly-fraction 0.2] [--mix location=2,night=1]
+#   python synthetic_data.py bench [--rows 5000000] [--events 200000]
+#   python synthetic_data.py check [--events 5000]
+#
+# Rows are generated in fixed blocks of BLOCK_ROWS, each with its own random stream derived from
+# (seed, model type, block index). The output for a seed is therefore the same whatever chunk
+# size it is read in, any block can be generated on its own (e.g. by parallel workers), and
+# streaming n rows only ever holds one block plus one chunk in memory.
+#
+# Feature matrices follow the static models' feature order (LOGIN_FEATURES / TRANSACTION_FEATURES).
+# Event dicts carry the raw request fields those features are derived from, plus user, session
+# and account ids and ISO timestamps. Keystroke timings are in ms, like real requests (see
+# keystroke_features.py), with a mean that follows the typing speed. Every event reproduces its row
+# exactly once the scorer prepares its features: the timings' variance is the row's
+# keystroke_variance, and `check` asserts this round trip. Events are written as
+# {"model_type", "features", "label"} JSON lines, which traffic_replay.py, incremental_retrain.py and
+# feedback_ingestion.py all read.
+
+import sys
+import json
+import time
+import argparse
+import logging
+from typing import Dict, Any, List, Optional, Iterator, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+BLOCK_ROWS = 16384
+DEFAULT_CHUNK_ROWS = 65536
+DEFAULT_SEED = 42
+DEFAULT_ANOMALY_FRACTION = 0.2
+DEFAULT_START_DATE = "2025-04-18"
+DEFAULT_ROWS_PER_DAY = 100000
+DEFAULT_USERS = 10000
+
+MODEL_TYPE_CODES = {"login": 0, "transaction": 1}
+
+# Columns of the feature matrices (the same order as the static models' features)
+LOGIN_COLUMNS = ['typing_speed', 'cursor_movements', 'session_duration', 'hour',
+                 'latitude', 'longitude', 'keystroke_variance']
+TRANSACTION_COLUMNS = ['transaction_amount', 'from_balance', 'amount_ratio', 'transaction_frequency',
+                       'session_duration', 'hour', 'latitude', 'longitude', 'cursor_movements']
+
+# What each kind of anomaly makes extreme; "all" makes every feature extreme at once, which is
+# what the initial training data has always used
+ANOMALY_KINDS = {
+    "login": ["typing", "cursor", "session", "night", "location", "all"],
+    "transaction": ["amount", "frequency", "session", "night", "location", "cursor", "all"]
+}
+DEFAULT_ANOMALY_MIX = {"all": 1.0}
+
+
+def feature_columns(model_type: str) -> List[str]:
+    """Names of the feature columns of generate_matrix / matrix_block rows, in order"""
+    if model_type not in MODEL_TYPE_CODES:
+        raise ValueError(f"Unknown model type: {model_type}")
+    return LOGIN_COLUMNS if model_type == "login" else TRANSACTION_COLUMNS
+
+
+def _block_rng(seed: int, model_type: str, block: int, stream: int = 0) -> np.random.Generator:
+    return np.random.default_rng([seed, MODEL_TYPE_CODES[model_type], block, stream])
+
+
+def _normal_rows(model_type: str, rng: np.random.Generator, n: int) -> np.ndarray:
+    """Typical behaviour: daytime, in the home region, moderate values"""
+    if model_type == "login":
+        X = np.empty((n, 7))
+        X[:, 0] = rng.random(n) * 10                # typing_speed: 0-10 chars/sec
+        X[:, 1] = np.floor(rng.random(n) * 100)     # cursor_movements: 0-99 movements
+        X[:, 2] = rng.random(n) * 120 + 30          # session_duration: 30-150 seconds
+        X[:, 3] = rng.integers(8, 20, size=n)       # hour: 8am-8pm
+        X[:, 4] = rng.uniform(10, 40, size=n)       # latitude: 10-40
+        X[:, 5] = rng.uniform(70, 100, size=n)      # longitude: 70-100
+        X[:, 6] = rng.uniform(0.01, 0.2, size=n)    # keystroke_variance: 0.01-0.2 s^2
+        return X
+
+    X = np.empty((n, 9))
+    X[:, 0] = rng.random(n) * 5000                  # transaction_amount: 0-5000
+    X[:, 1] = X[:, 0] * 10                          # from_balance: 10x transaction amount
+    X[:, 2] = X[:, 0] / np.where(X[:, 1] > 0, X[:, 1], 1.0)  # amount_ratio
+    X[:, 3] = rng.integers(1, 20, size=n)           # transaction_frequency: 1-20
+    X[:, 4] = rng.integers(30, 300, size=n)         # session_duration: 30-300 seconds
+    X[:, 5] = rng.integers(8, 20, size=n)           # hour: 8am-8pm
+    X[:, 6] = rng.uniform(10, 40, size=n)           # latitude: 10-40
+    X[:, 7] = rng.uniform(70, 100, size=n)          # longitude: 70-100
+    X[:, 8] = rng.integers(10, 100, size=n)         # cursor_movements: 10-100
+    return X
+
+
+def _make_anomalous(model_type: str, X: np.ndarray, kinds: np.ndarray, rng: np.random.Generator):
+    """Overwrite the features each row's anomaly kind makes extreme, in place"""
+    def rows(kind):
+        return np.flatnonzero((kinds == kind) | (kinds == "all"))
+
+    if model_type == "login":
+        r = rows("typing")
+        X[r, 0] = rng.choice([0.5, 15], size=len(r))            # very slow or very fast typing
+        X[r, 6] = rng.uniform(0.5, 2.0, size=len(r))            # high keystroke variance
+        r = rows("cursor")
+        X[r, 1] = rng.choice([5, 200], size=len(r))             # very few or many cursor movements
+        r = rows("session")
+        X[r, 2] = rng.choice([10, 300], size=len(r))            # very short or long sessions
+        r = rows("night")
+        X[r, 3] = rng.choice([1, 3, 23], size=len(r))           # unusual hours (night)
+        r = rows("location")
+        X[r, 4] = rng.uniform(-90, 90, size=len(r))             # random latitudes
+        X[r, 5] = rng.uniform(-180, 180, size=len(r))           # random longitudes
+        return
+
+    r = rows("amount")
+    X[r, 0] = rng.uniform(8000, 20000, size=len(r))             # very large transactions
+    X[r, 1] = rng.uniform(5000, 15000, size=len(r))             # lower balances
+    X[r, 2] = X[r, 0] / X[r, 1]                                 # high amount_ratio
+    r = rows("frequency")
+    X[r, 3] = rng.choice([0, 30], size=len(r))                  # very low or high frequency
+    r = rows("session")
+    X[r, 4] = rng.choice([5, 600], size=len(r))                 # very short or long sessions
+    r = rows("night")
+    X[r, 5] = rng.choice([1, 3, 23], size=len(r))               # unusual hours (night)
+    r = rows("location")
+    X[r, 6] = rng.uniform(-90, 90, size=len(r))                 # random latitudes
+    X[r, 7] = rng.uniform(-180, 180, size=len(r))               # random longitudes
+    r = rows("cursor")
+    X[r, 8] = rng.choice([5, 200], size=len(r))                 # unusual cursor movements
+
+
+def matrix_block(model_type: str, block: int, rows: int = BLOCK_ROWS, seed: int = DEFAULT_SEED,
+                 anomaly_fraction: float = DEFAULT_ANOMALY_FRACTION,
+                 anomaly_mix: Optional[Dict[str, float]] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    One block of feature rows; exactly round(rows * anomaly_fraction) of them are anomalous
+    anomaly_mix: relative weight of each anomaly kind (see ANOMALY_KINDS), default all-at-once
+    Returns: (X, y, kinds) with the anomaly kind of each row ("" for normal rows)
+    """
+    feature_columns(model_type)
+    mix = anomaly_mix or DEFAULT_ANOMALY_MIX
+    unknown = set(mix) - set(ANOMALY_KINDS[model_type])
+    if unknown:
+        raise ValueError(f"Unknown {model_type} anomaly kinds: {', '.join(sorted(unknown))}")
+
+    rng = _block_rng(seed, model_type, block)
+    X = _normal_rows(model_type, rng, rows)
+
+    n_anomalies = int(round(rows * anomaly_fraction))
+    y = np.zeros(rows)
+    anomalous = rng.permutation(rows)[:n_anomalies]
+    y[anomalous] = 1.0
+
+    names = list(mix)
+    weights = np.asarray([mix[name] for name in names], dtype=float)
+    kinds = np.full(rows, "", dtype=object)
+    kinds[anomalous] = np.asarray(names, dtype=object)[rng.choice(len(names), size=n_anomalies, p=weights / weights.sum())]
+    _make_anomalous(model_type, X, kinds, rng)
+    return X, y, kinds
+
+
+def _blocks(n: int, block_rows: int) -> Iterator[Tuple[int, int]]:
+    for block in range(-(-n // block_rows)):
+        yield block, min(block_rows, n - block * block_rows)
+
+
+def iter_matrix_chunks(model_type: str, n: int, chunk_size: int = DEFAULT_CHUNK_ROWS, seed: int = DEFAULT_SEED,
+                       anomaly_fraction: float = DEFAULT_ANOMALY_FRACTION,
+                       anomaly_mix: Optional[Dict[str, float]] = None) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """
+    n feature rows and labels, yielded as (X, y) chunks of chunk_size rows (the last may be shorter)
+    The rows do not depend on chunk_size
+    """
+    pending_X, pending_y, pending = [], [], 0
+    for block, rows in _blocks(n, BLOCK_ROWS):
+        X, y, _ = matrix_block(model_type, block, rows, seed, anomaly_fraction, anomaly_mix)
+        pending_X.append(X)
+        pending_y.append(y)
+        pending += rows
+        while pending >= chunk_size:
+            X, y = np.concatenate(pending_X), np.concatenate(pending_y)
+            yield X[:chunk_size], y[:chunk_size]
+            pending_X, pending_y, pending = [X[chunk_size:]], [y[chunk_size:]], pending - chunk_size
+    if pending:
+        yield np.concatenate(pending_X), np.concatenate(pending_y)
+
+
+def generate_matrix(model_type: str, n: int, seed: int = DEFAULT_SEED, **kwargs) -> Tuple[np.ndarray, np.ndarray]:
+    """All n rows of iter_matrix_chunks() at once (for training sets that fit in memory)"""
+    chunks = list(iter_matrix_chunks(model_type, n, chunk_size=max(1, n), seed=seed, **kwargs))
+    return chunks[0] if chunks else (np.empty((0, len(feature_columns(model_type)))), np.empty(0))
+
+
+def _timestamps(start_index: int, hours: np.ndarray, rng: np.random.Generator, start_date: str,
+                rows_per_day: int) -> List[str]:
+    """ISO timestamps on the row's day (rows_per_day rows per day) at the row's hour"""
+    days = (start_index + np.arange(len(hours))) // rows_per_day
+    seconds = days * 86400 + hours.astype(np.int64) * 3600 + rng.integers(0, 3600, size=len(hours))
+    milliseconds = rng.integers(0, 1000, size=len(hours))
+    moments = np.datetime64(start_date, 'ms') + seconds.astype('timedelta64[s]') + milliseconds.astype('timedelta64[ms]')
+    return [f"{moment}Z" for moment in np.datetime_as_string(moments, unit='ms')]
+
+
+def _keystroke_timings(typing_speed: np.ndarray, keystroke_variance: np.ndarray,
+                       rng: np.random.Generator) -> List[List[float]]:
+    """
+    Key intervals in ms with mean 1000 / typing_speed whose variance is exactly keystroke_variance, as
+    the scorer computes it (np.var of the timings); gamma draws give each sequence its skewed shape
+    and are then rescaled about the sequence mean to that variance
+    """
+    mean = 1000.0 / np.maximum(typing_speed, 0.5)
+    lengths = rng.integers(10, 60, size=len(mean))
+    starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    draws = rng.gamma(4.0, 1.0, size=int(lengths.sum()))
+    centered = draws - np.repeat(np.add.reduceat(draws, starts) / lengths, lengths)
+    spread = np.add.reduceat(centered * centered, starts) / lengths
+    scale = np.sqrt(np.maximum(keystroke_variance, 0.0) / spread)
+    values = (np.repeat(mean, lengths) + centered * np.repeat(scale, lengths)).tolist()
+    offsets = np.concatenate([starts, [len(values)]]).tolist()
+    return [values[offsets[i]:offsets[i + 1]] for i in range(len(mean))]
+
+
+def event_block(model_type: str, block: int, rows: int = BLOCK_ROWS, seed: int = DEFAULT_SEED,
+                anomaly_fraction: float = DEFAULT_ANOMALY_FRACTION, anomaly_mix: Optional[Dict[str, float]] = None,
+                start_date: str = DEFAULT_START_DATE, rows_per_day: int = DEFAULT_ROWS_PER_DAY,
+                n_users: int = DEFAULT_USERS) -> Tuple[List[Dict[str, Any]], np.ndarray]:
+    """
+    The request dicts behind one matrix_block() (same seed, block and rows give the same feature values)
+    Returns: (events, y)
+    """
+    X, y, _ = matrix_block(model_type, block, rows, seed, anomaly_fraction, anomaly_mix)
+    rng = _block_rng(seed, model_type, block, stream=1)
+    start = block * BLOCK_ROWS
+    users = rng.integers(0, n_users, size=rows).tolist()
+    timestamps = _timestamps(start, X[:, feature_columns(model_type).index('hour')], rng, start_date, rows_per_day)
+
+    if model_type == "login":
+        timings = _keystroke_timings(X[:, 0], X[:, 6], rng)
+        events = [
+            {
+                'user_id': f"user-{user}",
+                'session_id': f"session-{seed}-{start + i}",
+                'typing_speed': typing_speed,
+                'cursor_movements': int(cursor_movements),
+                'session_duration': session_duration,
+                'keystroke_timings': keystroke_timings,
+                'latitude': latitude,
+                'longitude': longitude,
+                'timestamp': timestamp
+            }
+            for i, (user, (typing_speed, cursor_movements, session_duration, _, latitude, longitude, _),
+                    keystroke_timings, timestamp)
+            in enumerate(zip(users, X.tolist(), timings, timestamps))
+        ]
+        return events, y
+
+    recipients = rng.integers(0, n_users, size=rows).tolist()
+    events = [
+        {
+            'user_id': f"user-{user}",
+            'from_account_id': f"account-{user}",
+            'to_account_id': f"account-{recipient}",
+            'transaction_amount': amount,
+            'from_balance': balance,
+            'transaction_frequency': int(frequency),
+            'session_duration': int(session_duration),
+            'cursor_movements': int(cursor_movements),
+            'latitude': latitude,
+            'longitude': longitude,
+            'timestamp': timestamp
+        }
+        for user, recipient, (amount, balance, _, frequency, session_duration, _, latitude, longitude, cursor_movements),
+            timestamp
+        in zip(users, recipients, X.tolist(), timestamps)
+    ]
+    return events, y
+
+
+def iter_event_chunks(model_type: str, n: int, chunk_size: int = DEFAULT_CHUNK_ROWS, seed: int = DEFAULT_SEED,
+                      **kwargs) -> Iterator[Tuple[List[Dict[str, Any]], np.ndarray]]:
+    """
+    n request dicts and labels, yielded as (events, y) chunks of chunk_size (see event_block for the options)
+    The events do not depend on chunk_size
+    """
+    pending_events, pending_y = [], []
+    for block, rows in _blocks(n, BLOCK_ROWS):
+        events, y = event_block(model_type, block, rows, seed, **kwargs)
+        pending_events.extend(events)
+        pending_y.append(y)
+        while len(pending_events) >= chunk_size:
+            labels = np.concatenate(pending_y)
+            yield pending_events[:chunk_size], labels[:chunk_size]
+            pending_events, pending_y = pending_events[chunk_size:], [labels[chunk_size:]]
+    if pending_events:
+        yield pending_events, np.concatenate(pending_y)
+
+
+def generate_events(model_type: str, n: int, seed: int = DEFAULT_SEED, **kwargs) -> Tuple[List[Dict[str, Any]], np.ndarray]:
+    """All n events of iter_event_chunks() at once"""
+    events, labels = [], []
+    for chunk, y in iter_event_chunks(model_type, n, seed=seed, **kwargs):
+        events.extend(chunk)
+        labels.append(y)
+    return events, np.concatenate(labels) if labels else np.empty(0)
+
+
+def write_events(path: str, model_type: str, n: int, seed: int = DEFAULT_SEED, **kwargs) -> int:
+    """Stream n events as {"model_type", "features", "label"} JSON lines to path ("-" for stdout)"""
+    out = sys.stdout if path == "-" else open(path, 'w', encoding='utf-8')
+    written = 0
+    try:
+        for events, y in iter_event_chunks(model_type, n, seed=seed, **kwargs):
+            out.write("".join(
+                json.dumps({"model_type": model_type, "features": event, "label": int(label)}) + "\n"
+                for event, label in zip(events, y)
+            ))
+            written += len(events)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    return written
+
+
+def _parse_mix(text: Optional[str]) -> Optional[Dict[str, float]]:
+    if not text:
+        return None
+    return {kind: float(weight) for kind, weight in (item.split("=") for item in text.split(","))}
+
+
+def bench(rows: int = 5000000, events: int = 200000, seed: int = DEFAULT_SEED) -> Dict[str, Any]:
+    """
+    Generation throughput, and the peak memory of streaming compared with one chunk
+    Returns: dict with rows per second for matrices and events, and peak traced MB
+    """
+    import tracemalloc
+
+    report = {}
+    for model_type in MODEL_TYPE_CODES:
+        tracemalloc.start()
+        started = time.perf_counter()
+        total = sum(len(y) for _, y in iter_matrix_chunks(model_type, rows, seed=seed))
+        elapsed = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        started = time.perf_counter()
+        total_events = sum(len(chunk) for chunk, _ in iter_event_chunks(model_type, events, chunk_size=4096, seed=seed))
+        event_elapsed = time.perf_counter() - started
+
+        report[model_type] = {
+            "matrix_rows": total,
+            "matrix_rows_per_s": total / elapsed,
+            "matrix_peak_mb": peak / 2**20,
+            "events": total_events,
+            "events_per_s": total_events / event_elapsed
+        }
+    return report
+
+
+def check(events: int = 5000, seed: int = DEFAULT_SEED, tolerance: float = 1e-9) -> Dict[str, Any]:
+    """
+    Whether every event, written and read back as JSON, prepares to the same row as the matrix
+    (see anomaly_detection_model.prepare_features)
+    Returns: dict with ok and, per model type, the largest relative error of each feature
+    """
+    from anomaly_detection_model import prepare_features
+
+    report = {"ok": True}
+    for model_type in MODEL_TYPE_CODES:
+        X, y = generate_matrix(model_type, events, seed=seed)
+        event_dicts, labels = generate_events(model_type, events, seed=seed)
+        prepared = np.vstack([prepare_features(model_type, json.loads(json.dumps(features)))
+                              for features in event_dicts])
+        error = (np.abs(prepared - X) / np.maximum(np.abs(X), 1.0)).max(axis=0)
+        report[model_type] = dict(zip(feature_columns(model_type), error.tolist()))
+        report["ok"] = report["ok"] and bool(np.array_equal(y, labels)) and bool((error <= tolerance).all())
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic login and transaction data")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    events_parser = subparsers.add_parser("events", help="Write labeled events as JSON lines")
+    events_parser.add_argument("model_type", choices=list(MODEL_TYPE_CODES))
+    events_parser.add_argument("n", type=int)
+    events_parser.add_argument("--out", default="-")
+    events_parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    events_parser.add_argument("--anomaly-fraction", type=float, default=DEFAULT_ANOMALY_FRACTION)
+    events_parser.add_argument("--mix", default=None, help="Anomaly kind weights, e.g. location=2,night=1")
+    events_parser.add_argument("--rows-per-day", type=int, default=DEFAULT_ROWS_PER_DAY)
+    events_parser.add_argument("--users", type=int, default=DEFAULT_USERS)
+    bench_parser = subparsers.add_parser("bench", help="Measure generation throughput and memory")
+    bench_parser.add_argument("--rows", type=int, default=5000000)
+    bench_parser.add_argument("--events", type=int, default=200000)
+    check_parser = subparsers.add_parser("check", help="Assert that events prepare to their matrix rows")
+    check_parser.add_argument("--events", type=int, default=5000)
+    check_parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    args = parser.parse_args()
+
+    if args.command == "events":
+        write_events(args.out, args.model_type, args.n, seed=args.seed, anomaly_fraction=args.anomaly_fraction,
+                     anomaly_mix=_parse_mix(args.mix), rows_per_day=args.rows_per_day, n_users=args.users)
+    elif args.command == "check":
+        report = check(args.events, seed=args.seed)
+        print(json.dumps(report, indent=2))
+        sys.exit(0 if report["ok"] else 1)
+    else:
+        print(json.dumps(bench(args.rows, args.events), indent=2))
@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+# Replay recorded traffic against the anomaly scorer and report latency and verdict statistics
+#
+# Usage:
+#   python traffic_replay.py <corpus> [<corpus> ...] [--target batch|cli|server] [--rate 50] [--concurrency 8]
+#
+# A corpus is either an anomaly detection log (the "Starting ... anomaly detection with features:"
+# lines are replayed) or a JSON-lines file with one {"model_type": ..., "features": {...}} per line.
+# The cli and server targets score for real and update the online models; the batch target
+# loads the models read-only in this process.
+
+import os
+import re
+import ast
+import sys
+import json
+import time
+import socket
+import argparse
+import threading
+import subprocess
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Tuple, Iterator, Optional
+
+import numpy as np
+
+LOG_LINE_PATTERN = re.compile(r"Starting (login|transaction) anomaly detection with features: (\{.*\})\s*$")
+MODEL_SCRIPT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "anomaly_detection_model.py")
+
+
+def parse_log(path: str) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """Yield (model_type, features) from the request lines of an anomaly detection log"""
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        for line in f:
+            match = LOG_LINE_PATTERN.search(line)
+            if not match:
+                continue
+            try:
+                # The features were logged with repr(), not JSON
+                yield match.group(1), ast.literal_eval(match.group(2))
+            except (ValueError, SyntaxError):
+                continue
+
+
+def parse_jsonl(path: str) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """Yield (model_type, features) from a JSON-lines export"""
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            yield record['model_type'], record['features']
+
+
+def load_corpus(paths: List[str], model_type: Optional[str] = None) -> List[Tuple[str, Dict[str, Any]]]:
+    """Load one or more log / JSON-lines files into a replay corpus"""
+    corpus = []
+    for path in paths:
+        parser = parse_jsonl if path.endswith((".jsonl", ".json")) else parse_log
+        corpus.extend(parser(path))
+    if model_type:
+        corpus = [(t, features) for t, features in corpus if t == model_type]
+    return corpus
+
+
+class CliTarget:
+    """Score by spawning the command line script, exactly as the Next.js API route does"""
+
+    def __init__(self, script_path: str = MODEL_SCRIPT_PATH):
+        self.script_path = script_path
+
+    def score(self, model_type: str, features: Dict[str, Any]) -> Dict[str, Any]:
+        completed = subprocess.run(
+            [sys.executable, self.script_path, model_type, json.dumps(features)],
+            capture_output=True, text=True
+        )
+        if completed.returncode != 0:
+            raise RuntimeError(f"Scorer exited with code {completed.returncode}")
+        return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+class ServerTarget:
+    """Score through a running scoring_server.py over one persistent connection"""
+
+    def __init__(self, host: str, port: int):
+        self.sock = socket.create_connection((host, port))
+        self.stream = self.sock.makefile('rwb')
+
+    def score(self, model_type: str, features: Dict[str, Any]) -> Dict[str, Any]:
+        self.stream.write((json.dumps({"model_type": model_type, "features": features}) + "\n").encode())
+        self.stream.flush()
+        line = self.stream.readline()
+        if not line:
+            raise ConnectionError("Scoring server closed the connection")
+        return json.loads(line)
+
+
+class BatchTarget:
+    """Score in this process through AnomalyDetectionModel.detect_anomaly_batch"""
+
+    def __init__(self):
+        from anomaly_detection_model import AnomalyDetectionModel
+        self.models = {
+            model_type: AnomalyDetectionModel(model_type, read_only=True)
+            for model_type in ("login", "transaction")
+        }
+
+    def score_batch(self, model_type: str, features_list: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        return self.models[model_type].detect_anomaly_batch(features_list)
+
+
+class ReplayReport:
+    """Collects per-request outcomes and summarizes them"""
+
+    def __init__(self):
+        self.latencies_ms = []
+        self.model_types = []
+        self.errors = 0
+        self.fallbacks = 0
+        self.verdicts = Counter()
+        self._lock = threading.Lock()
+
+    def record(self, model_type: str, latency_ms: float, result: Optional[Dict[str, Any]]):
+        with self._lock:
+            self.latencies_ms.append(latency_ms)
+            self.model_types.append(model_type)
+            if result is None or "error" in result:
+                self.errors += 1
+                return
+            if result.get("fallback"):
+                self.fallbacks += 1
+            verdict = result.get("anomaly_type") if result.get("is_anomalous") else "normal"
+            self.verdicts[f"{model_type}: {verdict or 'unknown'}"] += 1
+
+    def summary(self, elapsed: float) -> Dict[str, Any]:
+        n = len(self.latencies_ms)
+        latencies = np.asarray(self.latencies_ms) if n else np.zeros(1)
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+        return {
+            "requests": n,
+            "elapsed_s": elapsed,
+            "throughput_rps": n / elapsed if elapsed > 0 else 0.0,
+            "latency_ms": {"p50": float(p50), "p95": float(p95), "p99": float(p99), "max": float(latencies.max())},
+            "error_rate": self.errors / n if n else 0.0,
+            "fallback_rate": self.fallbacks / n if n else 0.0,
+            "verdicts": dict(self.verdicts.most_common())
+        }
+
+
+def replay(corpus: List[Tuple[str, Dict[str, Any]]], target: str = "batch", rate: Optional[float] = None,
+           concurrency: int = 8, batch_size: int = 32, host: str = "127.0.0.1", port: int = 8765,
+           repeat: int = 1) -> Dict[str, Any]:
+    """
+    Replay the corpus against a scorer
+    rate: requests per second (open loop); None replays at maximum throughput
+    Latency is measured from each request's scheduled start, so a scorer that falls
+    behind the requested rate shows up in the percentiles instead of slowing the replay.
+    """
+    corpus = corpus * repeat
+    report = ReplayReport()
+
+    if target == "batch":
+        # Batches are sent in corpus order, one model type at a time
+        scorer = BatchTarget()
+        started = time.perf_counter()
+        chunk_interval = batch_size / rate if rate else 0.0
+        for chunk_index, start in enumerate(range(0, len(corpus), batch_size)):
+            chunk = corpus[start:start + batch_size]
+            scheduled = started + chunk_index * chunk_interval
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            for model_type in ("login", "transaction"):
+                features_list = [features for t, features in chunk if t == model_type]
+                if not features_list:
+                    continue
+                try:
+                    results = scorer.score_batch(model_type, features_list)
+                except Exception:
+                    results = [None] * len(features_list)
+                latency_ms = (time.perf_counter() - scheduled) * 1000.0
+                for result in results:
+                    report.record(model_type, latency_ms, result)
+        return report.summary(time.perf_counter() - started)
+
+    local = threading.local()
+
+    def get_target():
+        if not hasattr(local, "target"):
+            local.target = CliTarget() if target == "cli" else ServerTarget(host, port)
+        return local.target
+
+    def run_one(index: int, model_type: str, features: Dict[str, Any], started: float):
+        scheduled = started + index / rate if rate else time.perf_counter()
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        try:
+            result = get_target().score(model_type, features)
+        except Exception as e:
+            result = {"error": str(e)}
+        report.record(model_type, (time.perf_counter() - scheduled) * 1000.0, result)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for index, (model_type, features) in enumerate(corpus):
+            executor.submit(run_one, index, model_type, features, started)
+    return report.summary(time.perf_counter() - started)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay recorded traffic against the anomaly scorer")
+    parser.add_argument("corpus", nargs="+", help="Anomaly detection log(s) or JSON-lines export(s)")
+    parser.add_argument("--target", choices=["batch", "cli", "server"], default="batch")
+    parser.add_argument("--rate", type=float, default=None, help="Requests per second (default: maximum throughput)")
+    parser.add_argument("--concurrency", type=int, default=8, help="Parallel clients for the cli and server targets")
+    parser.add_argument("--batch-size", type=int, default=32, help="Events per call for the batch target")
+    parser.add_argument("--model-type", choices=["login", "transaction"], default=None)
+    parser.add_argument("--repeat", type=int, default=1, help="Replay the corpus this many times")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus, args.model_type)
+    if not corpus:
+        print(json.dumps({"error": "No replayable requests found in the corpus"}))
+        sys.exit(1)
+
+    summary = replay(corpus, target=args.target, rate=args.rate, concurrency=args.concurrency,
+                     batch_size=args.batch_size, host=args.host, port=args.port, repeat=args.repeat)
+    print(json.dumps(summary, indent=2))
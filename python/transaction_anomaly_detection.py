@@ -9,9 +9,12 @@ import numpy as np
 from datetime import datetime
 import logging
 import joblib
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.preprocessing import StandardScaler
-import xgboost as xgb
+from build_models import ModelsNotReady, start_background_build, training_in_progress
+from rule_engine import columns_from_features, get_rules
+from request_profiler import profiled
+
+# This script has always reported the large-amount anomaly without the staff alert note
+ANOMALY_TYPE_LABELS = {"large_amount": "Unusually large transaction amount"}
 
 # Configure logging
 logging.basicConfig(
@@ -32,104 +35,30 @@ SCALER_PATH = "models/transaction_scaler.pkl"
 # Create models directory if it doesn't exist
 os.makedirs("models", exist_ok=True)
 
-def train_initial_models():
-    """
-    Train initial models if they don't exist
-    """
-    try:
-        # Create synthetic data for initial training
-        n_samples = 1000
-        
-        # Generate normal behavior data (80% of samples)
-        normal_samples = int(n_samples * 0.8)
-        anomaly_samples = n_samples - normal_samples
-        
-        # Features: transaction_amount, from_balance, amount_ratio, transaction_frequency, 
-        # session_duration, hour, latitude, longitude, cursor_movements
-        normal_data = np.random.rand(normal_samples, 9)
-        # Normalize to realistic ranges
-        normal_data[:, 0] *= 5000  # transaction_amount: 0-5000
-        normal_data[:, 1] = normal_data[:, 0] * 10  # from_balance: 10x transaction amount
-        normal_data[:, 2] = normal_data[:, 0] / normal_data[:, 1]  # amount_ratio: transaction/balance
-        normal_data[:, 3] = np.random.randint(1, 20, size=normal_samples)  # transaction_frequency: 1-20
-        normal_data[:, 4] = np.random.randint(30, 300, size=normal_samples)  # session_duration: 30-300 seconds
-        normal_data[:, 5] = np.random.randint(8, 20, size=normal_samples)  # hour: 8am-8pm
-        normal_data[:, 6] = np.random.uniform(10, 40, size=normal_samples)  # latitude: 10-40
-        normal_data[:, 7] = np.random.uniform(70, 100, size=normal_samples)  # longitude: 70-100
-        normal_data[:, 8] = np.random.randint(10, 100, size=normal_samples)  # cursor_movements: 10-100
-        
-        # Generate anomaly data (20% of samples)
-        anomaly_data = np.random.rand(anomaly_samples, 9)
-        # Make anomalies more extreme
-        anomaly_data[:, 0] = np.random.uniform(8000, 20000, size=anomaly_samples)  # very large transactions
-        anomaly_data[:, 1] = np.random.uniform(5000, 15000, size=anomaly_samples)  # lower balances
-        anomaly_data[:, 2] = anomaly_data[:, 0] / anomaly_data[:, 1]  # high amount_ratio
-        anomaly_data[:, 3] = np.random.choice([0, 30], size=anomaly_samples)  # very low or high frequency
-        anomaly_data[:, 4] = np.random.choice([5, 600], size=anomaly_samples)  # very short or long sessions
-        anomaly_data[:, 5] = np.random.choice([1, 3, 23], size=anomaly_samples)  # unusual hours (night)
-        anomaly_data[:, 6] = np.random.uniform(-90, 90, size=anomaly_samples)  # random latitudes
-        anomaly_data[:, 7] = np.random.uniform(-180, 180, size=anomaly_samples)  # random longitudes
-        anomaly_data[:, 8] = np.random.choice([5, 200], size=anomaly_samples)  # unusual cursor movements
-        
-        # Combine data and create labels
-        X = np.vstack([normal_data, anomaly_data])
-        y = np.hstack([np.zeros(normal_samples), np.ones(anomaly_samples)])
-        
-        # Shuffle the data
-        indices = np.arange(n_samples)
-        np.random.shuffle(indices)
-        X = X[indices]
-        y = y[indices]
-        
-        # Create and fit the scaler
-        scaler = StandardScaler()
-        X_scaled = scaler.fit_transform(X)
-        
-        # Train Random Forest model
-        rf_model = RandomForestClassifier(n_estimators=100, random_state=42)
-        rf_model.fit(X_scaled, y)
-        
-        # Train XGBoost model
-        xgb_model = xgb.XGBClassifier(n_estimators=100, random_state=42)
-        xgb_model.fit(X_scaled, y)
-        
-        # Save models
-        joblib.dump(rf_model, RF_MODEL_PATH)
-        joblib.dump(xgb_model, XGB_MODEL_PATH)
-        joblib.dump(scaler, SCALER_PATH)
-        
-        logger.info("Initial transaction models trained and saved successfully")
-        
-        return rf_model, xgb_model, scaler
-    
-    except Exception as e:
-        logger.error(f"Error training initial transaction models: {str(e)}", exc_info=True)
-        raise
-
 def load_or_train_models():
     """
-    Load existing models or train new ones if they don't exist
+    Load existing models
+    Missing or corrupt artifacts are rebuilt by a single background job (see build_models.py);
+    until then ModelsNotReady is raised and the caller falls back to heuristics
     """
     try:
         if (os.path.exists(RF_MODEL_PATH) and 
             os.path.exists(XGB_MODEL_PATH) and 
-            os.path.exists(SCALER_PATH)):
+            os.path.exists(SCALER_PATH) and
+            not training_in_progress("transaction")):
             
             logger.info("Loading existing transaction models")
             rf_model = joblib.load(RF_MODEL_PATH)
             xgb_model = joblib.load(XGB_MODEL_PATH)
             scaler = joblib.load(SCALER_PATH)
-        else:
-            logger.info("Training new transaction models")
-            rf_model, xgb_model, scaler = train_initial_models()
-            
-        return rf_model, xgb_model, scaler
+            return rf_model, xgb_model, scaler
     
     except Exception as e:
         logger.error(f"Error loading transaction models: {str(e)}", exc_info=True)
-        # Train new models as fallback
-        logger.info("Training new transaction models as fallback")
-        return train_initial_models()
+    
+    if start_background_build("transaction"):
+        logger.info("Training new transaction models in the background")
+    raise ModelsNotReady("Transaction models are not available yet")
 
 def detect_transaction_anomaly(features):
     """
@@ -138,9 +67,6 @@ def detect_transaction_anomaly(features):
     try:
         logger.info(f"Starting transaction anomaly detection with features: {features}")
         
-        # Load or train models
-        rf_model, xgb_model, scaler = load_or_train_models()
-        
         # Extract features
         from_account_id = features.get('from_account_id')
         to_account_id = features.get('to_account_id')
@@ -164,6 +90,16 @@ def detect_transaction_anomaly(features):
         except:
             hour = datetime.now().hour
         
+        # Inputs of the anomaly-type and fallback rules (missing values never match a rule)
+        rule_columns = columns_from_features(
+            {'transaction_amount': transaction_amount, 'amount_ratio': amount_ratio,
+             'session_duration': session_duration, 'hour': hour},
+            ['transaction_amount', 'amount_ratio', 'session_duration', 'hour']
+        )
+        
+        # Load models (raises ModelsNotReady while they are being built)
+        rf_model, xgb_model, scaler = load_or_train_models()
+        
         # Prepare features for the model
         model_features = np.array([
             transaction_amount,
@@ -196,19 +132,10 @@ def detect_transaction_anomaly(features):
         logger.info(f"Transaction model predictions - RF: {rf_pred} ({rf_prob:.3f}), XGB: {xgb_pred} ({xgb_prob:.3f}), Ensemble: {ensemble_pred} ({ensemble_prob:.3f})")
         
         # Determine anomaly type based on feature analysis
-        anomaly_type = None
-        if ensemble_pred == 1:
-            # Analyze which features contributed most to the anomaly
-            if amount_ratio > 0.7:
-                anomaly_type = "Unusually large transaction relative to balance"
-            elif transaction_amount > 10000:
-                anomaly_type = "Unusually large transaction amount"
-            elif session_duration is not None and session_duration < 10:
-                anomaly_type = "Unusually quick transaction"
-            elif hour >= 0 and hour <= 5:
-                anomaly_type = "Unusual transaction time (night)"
-            else:
-                anomaly_type = "Suspicious transaction pattern"
+        # Analyze which features contributed most to the anomaly (rules in anomaly_rules.json)
+        anomaly_type = get_rules("transaction").anomaly_types(
+            rule_columns, [ensemble_pred == 1], labels=ANOMALY_TYPE_LABELS
+        )[0]
         
         # Update models with this data point (online learning)
         # In a real system, you would want to confirm if this was actually an anomaly
@@ -226,37 +153,13 @@ def detect_transaction_anomaly(features):
     except Exception as e:
         logger.error(f"Error in transaction anomaly detection: {str(e)}", exc_info=True)
         
-        # Fall back to a simple heuristic approach
-        anomaly_score = 0.0
-        anomaly_type = None
-        
-        # Check transaction amount (if unusually large)
-        if transaction_amount > 10000:
-            anomaly_score += 0.3
-            anomaly_type = "Unusually large transaction"
-        
-        # Check amount ratio (if high percentage of balance)
-        if amount_ratio > 0.7:
-            anomaly_score += 0.4
-            anomaly_type = anomaly_type or "High percentage of available balance"
-        
-        # Check session duration (if too quick)
-        if session_duration is not None and session_duration < 10:
-            anomaly_score += 0.3
-            anomaly_type = anomaly_type or "Unusually quick transaction"
-        
-        # Check transaction time (if unusual)
-        if hour >= 0 and hour <= 5:
-            anomaly_score += 0.2
-            anomaly_type = anomaly_type or "Unusual transaction time (night)"
-        
-        # Determine if this is an anomaly
-        is_anomalous = anomaly_score >= 0.7
+        # Fall back to the heuristic rules (see anomaly_rules.json)
+        fallback = get_rules("transaction").fallback(rule_columns)
         
         result = {
-            "is_anomalous": is_anomalous,
-            "anomaly_type": anomaly_type if is_anomalous else None,
-            "score": anomaly_score
+            "is_anomalous": bool(fallback["is_anomalous"][0]),
+            "anomaly_type": fallback["anomaly_type"][0],
+            "score": float(fallback["score"][0])
         }
         
         logger.info(f"Fallback transaction anomaly detection result: {result}")
@@ -268,7 +171,8 @@ if __name__ == "__main__":
     features = json.loads(features_json)
     
     # Detect anomalies
-    result = detect_transaction_anomaly(features)
+    with profiled("cli.detect_transaction_anomaly", "transaction", [features]):
+        result = detect_transaction_anomaly(features)
     
     # Output result as JSON
     print(json.dumps(result))
@@ -0,0 +1,318 @@
+#!/usr/bin/env python
+# Incremental sender -> recipient transfer graph for recipient-novelty features
+
+import os
+import time
+import heapq
+import logging
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Features produced for every transfer
+TRANSFER_GRAPH_FEATURES = [
+    'recipient_is_new',           # 1.0 for the first transfer from this sender to this recipient
+    'recipient_transfer_count',   # earlier transfers on the same sender -> recipient edge
+    'recipient_in_degree',        # distinct senders that have paid this recipient (within the edge TTL)
+    'out_degree_24h',             # distinct recipients of this sender within the window
+    'new_recipient_share_24h'     # share of those recipients first paid within the window
+]
+
+DEFAULT_WINDOW_SECONDS = 24 * 60 * 60
+# Edges (sender -> recipient pairs) not used for this long are dropped, and so are the least
+# recently used ones beyond DEFAULT_MAX_EDGES, so the index stays bounded
+DEFAULT_EDGE_TTL_SECONDS = 90 * 24 * 60 * 60
+DEFAULT_MAX_EDGES = 1_000_000
+# Expired edges are swept out at most once per hour of event time; a sweep forced by the edge cap
+# keeps this share of the cap, so the next one is not due on the next transfer
+SWEEP_INTERVAL_SECONDS = 60 * 60
+SWEEP_KEEP_FRACTION = 0.9
+
+
+def event_time(features: Dict[str, Any]) -> float:
+    """Epoch seconds of an event from its ISO timestamp, or now if it has none"""
+    try:
+        return datetime.fromisoformat(features['timestamp'].replace('Z', '+00:00')).timestamp()
+    except Exception:
+        return time.time()
+
+
+class TransferGraphIndex:
+    """
+    In-memory index of sender -> recipient transfers with running window counters
+
+    Account IDs are integer-encoded on first sight and edges live in growable NumPy arrays, so
+    recording a transfer is amortized O(1). Every sender keeps a running count of the recipients it
+    paid within the window and of those it first paid within it. An expiry heap takes edges out of
+    those counts as the newest transfer time seen (the watermark) moves past them, so the window
+    features cost O(1) per transfer (plus O(log n) heap upkeep) whatever the sender's out-degree.
+    Edges unused for edge_ttl_seconds, and the least recently used ones beyond max_edges, are swept
+    out together with the accounts left without edges. Sweeps depend only on the transfers
+    recorded, so replaying the same transfers (see state_persistence.py) rebuilds the same index.
+    With a journal every transfer is also recorded there.
+    """
+
+    def __init__(self, window_seconds: float = DEFAULT_WINDOW_SECONDS,
+                 edge_ttl_seconds: float = DEFAULT_EDGE_TTL_SECONDS, max_edges: int = DEFAULT_MAX_EDGES,
+                 capacity: int = 1024):
+        self.window_seconds = window_seconds
+        self.edge_ttl_seconds = edge_ttl_seconds
+        self.max_edges = max_edges
+        self._account_ids = {}      # account id (str) -> node index
+        self._accounts = []         # node index -> account id
+        self._edge_index = {}       # (src << 32) | dst -> edge index
+        self.n_edges = 0
+        # Newest transfer time seen; the window ends there
+        self.watermark = -np.inf
+        self._next_sweep = -np.inf
+        self.sweeps = 0
+        # Snapshot generation (see state_persistence.py) and where transfers are recorded
+        self.generation = 0
+        self.journal = None
+
+        self._in_degree = np.zeros(capacity, dtype=np.int32)
+        self._recent = np.zeros(capacity, dtype=np.int32)    # recipients paid within the window, per sender
+        self._new = np.zeros(capacity, dtype=np.int32)       # of which first paid within the window
+
+        self._edge_src = np.zeros(capacity, dtype=np.int32)
+        self._edge_dst = np.zeros(capacity, dtype=np.int32)
+        self._edge_count = np.zeros(capacity, dtype=np.int32)
+        self._edge_first = np.zeros(capacity)
+        self._edge_last = np.zeros(capacity)
+        self._edge_recent = np.zeros(capacity, dtype=bool)
+        self._edge_new = np.zeros(capacity, dtype=bool)
+        # (time an edge leaves a window count, 0 for the recent count or 1 for the new one, edge key)
+        self._expiry = []
+
+    def __len__(self):
+        return self.n_edges
+
+    @property
+    def n_accounts(self) -> int:
+        return len(self._accounts)
+
+    @staticmethod
+    def _grow(array: np.ndarray, size: int, fill) -> np.ndarray:
+        if size <= len(array):
+            return array
+        grown = np.full(max(size, 2 * len(array)), fill, dtype=array.dtype)
+        grown[:len(array)] = array
+        return grown
+
+    def _node(self, account_id) -> int:
+        key = str(account_id)
+        node = self._account_ids.get(key)
+        if node is None:
+            node = len(self._accounts)
+            self._account_ids[key] = node
+            self._accounts.append(key)
+            self._in_degree = self._grow(self._in_degree, node + 1, 0)
+            self._recent = self._grow(self._recent, node + 1, 0)
+            self._new = self._grow(self._new, node + 1, 0)
+        return node
+
+    def update(self, from_account, to_account, timestamp: float) -> Tuple[int, int, Optional[int]]:
+        """
+        Record one transfer
+        Returns: (sender node, recipient node, edge count before this transfer or None if the edge is new)
+        """
+        if self.journal is not None:
+            self.journal.record([str(from_account), str(to_account), float(timestamp)])
+        if timestamp > self.watermark:
+            self.watermark = timestamp
+            if timestamp >= self._next_sweep:
+                self._sweep()
+        if self.n_edges >= self.max_edges:
+            self._sweep()
+
+        src, dst = self._node(from_account), self._node(to_account)
+        key = (src << 32) | dst
+        edge = self._edge_index.get(key)
+
+        if edge is not None:
+            previous = int(self._edge_count[edge])
+            self._edge_count[edge] += 1
+            # Events may arrive slightly out of order
+            self._edge_first[edge] = min(self._edge_first[edge], timestamp)
+            self._edge_last[edge] = max(self._edge_last[edge], timestamp)
+        else:
+            previous = None
+            edge = self.n_edges
+            size = edge + 1
+            self._edge_src = self._grow(self._edge_src, size, 0)
+            self._edge_dst = self._grow(self._edge_dst, size, 0)
+            self._edge_count = self._grow(self._edge_count, size, 0)
+            self._edge_first = self._grow(self._edge_first, size, 0.0)
+            self._edge_last = self._grow(self._edge_last, size, 0.0)
+            self._edge_recent = self._grow(self._edge_recent, size, False)
+            self._edge_new = self._grow(self._edge_new, size, False)
+
+            self._edge_src[edge] = src
+            self._edge_dst[edge] = dst
+            self._edge_count[edge] = 1
+            self._edge_first[edge] = timestamp
+            self._edge_last[edge] = timestamp
+            self._in_degree[dst] += 1
+
+            self._edge_index[key] = edge
+            self.n_edges = size
+
+        self._track(edge, key)
+        self._expire()
+        return src, dst, previous
+
+    def _track(self, edge: int, key: int):
+        """Bring an edge's window counts up to date after a transfer on it and schedule their expiry"""
+        src = self._edge_src[edge]
+        for kind, flags, counts, start in ((0, self._edge_recent, self._recent, self._edge_last[edge]),
+                                           (1, self._edge_new, self._new, self._edge_first[edge])):
+            due = start + self.window_seconds
+            inside = due >= self.watermark
+            if inside != flags[edge]:
+                flags[edge] = inside
+                counts[src] += 1 if inside else -1
+            if inside:
+                heapq.heappush(self._expiry, (due, kind, key))
+
+    def _expire(self):
+        """Take the edges the watermark has moved past out of their senders' window counts"""
+        expiry = self._expiry
+        while expiry and expiry[0][0] < self.watermark:
+            due, kind, key = heapq.heappop(expiry)
+            edge = self._edge_index.get(key)
+            if edge is None:
+                continue
+            flags, counts, start = ((self._edge_recent, self._recent, self._edge_last[edge]) if kind == 0
+                                    else (self._edge_new, self._new, self._edge_first[edge]))
+            # A later transfer on the edge has scheduled a later expiry
+            if start + self.window_seconds != due or not flags[edge]:
+                continue
+            flags[edge] = False
+            counts[self._edge_src[edge]] -= 1
+
+    def _sweep(self):
+        """Drop edges unused for edge_ttl_seconds and, past max_edges, the least recently used ones"""
+        n = self.n_edges
+        self._next_sweep = (np.floor(self.watermark / SWEEP_INTERVAL_SECONDS) + 1) * SWEEP_INTERVAL_SECONDS
+        last = self._edge_last[:n]
+        keep = last >= self.watermark - self.edge_ttl_seconds
+        target = int(self.max_edges * SWEEP_KEEP_FRACTION)
+        if keep.sum() >= self.max_edges:
+            newest = np.argsort(np.where(keep, last, -np.inf), kind='stable')[n - target:]
+            keep = np.zeros(n, dtype=bool)
+            keep[newest] = True
+        if keep.all():
+            return
+        self.sweeps += 1
+        self._rebuild(self._accounts, self._edge_src[:n][keep], self._edge_dst[:n][keep],
+                      self._edge_count[:n][keep], self._edge_first[:n][keep], self._edge_last[:n][keep])
+
+    def _rebuild(self, accounts: List[str], src: np.ndarray, dst: np.ndarray, count: np.ndarray,
+                 first: np.ndarray, last: np.ndarray):
+        """
+        Set the index to a set of edges, keeping only the accounts they use, and derive the degree,
+        window counts and expiry heap from them and the watermark
+        """
+        used = np.zeros(len(accounts), dtype=bool)
+        used[src] = True
+        used[dst] = True
+        renumber = np.cumsum(used) - 1
+        self._accounts = [account for account, is_used in zip(accounts, used.tolist()) if is_used]
+        self._account_ids = {account: node for node, account in enumerate(self._accounts)}
+        m, n = len(self._accounts), len(src)
+
+        self._edge_src = renumber[src].astype(np.int32)
+        self._edge_dst = renumber[dst].astype(np.int32)
+        self._edge_count = count.astype(np.int32)
+        self._edge_first = first.astype(float)
+        self._edge_last = last.astype(float)
+        self._edge_recent = self._edge_last + self.window_seconds >= self.watermark
+        self._edge_new = self._edge_first + self.window_seconds >= self.watermark
+        self.n_edges = n
+
+        self._in_degree = np.bincount(self._edge_dst, minlength=m).astype(np.int32)
+        self._recent = np.bincount(self._edge_src[self._edge_recent], minlength=m).astype(np.int32)
+        self._new = np.bincount(self._edge_src[self._edge_new], minlength=m).astype(np.int32)
+
+        keys = (self._edge_src.astype(np.int64) << 32) | self._edge_dst.astype(np.int64)
+        self._edge_index = dict(zip(keys.tolist(), range(n)))
+        self._expiry = (
+            list(zip((self._edge_last[self._edge_recent] + self.window_seconds).tolist(), [0] * int(self._edge_recent.sum()),
+                     keys[self._edge_recent].tolist()))
+            + list(zip((self._edge_first[self._edge_new] + self.window_seconds).tolist(), [1] * int(self._edge_new.sum()),
+                       keys[self._edge_new].tolist()))
+        )
+        heapq.heapify(self._expiry)
+
+    def observe(self, from_account, to_account, timestamp: float) -> Dict[str, float]:
+        """Record a transfer and return its TRANSFER_GRAPH_FEATURES (counting the transfer itself)"""
+        src, dst, previous = self.update(from_account, to_account, timestamp)
+        return self._feature_dict(previous, int(self._in_degree[dst]), int(self._recent[src]), int(self._new[src]))
+
+    def replay(self, entry: List[Any]):
+        """Apply a transfer recorded in the journal"""
+        from_account, to_account, timestamp = entry
+        self.update(from_account, to_account, float(timestamp))
+
+    def observe_batch(self, transfers: Sequence[Tuple[Any, Any, float]]) -> List[Optional[Dict[str, float]]]:
+        """observe() for each (from_account, to_account, timestamp) in order; incomplete transfers give None"""
+        return [
+            self.observe(from_account, to_account, timestamp)
+            if from_account not in (None, "") and to_account not in (None, "") else None
+            for from_account, to_account, timestamp in transfers
+        ]
+
+    @staticmethod
+    def _feature_dict(previous: Optional[int], in_degree: int, recent: int, new: int) -> Dict[str, float]:
+        return {
+            'recipient_is_new': 1.0 if previous is None else 0.0,
+            'recipient_transfer_count': float(previous or 0),
+            'recipient_in_degree': float(in_degree),
+            'out_degree_24h': float(recent),
+            'new_recipient_share_24h': new / recent if recent else 0.0
+        }
+
+    def save(self, path: str):
+        """Write the edges to a .npz snapshot; the counts and the expiry heap are derived again on load"""
+        n = self.n_edges
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(
+                f,
+                accounts=np.array(self._accounts, dtype=str),
+                edge_src=self._edge_src[:n],
+                edge_dst=self._edge_dst[:n],
+                edge_count=self._edge_count[:n],
+                edge_first=self._edge_first[:n],
+                edge_last=self._edge_last[:n],
+                watermark=np.float64(self.watermark),
+                generation=np.int64(self.generation)
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str, **kwargs) -> "TransferGraphIndex":
+        """Load a snapshot written by save(), or start empty if there is none"""
+        index = cls(**kwargs)
+        if not os.path.exists(path):
+            return index
+
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                accounts = [str(account) for account in data['accounts']]
+                edge_last = data['edge_last'].astype(float)
+                # Snapshots from before the watermark was kept end their window at the newest transfer
+                index.watermark = (float(data['watermark']) if 'watermark' in data.files
+                                   else float(edge_last.max()) if len(edge_last) else -np.inf)
+                index.generation = int(data['generation']) if 'generation' in data.files else 0
+                index._rebuild(accounts, data['edge_src'].astype(np.int64), data['edge_dst'].astype(np.int64),
+                               data['edge_count'], data['edge_first'], edge_last)
+            if np.isfinite(index.watermark):
+                index._next_sweep = (np.floor(index.watermark / SWEEP_INTERVAL_SECONDS) + 1) * SWEEP_INTERVAL_SECONDS
+        except Exception as e:
+            logger.error(f"Error loading transfer graph from {path}: {str(e)}. Starting empty.")
+            return cls(**kwargs)
+        return index
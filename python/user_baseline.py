@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# Per-user nearest-neighbour baseline of recent login feature vectors
+
+import os
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Signals produced for every login (None until the user has enough history)
+BASELINE_SIGNALS = ['baseline_knn_distance', 'baseline_distance_ratio']
+
+
+class LoginBaselineIndex:
+    """
+    Bounded ring of each user's most recent login feature vectors with a vectorized kNN query
+
+    All rings live in one (users, ring_size, n_features) float32 array; a user owns one slot,
+    so memory per user is fixed at ring_size * n_features * 4 bytes. When max_users is reached
+    the least recently seen user's slot is reused.
+    Distances are Euclidean after dividing each feature by a scale (the static model's scaler),
+    so the ring keeps raw feature values and stays valid when the models are retrained.
+    With a journal (a state_persistence.UpdateLog) every login written is also recorded there.
+    """
+
+    def __init__(self, n_features: int, ring_size: int = 32, k: int = 5, max_users: int = 10000,
+                 min_history: int = 5):
+        self.n_features = n_features
+        self.ring_size = ring_size
+        self.k = k
+        self.max_users = max_users
+        self.min_history = min_history
+        # user_id -> slot, least recently seen first
+        self._slots = OrderedDict()
+        self._vectors = np.zeros((0, ring_size, n_features), dtype=np.float32)
+        self._counts = np.zeros(0, dtype=np.int64)
+        # Snapshot generation (see state_persistence.py) and where updates are recorded
+        self.generation = 0
+        self.journal = None
+
+    def __len__(self):
+        return len(self._slots)
+
+    def _slot(self, user_id: str) -> int:
+        slot = self._slots.get(user_id)
+        if slot is not None:
+            self._slots.move_to_end(user_id)
+            return slot
+
+        if len(self._slots) >= self.max_users:
+            _, slot = self._slots.popitem(last=False)
+        else:
+            slot = len(self._slots)
+            if slot >= len(self._vectors):
+                capacity = min(self.max_users, max(16, 2 * len(self._vectors)))
+                vectors = np.zeros((capacity, self.ring_size, self.n_features), dtype=np.float32)
+                vectors[:len(self._vectors)] = self._vectors
+                counts = np.zeros(capacity, dtype=np.int64)
+                counts[:len(self._counts)] = self._counts
+                self._vectors, self._counts = vectors, counts
+
+        self._counts[slot] = 0
+        self._slots[user_id] = slot
+        return slot
+
+    def distance(self, user_id: str, vector: np.ndarray, scale: np.ndarray) -> Dict[str, Optional[float]]:
+        """
+        Compare a login with the user's ring
+        Returns: mean distance to the k nearest past logins, and that distance relative to the
+        typical kNN distance between the user's own past logins (about 1 for a usual login)
+        """
+        slot = self._slots.get(user_id)
+        n = min(int(self._counts[slot]), self.ring_size) if slot is not None else 0
+        if n < self.min_history:
+            return dict.fromkeys(BASELINE_SIGNALS)
+
+        ring = self._vectors[slot, :n] / scale
+        query = np.asarray(vector, dtype=float) / scale
+
+        distances = np.sqrt(((ring - query) ** 2).sum(axis=1))
+        k = min(self.k, n)
+        knn_distance = float(np.partition(distances, k - 1)[:k].mean())
+
+        # Leave-one-out kNN distance of every ring entry to the rest of the ring. Squared differences
+        # are accumulated one feature at a time, which keeps the scratch memory at (n, n) instead of
+        # (n, n, n_features) and adds them in the same order as a sum over the feature axis
+        pairwise = np.zeros((n, n))
+        difference = np.empty((n, n))
+        for j in range(self.n_features):
+            np.subtract.outer(ring[:, j], ring[:, j], out=difference)
+            np.multiply(difference, difference, out=difference)
+            pairwise += difference
+        np.sqrt(pairwise, out=pairwise)
+        np.fill_diagonal(pairwise, np.inf)
+        k_inner = min(self.k, n - 1)
+        pairwise.partition(k_inner - 1, axis=1)
+        typical = float(np.median(pairwise[:, :k_inner].mean(axis=1)))
+
+        return {
+            'baseline_knn_distance': knn_distance,
+            'baseline_distance_ratio': knn_distance / max(typical, 1e-9)
+        }
+
+    def update(self, user_id: str, vector: np.ndarray):
+        """Write a login into the user's ring, overwriting the oldest one once it is full"""
+        slot = self._slot(user_id)
+        self._vectors[slot, self._counts[slot] % self.ring_size] = vector
+        self._counts[slot] += 1
+        if self.journal is not None:
+            self.journal.record([user_id, np.asarray(vector, dtype=float).tolist()])
+
+    def replay(self, entry: List[Any]):
+        """Apply an update recorded in the journal"""
+        user_id, vector = entry
+        self.update(user_id, np.asarray(vector, dtype=float))
+
+    def observe(self, user_id: str, vector: np.ndarray, scale: np.ndarray) -> Dict[str, Optional[float]]:
+        """Score against the user's history, then add the same login to it"""
+        signals = self.distance(user_id, vector, scale)
+        self.update(user_id, vector)
+        return signals
+
+    def observe_batch(self, user_ids: List[Optional[str]], vectors: np.ndarray,
+                      scale: np.ndarray) -> List[Dict[str, Optional[float]]]:
+        """observe() for each row of a feature matrix; rows without a user get no signals"""
+        return [
+            self.observe(str(user_id), vector, scale) if user_id else dict.fromkeys(BASELINE_SIGNALS)
+            for user_id, vector in zip(user_ids, vectors)
+        ]
+
+    def save(self, path: str):
+        """Write every user's ring to a .npz snapshot, least recently seen first"""
+        user_ids = list(self._slots.keys())
+        slots = np.fromiter(self._slots.values(), dtype=np.int64, count=len(user_ids))
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, user_ids=np.array(user_ids, dtype=str), counts=self._counts[slots], vectors=self._vectors[slots],
+                     generation=np.int64(self.generation))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str, n_features: int, **kwargs) -> "LoginBaselineIndex":
+        """Load a snapshot written by save(), or start empty if there is none or it does not fit"""
+        index = cls(n_features, **kwargs)
+        if not os.path.exists(path):
+            return index
+
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                user_ids, counts, vectors = data['user_ids'], data['counts'], data['vectors']
+                generation = int(data['generation']) if 'generation' in data.files else 0
+            if vectors.shape[1:] != (index.ring_size, n_features):
+                logger.warning(f"Login baseline snapshot {path} has shape {vectors.shape[1:]}; starting empty")
+                return index
+            # Keep the most recently seen users if the snapshot is larger than max_users
+            keep = slice(max(0, len(user_ids) - index.max_users), None)
+            user_ids, counts, vectors = user_ids[keep], counts[keep], vectors[keep]
+            index._vectors = vectors.astype(np.float32)
+            index._counts = counts.astype(np.int64)
+            index._slots = OrderedDict((str(user_id), slot) for slot, user_id in enumerate(user_ids))
+            index.generation = generation
+        except Exception as e:
+            logger.error(f"Error loading login baseline from {path}: {str(e)}. Starting empty.")
+            return cls(n_features, **kwargs)
+        return index